@@ -0,0 +1,376 @@
+"""
+Backend Pool - load balancing nhiều Ollama backends 🌐
+
+Một Ollama box chỉ generate được vài request cùng lúc; muốn scale thì chạy
+nhiều box. BackendPool giữ danh sách backends và chọn backend cho từng request:
+
+- ✅ Least outstanding requests (mặc định) hoặc EWMA latency (peak-EWMA style)
+- ✅ Circuit Breaker riêng cho từng backend (reuse `app.circuit_breaker`)
+- ✅ Failover sang backend khác khi một backend lỗi
+- ✅ Hedged requests (tùy chọn) - gửi request thứ hai nếu request đầu chậm
+- ✅ Metrics: outstanding, request outcomes, hedges
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import TypeVar
+
+from app.circuit_breaker import CircuitBreaker, CircuitBreakerConfig, CircuitBreakerError
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+STRATEGY_LEAST_OUTSTANDING = "least_outstanding"
+STRATEGY_EWMA = "ewma"
+
+OLLAMA_LB_STRATEGY = os.getenv("OLLAMA_LB_STRATEGY", STRATEGY_LEAST_OUTSTANDING).strip().lower()
+BACKEND_EWMA_ALPHA = 0.3
+
+
+def parse_backend_urls(spec: str | None) -> list[str]:
+    """Parse "http://a:11434, http://b:11434" → list URL (bỏ trùng, bỏ '/' cuối)."""
+    out: list[str] = []
+    for part in (spec or "").split(","):
+        url = part.strip().rstrip("/")
+        if url and url not in out:
+            out.append(url)
+    return out
+
+
+class Backend:
+    """Một Ollama backend + trạng thái routing (outstanding, EWMA latency, breaker)."""
+
+    def __init__(self, url: str, pool_name: str, breaker_config: CircuitBreakerConfig):
+        self.url = url
+        self.outstanding = 0
+        self.ewma_latency_s = 0.0  # 0 = chưa có sample → được thử sớm
+        self.last_pick = 0
+        self.breaker = CircuitBreaker(name=f"ollama_{pool_name}:{url}", config=breaker_config)
+
+    def load_score(self, strategy: str) -> tuple:
+        if strategy == STRATEGY_EWMA:
+            # Peak-EWMA: latency dự kiến nếu xếp thêm một request vào backend này
+            return (self.ewma_latency_s * (self.outstanding + 1), self.outstanding, self.last_pick)
+        return (self.outstanding, self.ewma_latency_s, self.last_pick)
+
+    def to_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "ewma_latency_ms": round(self.ewma_latency_s * 1000, 1),
+            "circuit_state": self.breaker.state.value,
+        }
+
+
+class BackendPool:
+    """
+    Pool các Ollama backends với routing theo tải - scale ngang như rockstar! 🎸
+
+    Example:
+        >>> pool = BackendPool(["http://gpu1:11434", "http://gpu2:11434"], name="generate")
+        >>> text = pool.call(lambda url: post(f"{url}/api/generate", ...))
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        name: str = "generate",
+        strategy: str = OLLAMA_LB_STRATEGY,
+        breaker_config: CircuitBreakerConfig | None = None,
+    ):
+        if not urls:
+            raise ValueError("BackendPool needs at least one backend URL")
+        self.name = name
+        valid = (STRATEGY_LEAST_OUTSTANDING, STRATEGY_EWMA)
+        self.strategy = strategy if strategy in valid else STRATEGY_LEAST_OUTSTANDING
+        cfg = breaker_config or CircuitBreakerConfig(failure_threshold=3, timeout=15.0)
+        self.backends = [Backend(u, name, cfg) for u in urls]
+        self._lock = threading.Lock()
+        self._picks = 0
+        self._hedge_executor: ThreadPoolExecutor | None = None
+
+    def __len__(self) -> int:
+        return len(self.backends)
+
+    @property
+    def primary_url(self) -> str:
+        return self.backends[0].url
+
+    # ----- selection -----
+    def pick(self, exclude: set[str] | None = None) -> Backend | None:
+        """Chọn backend ít tải nhất trong các backend có circuit không OPEN."""
+        exclude = exclude or set()
+        candidates = [b for b in self.backends if b.url not in exclude and b.breaker.is_available()]
+        if not candidates:
+            return None
+        with self._lock:
+            best = min(candidates, key=lambda b: b.load_score(self.strategy))
+            self._picks += 1
+            best.last_pick = self._picks
+            return best
+
+    @contextmanager
+    def lease(self, backend: Backend) -> Iterator[Backend]:
+        """Đếm outstanding trong suốt request và cập nhật EWMA latency khi thành công."""
+        with self._lock:
+            backend.outstanding += 1
+            outstanding = backend.outstanding
+        self._publish_outstanding(backend, outstanding)
+        start = time.monotonic()
+        # None = request bị hủy giữa chừng: không phải success/failure của backend
+        ok: bool | None = False
+        try:
+            yield backend
+            ok = True
+        except (GeneratorExit, asyncio.CancelledError):
+            # Consumer đóng stream sớm / client ngắt kết nối - thời gian đo được không phản
+            # ánh latency của backend, không tính vào EWMA lẫn kết quả
+            ok = None
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                backend.outstanding = max(0, backend.outstanding - 1)
+                if ok:
+                    if backend.ewma_latency_s <= 0:
+                        backend.ewma_latency_s = elapsed
+                    else:
+                        a = BACKEND_EWMA_ALPHA
+                        backend.ewma_latency_s = (1 - a) * backend.ewma_latency_s + a * elapsed
+                outstanding = backend.outstanding
+            if ok is None:
+                self._publish_outstanding(backend, outstanding)
+            elif METRICS_ENABLED:
+                try:
+                    metrics.record_backend_request(
+                        self.name, backend.url, "success" if ok else "failure", outstanding
+                    )
+                except Exception:
+                    pass
+
+    def _publish_outstanding(self, backend: Backend, outstanding: int) -> None:
+        if METRICS_ENABLED:
+            try:
+                metrics.update_backend_outstanding(self.name, backend.url, outstanding)
+            except Exception:
+                pass
+
+    # ----- execution -----
+    def _call_on(self, backend: Backend, fn: Callable[[str], T]) -> T:
+        with self.lease(backend):
+            return backend.breaker.call(fn, backend.url)
+
+    def call(self, fn: Callable[[str], T]) -> T:
+        """
+        Gọi `fn(base_url)` trên backend tốt nhất, failover sang backend khác khi lỗi.
+
+        Raises:
+            CircuitBreakerError: Khi mọi backend đều đang OPEN
+            Exception: Lỗi cuối cùng nếu mọi backend đều fail
+        """
+        tried: set[str] = set()
+        last_exc: Exception | None = None
+        for _ in range(len(self.backends)):
+            backend = self.pick(exclude=tried)
+            if backend is None:
+                break
+            tried.add(backend.url)
+            try:
+                return self._call_on(backend, fn)
+            except Exception as e:
+                last_exc = e
+                if len(self.backends) > 1:
+                    logger.warning(
+                        f"⚠️ Backend {backend.url} failed ({type(e).__name__}), trying next backend"
+                    )
+        if last_exc is not None:
+            raise last_exc
+        raise CircuitBreakerError(f"No healthy backend in pool '{self.name}'")
+
+    def stream(
+        self, open_fn: Callable[[str], R], iterate: Callable[[R], Iterator[str]]
+    ) -> Iterator[str]:
+        """
+        Mở stream trên backend tốt nhất (failover nếu mở thất bại) và giữ lease
+        cho đến khi stream kết thúc. Lỗi giữa chừng không failover (tránh lặp token).
+        """
+        tried: set[str] = set()
+        last_exc: Exception | None = None
+        for _ in range(len(self.backends)):
+            backend = self.pick(exclude=tried)
+            if backend is None:
+                break
+            tried.add(backend.url)
+            opened = False
+            try:
+                with self.lease(backend):
+                    handle = backend.breaker.call(open_fn, backend.url)
+                    opened = True
+                    yield from iterate(handle)
+                return
+            except Exception as e:
+                if opened:
+                    raise
+                last_exc = e
+        if last_exc is not None:
+            raise last_exc
+        raise CircuitBreakerError(f"No healthy backend in pool '{self.name}'")
+
+    def call_hedged(self, fn: Callable[[str], T], hedge_delay_s: float) -> T:
+        """
+        Như `call`, nhưng nếu backend đầu chưa trả lời sau `hedge_delay_s` thì gửi
+        thêm request tới backend thứ hai; kết quả nào thành công trước được dùng.
+
+        Chỉ nên dùng cho request idempotent (embeddings).
+        """
+        if hedge_delay_s <= 0 or len(self.backends) < 2:
+            return self.call(fn)
+        primary = self.pick()
+        if primary is None:
+            return self.call(fn)
+        executor = self._get_hedge_executor()
+        futures: dict[Future, str] = {executor.submit(self._call_on, primary, fn): "primary"}
+        done, _ = wait(futures, timeout=hedge_delay_s)
+        if not done:
+            secondary = self.pick(exclude={primary.url})
+            if secondary is not None:
+                futures[executor.submit(self._call_on, secondary, fn)] = "hedge"
+        pending = set(futures)
+        last_exc: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    if len(futures) > 1 and METRICS_ENABLED:
+                        try:
+                            metrics.record_backend_hedge(self.name, futures[fut])
+                        except Exception:
+                            pass
+                    return fut.result()
+                last_exc = fut.exception()
+        # Mọi nhánh hedge đều lỗi → failover bình thường qua các backend còn lại
+        logger.warning(f"⚠️ Hedged request failed on all legs: {last_exc}")
+        return self.call(fn)
+
+    # ----- async execution (httpx.AsyncClient path) -----
+    async def _call_on_async(self, backend: Backend, fn: Callable[[str], Awaitable[T]]) -> T:
+        with self.lease(backend):
+            return await backend.breaker.call_async(fn, backend.url)
+
+    async def call_async(self, fn: Callable[[str], Awaitable[T]]) -> T:
+        """Async version của `call` - `fn(base_url)` là coroutine function."""
+        tried: set[str] = set()
+        last_exc: Exception | None = None
+        for _ in range(len(self.backends)):
+            backend = self.pick(exclude=tried)
+            if backend is None:
+                break
+            tried.add(backend.url)
+            try:
+                return await self._call_on_async(backend, fn)
+            except Exception as e:
+                last_exc = e
+                if len(self.backends) > 1:
+                    logger.warning(
+                        f"⚠️ Backend {backend.url} failed ({type(e).__name__}), trying next backend"
+                    )
+        if last_exc is not None:
+            raise last_exc
+        raise CircuitBreakerError(f"No healthy backend in pool '{self.name}'")
+
+    async def call_hedged_async(self, fn: Callable[[str], Awaitable[T]], hedge_delay_s: float) -> T:
+        """Async version của `call_hedged` - nhánh thua bị cancel ngay."""
+        if hedge_delay_s <= 0 or len(self.backends) < 2:
+            return await self.call_async(fn)
+        primary = self.pick()
+        if primary is None:
+            return await self.call_async(fn)
+        tasks: dict[asyncio.Task, str] = {
+            asyncio.ensure_future(self._call_on_async(primary, fn)): "primary"
+        }
+        done, _ = await asyncio.wait(set(tasks), timeout=hedge_delay_s)
+        if not done:
+            secondary = self.pick(exclude={primary.url})
+            if secondary is not None:
+                tasks[asyncio.ensure_future(self._call_on_async(secondary, fn))] = "hedge"
+        pending = set(tasks)
+        last_exc: BaseException | None = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1 and METRICS_ENABLED:
+                            try:
+                                metrics.record_backend_hedge(self.name, tasks[task])
+                            except Exception:
+                                pass
+                        return task.result()
+                    last_exc = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        logger.warning(f"⚠️ Hedged request failed on all legs: {last_exc}")
+        return await self.call_async(fn)
+
+    async def stream_async(
+        self,
+        open_fn: Callable[[str], Awaitable[R]],
+        iterate: Callable[[R], AsyncIterator[str]],
+    ) -> AsyncIterator[str]:
+        """Async version của `stream` - failover khi mở stream, giữ lease tới khi xong."""
+        tried: set[str] = set()
+        last_exc: Exception | None = None
+        for _ in range(len(self.backends)):
+            backend = self.pick(exclude=tried)
+            if backend is None:
+                break
+            tried.add(backend.url)
+            opened = False
+            try:
+                with self.lease(backend):
+                    handle = await backend.breaker.call_async(open_fn, backend.url)
+                    opened = True
+                    async for chunk in iterate(handle):
+                        yield chunk
+                return
+            except Exception as e:
+                if opened:
+                    raise
+                last_exc = e
+        if last_exc is not None:
+            raise last_exc
+        raise CircuitBreakerError(f"No healthy backend in pool '{self.name}'")
+
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=max(4, 4 * len(self.backends)),
+                    thread_name_prefix=f"hedge-{self.name}",
+                )
+            return self._hedge_executor
+
+    def stats(self) -> dict:
+        """Snapshot pool - for monitoring endpoints 📊"""
+        with self._lock:
+            return {
+                "pool": self.name,
+                "strategy": self.strategy,
+                "backends": [b.to_dict() for b in self.backends],
+            }
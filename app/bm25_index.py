@@ -0,0 +1,206 @@
+"""
+BM25 Index - biểu diễn corpus gọn trong RAM cho BM25 📦
+
+Thay cho 3 list Python song song (text, metadata dict, token list mỗi chunk) +
+frequency dicts của rank_bm25:
+
+- ✅ Vocabulary interned: token → term ID (int)
+- ✅ Inverted index CSR trên NumPy: postings doc ID (uint32) + tf (uint16) theo term
+- ✅ Độ dài tài liệu uint32, chunk IDs là mảng bytes cố định
+- ✅ Metadata lưu dạng cột: mã int nhỏ + bảng giá trị (không dict mỗi chunk)
+- ✅ Không giữ text: text chunk được lấy lazily theo ID từ store khi trả kết quả
+- ✅ Điểm số giống BM25Okapi (k1, b, epsilon floor cho idf âm)
+"""
+
+from array import array
+from collections import Counter
+from collections.abc import Callable, Iterable, Sequence
+from typing import Any
+
+import numpy as np
+
+# Một trang dữ liệu từ store: (ids, documents, metadatas)
+Page = tuple[Sequence[str], Sequence[str | None], Sequence[dict[str, Any] | None]]
+
+
+class _MetaColumn:
+    """Một cột metadata: mã int (-1 = thiếu) + bảng giá trị duy nhất."""
+
+    def __init__(self) -> None:
+        self.values: list[Any] = []
+        self._lookup: dict[Any, int] = {}
+        self.codes = array("i")
+
+    def append(self, value: Any, row: int) -> None:
+        while len(self.codes) < row:
+            self.codes.append(-1)
+        if value is None:
+            self.codes.append(-1)
+            return
+        code = self._lookup.get(value)
+        if code is None:
+            code = len(self.values)
+            self._lookup[value] = code
+            self.values.append(value)
+        self.codes.append(code)
+
+    def finish(self, rows: int) -> np.ndarray:
+        while len(self.codes) < rows:
+            self.codes.append(-1)
+        self._lookup = {}
+        dtype = np.int16 if len(self.values) < 2**15 else np.int32
+        return np.frombuffer(self.codes, dtype=np.int32).astype(dtype)
+
+
+class CompactBM25:
+    """BM25Okapi trên inverted index NumPy; metadata dạng cột, không giữ text."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.vocab: dict[str, int] = {}
+        self.ids = np.zeros(0, dtype="S1")
+        self.doc_len = np.zeros(0, dtype=np.uint32)
+        self.avgdl = 0.0
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.post_docs = np.zeros(0, dtype=np.uint32)
+        self.post_tfs = np.zeros(0, dtype=np.uint16)
+        self.meta_codes: dict[str, np.ndarray] = {}
+        self.meta_values: dict[str, list[Any]] = {}
+
+    def __len__(self) -> int:
+        return int(self.doc_len.shape[0])
+
+    @classmethod
+    def build(
+        cls,
+        pages: Iterable[Page],
+        tokenize: Callable[[str], list[str]],
+        **params: Any,
+    ) -> "CompactBM25 | None":
+        """Build từ các trang (ids, docs, metas); text chỉ sống trong trang đang xử lý."""
+        index = cls(**params)
+        vocab = index.vocab
+        ids: list[bytes] = []
+        doc_len = array("I")
+        p_terms = array("I")
+        p_docs = array("I")
+        p_tfs = array("H")
+        columns: dict[str, _MetaColumn] = {}
+        for page_ids, page_docs, page_metas in pages:
+            for cid, doc, meta in zip(page_ids, page_docs, page_metas, strict=False):
+                if not doc or not doc.strip():
+                    continue
+                row = len(ids)
+                ids.append(str(cid).encode("utf-8"))
+                tokens = tokenize(doc)
+                doc_len.append(len(tokens))
+                for tok, tf in Counter(tokens).items():
+                    term = vocab.get(tok)
+                    if term is None:
+                        term = vocab[tok] = len(vocab)
+                    p_terms.append(term)
+                    p_docs.append(row)
+                    p_tfs.append(min(tf, 0xFFFF))
+                for key, value in (meta or {}).items():
+                    col = columns.get(key)
+                    if col is None:
+                        col = columns[key] = _MetaColumn()
+                    col.append(value, row)
+        n_docs = len(ids)
+        if not n_docs:
+            return None
+        index.ids = np.array(ids, dtype=f"S{max(len(i) for i in ids)}")
+        index.doc_len = np.frombuffer(doc_len, dtype=np.uint32).copy()
+        index.avgdl = float(index.doc_len.sum()) / n_docs
+        # CSR theo term: sort ổn định postings theo term ID
+        terms = np.frombuffer(p_terms, dtype=np.uint32)
+        order = np.argsort(terms, kind="stable")
+        index.post_docs = np.frombuffer(p_docs, dtype=np.uint32)[order]
+        index.post_tfs = np.frombuffer(p_tfs, dtype=np.uint16)[order]
+        df = np.bincount(terms, minlength=len(vocab)).astype(np.int64)
+        index.offsets = np.concatenate(([0], np.cumsum(df)))
+        del terms, order, p_terms, p_docs, p_tfs
+        # idf như BM25Okapi: idf âm → epsilon * idf trung bình
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        avg_idf = float(idf.mean()) if idf.size else 0.0
+        idf[idf < 0] = index.epsilon * avg_idf
+        index.idf = idf.astype(np.float32)
+        for key, col in columns.items():
+            index.meta_codes[key] = col.finish(n_docs)
+            index.meta_values[key] = col.values
+        return index
+
+    # ===== Scoring =====
+    def get_scores(self, tokens: Iterable[str]) -> np.ndarray:
+        """Điểm BM25 cho toàn bộ corpus (float32[N])."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not len(self):
+            return scores
+        norm = None
+        for tok in tokens:
+            term = self.vocab.get(tok)
+            if term is None:
+                continue
+            if norm is None:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len / self.avgdl)
+            start, end = self.offsets[term], self.offsets[term + 1]
+            docs = self.post_docs[start:end]
+            tf = self.post_tfs[start:end].astype(np.float32)
+            scores[docs] += self.idf[term] * (tf * (self.k1 + 1) / (tf + norm[docs]))
+        return scores
+
+    def filter_mask(self, key: str, allowed: Sequence[str] | None) -> np.ndarray | None:
+        """Mask các chunk có str(meta[key]) thuộc `allowed` (None/[] → không lọc)."""
+        if not allowed:
+            return None
+        codes = self.meta_codes.get(key)
+        if codes is None:
+            return np.zeros(len(self), dtype=bool)
+        wanted = {str(a) for a in allowed}
+        ok = [i for i, v in enumerate(self.meta_values[key]) if str(v) in wanted]
+        return np.isin(codes, np.asarray(ok, dtype=codes.dtype))
+
+    def top_k(
+        self, tokens: Iterable[str], k: int, mask: np.ndarray | None = None
+    ) -> tuple[list[int], list[float]]:
+        """Chỉ số + điểm của k chunk điểm cao nhất (thỏa mask), giảm dần."""
+        scores = self.get_scores(tokens)
+        if mask is not None:
+            candidates = np.flatnonzero(mask)
+            if not candidates.size:
+                return [], []
+            sub = scores[candidates]
+        else:
+            candidates = None
+            sub = scores
+        k = min(k, sub.shape[0])
+        if k <= 0:
+            return [], []
+        part = np.argpartition(-sub, k - 1)[:k]
+        # Sắp xếp ổn định theo điểm giảm dần, hòa điểm → thứ tự trong corpus
+        part = part[np.lexsort((part, -sub[part]))]
+        idx = part if candidates is None else candidates[part]
+        return [int(i) for i in idx], [float(scores[i]) for i in idx]
+
+    # ===== Lookup =====
+    def chunk_ids(self, rows: Iterable[int]) -> list[str]:
+        return [self.ids[i].decode("utf-8") for i in rows]
+
+    def metadata(self, row: int) -> dict[str, Any]:
+        meta: dict[str, Any] = {}
+        for key, codes in self.meta_codes.items():
+            code = int(codes[row])
+            if code >= 0:
+                meta[key] = self.meta_values[key][code]
+        return meta
+
+    def nbytes(self) -> int:
+        """Ước lượng bộ nhớ (arrays + vocabulary) để so sánh/giám sát."""
+        arrays = (self.ids, self.doc_len, self.idf, self.offsets, self.post_docs, self.post_tfs)
+        total = sum(a.nbytes for a in arrays)
+        total += sum(c.nbytes for c in self.meta_codes.values())
+        total += sum(len(t) + 57 + 8 for t in self.vocab)  # str + dict slot (xấp xỉ)
+        return total
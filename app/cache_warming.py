@@ -19,6 +19,8 @@ from collections.abc import Callable
 from pathlib import Path
 from typing import Any
 
+from .llm_scheduler import PRIORITY_WARMING, llm_priority
+
 logger = logging.getLogger(__name__)
 
 
@@ -230,7 +232,9 @@ class CacheWarmer:
             else:
                 # Execute full query and cache result
                 if query_fn:
-                    query_result = await asyncio.to_thread(query_fn, query)
+                    # asyncio.to_thread copy context → LLM calls chạy ở priority warming
+                    with llm_priority(PRIORITY_WARMING):
+                        query_result = await asyncio.to_thread(query_fn, query)
                     cache.set(query, query_result, embedder)
                     result["full_query_cached"] = True
                 else:
@@ -285,7 +289,8 @@ class CacheWarmer:
                 else:
                     # Execute full query
                     if query_fn:
-                        query_result = query_fn(query)
+                        with llm_priority(PRIORITY_WARMING):
+                            query_result = query_fn(query)
                         cache.set(query, query_result, embedder)
                         stats["full_queries_cached"] += 1
                     else:
@@ -0,0 +1,301 @@
+"""
+Chunk Dedup - phát hiện chunk gần trùng lúc ingest (MinHash + LSH) 🧬
+
+Corpus hay có tài liệu gần giống nhau (manual nhiều version, boilerplate copy):
+
+- ✅ MinHash signature trên shingles từ (numpy, không cần thư viện ngoài)
+- ✅ LSH banding (b bands × r rows chọn theo ngưỡng) → chỉ so với ứng viên cùng bucket
+- ✅ Ngưỡng Jaccard cấu hình được (CHUNK_DEDUP_THRESHOLD)
+- ✅ Chỉ dedup trong cùng version + language (CHUNK_DEDUP_SCOPE) → filter không mất kết quả
+  (version tự sinh khi ingest không truyền version không tính vào scope)
+- ✅ Chunk trùng không được embed/ghi: chỉ lưu link duplicate → canonical
+- ✅ Index persistent per-DB (chunk_dedup.sqlite) → dedup cả giữa các lần ingest
+- ✅ Xóa canonical → duplicate "mồ côi" được trả về (kèm text) để promote thành canonical
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Sequence
+from typing import Any
+
+import numpy as np
+
+DEDUP_FILENAME = "chunk_dedup.sqlite"
+
+CHUNK_DEDUP_ENABLED = os.getenv("CHUNK_DEDUP", "1").strip() not in ("0", "false", "False")
+CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.9"))
+CHUNK_DEDUP_NUM_PERM = max(8, int(os.getenv("CHUNK_DEDUP_NUM_PERM", "64")))
+CHUNK_DEDUP_SHINGLE = max(1, int(os.getenv("CHUNK_DEDUP_SHINGLE", "3")))
+# Metadata keys giới hạn phạm vi dedup: mặc định chỉ dedup trong cùng version + language,
+# để filter theo version/language không mất chunk bị link sang bản khác. "" = toàn DB
+CHUNK_DEDUP_SCOPE = tuple(
+    k.strip() for k in os.getenv("CHUNK_DEDUP_SCOPE", "version,language").split(",") if k.strip()
+)
+
+_PRIME = np.uint64((1 << 32) - 5)
+_MAX_HASH = np.uint32(0xFFFFFFFF)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _scope_value(meta: dict[str, Any], key: str) -> str:
+    # Version tự sinh (hash từng file, ingest không truyền version) không phải version thật
+    # → không giới hạn scope, để file không version vẫn dedup được với nhau
+    if key == "version" and meta.get("version_auto"):
+        return ""
+    return str(meta.get(key, ""))
+
+
+def _permutations(num_perm: int, seed: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.RandomState(seed)
+    # a < 2^31, h < 2^32 → a*h + b < 2^64, không tràn uint64
+    a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+    b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+    return a, b
+
+
+def shingles(text: str, size: int = CHUNK_DEDUP_SHINGLE) -> set[str]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash_signature(
+    text: str, num_perm: int = CHUNK_DEDUP_NUM_PERM, shingle_size: int = CHUNK_DEDUP_SHINGLE
+) -> np.ndarray:
+    """MinHash signature (uint32[num_perm]) của tập shingles từ."""
+    sh = shingles(text, shingle_size)
+    if not sh:
+        return np.full(num_perm, _MAX_HASH, dtype=np.uint32)
+    hashes = np.fromiter(
+        (
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+            for s in sh
+        ),
+        dtype=np.uint64,
+        count=len(sh),
+    )
+    a, b = _permutations(num_perm)
+    # (a*h + b) mod p cho mọi (perm, shingle) → min theo shingle
+    perm = (np.outer(a, hashes) + b[:, None]) % _PRIME
+    return perm.min(axis=1).astype(np.uint32)
+
+
+def signature_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Ước lượng Jaccard = tỉ lệ vị trí MinHash trùng nhau."""
+    return float(np.mean(a == b))
+
+
+def lsh_params(threshold: float, num_perm: int) -> tuple[int, int]:
+    """Chọn (bands, rows) với bands*rows = num_perm, điểm uốn (1/b)^(1/r) gần ngưỡng nhất."""
+    best = (num_perm, 1)
+    best_err = float("inf")
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        err = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if err < best_err:
+            best, best_err = (bands, rows), err
+    return best
+
+
+class ChunkDeduper:
+    """LSH index persistent per-DB + bảng link duplicate → canonical."""
+
+    def __init__(
+        self,
+        db_dir: str,
+        threshold: float = CHUNK_DEDUP_THRESHOLD,
+        num_perm: int = CHUNK_DEDUP_NUM_PERM,
+        shingle_size: int = CHUNK_DEDUP_SHINGLE,
+        scope: Sequence[str] = CHUNK_DEDUP_SCOPE,
+    ):
+        self.path = os.path.join(db_dir, DEDUP_FILENAME)
+        self.threshold = min(1.0, max(0.0, threshold))
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.scope = tuple(scope)
+        # Lệch ngưỡng xuống một chút để LSH bắt đủ ứng viên, rồi verify bằng signature
+        self.bands, self.rows = lsh_params(max(0.05, self.threshold - 0.1), num_perm)
+        self._lock = threading.Lock()
+        self._ensure()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _ensure(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS signatures (chunk_id TEXT PRIMARY KEY, "
+                "source TEXT, sig BLOB)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (band INTEGER, bucket TEXT, chunk_id TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets ON buckets(band, bucket)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets_chunk ON buckets(chunk_id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS links (chunk_id TEXT PRIMARY KEY, "
+                "canonical_id TEXT, source TEXT, similarity REAL, doc TEXT, meta TEXT, "
+                "created_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_links_canon ON links(canonical_id)")
+
+    def _bucket_keys(self, sig: np.ndarray, meta: dict[str, Any] | None) -> list[str]:
+        scope = "\x00".join(_scope_value(meta or {}, k) for k in self.scope)
+        keys = []
+        for band in range(self.bands):
+            part = sig[band * self.rows : (band + 1) * self.rows].tobytes()
+            keys.append(hashlib.blake2b(scope.encode("utf-8") + part, digest_size=8).hexdigest())
+        return keys
+
+    def filter_batch(
+        self,
+        ids: Sequence[str],
+        docs: Sequence[str],
+        metas: Sequence[dict[str, Any]],
+    ) -> list[bool]:
+        """Trả mask keep[i]. Chunk trùng (>= threshold) với chunk đã index → ghi link, bỏ."""
+        keep: list[bool] = []
+        with self._lock, self._connect() as conn:
+            for cid, text, meta in zip(ids, docs, metas, strict=True):
+                known = conn.execute("SELECT 1 FROM signatures WHERE chunk_id=?", (cid,)).fetchone()
+                if known:  # upsert lại chunk canonical đã có
+                    keep.append(True)
+                    continue
+                if conn.execute("SELECT 1 FROM links WHERE chunk_id=?", (cid,)).fetchone():
+                    keep.append(False)
+                    continue
+                sig = minhash_signature(text, self.num_perm, self.shingle_size)
+                keys = self._bucket_keys(sig, meta)
+                canonical, sim = self._best_match(conn, sig, keys)
+                source = str((meta or {}).get("source", ""))
+                if canonical is not None:
+                    # Giữ text + metadata để promote khi canonical bị xóa
+                    conn.execute(
+                        "INSERT OR REPLACE INTO links(chunk_id, canonical_id, source, "
+                        "similarity, doc, meta, created_at) VALUES(?,?,?,?,?,?,?)",
+                        (
+                            cid,
+                            canonical,
+                            source,
+                            sim,
+                            text,
+                            json.dumps(meta, default=str),
+                            time.time(),
+                        ),
+                    )
+                    keep.append(False)
+                    continue
+                conn.execute(
+                    "INSERT OR REPLACE INTO signatures(chunk_id, source, sig) VALUES(?,?,?)",
+                    (cid, source, sig.tobytes()),
+                )
+                conn.executemany(
+                    "INSERT INTO buckets(band, bucket, chunk_id) VALUES(?,?,?)",
+                    [(band, key, cid) for band, key in enumerate(keys)],
+                )
+                keep.append(True)
+        return keep
+
+    def _best_match(
+        self, conn: sqlite3.Connection, sig: np.ndarray, keys: list[str]
+    ) -> tuple[str | None, float]:
+        candidates: set[str] = set()
+        for band, key in enumerate(keys):
+            rows = conn.execute(
+                "SELECT chunk_id FROM buckets WHERE band=? AND bucket=?", (band, key)
+            ).fetchall()
+            candidates.update(r[0] for r in rows)
+        best, best_sim = None, 0.0
+        for cand in candidates:
+            row = conn.execute("SELECT sig FROM signatures WHERE chunk_id=?", (cand,)).fetchone()
+            if not row:
+                continue
+            sim = signature_similarity(sig, np.frombuffer(row[0], dtype=np.uint32))
+            if sim >= self.threshold and sim > best_sim:
+                best, best_sim = cand, sim
+        return best, best_sim
+
+    def update_link_metas(self, ids: Sequence[str], metas: Sequence[dict[str, Any]]) -> None:
+        """Thay metadata lưu kèm link (dùng khi duplicate được promote thành canonical)."""
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "UPDATE links SET meta=? WHERE chunk_id=?",
+                [(json.dumps(m, default=str), cid) for cid, m in zip(ids, metas, strict=True)],
+            )
+
+    def canonical_of(self, chunk_id: str) -> str | None:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT canonical_id FROM links WHERE chunk_id=?", (chunk_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def remove_chunks(
+        self, chunk_ids: Iterable[str]
+    ) -> tuple[list[str], list[str], list[dict[str, Any]]]:
+        """Xóa chunks khỏi index + links.
+
+        Returns:
+            (ids, docs, metas) của duplicates có canonical vừa bị xóa - caller ghi lại
+            chúng qua filter_batch (chunk đầu tiên thành canonical mới).
+        """
+        ids = list(dict.fromkeys(chunk_ids))
+        removed = set(ids)
+        orphans: dict[str, tuple[str, dict[str, Any]]] = {}
+        with self._lock, self._connect() as conn:
+            for start in range(0, len(ids), 500):
+                part = ids[start : start + 500]
+                marks = ",".join("?" * len(part))
+                rows = conn.execute(
+                    f"SELECT chunk_id, doc, meta FROM links WHERE canonical_id IN ({marks})",
+                    part,
+                ).fetchall()
+                for cid, doc, meta in rows:
+                    if cid not in removed and doc:
+                        orphans[cid] = (doc, json.loads(meta or "{}"))
+                conn.execute(f"DELETE FROM links WHERE canonical_id IN ({marks})", part)
+                conn.execute(f"DELETE FROM links WHERE chunk_id IN ({marks})", part)
+                conn.execute(f"DELETE FROM signatures WHERE chunk_id IN ({marks})", part)
+                conn.execute(f"DELETE FROM buckets WHERE chunk_id IN ({marks})", part)
+        orphan_ids = [cid for cid in orphans if cid not in removed]
+        return (
+            orphan_ids,
+            [orphans[c][0] for c in orphan_ids],
+            [orphans[c][1] for c in orphan_ids],
+        )
+
+    def remove_sources(self, sources: Iterable[str]) -> int:
+        """Xóa links duplicate thuộc các source (trước khi xóa canonical → không bị promote)."""
+        srcs = [str(s) for s in dict.fromkeys(sources)]
+        removed = 0
+        with self._lock, self._connect() as conn:
+            for start in range(0, len(srcs), 500):
+                part = srcs[start : start + 500]
+                marks = ",".join("?" * len(part))
+                cur = conn.execute(f"DELETE FROM links WHERE source IN ({marks})", part)
+                removed += cur.rowcount
+        return removed
+
+    def stats(self) -> dict[str, Any]:
+        with self._connect() as conn:
+            canonical = conn.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+            duplicates = conn.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+        total = canonical + duplicates
+        return {
+            "canonical_chunks": canonical,
+            "duplicate_chunks": duplicates,
+            "dedup_ratio": (duplicates / total) if total else 0.0,
+            "threshold": self.threshold,
+            "bands": self.bands,
+            "rows": self.rows,
+        }
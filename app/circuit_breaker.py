@@ -20,7 +20,7 @@ import logging
 import threading
 import time
 from collections import deque
-from collections.abc import Callable
+from collections.abc import Awaitable, Callable
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
@@ -163,6 +163,12 @@ class CircuitBreaker:
                 state_transitions=self._stats.state_transitions,
             )
 
+    def is_available(self) -> bool:
+        """Circuit có nhận request không (OPEN hết timeout → HALF_OPEN) - dùng cho routing! 🧭"""
+        with self._lock:
+            self._check_and_update_state()
+            return self._state != CircuitState.OPEN
+
     def _transition_to(self, new_state: CircuitState):
         """
         Chuyển state - tracking như pro! 🎯
@@ -289,22 +295,8 @@ class CircuitBreaker:
                 if self._stats.consecutive_failures >= self.config.failure_threshold:
                     self._transition_to(CircuitState.OPEN)
 
-    def call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
-        """
-        Execute function với circuit breaker protection - an toàn tuyệt đối! 🛡️
-
-        Args:
-            func: Function to execute
-            *args: Positional arguments cho func
-            **kwargs: Keyword arguments cho func
-
-        Returns:
-            Result từ func nếu success
-
-        Raises:
-            CircuitBreakerError: Nếu circuit OPEN
-            Exception: Original exception từ func nếu call fails
-        """
+    def _before_call(self) -> None:
+        """Admission check trước mỗi call - raise CircuitBreakerError nếu không cho phép."""
         with self._lock:
             self._check_and_update_state()
 
@@ -340,6 +332,24 @@ class CircuitBreaker:
                     )
                 self._half_open_calls += 1
 
+    def call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Execute function với circuit breaker protection - an toàn tuyệt đối! 🛡️
+
+        Args:
+            func: Function to execute
+            *args: Positional arguments cho func
+            **kwargs: Keyword arguments cho func
+
+        Returns:
+            Result từ func nếu success
+
+        Raises:
+            CircuitBreakerError: Nếu circuit OPEN
+            Exception: Original exception từ func nếu call fails
+        """
+        self._before_call()
+
         # Execute function (outside lock để tránh block other threads!)
         try:
             result = func(*args, **kwargs)
@@ -350,6 +360,24 @@ class CircuitBreaker:
             logger.error(f"❌ Circuit '{self.name}' call failed: {type(e).__name__}: {e}")
             raise
 
+    async def call_async(self, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """
+        Async version của `call` - await coroutine function với cùng logic bảo vệ! 🛡️
+
+        Raises:
+            CircuitBreakerError: Nếu circuit OPEN
+            Exception: Original exception từ func nếu call fails
+        """
+        self._before_call()
+        try:
+            result = await func(*args, **kwargs)
+            self._record_success()
+            return result
+        except Exception as e:
+            self._record_failure()
+            logger.error(f"❌ Circuit '{self.name}' call failed: {type(e).__name__}: {e}")
+            raise
+
     def protect(self, func: Callable[..., T]) -> Callable[..., T]:
         """
         Decorator để wrap function với circuit breaker - dễ dàng như ăn kẹo! 🍬
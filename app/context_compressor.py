@@ -0,0 +1,212 @@
+"""
+Context compression - giữ lại các câu liên quan tới câu hỏi trước khi dựng prompt ✂️
+
+Chunk 800 ký tự (CHUNK_SIZE) thường chỉ có một hai câu trả lời được câu hỏi, phần còn lại
+chỉ làm prompt dài và prefill chậm. Compressor chạy giữa retrieval/rerank và context packing:
+
+- ✅ Tách mỗi context thành câu (dấu câu / xuống dòng, gộp mảnh quá ngắn)
+- ✅ Embed câu hỏi + mọi câu chưa có trong cache bằng MỘT lời gọi embed, chấm cosine
+  bằng một phép nhân ma trận (numpy)
+- ✅ Giữ câu điểm cao nhất kèm câu lân cận (±CONTEXT_COMPRESS_NEIGHBORS) tới khi đạt
+  CONTEXT_COMPRESS_RATIO số ký tự; đoạn bị lược nối bằng " … "
+- ✅ Mỗi context giữ ít nhất câu tốt nhất của nó → số context và thứ tự không đổi,
+  citation [n] vẫn trỏ đúng metadata
+- ✅ Cache embedding theo câu (LRU + TTL) - chunk lặp lại giữa các query không embed lại
+- ✅ Embed lỗi / vector fallback toàn 0 → trả nguyên contexts, không cache vector hỏng
+"""
+
+import hashlib
+import logging
+import os
+import re
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+from .cache_utils import LRUCacheWithTTL
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+# Bật mặc định cho mọi query (ghi đè theo request bằng field `compress`)
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "0").lower() in ("1", "true", "yes")
+# Tỉ lệ ký tự giữ lại mục tiêu (0.35 ≈ prompt ngắn ~3x)
+CONTEXT_COMPRESS_RATIO = min(1.0, max(0.05, float(os.getenv("CONTEXT_COMPRESS_RATIO", "0.35"))))
+# Số câu lân cận giữ kèm mỗi câu được chọn (mỗi phía)
+CONTEXT_COMPRESS_NEIGHBORS = max(0, int(os.getenv("CONTEXT_COMPRESS_NEIGHBORS", "1")))
+# Context ngắn hơn ngưỡng (ký tự) giữ nguyên
+CONTEXT_COMPRESS_MIN_CHARS = max(0, int(os.getenv("CONTEXT_COMPRESS_MIN_CHARS", "240")))
+# Cache embedding câu
+CONTEXT_COMPRESS_CACHE_SIZE = max(1, int(os.getenv("CONTEXT_COMPRESS_CACHE_SIZE", "20000")))
+CONTEXT_COMPRESS_CACHE_TTL = int(os.getenv("CONTEXT_COMPRESS_CACHE_TTL", "3600"))
+
+GAP = "…"
+_SENT_SPLIT_RE = re.compile(r"(?<=[.!?…;:])\s+|\n+")
+# Mảnh ngắn hơn ngưỡng (ký tự) gộp vào câu trước (viết tắt, số mục "1.", ...)
+_MIN_SENTENCE_CHARS = 20
+
+
+def split_sentences(text: str) -> list[str]:
+    """Tách câu đơn giản theo dấu câu / xuống dòng; gộp mảnh quá ngắn vào câu trước."""
+    out: list[str] = []
+    for part in _SENT_SPLIT_RE.split(text or ""):
+        part = part.strip()
+        if not part:
+            continue
+        if out and (len(out[-1]) < _MIN_SENTENCE_CHARS or len(part) < _MIN_SENTENCE_CHARS):
+            out[-1] = f"{out[-1]} {part}"
+        else:
+            out.append(part)
+    return out
+
+
+def _sent_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CompressResult:
+    docs: list[str]
+    chars_before: int = 0
+    chars_after: int = 0
+    sentences_total: int = 0
+    sentences_kept: int = 0
+
+    @property
+    def ratio(self) -> float:
+        return self.chars_after / self.chars_before if self.chars_before else 1.0
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "chars_before": self.chars_before,
+            "chars_after": self.chars_after,
+            "ratio": round(self.ratio, 3),
+            "sentences_total": self.sentences_total,
+            "sentences_kept": self.sentences_kept,
+        }
+
+
+class ContextCompressor:
+    """Nén contexts theo câu dựa trên độ tương đồng embedding với câu hỏi."""
+
+    def __init__(
+        self,
+        embed_fn: Callable[[list[str]], list[list[float]]],
+        ratio: float | None = None,
+        neighbors: int | None = None,
+        min_chars: int | None = None,
+        cache_size: int | None = None,
+    ):
+        self.embed_fn = embed_fn
+        self.ratio = CONTEXT_COMPRESS_RATIO if ratio is None else ratio
+        self.neighbors = CONTEXT_COMPRESS_NEIGHBORS if neighbors is None else neighbors
+        self.min_chars = CONTEXT_COMPRESS_MIN_CHARS if min_chars is None else min_chars
+        self._cache = LRUCacheWithTTL[np.ndarray](
+            max_size=cache_size or CONTEXT_COMPRESS_CACHE_SIZE, ttl=CONTEXT_COMPRESS_CACHE_TTL
+        )
+
+    def stats(self) -> dict[str, Any]:
+        return {"sentence_cache": self._cache.stats()}
+
+    def _embed(self, query: str, sentences: Sequence[str]) -> tuple[np.ndarray, np.ndarray]:
+        """(query_vec, sentence_matrix) chuẩn hóa L2; embed phần chưa cache trong một lời gọi."""
+        vecs: list[np.ndarray | None] = [self._cache.get(_sent_key(s)) for s in sentences]
+        missing = [i for i, v in enumerate(vecs) if v is None]
+        texts = [query] + [sentences[i] for i in missing]
+        embs = self.embed_fn(texts)
+        if len(embs) != len(texts):
+            raise ValueError(f"embed trả về {len(embs)} vectors cho {len(texts)} texts")
+        new = [np.asarray(e, dtype=np.float32) for e in embs]
+        # Ollama lỗi/circuit OPEN trả vector 0 (fallback) → không nén, không cache
+        if any(not v.size or not np.any(v) for v in new):
+            raise ValueError("embed trả về vector 0 (fallback)")
+        q = new[0]
+        for i, v in zip(missing, new[1:], strict=True):
+            vecs[i] = v
+            self._cache.set(_sent_key(sentences[i]), v)
+        mat = np.vstack(vecs) if vecs else np.zeros((0, q.shape[0]), dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return q, mat / norms
+
+    def compress(self, query: str, docs: list[str]) -> CompressResult:
+        """Nén từng context; số lượng và thứ tự contexts giữ nguyên."""
+        split = [split_sentences(d) if len(d or "") >= self.min_chars else [] for d in docs]
+        flat = [(di, si) for di, ss in enumerate(split) for si in range(len(ss))]
+        chars_before = sum(len(d or "") for d in docs)
+        if not flat or self.ratio >= 1.0:
+            return CompressResult(list(docs), chars_before, chars_before)
+        try:
+            q, mat = self._embed(query, [split[di][si] for di, si in flat])
+        except Exception as e:
+            logger.warning("Context compression bỏ qua (embed lỗi): %s", e)
+            return CompressResult(list(docs), chars_before, chars_before)
+        scores = mat @ q
+
+        keep: list[set[int]] = [set() for _ in docs]
+        # Ký tự mục tiêu chỉ tính trên contexts được nén
+        target = self.ratio * sum(len(docs[di]) for di, ss in enumerate(split) if ss)
+        kept_chars = 0
+
+        def take(di: int, si: int) -> int:
+            added = 0
+            lo, hi = max(0, si - self.neighbors), min(len(split[di]) - 1, si + self.neighbors)
+            for j in range(lo, hi + 1):
+                if j not in keep[di]:
+                    keep[di].add(j)
+                    added += len(split[di][j]) + 1
+            return added
+
+        order = np.argsort(-scores, kind="stable")
+        # Mỗi context giữ câu tốt nhất của nó (context không bị rỗng → citation giữ nguyên)
+        seen_docs: set[int] = set()
+        for k in order:
+            di, si = flat[int(k)]
+            if split[di] and di not in seen_docs:
+                seen_docs.add(di)
+                kept_chars += take(di, si)
+        for k in order:
+            if kept_chars >= target:
+                break
+            di, si = flat[int(k)]
+            if si not in keep[di]:
+                kept_chars += take(di, si)
+
+        out: list[str] = []
+        for di, doc in enumerate(docs):
+            ss = split[di]
+            if not ss:
+                out.append(doc)
+                continue
+            parts: list[str] = []
+            prev = -1
+            for j in sorted(keep[di]):
+                if parts and j != prev + 1:
+                    parts.append(GAP)
+                parts.append(ss[j])
+                prev = j
+            # Đánh dấu phần bị lược ở đầu/cuối để model không coi là trọn đoạn
+            if min(keep[di]) > 0:
+                parts.insert(0, GAP)
+            if prev < len(ss) - 1:
+                parts.append(GAP)
+            out.append(" ".join(parts))
+        result = CompressResult(
+            docs=out,
+            chars_before=chars_before,
+            chars_after=sum(len(d or "") for d in out),
+            sentences_total=len(flat),
+            sentences_kept=sum(len(k) for k in keep),
+        )
+        if METRICS_ENABLED:
+            metrics.record_context_compression(result.chars_before, result.chars_after)
+        return result
@@ -0,0 +1,311 @@
+"""
+Context packing - xếp contexts vào prompt theo ngân sách token 📦
+
+build_prompt ghép nguyên văn mọi context đã chọn, bất kể OLLAMA_NUM_CTX: k lớn hoặc chunk
+dài làm prefill chậm (chi phí chính của Ollama chạy CPU) và Ollama âm thầm cắt đầu prompt
+khi vượt num_ctx. Packer chạy trước build_prompt:
+
+- ✅ Đếm token bằng tokenizer HF (PROMPT_TOKENIZER) hoặc ước lượng nhanh theo từ/ký tự
+- ✅ Ngân sách = num_ctx - phần dành cho câu trả lời - khung prompt (system + câu hỏi)
+- ✅ Chia ngân sách theo thứ hạng/điểm (water-filling): context ngắn lấy đủ, phần dư
+  chuyển cho context khác
+- ✅ Context được phần quá ít → bỏ; context dài → cắt ở ranh giới câu
+- ✅ Đánh số lại [CTX n] liên tục trên các context giữ lại (metas lọc tương ứng)
+  nên citation [n] luôn khớp với `contexts` trả về
+- ✅ Báo cáo số token dùng / bỏ / cắt trong response (`packing`) và metrics
+"""
+
+import logging
+import math
+import os
+import re
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+try:
+    from transformers import AutoTokenizer  # type: ignore
+except Exception:  # pragma: no cover
+    AutoTokenizer = None  # type: ignore
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except ValueError:
+        return default
+
+
+PROMPT_PACKING = os.getenv("PROMPT_PACKING", "1").lower() in ("1", "true", "yes")
+# Ngân sách token cho toàn prompt (0 = OLLAMA_NUM_CTX - PROMPT_ANSWER_RESERVE)
+PROMPT_TOKEN_BUDGET = max(0, _int_env("PROMPT_TOKEN_BUDGET", 0))
+# num_ctx khi OLLAMA_NUM_CTX không đặt (mặc định của Ollama)
+PROMPT_DEFAULT_NUM_CTX = max(256, _int_env("PROMPT_DEFAULT_NUM_CTX", 2048))
+# Số token dành cho câu trả lời (num_ctx gồm cả prompt lẫn output)
+PROMPT_ANSWER_RESERVE = max(0, _int_env("PROMPT_ANSWER_RESERVE", 256))
+# Context được phần ít hơn ngưỡng này (token) thì bỏ thay vì cắt vụn
+PROMPT_MIN_CTX_TOKENS = max(1, _int_env("PROMPT_MIN_CTX_TOKENS", 48))
+# Tokenizer HF (repo id/path) để đếm chính xác; trống = ước lượng
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "").strip()
+
+# "[CTX n]\n" + "\n\n" giữa các block
+BLOCK_OVERHEAD_TOKENS = 6
+_ELLIPSIS = " …"
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_SENTENCE_END_RE = re.compile(r"[.!?。…]\s|\n")
+
+
+def _piece_tokens(piece: str) -> int:
+    """Ước lượng token của một từ: BPE tách từ dài / có dấu (tiếng Việt) thành nhiều mảnh."""
+    per = 4 if piece.isascii() else 3
+    return max(1, math.ceil(len(piece) / per))
+
+
+class ApproxTokenCounter:
+    """Đếm token xấp xỉ theo từ + dấu câu (không cần tokenizer, ~µs mỗi context)."""
+
+    name = "approx"
+
+    def count(self, text: str) -> int:
+        return sum(_piece_tokens(m.group()) for m in _PIECE_RE.finditer(text or ""))
+
+    def cut(self, text: str, max_tokens: int) -> int:
+        """Vị trí ký tự sau token thứ `max_tokens`."""
+        used = 0
+        end = 0
+        for m in _PIECE_RE.finditer(text or ""):
+            used += _piece_tokens(m.group())
+            if used > max_tokens:
+                break
+            end = m.end()
+        return end
+
+
+class HfTokenCounter:
+    """Đếm token bằng tokenizer HF (fast tokenizer, dùng offset mapping để cắt)."""
+
+    def __init__(self, tokenizer: Any, name: str):
+        self._tok = tokenizer
+        self.name = f"hf:{name}"
+
+    def count(self, text: str) -> int:
+        return len(self._tok.encode(text or "", add_special_tokens=False))
+
+    def cut(self, text: str, max_tokens: int) -> int:
+        enc = self._tok(text or "", add_special_tokens=False, return_offsets_mapping=True)
+        offsets = enc["offset_mapping"]
+        if max_tokens <= 0:
+            return 0
+        if len(offsets) <= max_tokens:
+            return len(text or "")
+        return int(offsets[max_tokens - 1][1])
+
+
+_counter: Any = None
+
+
+def get_token_counter() -> Any:
+    """Token counter dùng chung: HF nếu PROMPT_TOKENIZER nạp được, ngược lại ước lượng."""
+    global _counter
+    if _counter is None:
+        counter: Any = ApproxTokenCounter()
+        if PROMPT_TOKENIZER and AutoTokenizer is not None:
+            try:
+                tok = AutoTokenizer.from_pretrained(PROMPT_TOKENIZER, use_fast=True)
+                counter = HfTokenCounter(tok, PROMPT_TOKENIZER)
+            except Exception as e:
+                logger.warning(
+                    "PROMPT_TOKENIZER %s không nạp được (%s), dùng ước lượng", PROMPT_TOKENIZER, e
+                )
+        _counter = counter
+    return _counter
+
+
+def default_prompt_budget() -> int:
+    """Ngân sách token cho toàn prompt theo env (PROMPT_TOKEN_BUDGET hoặc num_ctx - reserve)."""
+    if PROMPT_TOKEN_BUDGET > 0:
+        return PROMPT_TOKEN_BUDGET
+    num_ctx = _int_env("OLLAMA_NUM_CTX", PROMPT_DEFAULT_NUM_CTX) or PROMPT_DEFAULT_NUM_CTX
+    return max(PROMPT_MIN_CTX_TOKENS, num_ctx - PROMPT_ANSWER_RESERVE)
+
+
+def allocate(sizes: list[int], weights: list[float], budget: int) -> list[int]:
+    """
+    Chia `budget` token theo trọng số (water-filling).
+
+    Context cần ít hơn phần của nó lấy đúng `size`, phần dư chia lại cho các context còn lại.
+    """
+    alloc = [0] * len(sizes)
+    active = [i for i in range(len(sizes)) if sizes[i] > 0]
+    left = max(0, budget)
+    while active and left > 0:
+        total_w = sum(weights[i] for i in active) or float(len(active))
+        share = {i: left * (weights[i] or 1.0) / total_w for i in active}
+        fits = [i for i in active if sizes[i] <= share[i]]
+        if not fits:
+            for i in active:
+                alloc[i] = int(share[i])
+            break
+        for i in fits:
+            alloc[i] = sizes[i]
+            left -= sizes[i]
+        active = [i for i in active if i not in fits]
+    return alloc
+
+
+def trim_text(text: str, max_tokens: int, counter: Any) -> str:
+    """Cắt `text` còn ~max_tokens token, ưu tiên dừng ở cuối câu."""
+    end = counter.cut(text, max(0, max_tokens - 1))  # chừa 1 token cho dấu "…"
+    if end >= len(text):
+        return text
+    head = text[:end]
+    # Lùi về ranh giới câu nếu không mất quá 1/3 phần đã giữ
+    last = None
+    for m in _SENTENCE_END_RE.finditer(head):
+        last = m
+    if last is not None and last.start() + 1 >= len(head) * 2 / 3:
+        head = head[: last.start() + 1]
+    return head.rstrip() + _ELLIPSIS
+
+
+@dataclass
+class PackResult:
+    """Contexts sau khi pack (thứ tự giữ nguyên, đánh số lại 1..n) + báo cáo token."""
+
+    docs: list[str]
+    metas: list[dict]
+    kept: list[int]  # chỉ số gốc của các context giữ lại
+    dropped: list[int] = field(default_factory=list)
+    trimmed: list[int] = field(default_factory=list)  # chỉ số gốc đã bị cắt
+    budget: int = 0
+    prompt_tokens: int = 0
+    context_tokens: int = 0
+    tokenizer: str = "approx"
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "budget": self.budget,
+            "prompt_tokens": self.prompt_tokens,
+            "context_tokens": self.context_tokens,
+            "kept": len(self.kept),
+            "dropped": list(self.dropped),
+            "trimmed": list(self.trimmed),
+            "tokenizer": self.tokenizer,
+        }
+
+
+class ContextPacker:
+    """Pack contexts vào ngân sách token của prompt."""
+
+    def __init__(
+        self,
+        budget: int | None = None,
+        min_ctx_tokens: int | None = None,
+        counter: Any = None,
+    ):
+        self.budget = budget if budget is not None else default_prompt_budget()
+        self.min_ctx_tokens = (
+            min_ctx_tokens if min_ctx_tokens is not None else PROMPT_MIN_CTX_TOKENS
+        )
+        self.counter = counter if counter is not None else get_token_counter()
+
+    def pack(
+        self,
+        docs: list[str],
+        metas: list[dict] | None = None,
+        *,
+        scaffold: str = "",
+        scores: list[float] | None = None,
+        render: Callable[[list[str]], str] | None = None,
+    ) -> PackResult:
+        """
+        Chọn/cắt contexts để prompt (scaffold + các block) vừa ngân sách.
+
+        Args:
+            docs: contexts theo thứ hạng (tốt nhất trước)
+            metas: metadatas tương ứng (lọc cùng docs)
+            scaffold: phần prompt không phải context (system + câu hỏi)
+            scores: điểm rerank/retrieval (cao = tốt); None → trọng số theo thứ hạng 1/(r+1)
+            render: hàm dựng prompt đầy đủ để đếm lại prompt_tokens (tùy chọn)
+        """
+        metas = list(metas) if metas is not None else [{} for _ in docs]
+        counter = self.counter
+        n = len(docs)
+        scaffold_tokens = counter.count(scaffold)
+        ctx_budget = max(0, self.budget - scaffold_tokens)
+        sizes = [counter.count(d) + BLOCK_OVERHEAD_TOKENS for d in docs]
+        weights = self._weights(n, scores)
+
+        candidates = list(range(n))
+        alloc: list[int] = []
+        while candidates:
+            alloc = allocate(
+                [sizes[i] for i in candidates], [weights[i] for i in candidates], ctx_budget
+            )
+            starving = [
+                j
+                for j, i in enumerate(candidates)
+                if alloc[j] < sizes[i] and alloc[j] - BLOCK_OVERHEAD_TOKENS < self.min_ctx_tokens
+            ]
+            if not starving or len(candidates) == 1:
+                break
+            # Bỏ context giá trị thấp nhất trong số bị "đói", chia lại ngân sách
+            drop = min(starving, key=lambda j: (weights[candidates[j]], -candidates[j]))
+            candidates.pop(drop)
+
+        out_docs: list[str] = []
+        kept: list[int] = []
+        trimmed: list[int] = []
+        used = 0
+        for j, i in enumerate(candidates):
+            # Luôn giữ context tốt nhất dù ngân sách cạn - trả lời không ngữ cảnh còn tệ hơn
+            room = max(alloc[j], self.min_ctx_tokens + BLOCK_OVERHEAD_TOKENS if j == 0 else 0)
+            if room < sizes[i]:
+                text = trim_text(docs[i], room - BLOCK_OVERHEAD_TOKENS, counter)
+                if not text.strip() or text == _ELLIPSIS.strip():
+                    continue
+                trimmed.append(i)
+                used += counter.count(text) + BLOCK_OVERHEAD_TOKENS
+            else:
+                text = docs[i]
+                used += sizes[i]
+            out_docs.append(text)
+            kept.append(i)
+
+        kept_set = set(kept)
+        result = PackResult(
+            docs=out_docs,
+            metas=[metas[i] if i < len(metas) else {} for i in kept],
+            kept=kept,
+            dropped=[i for i in range(n) if i not in kept_set],
+            trimmed=trimmed,
+            budget=self.budget,
+            prompt_tokens=scaffold_tokens + used,
+            context_tokens=used,
+            tokenizer=counter.name,
+        )
+        if render is not None:
+            result.prompt_tokens = counter.count(render(out_docs))
+        if METRICS_ENABLED:
+            metrics.record_context_packing(
+                result.prompt_tokens, len(result.dropped), len(result.trimmed)
+            )
+        return result
+
+    @staticmethod
+    def _weights(n: int, scores: list[float] | None) -> list[float]:
+        if scores is None or len(scores) != n:
+            return [1.0 / (r + 1) for r in range(n)]
+        # Đưa điểm về (0, 1]: context tệ nhất vẫn có trọng số nhỏ > 0
+        lo, hi = min(scores), max(scores)
+        span = (hi - lo) or 1.0
+        return [0.1 + 0.9 * (s - lo) / span for s in scores]
@@ -125,6 +125,25 @@ class CrossEncoderReranker:
         """Check if reranker is available."""
         return self._initialized and self.model is not None
 
+    def score(self, query: str, docs: list[str]) -> list[float]:
+        """
+        Raw relevance scores for (query, doc) pairs, in input order.
+
+        Raises:
+            RuntimeError: if the model is not loaded
+        """
+        if not self.is_available():
+            raise RuntimeError("Cross-encoder not available")
+        if not docs:
+            return []
+        scores = self.model.predict(
+            [[query, doc] for doc in docs],
+            batch_size=self.batch_size,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+        )
+        return [float(x) for x in np.asarray(scores).reshape(-1)]
+
     def rerank(
         self,
         query: str,
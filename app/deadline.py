@@ -0,0 +1,170 @@
+"""
+Deadline - ngân sách thời gian end-to-end cho một query + degrade từng bước ⏱️
+
+/api/query và /api/stream_query không có deadline: rewrite hay rerank chậm chỉ đơn giản
+làm request chậm theo. Deadline (field `deadline_ms` hoặc header X-Deadline-Ms) được
+truyền qua contextvar (giống `llm_priority`) nên retrieve_aggregate, _apply_rerank và
+LLM client đọc được mà không phải thread thêm tham số:
+
+- ✅ Còn ít thời gian → bỏ query rewrite (thêm một lượt LLM)
+- ✅ Rất ít → vector/hybrid lùi về BM25-only (không cần gọi embed)
+- ✅ Rerank: thu nhỏ số candidate theo thời gian còn lại, quá ít → bỏ rerank
+- ✅ Generation: giới hạn num_predict (max_tokens) theo thời gian còn lại
+- ✅ Mỗi quyết định được ghi vào response (`degradations`) và metrics
+"""
+
+import logging
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+
+# Deadline mặc định cho query (ms, 0 = không giới hạn)
+QUERY_DEADLINE_MS = max(0, int(os.getenv("QUERY_DEADLINE_MS", "0")))
+# Ngưỡng thời gian còn lại (ms) cho từng bước
+DEADLINE_REWRITE_MIN_MS = float(os.getenv("DEADLINE_REWRITE_MIN_MS", "4000"))
+DEADLINE_VECTOR_MIN_MS = float(os.getenv("DEADLINE_VECTOR_MIN_MS", "1000"))
+DEADLINE_RERANK_MIN_MS = float(os.getenv("DEADLINE_RERANK_MIN_MS", "1500"))
+DEADLINE_RERANK_FULL_MS = float(os.getenv("DEADLINE_RERANK_FULL_MS", "4000"))
+# Generation: ms/token ước lượng, thời gian dành cho prompt eval, số token tối thiểu
+DEADLINE_MS_PER_TOKEN = max(1.0, float(os.getenv("DEADLINE_MS_PER_TOKEN", "50")))
+DEADLINE_PROMPT_RESERVE_MS = float(os.getenv("DEADLINE_PROMPT_RESERVE_MS", "500"))
+DEADLINE_MIN_PREDICT = max(1, int(os.getenv("DEADLINE_MIN_PREDICT", "32")))
+# Cap >= ngưỡng này coi như không degrade (không ghi nhận)
+DEADLINE_FULL_PREDICT = max(1, int(os.getenv("DEADLINE_FULL_PREDICT", "1024")))
+
+
+class Deadline:
+    """Deadline của một request: thời gian còn lại + danh sách quyết định degrade."""
+
+    def __init__(self, budget_ms: float, start: float | None = None):
+        self.budget_ms = float(budget_ms)
+        self.start = time.monotonic() if start is None else start
+        self.degradations: list[dict[str, Any]] = []
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.start) * 1000.0
+
+    def remaining_ms(self) -> float:
+        return max(0.0, self.budget_ms - self.elapsed_ms())
+
+    def expired(self) -> bool:
+        return self.remaining_ms() <= 0
+
+    def degrade(self, stage: str, action: str, **detail: Any) -> None:
+        """Ghi một quyết định; cùng (stage, action) chỉ giữ lần cuối."""
+        entry = {
+            "stage": stage,
+            "action": action,
+            "remaining_ms": round(self.remaining_ms()),
+            **detail,
+        }
+        for i, d in enumerate(self.degradations):
+            if d["stage"] == stage and d["action"] == action:
+                self.degradations[i] = entry
+                return
+        self.degradations.append(entry)
+        if METRICS_ENABLED:
+            metrics.record_degradation(stage, action)
+
+    # ===== Quyết định theo từng bước =====
+    def allow_rewrite(self) -> bool:
+        if self.remaining_ms() < DEADLINE_REWRITE_MIN_MS:
+            self.degrade("rewrite", "skipped")
+            return False
+        return True
+
+    def retrieval_method(self, method: str) -> str:
+        if method in ("vector", "hybrid") and self.remaining_ms() < DEADLINE_VECTOR_MIN_MS:
+            self.degrade("retrieval", "bm25_only", requested=method)
+            return "bm25"
+        return method
+
+    def rerank_limit(self, n: int, top_k: int) -> int:
+        """Số candidate được rerank (0 = bỏ rerank)."""
+        left = self.remaining_ms()
+        if left < DEADLINE_RERANK_MIN_MS:
+            self.degrade("rerank", "skipped", candidates=n)
+            return 0
+        if left >= DEADLINE_RERANK_FULL_MS or n <= top_k:
+            return n
+        span = max(1.0, DEADLINE_RERANK_FULL_MS - DEADLINE_RERANK_MIN_MS)
+        frac = (left - DEADLINE_RERANK_MIN_MS) / span
+        limit = max(top_k, int(round(top_k + (n - top_k) * frac)))
+        if limit < n:
+            self.degrade("rerank", "shrunk", candidates=n, limit=limit)
+        return min(n, limit)
+
+    def generation_cap(self) -> int:
+        """num_predict tối đa để kịp deadline (ít nhất DEADLINE_MIN_PREDICT)."""
+        usable = self.remaining_ms() - DEADLINE_PROMPT_RESERVE_MS
+        cap = max(DEADLINE_MIN_PREDICT, int(usable / DEADLINE_MS_PER_TOKEN))
+        if cap < DEADLINE_FULL_PREDICT:
+            self.degrade("generate", "capped", num_predict=cap)
+        return cap
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "deadline_ms": self.budget_ms,
+            "elapsed_ms": round(self.elapsed_ms()),
+            "degradations": list(self.degradations),
+        }
+
+
+_current: ContextVar[Deadline | None] = ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Deadline | None:
+    return _current.get()
+
+
+def new_deadline(budget_ms: float | None = None, header: str | None = None) -> Deadline | None:
+    """Deadline từ field request, header (ms) hoặc QUERY_DEADLINE_MS; None nếu không có."""
+    value: float | None = budget_ms
+    if value is None and header:
+        try:
+            value = float(header)
+        except ValueError:
+            value = None
+    if value is None:
+        value = QUERY_DEADLINE_MS
+    return Deadline(value) if value and value > 0 else None
+
+
+@contextmanager
+def use_deadline(deadline: Deadline | None) -> Iterator[Deadline | None]:
+    """Gắn deadline vào context hiện tại (None = không giới hạn)."""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # async generator bị đóng ở context khác (client ngắt stream)
+            pass
+
+
+def generation_cap() -> int | None:
+    """num_predict cho lời gọi LLM hiện tại theo deadline (None = không giới hạn)."""
+    dl = _current.get()
+    return dl.generation_cap() if dl is not None else None
+
+
+def generation_capped() -> bool:
+    """Generation hiện tại có bị cắt bởi deadline (không nên cache kết quả)."""
+    dl = _current.get()
+    return dl is not None and any(d["stage"] == "generate" for d in dl.degradations)
@@ -0,0 +1,258 @@
+"""
+Dir Watcher - đồng bộ thư mục tài liệu gần real-time 👀
+
+Thay cho cron gọi /api/ingest (quét lại toàn bộ bằng glob mỗi lần):
+
+- ✅ Backend inotify (qua watchfiles - có sẵn với uvicorn[standard]), fallback polling
+- ✅ Debounce: gom events cho tới khi thư mục "yên" DEBOUNCE_S giây (tối đa MAX_DELAY_S)
+- ✅ Chỉ đẩy paths created/modified/deleted (*.txt/*.pdf/*.docx) vào ingest tăng dần
+- ✅ Paths giữ đúng dạng root đã cấu hình → khớp source/manifest của ingest thủ công
+- ✅ Metrics: số events theo loại, số lần flush
+"""
+
+import fnmatch
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from app.ingest_pipeline import INGEST_PATTERNS
+
+try:
+    import watchfiles as _watchfiles  # type: ignore
+except Exception:  # pragma: no cover
+    _watchfiles = None
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+BACKEND_AUTO = "auto"
+BACKEND_INOTIFY = "inotify"
+BACKEND_POLL = "poll"
+
+EVENT_CHANGED = "changed"
+EVENT_DELETED = "deleted"
+
+# on_change(changed_paths, deleted_paths) - gọi từ thread flush của watcher
+ChangeHandler = Callable[[list[str], list[str]], Any]
+
+
+def is_ingestable(path: str) -> bool:
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(name.lower(), p) for p in INGEST_PATTERNS)
+
+
+def _is_relevant(path: str, kind: str) -> bool:
+    """File tài liệu, thư mục được move vào, hoặc thư mục (không đuôi) bị xóa/move đi."""
+    if is_ingestable(path):
+        return True
+    if kind == EVENT_DELETED:
+        return not os.path.splitext(path)[1]
+    return os.path.isdir(path)
+
+
+class DirWatcher:
+    """Theo dõi các thư mục gốc, debounce events rồi gọi `on_change` theo lô."""
+
+    def __init__(
+        self,
+        roots: Iterable[str],
+        on_change: ChangeHandler,
+        debounce_s: float = 2.0,
+        max_delay_s: float = 30.0,
+        poll_interval_s: float = 5.0,
+        backend: str = BACKEND_AUTO,
+    ):
+        self.roots = [r for r in roots if r]
+        self.on_change = on_change
+        self.debounce_s = max(0.0, debounce_s)
+        self.max_delay_s = max(self.debounce_s, max_delay_s)
+        self.poll_interval_s = max(0.1, poll_interval_s)
+        self.backend = self._pick_backend(backend)
+        self._pending: dict[str, str] = {}
+        self._first_event_at = 0.0
+        self._last_event_at = 0.0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self.events_seen = 0
+        self.flushes = 0
+        self.last_flush_at: float | None = None
+        self.last_error: str | None = None
+
+    @staticmethod
+    def _pick_backend(backend: str) -> str:
+        backend = (backend or BACKEND_AUTO).strip().lower()
+        if backend == BACKEND_POLL:
+            return BACKEND_POLL
+        if _watchfiles is None:
+            if backend == BACKEND_INOTIFY:
+                logger.warning("watchfiles not installed → falling back to polling watcher")
+            return BACKEND_POLL
+        return BACKEND_INOTIFY
+
+    # ===== Lifecycle =====
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        for root in self.roots:
+            os.makedirs(root, exist_ok=True)
+        source = self._watch_inotify if self.backend == BACKEND_INOTIFY else self._watch_poll
+        self._threads = [
+            threading.Thread(target=source, name="dir-watcher", daemon=True),
+            threading.Thread(target=self._flush_loop, name="dir-watcher-flush", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        logger.info(f"Watching {self.roots} ({self.backend}, debounce {self.debounce_s}s)")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    @property
+    def running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def status(self) -> dict[str, Any]:
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "running": self.running,
+            "roots": list(self.roots),
+            "backend": self.backend,
+            "debounce_s": self.debounce_s,
+            "pending": pending,
+            "events_seen": self.events_seen,
+            "flushes": self.flushes,
+            "last_flush_at": self.last_flush_at,
+            "last_error": self.last_error,
+        }
+
+    # ===== Events =====
+    def record(self, path: str, kind: str) -> None:
+        """Ghi nhận một event (backends gọi). Event sau cùng của cùng path thắng."""
+        if not _is_relevant(path, kind):
+            return
+        now = time.monotonic()
+        with self._cond:
+            if not self._pending:
+                self._first_event_at = now
+            self._pending[path] = kind
+            self._last_event_at = now
+            self.events_seen += 1
+            self._cond.notify_all()
+        if METRICS_ENABLED:
+            metrics.record_watch_event(kind)
+
+    def _to_root_form(self, root: str, abs_root: str, path: str) -> str:
+        """Đổi path tuyệt đối từ backend về dạng root đã cấu hình (vd. data/docs/a.pdf)."""
+        rel = os.path.relpath(path, abs_root)
+        return root if rel == "." else os.path.join(root, rel)
+
+    def _take_ready(self) -> tuple[list[str], list[str]] | None:
+        """Lấy lô events nếu đã hết debounce (hoặc quá max delay). Gọi khi giữ _cond."""
+        if not self._pending:
+            return None
+        now = time.monotonic()
+        quiet = now - self._last_event_at >= self.debounce_s
+        overdue = now - self._first_event_at >= self.max_delay_s
+        if not (quiet or overdue or self._stop.is_set()):
+            return None
+        batch, self._pending = self._pending, {}
+        changed = sorted(p for p, k in batch.items() if k == EVENT_CHANGED)
+        deleted = sorted(p for p, k in batch.items() if k == EVENT_DELETED)
+        return changed, deleted
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cond:
+                ready = self._take_ready()
+                while ready is None and not self._stop.is_set():
+                    self._cond.wait(timeout=max(0.05, self.debounce_s / 4))
+                    ready = self._take_ready()
+            if ready is None:
+                return
+            self._flush(*ready)
+            if self._stop.is_set():
+                return
+
+    def _flush(self, changed: list[str], deleted: list[str]) -> None:
+        self.flushes += 1
+        self.last_flush_at = time.time()
+        if METRICS_ENABLED:
+            metrics.record_watch_flush()
+        try:
+            self.on_change(changed, deleted)
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning(
+                f"Watcher sync failed ({len(changed)} changed, {len(deleted)} deleted): {e}"
+            )
+
+    # ===== Backends =====
+    def _watch_inotify(self) -> None:
+        abs_roots = [(r, os.path.abspath(r)) for r in self.roots]
+        try:
+            for changes in _watchfiles.watch(
+                *[a for _, a in abs_roots],
+                stop_event=self._stop,
+                debounce=max(50, int(self.debounce_s * 1000)),
+                step=50,
+                rust_timeout=1000,
+                raise_interrupt=False,
+            ):
+                for change, path in changes:
+                    root, abs_root = next(
+                        ((r, a) for r, a in abs_roots if path.startswith(os.path.join(a, ""))),
+                        abs_roots[0],
+                    )
+                    kind = EVENT_DELETED if change == _watchfiles.Change.deleted else EVENT_CHANGED
+                    self.record(self._to_root_form(root, abs_root, path), kind)
+        except Exception as e:
+            if self._stop.is_set():
+                return
+            logger.warning(f"inotify watcher failed ({e}) → falling back to polling")
+            self.backend = BACKEND_POLL
+            self._watch_poll()
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        snapshot: dict[str, tuple[int, int]] = {}
+        for root in self.roots:
+            for dirpath, _dirs, files in os.walk(root):
+                for name in files:
+                    path = os.path.join(dirpath, name)
+                    if not is_ingestable(path):
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def _watch_poll(self) -> None:
+        """Fallback: so sánh snapshot (size, mtime) mỗi poll_interval_s - chỉ stat, không parse."""
+        previous = self._scan()
+        while not self._stop.wait(self.poll_interval_s):
+            current = self._scan()
+            for path, stat in current.items():
+                if previous.get(path) != stat:
+                    self.record(path, EVENT_CHANGED)
+            for path in previous.keys() - current.keys():
+                self.record(path, EVENT_DELETED)
+            previous = current
@@ -40,6 +40,16 @@ class IngestError(OllamaRAGException):
     pass
 
 
+class IngestCancelledError(IngestError):
+    """
+    Ingest job bị hủy giữa chừng (qua API cancel).
+
+    Các batch đã ghi vẫn được giữ lại; job có thể chạy lại để hoàn tất.
+    """
+
+    pass
+
+
 class RetrievalError(OllamaRAGException):
     """
     Lỗi khi retrieve documents.
@@ -129,6 +139,23 @@ class RateLimitError(OllamaRAGException):
     pass
 
 
+class LLMOverloadedError(OllamaRAGException):
+    """
+    LLM scheduler từ chối request vì hàng đợi quá tải.
+
+    Có thể xảy ra khi:
+    - Thời gian chờ ước tính vượt ngưỡng
+    - Hàng đợi đã đầy
+    - Chờ slot quá lâu (queue timeout)
+
+    Client nên retry sau `retry_after` giây.
+    """
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after))
+
+
 class AuthenticationError(OllamaRAGException):
     """
     Lỗi authentication.
@@ -146,6 +173,7 @@ class AuthenticationError(OllamaRAGException):
 ERROR_CODE_MAP = {
     ValidationError: 400,
     IngestError: 500,
+    IngestCancelledError: 409,
     RetrievalError: 500,
     GenerationError: 500,
     ConfigError: 500,
@@ -153,6 +181,7 @@ ERROR_CODE_MAP = {
     ChatError: 404,
     ConnectionError: 503,
     RateLimitError: 429,
+    LLMOverloadedError: 503,
     AuthenticationError: 401,
     OllamaRAGException: 500,  # Default
 }
@@ -0,0 +1,352 @@
+"""
+Ingest Jobs - chạy ingestion nền, không chặn HTTP request/event loop 📥
+
+Parse PDF, chunking, embedding và ghi Chroma có thể mất hàng phút (hoặc hàng giờ
+với corpus nhiều GB). Thay vì chạy trong handler, request chỉ tạo job rồi trả về
+job ID ngay:
+
+- ✅ Job table SQLite dưới PERSIST_ROOT (ingest_jobs.sqlite) - sống sót qua restart
+- ✅ Worker pool riêng (mặc định 1 → ingest tuần tự, an toàn cho engine dùng chung)
+- ✅ Trạng thái: queued → running → done | failed | cancelled
+- ✅ Progress: files parsed/failed/skipped, chunks deduped/embedded/written/deleted
+- ✅ Hủy job (queued: hủy ngay, running: dừng ở batch kế tiếp)
+- ✅ Resume sau restart: job queued/running được chạy lại, bỏ qua file đã xong
+- ✅ Metrics: số job theo trạng thái
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Callable, Collection
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from app.exceptions import IngestCancelledError
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = max(1, int(os.getenv("INGEST_WORKERS", "1")))
+INGEST_JOB_HISTORY = max(1, int(os.getenv("INGEST_JOB_HISTORY", "200")))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINAL_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+# Counters cập nhật từ progress callback của RagEngine.ingest_paths
+PROGRESS_FIELDS = (
+    "files_total",
+    "files_parsed",
+    "files_failed",
+    "files_skipped",
+    "chunks_deduped",
+    "chunks_embedded",
+    "chunks_written",
+    "chunks_deleted",
+)
+
+# ingest_fn(paths, db, version, *, progress, should_cancel, skip_files) -> số chunks đã index
+IngestFn = Callable[..., int]
+
+_COLUMNS = (
+    "id",
+    "kind",
+    "status",
+    "db",
+    "version",
+    "paths",
+    *PROGRESS_FIELDS,
+    "chunks_indexed",
+    "error",
+    "cancel_requested",
+    "attempts",
+    "created_at",
+    "started_at",
+    "finished_at",
+    "updated_at",
+)
+
+
+class IngestJobStore:
+    """SQLite job table: ingest_jobs + ingest_job_files (file đã xử lý xong, dùng để resume)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ensure()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _ensure(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        counters = ", ".join(f"{f} INTEGER DEFAULT 0" for f in PROGRESS_FIELDS)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ingest_jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, status TEXT, db TEXT, version TEXT, "
+                f"paths TEXT, {counters}, chunks_indexed INTEGER DEFAULT 0, error TEXT, "
+                "cancel_requested INTEGER DEFAULT 0, attempts INTEGER DEFAULT 0, "
+                "created_at REAL, started_at REAL, finished_at REAL, updated_at REAL)"
+            )
+            # Migrate: thêm cột progress mới cho job table cũ
+            existing = {r[1] for r in conn.execute("PRAGMA table_info(ingest_jobs)")}
+            for f in PROGRESS_FIELDS:
+                if f not in existing:
+                    conn.execute(f"ALTER TABLE ingest_jobs ADD COLUMN {f} INTEGER DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs(status)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ingest_job_files ("
+                "job_id TEXT, path TEXT, PRIMARY KEY (job_id, path))"
+            )
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict[str, Any]:
+        job = {k: row[k] for k in _COLUMNS}
+        job["paths"] = json.loads(job["paths"] or "[]")
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def insert(self, job: dict[str, Any]) -> None:
+        row = dict(job, paths=json.dumps(job["paths"], ensure_ascii=False))
+        cols = [c for c in _COLUMNS if c in row]
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"INSERT INTO ingest_jobs ({', '.join(cols)}) "
+                f"VALUES ({', '.join('?' for _ in cols)})",
+                [row[c] for c in cols],
+            )
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM ingest_jobs WHERE id=?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_jobs(self, limit: int = 50, statuses: Collection[str] | None = None) -> list[dict]:
+        sql = "SELECT * FROM ingest_jobs"
+        args: list[Any] = []
+        if statuses:
+            sql += f" WHERE status IN ({', '.join('?' for _ in statuses)})"
+            args.extend(statuses)
+        sql += " ORDER BY created_at DESC"
+        if limit and limit > 0:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        with self._connect() as conn:
+            rows = conn.execute(sql, args).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        fields["updated_at"] = time.time()
+        sets = ", ".join(f"{k}=?" for k in fields)
+        with self._lock, self._connect() as conn:
+            conn.execute(f"UPDATE ingest_jobs SET {sets} WHERE id=?", [*fields.values(), job_id])
+
+    def add_progress(self, job_id: str, field: str, amount: int) -> None:
+        if field not in PROGRESS_FIELDS:
+            return
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"UPDATE ingest_jobs SET {field}={field}+?, updated_at=? WHERE id=?",
+                (int(amount), time.time(), job_id),
+            )
+
+    def mark_file_done(self, job_id: str, path: str) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO ingest_job_files(job_id, path) VALUES(?, ?)",
+                (job_id, path),
+            )
+
+    def done_files(self, job_id: str) -> set[str]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT path FROM ingest_job_files WHERE job_id=?", (job_id,)
+            ).fetchall()
+        return {r[0] for r in rows}
+
+    def trim(self, max_history: int) -> int:
+        """Xóa job đã kết thúc cũ nhất khi vượt quá max_history."""
+        marks = ", ".join("?" for _ in FINAL_STATUSES)
+        with self._lock, self._connect() as conn:
+            ids = [
+                r[0]
+                for r in conn.execute(
+                    f"SELECT id FROM ingest_jobs WHERE status IN ({marks}) "
+                    "ORDER BY created_at DESC LIMIT -1 OFFSET ?",
+                    (*FINAL_STATUSES, int(max_history)),
+                ).fetchall()
+            ]
+            for jid in ids:
+                conn.execute("DELETE FROM ingest_jobs WHERE id=?", (jid,))
+                conn.execute("DELETE FROM ingest_job_files WHERE job_id=?", (jid,))
+        return len(ids)
+
+
+class IngestJobManager:
+    """Hàng đợi ingest jobs bền vững (SQLite) chạy trên thread pool riêng."""
+
+    def __init__(
+        self,
+        ingest_fn: IngestFn,
+        db_path: str,
+        max_workers: int = INGEST_WORKERS,
+        max_history: int = INGEST_JOB_HISTORY,
+    ):
+        self.ingest_fn = ingest_fn
+        self.store = IngestJobStore(db_path)
+        self.max_history = max(1, int(max_history))
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, int(max_workers)), thread_name_prefix="ingest"
+        )
+        self._cancel_flags: set[str] = set()
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        paths: list[str],
+        db: str | None = None,
+        version: str | None = None,
+        kind: str = "ingest",
+    ) -> dict[str, Any]:
+        """Tạo job và đưa vào hàng đợi. Trả về snapshot của job (có `id`)."""
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": STATUS_QUEUED,
+            "db": db,
+            "version": version,
+            "paths": list(paths),
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.store.insert(job)
+        self.store.trim(self.max_history)
+        self._record(STATUS_QUEUED)
+        self._executor.submit(self._run, job["id"])
+        return self.store.get(job["id"]) or job
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        return self.store.get(job_id)
+
+    def list_jobs(self, limit: int = 50) -> list[dict[str, Any]]:
+        """Job mới nhất trước."""
+        return self.store.list_jobs(limit=limit)
+
+    def cancel(self, job_id: str) -> dict[str, Any] | None:
+        """Hủy job: queued → cancelled ngay; running → dừng ở batch kế tiếp."""
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINAL_STATUSES:
+            return job
+        with self._lock:
+            self._cancel_flags.add(job_id)
+        if job["status"] == STATUS_QUEUED:
+            self.store.update(
+                job_id, status=STATUS_CANCELLED, cancel_requested=1, finished_at=time.time()
+            )
+            self._record(STATUS_CANCELLED)
+        else:
+            self.store.update(job_id, cancel_requested=1)
+        return self.store.get(job_id)
+
+    def resume(self) -> list[str]:
+        """Đưa job queued/running (bị gián đoạn bởi restart) trở lại hàng đợi."""
+        resumed: list[str] = []
+        for job in self.store.list_jobs(limit=0, statuses=(STATUS_QUEUED, STATUS_RUNNING)):
+            if job["cancel_requested"]:
+                self.store.update(job["id"], status=STATUS_CANCELLED, finished_at=time.time())
+                continue
+            self.store.update(job["id"], status=STATUS_QUEUED)
+            self._executor.submit(self._run, job["id"])
+            resumed.append(job["id"])
+        if resumed:
+            logger.info(f"Resumed {len(resumed)} ingest job(s)")
+        return resumed
+
+    def wait(self, job_id: str, timeout: float | None = None, poll_s: float = 0.05) -> dict | None:
+        """Chờ job kết thúc (dùng cho tests/CLI). Trả về snapshot cuối cùng."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in FINAL_STATUSES:
+                return job
+            if deadline is not None and time.time() >= deadline:
+                return job
+            time.sleep(poll_s)
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Dừng worker pool. Job đang chạy dở sẽ được resume() ở lần khởi động sau."""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    # ===== Internal =====
+    def _should_cancel(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._cancel_flags
+
+    def _progress(self, job_id: str) -> Callable[..., None]:
+        def progress(stage: str, amount: int = 1, path: str | None = None) -> None:
+            if stage == "file_done":
+                if path:
+                    self.store.mark_file_done(job_id, path)
+            else:
+                self.store.add_progress(job_id, stage, amount)
+
+        return progress
+
+    def _run(self, job_id: str) -> None:
+        job = self.store.get(job_id)
+        if job is None or job["status"] != STATUS_QUEUED:
+            return
+        self.store.update(
+            job_id,
+            status=STATUS_RUNNING,
+            # files_total được đếm lại từ đầu mỗi lần chạy (discover gồm cả file đã xong)
+            files_total=0,
+            started_at=job["started_at"] or time.time(),
+            attempts=int(job["attempts"] or 0) + 1,
+        )
+        self._record(STATUS_RUNNING)
+        try:
+            count = self.ingest_fn(
+                job["paths"],
+                job["db"],
+                job["version"],
+                progress=self._progress(job_id),
+                should_cancel=lambda: self._should_cancel(job_id),
+                skip_files=self.store.done_files(job_id),
+            )
+            updates: dict[str, Any] = {"status": STATUS_DONE, "error": None}
+        except IngestCancelledError:
+            count, updates = 0, {"status": STATUS_CANCELLED}
+        except Exception as e:
+            logger.warning(f"Ingest job {job_id} failed: {e}")
+            count, updates = 0, {"status": STATUS_FAILED, "error": str(e)}
+        # chunks_written cộng dồn qua các lần resume; count chỉ tính lần chạy này
+        current = self.store.get(job_id) or {}
+        updates["chunks_indexed"] = max(int(count or 0), int(current.get("chunks_written") or 0))
+        self.store.update(job_id, finished_at=time.time(), **updates)
+        with self._lock:
+            self._cancel_flags.discard(job_id)
+        self._record(updates["status"])
+
+    @staticmethod
+    def _record(status: str) -> None:
+        if METRICS_ENABLED:
+            metrics.record_ingest_job(status)
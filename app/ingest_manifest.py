@@ -0,0 +1,159 @@
+"""
+Ingest Manifest - ingest tăng dần (incremental) cho từng DB 🗂️
+
+Mỗi DB có một manifest SQLite (persist_dir/ingest_manifest.sqlite):
+
+- ✅ files: path, size, mtime, content hash, version, số chunks
+- ✅ chunks: chunk_id → source (chunk IDs xác định từ nội dung, không còn uuid4)
+- ✅ Re-ingest: file không đổi (size+mtime hoặc hash) → bỏ qua, không parse/embed lại
+- ✅ File đổi → upsert chunks mới, xóa chunks cũ không còn dùng
+- ✅ File biến mất khỏi thư mục đã quét → xóa chunks + record
+"""
+
+import fnmatch
+import glob
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from typing import Any
+
+MANIFEST_FILENAME = "ingest_manifest.sqlite"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def chunk_id(source: Any, version: str, chunk: str, occurrence: int = 0) -> str:
+    """Chunk ID xác định từ source + version + nội dung chunk (không theo vị trí).
+
+    Sửa một đoạn chỉ đổi ID của chunks chứa đoạn đó → các chunk còn lại giữ ID và không
+    embed lại. `version` = "" khi caller không truyền version. `occurrence` phân biệt các
+    chunk trùng nội dung trong cùng tài liệu (lần thứ 2 trở đi).
+    """
+    seed = f"{source}\x00{version}\x00{chunk}"
+    if occurrence:
+        seed += f"\x00{occurrence}"
+    return hashlib.blake2b(seed.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def path_in_scope(path: str, roots: Iterable[str]) -> bool:
+    """File có thuộc phạm vi các paths đã quét (thư mục, glob pattern hoặc file) không."""
+    for root in roots:
+        if glob.has_magic(root):
+            if fnmatch.fnmatch(path, root):
+                return True
+        elif path == root or path.startswith(os.path.join(root, "")):
+            # Thư mục (kể cả thư mục vừa bị xóa) hoặc chính file
+            return True
+    return False
+
+
+class IngestManifest:
+    """Manifest per-DB: trạng thái file đã ingest + chỉ mục source → chunk IDs."""
+
+    def __init__(self, db_dir: str):
+        self.path = os.path.join(db_dir, MANIFEST_FILENAME)
+        self._lock = threading.Lock()
+        self._ensure()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _ensure(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, "
+                "mtime REAL, content_hash TEXT, version TEXT, chunk_count INTEGER, "
+                "updated_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (chunk_id TEXT PRIMARY KEY, source TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source)")
+
+    # ===== Files =====
+    def get_file(self, path: str) -> dict[str, Any] | None:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT size, mtime, content_hash, version, chunk_count FROM files WHERE path=?",
+                (path,),
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            "size": row[0],
+            "mtime": row[1],
+            "content_hash": row[2],
+            "version": row[3],
+            "chunk_count": row[4],
+        }
+
+    def is_unchanged(self, path: str, size: int, mtime: float, version: str | None) -> bool:
+        """Cùng size + mtime + version với lần index trước (đổi version → phải index lại)."""
+        rec = self.get_file(path)
+        return (
+            rec is not None
+            and rec["size"] == size
+            and rec["mtime"] == mtime
+            and rec["version"] == version
+        )
+
+    def touch(self, path: str, size: int, mtime: float) -> None:
+        """Nội dung không đổi nhưng mtime đổi (copy/touch) → chỉ cập nhật stat."""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE files SET size=?, mtime=?, updated_at=? WHERE path=?",
+                (size, mtime, time.time(), path),
+            )
+
+    def record_file(
+        self,
+        path: str,
+        size: int,
+        mtime: float,
+        digest: str,
+        version: str | None,
+        chunk_ids: list[str],
+    ) -> None:
+        """Ghi trạng thái file sau khi toàn bộ chunks đã ghi xong (thay chunk IDs cũ)."""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO files(path, size, mtime, content_hash, version, "
+                "chunk_count, updated_at) VALUES(?,?,?,?,?,?,?)",
+                (path, size, mtime, digest, version, len(chunk_ids), time.time()),
+            )
+            conn.execute("DELETE FROM chunks WHERE source=?", (path,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks(chunk_id, source) VALUES(?, ?)",
+                [(cid, path) for cid in chunk_ids],
+            )
+
+    def list_paths(self) -> list[str]:
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute("SELECT path FROM files").fetchall()]
+
+    # ===== Chunks =====
+    def chunk_ids(self, source: str) -> list[str]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT chunk_id FROM chunks WHERE source=?", (source,)).fetchall()
+        return [r[0] for r in rows]
+
+    def add_chunks(self, source: Any, chunk_ids: Iterable[str]) -> None:
+        """Ghi chỉ mục source → chunk IDs cho chunks không đến từ file (ingest_texts)."""
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks(chunk_id, source) VALUES(?, ?)",
+                [(cid, str(source)) for cid in chunk_ids],
+            )
+
+    def remove_sources(self, sources: Iterable[str]) -> None:
+        with self._lock, self._connect() as conn:
+            for s in sources:
+                conn.execute("DELETE FROM files WHERE path=?", (s,))
+                conn.execute("DELETE FROM chunks WHERE source=?", (s,))
@@ -0,0 +1,602 @@
+"""
+Ingest Pipeline - ingestion dạng generator pipeline, bộ nhớ bị chặn trên 🚰
+
+discover → read/extract → chunk + detect language → dedup → embed → write
+
+Mỗi stage là một generator; giữa các stage là queue có kích thước cố định
+(chạy trên thread riêng) nên:
+
+- ✅ Peak memory không phụ thuộc kích thước corpus (chỉ vài file + vài batch trong RAM)
+- ✅ Đọc/parse file, embed và ghi Chroma chạy chồng lên nhau (overlap I/O + CPU)
+- ✅ Ghi theo batch cố định, không vượt max batch size của Chroma
+- ✅ Progress theo file/batch, hủy giữa chừng, resume bằng `skip_files`
+- ✅ Extract text (PDF/DOCX) song song trên ProcessPoolExecutor, timeout từng file
+- ✅ Incremental (IngestManifest): bỏ qua file không đổi, chỉ embed chunks mới
+- ✅ Dedup (ChunkDeduper): chunk gần trùng chunk đã index không được embed/ghi
+"""
+
+import glob
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Collection, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, TypeVar
+
+from app.chunk_dedup import ChunkDeduper
+from app.exceptions import IngestCancelledError
+from app.file_utils import read_file_by_extension
+from app.ingest_manifest import IngestManifest, content_hash
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+INGEST_BATCH_SIZE = max(1, int(os.getenv("INGEST_BATCH_SIZE", "64")))
+# Số file đã đọc / batch đã embed được phép nằm chờ giữa các stage
+INGEST_READ_QUEUE = max(1, int(os.getenv("INGEST_READ_QUEUE", "4")))
+INGEST_EMBED_QUEUE = max(1, int(os.getenv("INGEST_EMBED_QUEUE", "2")))
+
+# Extract text song song: số process (<=1 = tắt), timeout mỗi file, start method
+INGEST_EXTRACT_WORKERS = int(os.getenv("INGEST_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+INGEST_EXTRACT_TIMEOUT_S = float(os.getenv("INGEST_EXTRACT_TIMEOUT_S", "120"))
+INGEST_EXTRACT_MP_CONTEXT = os.getenv("INGEST_EXTRACT_MP_CONTEXT", "spawn").strip() or "spawn"
+
+INGEST_PATTERNS = ("*.txt", "*.pdf", "*.docx")
+
+Reader = Callable[[str], tuple[str | None, str | None]]
+
+# progress(stage, amount, path) - stages: files_total, files_parsed, files_failed,
+# files_skipped, chunks_deduped, chunks_embedded, chunks_written, chunks_deleted, file_done
+IngestProgressFn = Callable[..., None]
+
+
+def report_progress(
+    progress: IngestProgressFn | None, stage: str, amount: int, path: str | None = None
+) -> None:
+    if progress is None:
+        return
+    try:
+        progress(stage, amount, path)
+    except Exception:
+        pass
+
+
+def check_cancel(should_cancel: Callable[[], bool] | None) -> None:
+    if should_cancel is not None and should_cancel():
+        raise IngestCancelledError("Ingest cancelled")
+
+
+@dataclass
+class Document:
+    """Một tài liệu đã đọc (text=None nếu đọc lỗi hoặc không đổi so với manifest)."""
+
+    source: str
+    text: str | None
+    error: str | None = None
+    extract_s: float = 0.0
+    size: int | None = None
+    mtime: float | None = None
+    unchanged: bool = False
+    content_hash: str | None = None
+    # Toàn bộ chunk IDs của tài liệu (kể cả chunks giữ lại), ghi vào manifest khi xong
+    chunk_ids: list[str] = field(default_factory=list)
+
+
+@dataclass
+class ChunkBatch:
+    """Batch chunks có kích thước cố định đi qua stage embed → write."""
+
+    ids: list[str] = field(default_factory=list)
+    docs: list[str] = field(default_factory=list)
+    metas: list[dict[str, Any]] = field(default_factory=list)
+    embeddings: list[list[float]] | None = None
+    # Chunks cũ của file đã đổi, không còn dùng → xóa trước khi ghi
+    delete_ids: list[str] = field(default_factory=list)
+    # Chunks giữ lại của file đã đổi (không embed lại) → chỉ cập nhật metadata (vị trí, version)
+    refresh_ids: list[str] = field(default_factory=list)
+    refresh_metas: list[dict[str, Any]] = field(default_factory=list)
+    # Tài liệu đã có chunk cuối cùng nằm trong batch này → báo file_done sau khi ghi
+    files_done: list[Document] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+
+# ===== Stages =====
+def discover_files(paths: Iterable[str], progress: IngestProgressFn | None = None) -> Iterator[str]:
+    """Glob lazily (iglob) → file *.txt/*.pdf/*.docx, bỏ trùng. Báo files_total từng file."""
+    seen: set[str] = set()
+    for p in paths:
+        for entry in glob.iglob(p, recursive=True):
+            if os.path.isdir(entry):
+                found: Iterable[str] = (
+                    f
+                    for pattern in INGEST_PATTERNS
+                    for f in glob.iglob(os.path.join(entry, "**", pattern), recursive=True)
+                )
+            else:
+                found = (entry,)
+            for f in found:
+                if f in seen:
+                    continue
+                seen.add(f)
+                report_progress(progress, "files_total", 1)
+                yield f
+
+
+def _timed_read(reader: Reader, path: str) -> tuple[str | None, str | None, float]:
+    """Chạy trong worker process: đọc file + đo thời gian extract."""
+    t0 = time.perf_counter()
+    try:
+        content, error = reader(path)
+    except Exception as e:  # reader đã tự bắt lỗi; đây chỉ là lưới an toàn
+        content, error = None, f"Unexpected error: {e}"
+    return content, error, time.perf_counter() - t0
+
+
+class ParallelExtractor:
+    """Extract text trên ProcessPoolExecutor, giữ thứ tự file, timeout từng file.
+
+    Chỉ giữ tối đa `workers` file đang xử lý (bounded). File quá timeout hoặc làm
+    crash worker bị đánh dấu lỗi; pool được tạo lại và các file còn lại chạy tiếp.
+    """
+
+    def __init__(
+        self,
+        workers: int = INGEST_EXTRACT_WORKERS,
+        timeout_s: float = INGEST_EXTRACT_TIMEOUT_S,
+        reader: Reader = read_file_by_extension,
+        mp_context: str = INGEST_EXTRACT_MP_CONTEXT,
+    ):
+        self.workers = max(1, int(workers))
+        self.timeout_s = float(timeout_s)
+        self.reader = reader
+        self.mp_context = mp_context
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self.mp_context),
+            )
+        return self._pool
+
+    def _reset_pool(self) -> None:
+        """Hủy pool hiện tại, kill worker đang kẹt (ProcessPoolExecutor không hủy được task)."""
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        for proc in list((getattr(pool, "_processes", None) or {}).values()):
+            try:
+                proc.terminate()
+            except Exception:
+                pass
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def close(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, path: str) -> tuple[str, Future, float]:
+        return path, self._get_pool().submit(_timed_read, self.reader, path), time.monotonic()
+
+    def extract(
+        self, files: Iterable[str], should_cancel: Callable[[], bool] | None = None
+    ) -> Iterator[tuple[str, str | None, str | None, float]]:
+        """Yield (path, content, error, seconds) theo đúng thứ tự `files`."""
+        it = iter(files)
+        window: deque[tuple[str, Future, float]] = deque()
+        try:
+            for path in itertools.islice(it, self.workers):
+                window.append(self._submit(path))
+            while window:
+                check_cancel(should_cancel)
+                path, fut, started = window.popleft()
+                remaining = max(0.0, self.timeout_s - (time.monotonic() - started))
+                try:
+                    content, error, seconds = fut.result(timeout=remaining)
+                    outcome = "ok" if content else "error"
+                except FutureTimeoutError:
+                    content, error = None, f"Extraction timed out after {self.timeout_s:.0f}s"
+                    seconds, outcome = time.monotonic() - started, "timeout"
+                    self._restart(window)
+                except BrokenProcessPool:
+                    content, error = None, "Extraction worker crashed"
+                    seconds, outcome = time.monotonic() - started, "error"
+                    self._restart(window)
+                _record_extract(path, outcome, seconds)
+                yield path, content, error, seconds
+                nxt = next(it, None)
+                if nxt is not None:
+                    window.append(self._submit(nxt))
+        finally:
+            if window:
+                self._reset_pool()
+            else:
+                self.close()
+
+    def _restart(self, window: deque[tuple[str, Future, float]]) -> None:
+        pending = [path for path, _, _ in window]
+        window.clear()
+        self._reset_pool()
+        for path in pending:
+            window.append(self._submit(path))
+
+
+def extract_files(
+    files: Iterable[str],
+    reader: Reader = read_file_by_extension,
+    workers: int = INGEST_EXTRACT_WORKERS,
+    timeout_s: float = INGEST_EXTRACT_TIMEOUT_S,
+    should_cancel: Callable[[], bool] | None = None,
+) -> Iterator[tuple[str, str | None, str | None, float]]:
+    """Extract tuần tự (1 file / workers<=1) hoặc song song qua ParallelExtractor."""
+    it = iter(files)
+    head = list(itertools.islice(it, 2))
+    if workers > 1 and len(head) > 1:
+        extractor = ParallelExtractor(workers, timeout_s, reader)
+        yield from extractor.extract(itertools.chain(head, it), should_cancel)
+        return
+    for path in itertools.chain(head, it):
+        check_cancel(should_cancel)
+        content, error, seconds = _timed_read(reader, path)
+        _record_extract(path, "ok" if content else "error", seconds)
+        yield path, content, error, seconds
+
+
+def _record_extract(path: str, outcome: str, seconds: float) -> None:
+    if outcome != "ok":
+        logger.debug(f"Extract {path}: {outcome} in {seconds:.2f}s")
+    if METRICS_ENABLED:
+        ext = os.path.splitext(path)[1].lower().lstrip(".") or "none"
+        metrics.observe_ingest_extract(ext, outcome, seconds)
+
+
+def _stat(path: str) -> tuple[int | None, float | None]:
+    try:
+        st = os.stat(path)
+        return int(st.st_size), float(st.st_mtime)
+    except OSError:
+        return None, None
+
+
+def read_documents(
+    files: Iterable[str],
+    reader: Reader = read_file_by_extension,
+    skip_files: Collection[str] | None = None,
+    progress: IngestProgressFn | None = None,
+    should_cancel: Callable[[], bool] | None = None,
+    workers: int = INGEST_EXTRACT_WORKERS,
+    timeout_s: float = INGEST_EXTRACT_TIMEOUT_S,
+    manifest: IngestManifest | None = None,
+    version: str | None = None,
+) -> Iterator[Document]:
+    """Đọc/extract từng file (bỏ qua file đã xong ở lần chạy trước).
+
+    Với manifest: file có size+mtime+version khớp được trả về ngay (unchanged), không extract.
+    """
+    skip = skip_files or ()
+    unchanged: deque[Document] = deque()
+    stats: dict[str, tuple[int | None, float | None]] = {}
+
+    def pending() -> Iterator[str]:
+        for f in files:
+            if f in skip:
+                continue
+            size, mtime = _stat(f)
+            if manifest is not None and size is not None and mtime is not None:
+                if manifest.is_unchanged(f, size, mtime, version):
+                    unchanged.append(Document(f, None, size=size, mtime=mtime, unchanged=True))
+                    continue
+            stats[f] = (size, mtime)
+            yield f
+
+    def flush_unchanged() -> Iterator[Document]:
+        while unchanged:
+            yield unchanged.popleft()
+
+    for f, content, error, seconds in extract_files(
+        pending(), reader, workers, timeout_s, should_cancel
+    ):
+        yield from flush_unchanged()
+        if content:
+            report_progress(progress, "files_parsed", 1, f)
+        elif error:
+            logger.warning(f"Skipping {f}: {error}")
+            report_progress(progress, "files_failed", 1, f)
+        size, mtime = stats.pop(f, (None, None))
+        yield Document(f, content or None, error, extract_s=seconds, size=size, mtime=mtime)
+    yield from flush_unchanged()
+
+
+def chunk_batches(
+    documents: Iterable[Document],
+    build_chunks: Callable[[Document], tuple[list[str], list[str], list[dict[str, Any]]]],
+    batch_size: int = INGEST_BATCH_SIZE,
+    manifest: IngestManifest | None = None,
+    version: str | None = None,
+) -> Iterator[ChunkBatch]:
+    """Chunk + detect language (qua build_chunks) → batch cố định batch_size chunks.
+
+    Với manifest: tài liệu có cùng content hash + version bị bỏ qua; tài liệu đã đổi
+    chỉ đưa chunks có ID mới vào batch, chunks giữ ID vào `refresh_ids` (chỉ cập nhật
+    metadata), chunk IDs cũ không còn dùng vào `delete_ids`.
+    """
+    batch = ChunkBatch()
+    for doc in documents:
+        if doc.text:
+            doc.content_hash = content_hash(doc.text)
+            old_ids: set[str] = set()
+            if manifest is not None and doc.size is not None:
+                rec = manifest.get_file(doc.source)
+                if rec and rec["content_hash"] == doc.content_hash and rec["version"] == version:
+                    doc.unchanged = True
+                if rec and not doc.unchanged:
+                    old_ids = set(manifest.chunk_ids(doc.source))
+            if not doc.unchanged:
+                ids, docs, metas = build_chunks(doc)
+                doc.chunk_ids = list(ids)
+                keep = set(ids)
+                batch.delete_ids.extend(i for i in old_ids if i not in keep)
+                for i in range(len(docs)):
+                    if ids[i] in old_ids:
+                        # Chunk giống hệt đã có trong index → không embed lại
+                        batch.refresh_ids.append(ids[i])
+                        batch.refresh_metas.append(metas[i])
+                        continue
+                    batch.ids.append(ids[i])
+                    batch.docs.append(docs[i])
+                    batch.metas.append(metas[i])
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = ChunkBatch()
+            doc.text = None  # giải phóng text ngay khi đã chunk xong
+        batch.files_done.append(doc)
+    if len(batch) or batch.files_done or batch.delete_ids or batch.refresh_ids:
+        yield batch
+
+
+def dedup_batches(
+    batches: Iterable[ChunkBatch],
+    deduper: ChunkDeduper,
+    stats: "IngestStats | None" = None,
+    progress: IngestProgressFn | None = None,
+) -> Iterator[ChunkBatch]:
+    """Bỏ chunks gần trùng (LSH) khỏi batch trước khi embed; dedup tính cả trong batch."""
+    for batch in batches:
+        if len(batch):
+            keep = deduper.filter_batch(batch.ids, batch.docs, batch.metas)
+            dropped = len(keep) - sum(keep)
+            if dropped:
+                batch.ids = [x for x, k in zip(batch.ids, keep, strict=True) if k]
+                batch.docs = [x for x, k in zip(batch.docs, keep, strict=True) if k]
+                batch.metas = [x for x, k in zip(batch.metas, keep, strict=True) if k]
+                if stats is not None:
+                    stats.chunks_deduped += dropped
+                report_progress(progress, "chunks_deduped", dropped)
+                if METRICS_ENABLED:
+                    metrics.record_chunks_deduped(dropped)
+        yield batch
+
+
+def embed_batches(
+    batches: Iterable[ChunkBatch],
+    embed: Callable[[list[str]], list[list[float]]],
+    progress: IngestProgressFn | None = None,
+    should_cancel: Callable[[], bool] | None = None,
+) -> Iterator[ChunkBatch]:
+    for batch in batches:
+        check_cancel(should_cancel)
+        if len(batch):
+            batch.embeddings = embed(batch.docs)
+            report_progress(progress, "chunks_embedded", len(batch))
+        yield batch
+
+
+def prefetch(items: Iterable[T], maxsize: int, name: str = "ingest") -> Iterator[T]:
+    """Chạy `items` trên thread riêng, đẩy qua queue có giới hạn (backpressure).
+
+    Lỗi ở thread producer được raise lại phía consumer. Nếu consumer dừng sớm
+    (exception/hủy), producer cũng dừng ở lần put kế tiếp.
+    """
+    q: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+    done = object()
+    errors: list[BaseException] = []
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:  # noqa: BLE001 - chuyển lỗi sang consumer
+            errors.append(e)
+        finally:
+            put(done)
+
+    t = threading.Thread(target=run, name=f"{name}-prefetch", daemon=True)
+    t.start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        t.join(timeout=5)
+    if errors:
+        raise errors[0]
+
+
+# ===== Pipeline =====
+@dataclass
+class IngestStats:
+    files_parsed: int = 0
+    files_skipped: int = 0
+    chunks_deduped: int = 0
+    chunks_written: int = 0
+    chunks_deleted: int = 0
+    extract_s: float = 0.0
+    errors: list[dict[str, str]] = field(default_factory=list)
+
+    @property
+    def dedup_ratio(self) -> float:
+        total = self.chunks_deduped + self.chunks_written
+        return self.chunks_deduped / total if total else 0.0
+
+
+def _counting(documents: Iterable[Document], stats: IngestStats) -> Iterator[Document]:
+    for doc in documents:
+        stats.extract_s += doc.extract_s
+        if doc.text:
+            stats.files_parsed += 1
+        elif doc.error:
+            stats.errors.append({"file": doc.source, "error": doc.error})
+        yield doc
+
+
+class IngestPipeline:
+    """Nối các stage: (discover → read) ⇉ (chunk → dedup → embed) ⇉ write."""
+
+    def __init__(
+        self,
+        build_chunks: Callable[[Document], tuple[list[str], list[str], list[dict[str, Any]]]],
+        embed: Callable[[list[str]], list[list[float]]],
+        write: Callable[[ChunkBatch], None],
+        batch_size: int = INGEST_BATCH_SIZE,
+        read_queue: int = INGEST_READ_QUEUE,
+        embed_queue: int = INGEST_EMBED_QUEUE,
+        reader: Reader = read_file_by_extension,
+        extract_workers: int = INGEST_EXTRACT_WORKERS,
+        extract_timeout_s: float = INGEST_EXTRACT_TIMEOUT_S,
+        manifest: IngestManifest | None = None,
+        version: str | None = None,
+        deduper: ChunkDeduper | None = None,
+    ):
+        self.build_chunks = build_chunks
+        self.embed = embed
+        self.write = write
+        self.batch_size = max(1, int(batch_size))
+        self.read_queue = read_queue
+        self.embed_queue = embed_queue
+        self.reader = reader
+        self.extract_workers = extract_workers
+        self.extract_timeout_s = extract_timeout_s
+        self.manifest = manifest
+        self.version = version
+        self.deduper = deduper
+
+    def run_paths(
+        self,
+        paths: list[str],
+        progress: IngestProgressFn | None = None,
+        should_cancel: Callable[[], bool] | None = None,
+        skip_files: Collection[str] | None = None,
+        stats: IngestStats | None = None,
+    ) -> IngestStats:
+        files = discover_files(paths, progress)
+        documents = read_documents(
+            files,
+            self.reader,
+            skip_files,
+            progress,
+            should_cancel,
+            self.extract_workers,
+            self.extract_timeout_s,
+            self.manifest,
+            self.version,
+        )
+        return self.run_documents(documents, progress, should_cancel, stats)
+
+    def run_documents(
+        self,
+        documents: Iterable[Document],
+        progress: IngestProgressFn | None = None,
+        should_cancel: Callable[[], bool] | None = None,
+        stats: IngestStats | None = None,
+    ) -> IngestStats:
+        """Chạy pipeline; `stats` được cập nhật dần (kể cả khi bị hủy/lỗi giữa chừng)."""
+        stats = stats if stats is not None else IngestStats()
+        docs = prefetch(_counting(documents, stats), self.read_queue, "ingest-read")
+        batches = chunk_batches(
+            docs, self.build_chunks, self.batch_size, self.manifest, self.version
+        )
+        if self.deduper is not None:
+            batches = dedup_batches(batches, self.deduper, stats, progress)
+        embedded = prefetch(
+            embed_batches(batches, self.embed, progress, should_cancel),
+            self.embed_queue,
+            "ingest-embed",
+        )
+        try:
+            for batch in embedded:
+                check_cancel(should_cancel)
+                if len(batch) or batch.delete_ids or batch.refresh_ids:
+                    self.write(batch)
+                    stats.chunks_written += len(batch)
+                    stats.chunks_deleted += len(batch.delete_ids)
+                    report_progress(progress, "chunks_written", len(batch))
+                    report_progress(progress, "chunks_deleted", len(batch.delete_ids))
+                for doc in batch.files_done:
+                    self._finish_document(doc, stats, progress)
+        finally:
+            # Dừng các stage phía trước ngay (không đợi GC) khi lỗi/hủy
+            embedded.close()
+            docs.close()
+        return stats
+
+    def _finish_document(
+        self, doc: Document, stats: IngestStats, progress: IngestProgressFn | None
+    ) -> None:
+        """Mọi chunk của tài liệu đã ghi xong → cập nhật manifest, báo file_done."""
+        if doc.unchanged:
+            stats.files_skipped += 1
+            report_progress(progress, "files_skipped", 1, doc.source)
+        if self.manifest is not None and not doc.error:
+            try:
+                if doc.size is None or doc.mtime is None:
+                    # Không phải file (ingest_texts): chỉ ghi chỉ mục source → chunk IDs
+                    if doc.chunk_ids:
+                        self.manifest.add_chunks(doc.source, doc.chunk_ids)
+                elif doc.unchanged:
+                    self.manifest.touch(doc.source, doc.size, doc.mtime)
+                elif doc.content_hash:
+                    self.manifest.record_file(
+                        doc.source,
+                        doc.size,
+                        doc.mtime,
+                        doc.content_hash,
+                        self.version,
+                        doc.chunk_ids,
+                    )
+            except Exception as e:
+                logger.warning(f"Manifest update failed for {doc.source}: {e}")
+        report_progress(progress, "file_done", 1, doc.source)
@@ -0,0 +1,163 @@
+"""
+Lang Detect - nhận diện ngôn ngữ theo tài liệu, batch + cache 🌐
+
+langid trên từng chunk là một trong các bước tốn CPU nhất khi ingest:
+
+- ✅ Detect một lần cho tài liệu trên vài chunk mẫu (rải đều), cắt ngắn mỗi mẫu
+- ✅ Tài liệu "mixed" (mẫu không thống nhất) → mới detect từng chunk
+- ✅ Batch: một phép nhân ma trận NB cho cả lô feature vectors (langid model)
+- ✅ Cache LRU theo content hash → boilerplate/chunk lặp lại không detect lại
+- ✅ Metrics: thời gian + số text thực sự đi qua langid
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from collections.abc import Sequence
+from typing import Any
+
+from app.cache_utils import LRUCacheWithTTL
+
+try:
+    import langid  # type: ignore
+except Exception:  # pragma: no cover
+    langid = None  # optional dependency
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover
+    np = None  # type: ignore
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_LANG = "unknown"
+
+# Số chunk mẫu mỗi tài liệu, số ký tự tối đa mỗi mẫu đưa vào langid
+LANG_DETECT_SAMPLE_CHUNKS = max(1, int(os.getenv("LANG_DETECT_SAMPLE_CHUNKS", "5")))
+LANG_DETECT_SAMPLE_CHARS = max(50, int(os.getenv("LANG_DETECT_SAMPLE_CHARS", "1000")))
+# Ngôn ngữ chiếm >= tỉ lệ này trong mẫu → gán cho cả tài liệu; ngược lại detect từng chunk
+LANG_DETECT_MIXED_RATIO = float(os.getenv("LANG_DETECT_MIXED_RATIO", "0.8"))
+LANG_DETECT_CACHE_SIZE = max(1, int(os.getenv("LANG_DETECT_CACHE_SIZE", "20000")))
+
+
+def _sample_indices(n: int, k: int) -> list[int]:
+    """k chỉ số rải đều trên [0, n) (gồm chunk đầu và cuối)."""
+    if n <= k:
+        return list(range(n))
+    if k == 1:
+        return [n // 2]
+    return sorted({round(i * (n - 1) / (k - 1)) for i in range(k)})
+
+
+class LangDetector:
+    """Language ID theo tài liệu với batch + cache (thread-safe)."""
+
+    def __init__(
+        self,
+        sample_chunks: int = LANG_DETECT_SAMPLE_CHUNKS,
+        sample_chars: int = LANG_DETECT_SAMPLE_CHARS,
+        mixed_ratio: float = LANG_DETECT_MIXED_RATIO,
+        cache_size: int = LANG_DETECT_CACHE_SIZE,
+    ):
+        self.sample_chunks = sample_chunks
+        self.sample_chars = sample_chars
+        self.mixed_ratio = mixed_ratio
+        # TTL dài: kết quả langid của một text không bao giờ đổi
+        self._cache = LRUCacheWithTTL[str](max_size=cache_size, ttl=7 * 24 * 3600)
+        self._lock = threading.Lock()
+        self.classified = 0
+        self.mixed_documents = 0
+
+    def _key(self, text: str) -> str:
+        snippet = text[: self.sample_chars]
+        return hashlib.blake2b(snippet.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _classify_batch(self, texts: list[str]) -> list[str]:
+        """langid cho cả lô: feature vectors → một phép nhân với ma trận NB của model."""
+        if langid is None:
+            return [UNKNOWN_LANG] * len(texts)
+        with self._lock:  # langid model global, không thread-safe khi load
+            try:
+                from langid import langid as _model  # type: ignore
+
+                if _model.identifier is None:
+                    _model.load_model()
+                ident = _model.identifier
+                fv = np.stack([ident.instance2fv(t) for t in texts])
+                scores = np.dot(fv, ident.nb_ptc) + ident.nb_pc
+                return [str(ident.nb_classes[i]) for i in np.argmax(scores, axis=1)]
+            except Exception:
+                out = []
+                for t in texts:
+                    try:
+                        out.append(langid.classify(t)[0])
+                    except Exception:
+                        out.append(UNKNOWN_LANG)
+                return out
+
+    def classify_many(self, texts: Sequence[str]) -> list[str]:
+        """Ngôn ngữ cho từng text (cache theo hash của đoạn đầu sample_chars ký tự)."""
+        results: list[str | None] = []
+        missing: dict[str, list[int]] = {}
+        snippets: dict[str, str] = {}
+        for i, text in enumerate(texts):
+            if not text or not text.strip():
+                results.append(UNKNOWN_LANG)
+                continue
+            key = self._key(text)
+            cached = self._cache.get(key)
+            results.append(cached)
+            if cached is None:
+                missing.setdefault(key, []).append(i)
+                snippets[key] = text[: self.sample_chars]
+        if missing:
+            t0 = time.perf_counter()
+            keys = list(missing)
+            langs = self._classify_batch([snippets[k] for k in keys])
+            for key, lang in zip(keys, langs, strict=True):
+                self._cache.set(key, lang)
+                for i in missing[key]:
+                    results[i] = lang
+            self.classified += len(keys)
+            if METRICS_ENABLED:
+                metrics.observe_lang_detect(len(keys), time.perf_counter() - t0)
+        return [r or UNKNOWN_LANG for r in results]
+
+    def detect(self, text: str) -> str:
+        return self.classify_many([text])[0]
+
+    def detect_chunks(self, chunks: Sequence[str]) -> list[str]:
+        """Ngôn ngữ cho các chunk của một tài liệu.
+
+        Detect trên mẫu; nếu một ngôn ngữ chiếm >= mixed_ratio số mẫu thì gán cho cả
+        tài liệu, ngược lại (tài liệu mixed) detect từng chunk.
+        """
+        if not chunks:
+            return []
+        idx = _sample_indices(len(chunks), self.sample_chunks)
+        sample = self.classify_many([chunks[i] for i in idx])
+        known = [lang for lang in sample if lang != UNKNOWN_LANG]
+        if not known:
+            return [UNKNOWN_LANG] * len(chunks)
+        lang, count = Counter(known).most_common(1)[0]
+        if count / len(known) >= self.mixed_ratio:
+            return [lang] * len(chunks)
+        self.mixed_documents += 1
+        return self.classify_many(chunks)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "classified": self.classified,
+            "mixed_documents": self.mixed_documents,
+            "cache": self._cache.stats(),
+        }
@@ -0,0 +1,396 @@
+"""
+LLM Scheduler - admission control + priority queue trước Ollama 🚦
+
+Ollama xử lý generation tuần tự trên từng model (tối đa OLLAMA_NUM_PARALLEL),
+nên khi tải cao các request cứ dồn lại ở HTTP layer cho đến khi READ_TIMEOUT
+(180s) hết hạn - mọi người cùng timeout. Scheduler này giữ hàng đợi ngay trong
+app để:
+
+- ✅ Giới hạn số generation đồng thời theo từng model
+- ✅ Ưu tiên theo class: interactive stream > query > rewrite/decompose > warming > eval
+- ✅ Ước tính thời gian chờ bằng EWMA service time
+- ✅ Từ chối nhanh (503 + Retry-After) khi thời gian chờ ước tính vượt ngưỡng
+- ✅ Metrics: queue depth, in-flight, wait time, admission outcomes
+
+Priority của request hiện tại được truyền qua contextvar (`llm_priority`),
+nên các layer ở giữa (RagEngine, cache warming) không phải thread thêm tham số.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from .exceptions import LLMOverloadedError
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+# Priority classes - số nhỏ hơn = ưu tiên cao hơn
+PRIORITY_INTERACTIVE = 0
+PRIORITY_QUERY = 1
+PRIORITY_REWRITE = 2
+PRIORITY_WARMING = 3
+PRIORITY_EVAL = 4
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_QUERY: "query",
+    PRIORITY_REWRITE: "rewrite",
+    PRIORITY_WARMING: "warming",
+    PRIORITY_EVAL: "eval",
+}
+_PRIORITY_BY_NAME = {v: k for k, v in PRIORITY_NAMES.items()}
+
+# Configuration
+LLM_SCHEDULER_ENABLE = os.getenv("LLM_SCHEDULER_ENABLE", "1").strip() not in ("0", "false", "False")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "1"))  # khớp OLLAMA_NUM_PARALLEL
+LLM_MODEL_CONCURRENCY = os.getenv("LLM_MODEL_CONCURRENCY", "")  # "llama3.1:8b=2,qwen2.5:3b=4"
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_MAX_EST_WAIT_S = float(os.getenv("LLM_MAX_EST_WAIT_S", "30"))
+LLM_QUEUE_TIMEOUT_S = float(os.getenv("LLM_QUEUE_TIMEOUT_S", "60"))
+LLM_SERVICE_TIME_INIT_S = float(os.getenv("LLM_SERVICE_TIME_INIT_S", "5"))
+LLM_SERVICE_TIME_ALPHA = 0.2  # EWMA smoothing
+
+_current_priority: ContextVar[int] = ContextVar("llm_priority", default=PRIORITY_QUERY)
+
+
+def resolve_priority(priority: int | str | None) -> int:
+    """Chuẩn hóa priority (int, tên class, hoặc None = priority của context hiện tại)."""
+    if priority is None:
+        return _current_priority.get()
+    if isinstance(priority, str):
+        return _PRIORITY_BY_NAME.get(priority.strip().lower(), PRIORITY_QUERY)
+    return max(PRIORITY_INTERACTIVE, min(int(priority), PRIORITY_EVAL))
+
+
+def current_priority() -> int:
+    """Priority của context hiện tại (mặc định: query)."""
+    return _current_priority.get()
+
+
+@contextmanager
+def llm_priority(priority: int | str):
+    """
+    Đặt priority cho mọi lời gọi LLM trong block (thread/async context hiện tại).
+
+    Example:
+        >>> with llm_priority(PRIORITY_REWRITE):
+        ...     llm.generate(prompt)
+    """
+    token = _current_priority.set(resolve_priority(priority))
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def _parse_model_concurrency(spec: str) -> dict[str, int]:
+    out: dict[str, int] = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        name, _, val = part.rpartition("=")
+        try:
+            out[name.strip()] = max(1, int(val))
+        except ValueError:
+            logger.warning(f"Invalid LLM_MODEL_CONCURRENCY entry: {part!r}")
+    return out
+
+
+class _Waiter:
+    """Một request đang chờ slot; `notify` được gọi (dưới lock) khi được cấp slot."""
+
+    __slots__ = ("priority", "notify", "granted")
+
+    def __init__(self, priority: int, notify: Callable[[], None]):
+        self.priority = priority
+        self.notify = notify
+        self.granted = False
+
+
+class LLMScheduler:
+    """
+    Priority admission control cho một model - hàng đợi có kỷ luật! 🚦
+
+    Example:
+        >>> sched = get_scheduler("llama3.1:8b")
+        >>> with sched.slot(PRIORITY_QUERY):
+        ...     resp = call_ollama()
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        max_est_wait_s: float = LLM_MAX_EST_WAIT_S,
+        queue_timeout_s: float = LLM_QUEUE_TIMEOUT_S,
+        service_time_init_s: float = LLM_SERVICE_TIME_INIT_S,
+    ):
+        self.model = model
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.max_est_wait_s = float(max_est_wait_s)
+        self.queue_timeout_s = float(queue_timeout_s)
+        self._service_time_s = float(service_time_init_s)
+        self._lock = threading.Lock()
+        self._heap: list[tuple[int, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "timeout": 0}
+
+    # ----- metrics -----
+    def _record(self, priority: int, outcome: str) -> None:
+        self._stats[outcome] = self._stats.get(outcome, 0) + 1
+        if METRICS_ENABLED:
+            try:
+                metrics.record_llm_admission(self.model, PRIORITY_NAMES[priority], outcome)
+            except Exception:
+                pass
+
+    def _publish_state(self) -> None:
+        if METRICS_ENABLED:
+            try:
+                metrics.update_llm_queue_state(self.model, len(self._heap), self._in_flight)
+            except Exception:
+                pass
+
+    # ----- estimation -----
+    def _estimate_wait_locked(self, priority: int) -> float:
+        ahead = sum(1 for p, _, _ in self._heap if p <= priority)
+        if self._in_flight < self.max_concurrency and ahead == 0:
+            return 0.0
+        # Mỗi "vòng" giải phóng max_concurrency slot sau ~1 service time
+        return (ahead + 1) / self.max_concurrency * self._service_time_s
+
+    def estimate_wait(self, priority: int | str | None = None) -> float:
+        """Thời gian chờ ước tính (giây) cho một request mới ở priority này."""
+        with self._lock:
+            return self._estimate_wait_locked(resolve_priority(priority))
+
+    def _retry_after(self, est_wait: float) -> int:
+        return max(1, math.ceil(est_wait or self._service_time_s))
+
+    def _reject_locked(self, priority: int) -> None:
+        est = self._estimate_wait_locked(priority)
+        if len(self._heap) >= self.max_queue:
+            reason = f"queue full ({len(self._heap)}/{self.max_queue})"
+        elif est > self.max_est_wait_s:
+            reason = f"estimated wait {est:.1f}s > {self.max_est_wait_s:.1f}s"
+        else:
+            return
+        self._record(priority, "rejected")
+        raise LLMOverloadedError(
+            f"LLM '{self.model}' overloaded: {reason}", retry_after=self._retry_after(est)
+        )
+
+    def check_admission(self, priority: int | str | None = None) -> None:
+        """Raise LLMOverloadedError nếu request mới ở priority này sẽ bị từ chối.
+
+        Dùng trước khi mở StreamingResponse để trả 503 trước khi gửi headers.
+        """
+        p = resolve_priority(priority)
+        with self._lock:
+            if self._in_flight < self.max_concurrency and not self._heap:
+                return
+            self._reject_locked(p)
+
+    # ----- slot management -----
+    def acquire(self, priority: int | str | None = None) -> float:
+        """
+        Chờ tới lượt (theo priority, FIFO trong cùng class).
+
+        Returns:
+            Số giây đã chờ trong hàng đợi
+
+        Raises:
+            LLMOverloadedError: Khi bị từ chối hoặc chờ quá LLM_QUEUE_TIMEOUT_S
+        """
+        p = resolve_priority(priority)
+        event = threading.Event()
+        entry = self._enqueue(p, event.set)
+        if entry is None:
+            return 0.0
+        start = time.monotonic()
+        event.wait(self.queue_timeout_s)
+        return self._finish_wait(entry, time.monotonic() - start)
+
+    async def acquire_async(self, priority: int | str | None = None) -> float:
+        """Async version của `acquire` - chờ slot mà không chiếm thread của event loop."""
+        p = resolve_priority(priority)
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+        entry = self._enqueue(p, lambda: loop.call_soon_threadsafe(granted.set))
+        if entry is None:
+            return 0.0
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(granted.wait(), self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Client ngắt kết nối khi đang chờ: bỏ chỗ trong hàng đợi / trả slot nếu đã được cấp
+            if not self._abandon(entry):
+                self.release()
+            raise
+        return self._finish_wait(entry, time.monotonic() - start)
+
+    def _enqueue(self, p: int, notify: Callable[[], None]) -> tuple[int, int, _Waiter] | None:
+        """Cấp slot ngay (trả None) hoặc xếp hàng (trả heap entry); raise nếu bị từ chối."""
+        with self._lock:
+            if self._in_flight < self.max_concurrency and not self._heap:
+                self._in_flight += 1
+                self._record(p, "admitted")
+                self._publish_state()
+                return None
+            self._reject_locked(p)
+            entry = (p, next(self._seq), _Waiter(p, notify))
+            heapq.heappush(self._heap, entry)
+            self._record(p, "queued")
+            self._publish_state()
+            return entry
+
+    def _abandon(self, entry: tuple[int, int, _Waiter]) -> bool:
+        """Gỡ waiter khỏi hàng đợi. Trả False nếu waiter đã được cấp slot."""
+        with self._lock:
+            if entry[2].granted:
+                return False
+            try:
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+            except ValueError:
+                pass
+            self._publish_state()
+            return True
+
+    def _finish_wait(self, entry: tuple[int, int, _Waiter], waited: float) -> float:
+        p = entry[0]
+        if self._abandon(entry):
+            with self._lock:
+                self._record(p, "timeout")
+                retry_after = self._retry_after(self._estimate_wait_locked(p))
+            raise LLMOverloadedError(
+                f"LLM '{self.model}' queue timeout after {waited:.1f}s", retry_after=retry_after
+            )
+        if METRICS_ENABLED:
+            try:
+                metrics.observe_llm_queue_wait(self.model, PRIORITY_NAMES[p], waited)
+            except Exception:
+                pass
+        return waited
+
+    def release(self, service_time_s: float | None = None) -> None:
+        """Trả slot, cập nhật EWMA service time và đánh thức waiter kế tiếp."""
+        with self._lock:
+            if service_time_s is not None and service_time_s > 0:
+                a = LLM_SERVICE_TIME_ALPHA
+                self._service_time_s = (1 - a) * self._service_time_s + a * service_time_s
+            self._in_flight = max(0, self._in_flight - 1)
+            self._dispatch_locked()
+
+    def _dispatch_locked(self) -> None:
+        while self._heap and self._in_flight < self.max_concurrency:
+            _, _, waiter = heapq.heappop(self._heap)
+            waiter.granted = True
+            self._in_flight += 1
+            waiter.notify()
+        self._publish_state()
+
+    def resize(self, max_concurrency: int) -> None:
+        """Đổi concurrency limit (ví dụ khi số backend thay đổi) và đánh thức waiters."""
+        with self._lock:
+            self.max_concurrency = max(1, int(max_concurrency))
+            self._dispatch_locked()
+
+    @contextmanager
+    def slot(self, priority: int | str | None = None):
+        """Context manager: acquire slot, đo service time, release."""
+        self.acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stream(
+        self, factory: Callable[[], Iterator[str]], priority: int | str | None = None
+    ) -> Iterator[str]:
+        """Giữ slot trong suốt thời gian stream được tiêu thụ."""
+        p = resolve_priority(priority)
+        with self.slot(p):
+            yield from factory()
+
+    @asynccontextmanager
+    async def slot_async(self, priority: int | str | None = None):
+        """Async context manager: acquire slot (không block event loop), release khi xong."""
+        await self.acquire_async(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    async def stream_async(
+        self, factory: Callable[[], AsyncIterator[str]], priority: int | str | None = None
+    ) -> AsyncIterator[str]:
+        """Async version của `stream` - giữ slot cho đến khi async stream kết thúc."""
+        p = resolve_priority(priority)
+        async with self.slot_async(p):
+            async for chunk in factory():
+                yield chunk
+
+    def stats(self) -> dict:
+        """Snapshot trạng thái scheduler - for /api/metrics style endpoints 📊"""
+        with self._lock:
+            return {
+                "model": self.model,
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._heap),
+                "service_time_ewma_s": round(self._service_time_s, 3),
+                **self._stats,
+            }
+
+
+_schedulers: dict[str, LLMScheduler] = {}
+_schedulers_lock = threading.Lock()
+_model_concurrency = _parse_model_concurrency(LLM_MODEL_CONCURRENCY)
+
+
+def get_scheduler(model: str, backends: int = 1) -> LLMScheduler:
+    """Lấy (hoặc tạo) scheduler cho model - một hàng đợi cho mỗi model.
+
+    Concurrency limit là per-backend: với N backends, model được chạy tối đa
+    N × limit generation đồng thời.
+    """
+    per_backend = _model_concurrency.get(model, LLM_MAX_CONCURRENCY)
+    backends = max(1, int(backends))
+    with _schedulers_lock:
+        sched = _schedulers.get(model)
+        if sched is None:
+            sched = LLMScheduler(model, max_concurrency=per_backend * backends)
+            _schedulers[model] = sched
+        elif per_backend * backends > sched.max_concurrency:
+            sched.resize(per_backend * backends)
+        return sched
+
+
+def scheduler_stats() -> list[dict]:
+    """Stats của mọi scheduler đang hoạt động."""
+    with _schedulers_lock:
+        scheds = list(_schedulers.values())
+    return [s.stats() for s in scheds]
@@ -1,5 +1,8 @@
+import asyncio
+import contextlib
 import json
 import os
+import threading
 import time
 import uuid
 from typing import Any
@@ -29,13 +32,24 @@ from .constants import (
     RATE_LIMIT_UPLOAD,
 )
 from .cors_utils import parse_cors_origins_safe
-from .exceptions import OllamaRAGException, get_http_status_code
+from .deadline import DEADLINE_HEADER, new_deadline, use_deadline
+from .dir_watcher import DirWatcher
+from .exceptions import LLMOverloadedError, OllamaRAGException, get_http_status_code
 from .exp_logger import ExperimentLogger
 from .feedback_store import FeedbackStore
+from .ingest_jobs import IngestJobManager
+from .llm_scheduler import PRIORITY_EVAL, llm_priority, scheduler_stats
 from .logging_utils import setup_secure_logging
+from .model_residency import ModelResidency
+from .ollama_client import EMBED_MODEL, LLM_MODEL
 from .rag_engine import RagEngine
 from .semantic_cache import SemanticQueryCache
-from .validators import validate_db_name, validate_safe_path, validate_version_string
+from .validators import (
+    normalize_db_name,
+    validate_db_name,
+    validate_safe_path,
+    validate_version_string,
+)
 
 # Load .env after all imports, before any os.getenv usage
 load_dotenv(override=True)  # Ensures .env is loaded for environment-based config
@@ -157,6 +171,11 @@ async def ollama_rag_exception_handler(request: Request, exc: OllamaRAGException
     """Handle custom Ollama RAG exceptions."""
     status_code = get_http_status_code(exc)
     request_id = getattr(request.state, 'request_id', 'unknown')
+    headers = {"X-Request-ID": request_id}
+    # LLM scheduler quá tải → client biết khi nào nên thử lại
+    retry_after = getattr(exc, 'retry_after', None)
+    if retry_after:
+        headers["Retry-After"] = str(retry_after)
     return JSONResponse(
         status_code=status_code,
         content={
@@ -165,7 +184,7 @@ async def ollama_rag_exception_handler(request: Request, exc: OllamaRAGException
             "detail": getattr(exc, 'detail', None),
             "request_id": request_id,
         },
-        headers={"X-Request-ID": request_id},
+        headers=headers,
     )
 
 
@@ -188,6 +207,75 @@ chat_store = ChatStore(engine.persist_root)
 feedback_store = FeedbackStore(engine.persist_root)
 exp_logger = ExperimentLogger(engine.persist_root)
 
+# Kích thước mỗi lần đọc khi stream file upload xuống đĩa
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+
+
+# Engine riêng theo DB cho ingest jobs: job không đổi DB đang chọn của HTTP requests,
+# và request gọi use_db() không đổi collection/manifest giữa chừng một job
+_job_engines: dict[str, RagEngine] = {}
+_job_engines_lock = threading.Lock()
+
+
+def _job_engine(db: str | None) -> RagEngine:
+    name = normalize_db_name(db) if db else engine.db_name
+    if not validate_db_name(name):
+        raise ValueError(f"Invalid db name: {name!r}")
+    with _job_engines_lock:
+        job_engine = _job_engines.get(name)
+        if job_engine is None:
+            job_engine = RagEngine(persist_dir=None, persist_root=engine.persist_root, db_name=name)
+            _job_engines[name] = job_engine
+        return job_engine
+
+
+def _run_ingest_job(paths: list[str], db: str | None, version: str | None, **kwargs: Any) -> int:
+    """Chạy trong worker thread của IngestJobManager (không phải event loop)."""
+    job_engine = _job_engine(db)
+    try:
+        return job_engine.ingest_paths(paths, version=version, **kwargs)
+    finally:
+        # Engine phục vụ HTTP đang ở cùng DB → bỏ BM25/filters cache cũ, đọc corpus stamp mới
+        if engine.db_name == job_engine.db_name:
+            engine.refresh_corpus()
+
+
+ingest_jobs = IngestJobManager(
+    _run_ingest_job, os.path.join(engine.persist_root, "ingest_jobs.sqlite")
+)
+
+# ✅ Watch mode: đồng bộ thư mục gần real-time thay cho cron gọi /api/ingest
+WATCH_DIRS = [d.strip() for d in os.getenv("WATCH_DIRS", "").split(",") if d.strip()]
+WATCH_DB = os.getenv("WATCH_DB", "").strip() or engine.db_name
+WATCH_VERSION = os.getenv("WATCH_VERSION", "").strip() or None
+WATCH_INITIAL_SCAN = os.getenv("WATCH_INITIAL_SCAN", "1").strip() not in ("0", "false", "False")
+
+
+def _sync_watched(changed: list[str], deleted: list[str]) -> None:
+    """Đẩy paths đã đổi/bị xóa vào job ingest tăng dần (file xóa → _remove_vanished)."""
+    ingest_jobs.submit(changed + deleted, db=WATCH_DB, version=WATCH_VERSION, kind="watch")
+
+
+dir_watcher = (
+    DirWatcher(
+        WATCH_DIRS,
+        _sync_watched,
+        debounce_s=float(os.getenv("WATCH_DEBOUNCE_S", "2")),
+        max_delay_s=float(os.getenv("WATCH_MAX_DELAY_S", "30")),
+        poll_interval_s=float(os.getenv("WATCH_POLL_INTERVAL_S", "5")),
+        backend=os.getenv("WATCH_BACKEND", "auto"),
+    )
+    if WATCH_DIRS
+    else None
+)
+
+# ✅ Model residency: preload + keep-warm để query đầu tiên không phải chờ Ollama nạp model
+model_residency = ModelResidency(
+    engine.ollama,
+    llm_model=LLM_MODEL if engine.default_provider == "ollama" else None,
+    embed_model=EMBED_MODEL,
+)
+
 # ✅ Initialize application metrics 📊
 metrics.set_app_info(version=APP_VERSION, db_type="chromadb")
 
@@ -212,6 +300,34 @@ async def startup_event():
         app.state.semantic_cache = None
         print("[SEMANTIC CACHE] DISABLED. Set USE_SEMANTIC_CACHE=true to enable.")
 
+    # Resume ingest jobs bị gián đoạn bởi lần restart trước
+    ingest_jobs.resume()
+
+    if dir_watcher is not None:
+        dir_watcher.start()
+        # Bắt kịp thay đổi trong lúc server tắt (file không đổi bị manifest bỏ qua)
+        if WATCH_INITIAL_SCAN:
+            ingest_jobs.submit(WATCH_DIRS, db=WATCH_DB, version=WATCH_VERSION, kind="watch")
+
+    # Preload model trên thread nền (MODEL_PRELOAD) + keep-warm ping (MODEL_KEEPWARM_INTERVAL_S)
+    model_residency.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Đóng keep-alive pools của async LLM clients."""
+    for llm in (getattr(engine, "ollama", None), getattr(engine, "_openai", None)):
+        aclient = getattr(llm, "_async_client", None)
+        if aclient is not None:
+            try:
+                await aclient.aclose()
+            except Exception:
+                pass
+    if dir_watcher is not None:
+        dir_watcher.stop()
+    model_residency.stop(timeout=1.0)
+    ingest_jobs.shutdown(wait=False)
+
 
 @app.get("/", tags=["Web UI"])
 def root():
@@ -696,6 +812,7 @@ def get_connection_pool_metrics():
         response = {
             "timestamp": time.time(),
             "connection_pool": pool_metrics,
+            "backend_pools": engine.ollama.get_backend_pool_metrics(),
             "info": {
                 "description": "HTTP connection pooling metrics for Ollama client",
                 "benefits": [
@@ -717,6 +834,35 @@ def get_connection_pool_metrics():
         )
 
 
+@app.get("/api/llm-scheduler/metrics", tags=["Monitoring"])
+def get_llm_scheduler_metrics():
+    """🚦 LLM Scheduler metrics endpoint - queue depth, in-flight, EWMA service time.
+
+    Returns:
+        Per-model scheduler snapshot (admitted/queued/rejected/timeout counters)
+    """
+    try:
+        return {"timestamp": time.time(), "schedulers": scheduler_stats()}
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Failed to retrieve LLM scheduler metrics", "detail": str(e)},
+        )
+
+
+@app.get("/api/models/residency", tags=["Monitoring"])
+def get_model_residency():
+    """🔥 Model residency - keep_alive, khung giờ keep-warm, lần preload/ping cuối mỗi backend."""
+    return {"timestamp": time.time(), **model_residency.status()}
+
+
+@app.post("/api/models/preload", tags=["System"])
+def api_models_preload():
+    """Nạp (hoặc gia hạn keep_alive) LLM + embedding model trên mọi backend ngay lập tức."""
+    results = model_residency.preload()
+    return {"ok": all(r.get("ok") for r in results), "models": results}
+
+
 @app.get("/api/semantic-cache/metrics", tags=["Monitoring"])
 def get_semantic_cache_metrics():
     """🧠 Semantic Cache metrics endpoint - Monitor cache performance and efficiency.
@@ -787,6 +933,7 @@ class IngestRequest(BaseModel):
     paths: list[str] = ["data/docs"]
     db: str | None = None
     version: str | None = None
+    wait: bool = False
 
     @field_validator('paths')
     @classmethod
@@ -821,31 +968,48 @@ class IngestRequest(BaseModel):
         return v
 
 
-@app.post("/api/ingest", tags=["Ingestion"])
+@app.post("/api/ingest", tags=["Ingestion"], status_code=202)
 @limiter.limit(RATE_LIMIT_INGEST)
-def api_ingest(req: IngestRequest, request: Request):
+async def api_ingest(req: IngestRequest, request: Request):
+    """Tạo ingest job nền và trả job ID ngay. Dùng `wait=true` để chờ job xong."""
     try:
-        if req.db:
-            engine.use_db(req.db)
-        count = engine.ingest_paths(req.paths, version=req.version)
-        return {"status": "ok", "chunks_indexed": count, "db": engine.db_name}
+        job = ingest_jobs.submit(req.paths, db=req.db or engine.db_name, version=req.version)
+        if req.wait:
+            job = await asyncio.to_thread(ingest_jobs.wait, job["id"])
+            if job["status"] == "failed":
+                raise HTTPException(status_code=500, detail=job["error"])
+        return {
+            "status": job["status"],
+            "job_id": job["id"],
+            "chunks_indexed": job["chunks_indexed"],
+            "db": job["db"],
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # ===== Upload & Ingest =====
-@app.post("/api/upload", tags=["Ingestion"])
+@app.post("/api/upload", tags=["Ingestion"], status_code=202)
 @limiter.limit(RATE_LIMIT_UPLOAD)
 async def api_upload(
     request: Request,
     files: list[UploadFile] = File(...),
     db: str | None = Form(None),
     version: str | None = Form(None),
+    wait: bool = Form(False),
 ):
-    """Upload files. ✅ FIX BUG #9: Async file I/O to avoid blocking event loop! 🚀"""
+    """Upload files rồi ingest nền. ✅ Stream file xuống đĩa theo chunk, trả job ID ngay 🚀
+
+    Parse/chunk/embed/ghi Chroma chạy trong worker của IngestJobManager nên
+    event loop không bị chặn. Dùng `wait=true` để chờ job xong (tương thích ngược).
+    """
+    if db and not validate_db_name(db):
+        raise HTTPException(status_code=400, detail=f"Invalid DB name: {db}")
+    if version and not validate_version_string(version):
+        raise HTTPException(status_code=400, detail=f"Invalid version: {version}")
     try:
-        if db:
-            engine.use_db(db)
         save_dir = os.path.join("data", "docs", "uploads")
         os.makedirs(save_dir, exist_ok=True)
         saved_paths: list[str] = []
@@ -859,26 +1023,80 @@ async def api_upload(
             ext = os.path.splitext(name)[1].lower()
             if ext not in allowed:
                 continue
-            data = await f.read()
             new_name = f"{uuid.uuid4().hex}{ext}"
             path = os.path.join(save_dir, new_name)
 
-            # ✅ Ghi file bằng aiofiles.open() thay vì blocking open()
+            # ✅ Stream theo chunk thay vì đọc cả file vào RAM
+            written = 0
             async with aiofiles.open(path, "wb") as out:
-                await out.write(data)
+                while chunk := await f.read(UPLOAD_CHUNK_BYTES):
+                    written += len(chunk)
+                    if written > MAX_UPLOAD_SIZE_BYTES:
+                        break
+                    await out.write(chunk)
+            if written > MAX_UPLOAD_SIZE_BYTES:
+                # Cả request bị từ chối → dọn luôn các file đã lưu trước đó
+                for p in [*saved_paths, path]:
+                    with contextlib.suppress(OSError):
+                        os.remove(p)
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File {name} exceeds {MAX_UPLOAD_SIZE_BYTES} bytes",
+                )
 
             saved_paths.append(path)
-        count = engine.ingest_paths(saved_paths, version=version) if saved_paths else 0
+
+        target_db = db or engine.db_name
+        if not saved_paths:
+            return {"status": "ok", "saved": [], "chunks_indexed": 0, "db": target_db}
+
+        job = ingest_jobs.submit(saved_paths, db=target_db, version=version, kind="upload")
+        if wait:
+            job = await asyncio.to_thread(ingest_jobs.wait, job["id"])
+            if job["status"] == "failed":
+                raise HTTPException(status_code=500, detail=job["error"])
         return {
-            "status": "ok",
+            "status": job["status"],
+            "job_id": job["id"],
             "saved": [os.path.basename(p) for p in saved_paths],
-            "chunks_indexed": count,
-            "db": engine.db_name,
+            "chunks_indexed": job["chunks_indexed"],
+            "db": target_db,
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/ingest/jobs", tags=["Ingestion"])
+def api_list_ingest_jobs(limit: int = 50):
+    return {"jobs": ingest_jobs.list_jobs(limit=limit)}
+
+
+@app.get("/api/ingest/jobs/{job_id}", tags=["Ingestion"])
+def api_get_ingest_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/api/ingest/jobs/{job_id}/cancel", tags=["Ingestion"])
+def api_cancel_ingest_job(job_id: str):
+    job = ingest_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api/ingest/watch", tags=["Ingestion"])
+def api_watch_status():
+    """Trạng thái watcher thư mục (WATCH_DIRS)."""
+    if dir_watcher is None:
+        return {"enabled": False}
+    return {"enabled": True, "db": WATCH_DB, **dir_watcher.status()}
+
+
 class QueryRequest(BaseModel):
     query: str
     k: int = 5
@@ -896,10 +1114,14 @@ class QueryRequest(BaseModel):
     db: str | None = None
     languages: list[str] | None = None
     versions: list[str] | None = None
-    rr_provider: str | None = None  # auto|bge|embed
+    rr_provider: str | None = None  # auto|bge|embed|cascade
     rr_max_k: int | None = None
     rr_batch_size: int | None = None
     rr_num_threads: int | None = None
+    # Deadline end-to-end (ms); thiếu → header X-Deadline-Ms hoặc QUERY_DEADLINE_MS
+    deadline_ms: int | None = None
+    # Nén contexts theo câu trước khi dựng prompt (None = theo CONTEXT_COMPRESSION)
+    compress: bool | None = None
 
 
 class MultiHopQueryRequest(BaseModel):
@@ -929,10 +1151,12 @@ class MultiHopQueryRequest(BaseModel):
 
 @app.post("/api/query", tags=["RAG Query"])
 @limiter.limit(RATE_LIMIT_QUERY)
-def api_query(req: QueryRequest, request: Request):
+async def api_query(req: QueryRequest, request: Request):
+    # Deadline tính từ lúc nhận request (gồm cả semantic cache lookup)
+    deadline = new_deadline(req.deadline_ms, request.headers.get(DEADLINE_HEADER))
     try:
         if req.db:
-            engine.use_db(req.db)
+            await asyncio.to_thread(engine.use_db, req.db)
 
         # ✅ Track query metrics
         provider = req.provider or engine.default_provider
@@ -948,8 +1172,13 @@ def api_query(req: QueryRequest, request: Request):
         if hasattr(app.state, 'semantic_cache') and (app.state.semantic_cache is not None):
             try:
                 ns = f"{engine.db_name}:{getattr(engine, '_corpus_stamp', '0')}"
-                cached_result, cache_metadata = app.state.semantic_cache.get(
-                    req.query, engine.ollama.embed, return_metadata=True, namespace=ns
+                # Embedding query là blocking I/O → chạy trong thread
+                cached_result, cache_metadata = await asyncio.to_thread(
+                    app.state.semantic_cache.get,
+                    req.query,
+                    engine.ollama.embed,
+                    return_metadata=True,
+                    namespace=ns,
                 )
                 if cached_result:
                     # Cache HIT! 🎉 Return immediately
@@ -965,26 +1194,28 @@ def api_query(req: QueryRequest, request: Request):
                 # If cache check fails, just continue with normal query
                 print(f"⚠️ Semantic cache check failed: {e}")
 
-        # Cache MISS or cache disabled - Execute normal query
-        result = engine.answer(
-            req.query,
-            top_k=req.k,
-            method=req.method,
-            bm25_weight=req.bm25_weight,
-            rerank_enable=req.rerank_enable,
-            rerank_top_n=req.rerank_top_n,
-            provider=req.provider,
-            rrf_enable=req.rrf_enable,
-            rrf_k=req.rrf_k,
-            rewrite_enable=req.rewrite_enable,
-            rewrite_n=req.rewrite_n,
-            languages=req.languages,
-            versions=req.versions,
-            rr_provider=req.rr_provider,
-            rr_max_k=req.rr_max_k,
-            rr_batch_size=req.rr_batch_size,
-            rr_num_threads=req.rr_num_threads,
-        )
+        # Cache MISS or cache disabled - Execute normal query (async LLM path)
+        with use_deadline(deadline):
+            result = await engine.answer_async(
+                req.query,
+                top_k=req.k,
+                method=req.method,
+                bm25_weight=req.bm25_weight,
+                rerank_enable=req.rerank_enable,
+                rerank_top_n=req.rerank_top_n,
+                provider=req.provider,
+                rrf_enable=req.rrf_enable,
+                rrf_k=req.rrf_k,
+                rewrite_enable=req.rewrite_enable,
+                rewrite_n=req.rewrite_n,
+                languages=req.languages,
+                versions=req.versions,
+                rr_provider=req.rr_provider,
+                rr_max_k=req.rr_max_k,
+                rr_batch_size=req.rr_batch_size,
+                rr_num_threads=req.rr_num_threads,
+                compress=req.compress,
+            )
         # Lưu chat nếu cần
         if req.save_chat and req.chat_id:
             try:
@@ -1000,11 +1231,21 @@ def api_query(req: QueryRequest, request: Request):
         result["db"] = engine.db_name
         result["cache_hit"] = False  # Mark as fresh query
 
-        # 🧠 Cache the result (if semantic cache enabled)
-        if hasattr(app.state, 'semantic_cache') and (app.state.semantic_cache is not None):
+        # 🧠 Cache the result (if semantic cache enabled) - kết quả đã degrade thì không cache
+        if (
+            hasattr(app.state, 'semantic_cache')
+            and (app.state.semantic_cache is not None)
+            and not result.get("degradations")
+        ):
             try:
                 ns = f"{engine.db_name}:{getattr(engine, '_corpus_stamp', '0')}"
-                app.state.semantic_cache.set(req.query, result, engine.ollama.embed, namespace=ns)
+                await asyncio.to_thread(
+                    app.state.semantic_cache.set,
+                    req.query,
+                    result,
+                    engine.ollama.embed,
+                    namespace=ns,
+                )
                 print(f"Query cached: {req.query[:50]}... ns={ns}")
             except Exception as e:
                 print(f"Failed to cache query: {e}")
@@ -1043,6 +1284,11 @@ def api_query(req: QueryRequest, request: Request):
         except Exception:
             pass
         return result
+    except LLMOverloadedError as e:
+        # 503 + Retry-After qua exception handler, không gói thành 500
+        provider = req.provider or engine.default_provider
+        metrics.track_query_error(req.method, provider, type(e).__name__)
+        raise
     except Exception as e:
         # ✅ Track query error
         provider = req.provider or engine.default_provider
@@ -1053,13 +1299,18 @@ def api_query(req: QueryRequest, request: Request):
 
 @app.post("/api/stream_query", tags=["RAG Query"])
 @limiter.limit(RATE_LIMIT_QUERY)
-def api_stream_query(req: QueryRequest, request: Request):
+async def api_stream_query(req: QueryRequest, request: Request):
+    deadline = new_deadline(req.deadline_ms, request.headers.get(DEADLINE_HEADER))
     try:
+        # Từ chối sớm khi LLM quá tải - trước khi gửi headers của stream
+        engine.check_llm_admission(req.provider)
 
-        def gen():
-            import time as _t
+        def prepare():
+            with use_deadline(deadline):
+                return _prepare()
 
-            t0 = int(_t.time() * 1000)
+        def _prepare():
+            """Retrieval + rerank + lưu/log sớm - phần blocking, chạy trong threadpool."""
             saved_early = False
             if req.db:
                 engine.use_db(req.db)
@@ -1080,11 +1331,13 @@ def api_stream_query(req: QueryRequest, request: Request):
                     versions=req.versions,
                 )
             else:
-                if req.method == "bm25":
+                # Deadline gần hết → vector/hybrid lùi về BM25-only
+                method = deadline.retrieval_method(req.method) if deadline else req.method
+                if method == "bm25":
                     retrieved = engine.retrieve_bm25(
                         req.query, top_k=base_k, languages=req.languages, versions=req.versions
                     )
-                elif req.method == "hybrid":
+                elif method == "hybrid":
                     retrieved = engine.retrieve_hybrid(
                         req.query,
                         top_k=base_k,
@@ -1141,9 +1394,10 @@ def api_stream_query(req: QueryRequest, request: Request):
             else:
                 ctx_docs = ctx_docs[: req.k]
                 metas = metas[: req.k]
-            # Gửi contexts trước dưới dạng JSON đánh dấu
-            header = {"contexts": ctx_docs, "metadatas": metas, "db": engine.db_name}
-            yield "[[CTXJSON]]" + json.dumps(header) + "\n"
+            # Compress + pack theo ngân sách token - contexts gửi client khớp [CTX n] trong prompt
+            ctx_docs, metas, prompt_info = engine.prepare_contexts(
+                req.query, ctx_docs, metas, compress=req.compress
+            )
             # Lưu chat sớm (trả lời rỗng) ngay sau khi có contexts (giúp analytics và test nhanh)
             if req.save_chat and req.chat_id and not saved_early:
                 try:
@@ -1182,12 +1436,29 @@ def api_stream_query(req: QueryRequest, request: Request):
                 )
             except Exception:
                 pass
+            return ctx_docs, metas, saved_early, prompt_info
+
+        async def gen():
+            import time as _t
+
+            t0 = int(_t.time() * 1000)
+            ctx_docs, metas, saved_early, prompt_info = await asyncio.to_thread(prepare)
+            # Gửi contexts trước dưới dạng JSON đánh dấu
+            header = {"contexts": ctx_docs, "metadatas": metas, "db": engine.db_name}
+            header.update(prompt_info)
+            if deadline is not None:
+                # Quyết định cap num_predict trước header để client thấy đủ các degrade
+                deadline.generation_cap()
+                header.update(deadline.report())
+            yield "[[CTXJSON]]" + json.dumps(header) + "\n"
             prompt = engine.build_prompt(req.query, ctx_docs)
             answer_buf = []
             try:
-                for chunk in engine.generate_stream(prompt, provider=req.provider):
-                    answer_buf.append(chunk)
-                    yield chunk
+                # Async LLM stream - không giữ thread của threadpool trong suốt stream ⚡
+                with use_deadline(deadline):
+                    async for chunk in engine.generate_stream_async(prompt, provider=req.provider):
+                        answer_buf.append(chunk)
+                        yield chunk
             except Exception:
                 return
             finally:
@@ -1235,6 +1506,8 @@ def api_stream_query(req: QueryRequest, request: Request):
                     pass
 
         return StreamingResponse(gen(), media_type="text/plain")
+    except LLMOverloadedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1310,18 +1583,20 @@ def api_multihop_query(req: MultiHopQueryRequest):
         except Exception:
             pass
         return result
+    except LLMOverloadedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/stream_multihop_query", tags=["RAG Query"])
-def api_stream_multihop_query(req: MultiHopQueryRequest):
+async def api_stream_multihop_query(req: MultiHopQueryRequest):
     try:
+        # Từ chối sớm khi LLM quá tải - trước khi gửi headers của stream
+        engine.check_llm_admission(req.provider)
 
-        def gen():
-            import time as _t
-
-            t0 = int(_t.time() * 1000)
+        def prepare():
+            """Multi-hop retrieval (blocking) - chạy trong threadpool."""
             if req.db:
                 engine.use_db(req.db)
             # Chuẩn bị contexts qua multi-hop (không stream decomposition để đơn giản)
@@ -1342,6 +1617,7 @@ def api_stream_multihop_query(req: MultiHopQueryRequest):
             )
             ctx_docs = mh.get("contexts", [])
             metas = mh.get("metadatas", [])
+            prompt_info = {k: mh[k] for k in ("compression", "packing") if k in mh}
             # Nếu multi-hop không thu được contexts, fallback về single-hop theo method
             if not ctx_docs:
                 base_k = max(req.k, req.rerank_top_n if req.rerank_enable else req.k)
@@ -1373,13 +1649,22 @@ def api_stream_multihop_query(req: MultiHopQueryRequest):
                 else:
                     ctx_docs = ctx_docs[: req.k]
                     metas = metas[: req.k]
+                ctx_docs, metas, prompt_info = engine.prepare_contexts(req.query, ctx_docs, metas)
+            return ctx_docs, metas, prompt_info
+
+        async def gen():
+            import time as _t
+
+            t0 = int(_t.time() * 1000)
+            ctx_docs, metas, prompt_info = await asyncio.to_thread(prepare)
             header = {"contexts": ctx_docs, "metadatas": metas, "db": engine.db_name}
+            header.update(prompt_info)
             yield "[[CTXJSON]]" + json.dumps(header) + "\n"
             # Stream phần trả lời chính thức dựa trên prompt đã dùng
             prompt = engine.build_prompt(req.query, ctx_docs)
             answer_buf = []
             try:
-                for chunk in engine.generate_stream(prompt, provider=req.provider):
+                async for chunk in engine.generate_stream_async(prompt, provider=req.provider):
                     answer_buf.append(chunk)
                     yield chunk
             except Exception:
@@ -1426,6 +1711,8 @@ def api_stream_multihop_query(req: MultiHopQueryRequest):
                     pass
 
         return StreamingResponse(gen(), media_type="text/plain")
+    except LLMOverloadedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1586,11 +1873,23 @@ class DocsDeleteRequest(BaseModel):
 
 
 @app.get("/api/docs", tags=["Document Management"])
-def api_docs_list(db: str | None = None):
+def api_docs_list(db: str | None = None, details: bool = False):
+    """Danh sách sources + số chunks (details=true → kèm versions/languages mỗi source)."""
     try:
         if db:
             engine.use_db(db)
-        return {"db": engine.db_name, "docs": engine.list_sources()}
+        return {"db": engine.db_name, "docs": engine.list_sources(details=details)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/docs/dedup", tags=["Document Management"])
+def api_docs_dedup(db: str | None = None):
+    """Thống kê dedup chunk gần trùng: số canonical/duplicate, dedup ratio."""
+    try:
+        if db:
+            engine.use_db(db)
+        return {"db": engine.db_name, **engine.dedup_stats()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1600,8 +1899,14 @@ def api_docs_delete(req: DocsDeleteRequest):
     try:
         if req.db:
             engine.use_db(req.db)
-        n = engine.delete_sources(req.sources or [])
-        return {"status": "ok", "deleted_sources": n, "db": engine.db_name}
+        sources = [s for s in dict.fromkeys(req.sources or []) if s]
+        n = engine.delete_sources(sources)
+        return {
+            "status": "ok",
+            "deleted_sources": len(sources),
+            "deleted_chunks": n,
+            "db": engine.db_name,
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1631,86 +1936,104 @@ class EvalRequest(BaseModel):
     # defaults for all items if not provided per-item
     languages: list[str] | None = None
     versions: list[str] | None = None
+    # Đo context compression: match expected_substrings trên contexts đã nén + tỉ lệ nén
+    compress: bool = False
 
 
 @app.post("/api/eval/offline", tags=["Evaluation"])
 def api_eval_offline(req: EvalRequest):
     try:
-        if req.db:
-            engine.use_db(req.db)
-        total = len(req.queries or [])
-        hits = 0
-        details: list[dict[str, Any]] = []
-        for item in req.queries:
-            langs = item.languages if item.languages is not None else req.languages
-            vers = item.versions if item.versions is not None else req.versions
-            base_k = max(req.k, req.rerank_top_n if req.rerank_enable else req.k)
-            retrieved = engine.retrieve_aggregate(
-                item.query,
-                top_k=base_k,
-                method=req.method,
-                bm25_weight=req.bm25_weight,
-                rrf_enable=req.rrf_enable,
-                rrf_k=req.rrf_k,
-                rewrite_enable=req.rewrite_enable,
-                rewrite_n=req.rewrite_n,
-                provider=req.provider,
-                languages=langs,
-                versions=vers,
-            )
-            docs = retrieved.get("documents", [])
-            metas = retrieved.get("metadatas", [])
-            if req.rerank_enable and docs:
-                docs, metas = engine._apply_rerank(item.query, docs, metas, req.k)  # type: ignore[attr-defined]
-            else:
-                docs = docs[: req.k]
-                metas = metas[: req.k]
-            # Prepare for matching
-            srcs: list[str] = []
-            for m in metas:
-                try:
-                    s = str(m.get("source", ""))
-                except Exception:
-                    s = ""
-                srcs.append(s)
-            matched_srcs: list[str] = []
-            matched_subs: list[str] = []
-            # Match sources by substring anywhere in path
-            if item.expected_sources:
-                for exp in item.expected_sources:
-                    exp = (exp or "").strip()
-                    if not exp:
-                        continue
-                    if any(exp in s for s in srcs):
-                        matched_srcs.append(exp)
-            # Match expected substrings in any retrieved doc
-            if item.expected_substrings:
-                for exp in item.expected_substrings:
-                    exp = (exp or "").strip()
-                    if not exp:
-                        continue
-                    if any(exp.lower() in (d or "").lower() for d in docs):
-                        matched_subs.append(exp)
-            matched = bool(matched_srcs or matched_subs)
-            if matched:
-                hits += 1
-            details.append(
-                {
-                    "query": item.query,
-                    "matched": matched,
-                    "matched_sources": matched_srcs,
-                    "matched_substrings": matched_subs,
-                    "retrieved_sources": srcs,
-                }
-            )
-        recall = (hits / total) if total > 0 else 0.0
-        return {
-            "db": engine.db_name,
-            "n": total,
-            "hits": hits,
-            "recall_at_k": recall,
-            "details": details,
-        }
+        # Eval chạy ở priority thấp nhất - không chen lấn traffic người dùng
+        with llm_priority(PRIORITY_EVAL):
+            if req.db:
+                engine.use_db(req.db)
+            total = len(req.queries or [])
+            hits = 0
+            chars_before = 0
+            chars_after = 0
+            details: list[dict[str, Any]] = []
+            for item in req.queries:
+                langs = item.languages if item.languages is not None else req.languages
+                vers = item.versions if item.versions is not None else req.versions
+                base_k = max(req.k, req.rerank_top_n if req.rerank_enable else req.k)
+                retrieved = engine.retrieve_aggregate(
+                    item.query,
+                    top_k=base_k,
+                    method=req.method,
+                    bm25_weight=req.bm25_weight,
+                    rrf_enable=req.rrf_enable,
+                    rrf_k=req.rrf_k,
+                    rewrite_enable=req.rewrite_enable,
+                    rewrite_n=req.rewrite_n,
+                    provider=req.provider,
+                    languages=langs,
+                    versions=vers,
+                )
+                docs = retrieved.get("documents", [])
+                metas = retrieved.get("metadatas", [])
+                if req.rerank_enable and docs:
+                    docs, metas = engine._apply_rerank(item.query, docs, metas, req.k)  # type: ignore[attr-defined]
+                else:
+                    docs = docs[: req.k]
+                    metas = metas[: req.k]
+                compression = None
+                if req.compress and docs:
+                    docs, compression = engine.compress_contexts(item.query, docs, True)
+                    if compression:
+                        chars_before += compression["chars_before"]
+                        chars_after += compression["chars_after"]
+                # Prepare for matching
+                srcs: list[str] = []
+                for m in metas:
+                    try:
+                        s = str(m.get("source", ""))
+                    except Exception:
+                        s = ""
+                    srcs.append(s)
+                matched_srcs: list[str] = []
+                matched_subs: list[str] = []
+                # Match sources by substring anywhere in path
+                if item.expected_sources:
+                    for exp in item.expected_sources:
+                        exp = (exp or "").strip()
+                        if not exp:
+                            continue
+                        if any(exp in s for s in srcs):
+                            matched_srcs.append(exp)
+                # Match expected substrings in any retrieved doc
+                if item.expected_substrings:
+                    for exp in item.expected_substrings:
+                        exp = (exp or "").strip()
+                        if not exp:
+                            continue
+                        if any(exp.lower() in (d or "").lower() for d in docs):
+                            matched_subs.append(exp)
+                matched = bool(matched_srcs or matched_subs)
+                if matched:
+                    hits += 1
+                details.append(
+                    {
+                        "query": item.query,
+                        "matched": matched,
+                        "matched_sources": matched_srcs,
+                        "matched_substrings": matched_subs,
+                        "retrieved_sources": srcs,
+                        **({"compression": compression} if compression else {}),
+                    }
+                )
+            recall = (hits / total) if total > 0 else 0.0
+            out = {
+                "db": engine.db_name,
+                "n": total,
+                "hits": hits,
+                "recall_at_k": recall,
+                "details": details,
+            }
+            if req.compress:
+                out["compression_ratio"] = (chars_after / chars_before) if chars_before else 1.0
+            return out
+    except LLMOverloadedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -2431,6 +2754,8 @@ def api_create_db(req: DbName):
 def api_delete_db(name: str):
     try:
         engine.delete_db(name)
+        with _job_engines_lock:
+            _job_engines.pop(normalize_db_name(name), None)
         return {"status": "ok", "current": engine.db_name, "dbs": engine.list_dbs()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
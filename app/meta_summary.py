@@ -0,0 +1,177 @@
+"""
+Meta Summary - bảng tóm tắt metadata corpus, cập nhật tăng dần 📊
+
+/api/docs và /api/filters trước đây quét toàn bộ collection (O(corpus)) mỗi lần cache miss:
+
+- ✅ chunks: chunk_id → (source, version, language) - ghi cùng lúc với upsert/delete
+- ✅ summary: (source, version, language) → số chunks, duy trì bằng SQLite triggers
+- ✅ list sources / filters = đọc bảng summary (O(số giá trị phân biệt))
+- ✅ Chỉ mục source → chunk IDs cho xóa hàng loạt (không quét collection)
+- ✅ Cờ ready: DB cũ (chưa có summary) hoặc lệch với store → rebuild một lần theo trang
+"""
+
+import os
+import sqlite3
+import threading
+from collections.abc import Iterable, Sequence
+from typing import Any
+
+SUMMARY_FILENAME = "meta_summary.sqlite"
+
+# Các trang (ids, metadatas) đọc từ store khi rebuild
+MetaPage = tuple[Sequence[str], Sequence[dict[str, Any] | None]]
+
+
+def _value(meta: dict[str, Any] | None, key: str) -> str:
+    """Giá trị metadata dạng str ('' = thiếu; NULL không dùng được trong primary key)."""
+    v = (meta or {}).get(key)
+    return str(v).strip() if v is not None else ""
+
+
+class MetaSummary:
+    """Tóm tắt metadata per-DB: chỉ mục chunk + bảng đếm theo (source, version, language)."""
+
+    def __init__(self, db_dir: str):
+        self.path = os.path.join(db_dir, SUMMARY_FILENAME)
+        self._lock = threading.Lock()
+        self._ensure()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _ensure(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (chunk_id TEXT PRIMARY KEY, source TEXT, "
+                "version TEXT, language TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS summary (source TEXT, version TEXT, language TEXT, "
+                "chunks INTEGER, PRIMARY KEY (source, version, language))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS trg_chunks_insert AFTER INSERT ON chunks BEGIN "
+                "INSERT INTO summary(source, version, language, chunks) "
+                "VALUES (NEW.source, NEW.version, NEW.language, 1) "
+                "ON CONFLICT(source, version, language) DO UPDATE SET chunks = chunks + 1; "
+                "END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS trg_chunks_delete AFTER DELETE ON chunks BEGIN "
+                "UPDATE summary SET chunks = chunks - 1 WHERE source = OLD.source "
+                "AND version = OLD.version AND language = OLD.language; "
+                "DELETE FROM summary WHERE source = OLD.source AND version = OLD.version "
+                "AND language = OLD.language AND chunks <= 0; "
+                "END"
+            )
+
+    # ===== Ready flag =====
+    def is_ready(self) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM state WHERE key='ready'").fetchone()
+        return bool(row and row[0] == "1")
+
+    def invalidate(self) -> None:
+        """Đánh dấu summary không tin được (vd. ghi lỗi giữa chừng) → rebuild lần đọc sau."""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM state WHERE key='ready'")
+
+    def rebuild(self, pages: Iterable[MetaPage]) -> int:
+        """Dựng lại từ store (từng trang ids + metadatas) rồi bật cờ ready."""
+        rows = []
+        for ids, metas in pages:
+            for cid, meta in zip(ids, metas, strict=False):
+                rows.append(
+                    (
+                        str(cid),
+                        _value(meta, "source"),
+                        _value(meta, "version"),
+                        _value(meta, "language"),
+                    )
+                )
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM chunks")
+            conn.execute("DELETE FROM summary")
+            conn.executemany("INSERT OR IGNORE INTO chunks VALUES (?,?,?,?)", rows)
+            conn.execute("INSERT OR REPLACE INTO state(key, value) VALUES ('ready', '1')")
+        return len(rows)
+
+    # ===== Incremental updates =====
+    def add(self, ids: Sequence[str], metas: Sequence[dict[str, Any] | None]) -> None:
+        """Ghi nhận chunks vừa upsert (ID đã có → thay metadata, không đếm hai lần)."""
+        rows = [
+            (str(cid), _value(m, "source"), _value(m, "version"), _value(m, "language"))
+            for cid, m in zip(ids, metas, strict=False)
+        ]
+        with self._lock, self._connect() as conn:
+            conn.executemany("DELETE FROM chunks WHERE chunk_id=?", [(r[0],) for r in rows])
+            conn.executemany("INSERT INTO chunks VALUES (?,?,?,?)", rows)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock, self._connect() as conn:
+            conn.executemany("DELETE FROM chunks WHERE chunk_id=?", [(str(i),) for i in ids])
+
+    def remove_sources(self, sources: Iterable[str]) -> None:
+        with self._lock, self._connect() as conn:
+            conn.executemany("DELETE FROM chunks WHERE source=?", [(str(s),) for s in sources])
+
+    def chunk_ids(self, sources: Iterable[str]) -> list[str]:
+        """Chunk IDs của các source (theo index idx_chunks_source)."""
+        srcs = [str(s) for s in dict.fromkeys(sources)]
+        out: list[str] = []
+        with self._connect() as conn:
+            for start in range(0, len(srcs), 500):
+                part = srcs[start : start + 500]
+                marks = ",".join("?" * len(part))
+                rows = conn.execute(
+                    f"SELECT chunk_id FROM chunks WHERE source IN ({marks})", part
+                ).fetchall()
+                out.extend(r[0] for r in rows)
+        return out
+
+    # ===== Lookups: O(số giá trị phân biệt) =====
+    def total_chunks(self) -> int:
+        with self._connect() as conn:
+            row = conn.execute("SELECT COALESCE(SUM(chunks), 0) FROM summary").fetchone()
+        return int(row[0])
+
+    def sources(self, details: bool = False) -> list[dict[str, Any]]:
+        """[{source, chunks}] theo thứ tự source; details → kèm versions/languages."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT source, version, language, chunks FROM summary WHERE source != '' "
+                "ORDER BY source"
+            ).fetchall()
+        items: dict[str, dict[str, Any]] = {}
+        for source, version, language, count in rows:
+            item = items.get(source)
+            if item is None:
+                item = items[source] = {"source": source, "chunks": 0}
+                if details:
+                    item["versions"], item["languages"] = [], []
+            item["chunks"] += count
+            if details:
+                if version and version not in item["versions"]:
+                    item["versions"].append(version)
+                if language and language not in item["languages"]:
+                    item["languages"].append(language)
+        if details:
+            for item in items.values():
+                item["versions"].sort()
+                item["languages"].sort()
+        return list(items.values())
+
+    def filters(self) -> tuple[list[str], list[str]]:
+        """(languages, versions) phân biệt, đã sort."""
+        with self._connect() as conn:
+            langs = conn.execute(
+                "SELECT DISTINCT language FROM summary WHERE language != '' ORDER BY language"
+            ).fetchall()
+            vers = conn.execute(
+                "SELECT DISTINCT version FROM summary WHERE version != '' ORDER BY version"
+            ).fetchall()
+        return [r[0] for r in langs], [r[0] for r in vers]
@@ -348,3 +348,339 @@ def update_connection_pool_config(
         connection_pool_size.labels(client_name=client_name, pool_type='maxsize').set(pool_maxsize)
     except Exception:
         pass
+
+
+# ===== Single-flight Coalescing Metrics =====
+
+singleflight_calls_total = Counter(
+    'ollama_rag_singleflight_calls_total',
+    'Calls through single-flight coalescing',
+    ['flight', 'kind', 'role'],  # kind: call|stream, role: leader|follower
+)
+
+
+def record_singleflight(flight: str, kind: str, role: str) -> None:
+    """Record a leader/follower call through single-flight coalescing.
+
+    Args:
+        flight: Name of the SingleFlight group (e.g., 'answer', 'generate')
+        kind: 'call' or 'stream'
+        role: 'leader' or 'follower'
+    """
+    try:
+        singleflight_calls_total.labels(flight=flight, kind=kind, role=role).inc()
+    except Exception:
+        pass
+
+
+# ===== LLM Scheduler (Admission Control) Metrics =====
+
+llm_queue_depth = Gauge(
+    'ollama_rag_llm_queue_depth',
+    'LLM requests waiting for a generation slot',
+    ['model'],
+)
+
+llm_inflight = Gauge(
+    'ollama_rag_llm_inflight',
+    'LLM generations currently holding a slot',
+    ['model'],
+)
+
+llm_queue_wait_seconds = Histogram(
+    'ollama_rag_llm_queue_wait_seconds',
+    'Time spent waiting in the LLM scheduler queue',
+    ['model', 'priority'],
+    buckets=[0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0],
+)
+
+llm_admission_total = Counter(
+    'ollama_rag_llm_admission_total',
+    'LLM scheduler admission decisions',
+    ['model', 'priority', 'outcome'],  # outcome: admitted|queued|rejected|timeout
+)
+
+
+def record_llm_admission(model: str, priority: str, outcome: str) -> None:
+    """Record an LLM scheduler admission decision.
+
+    Args:
+        model: LLM model name
+        priority: Priority class name (e.g., 'interactive', 'eval')
+        outcome: 'admitted', 'queued', 'rejected' or 'timeout'
+    """
+    try:
+        llm_admission_total.labels(model=model, priority=priority, outcome=outcome).inc()
+    except Exception:
+        pass
+
+
+def update_llm_queue_state(model: str, depth: int, inflight: int) -> None:
+    """Update LLM scheduler queue depth and in-flight gauges."""
+    try:
+        llm_queue_depth.labels(model=model).set(depth)
+        llm_inflight.labels(model=model).set(inflight)
+    except Exception:
+        pass
+
+
+def observe_llm_queue_wait(model: str, priority: str, seconds: float) -> None:
+    """Observe time a request waited for an LLM slot."""
+    try:
+        llm_queue_wait_seconds.labels(model=model, priority=priority).observe(seconds)
+    except Exception:
+        pass
+
+
+# ===== Ollama Backend Pool Metrics =====
+
+backend_requests_total = Counter(
+    'ollama_rag_backend_requests_total',
+    'Requests routed to each Ollama backend',
+    ['pool', 'backend', 'outcome'],  # outcome: success|failure|rejected
+)
+
+backend_outstanding = Gauge(
+    'ollama_rag_backend_outstanding',
+    'Outstanding requests per Ollama backend',
+    ['pool', 'backend'],
+)
+
+backend_hedges_total = Counter(
+    'ollama_rag_backend_hedges_total',
+    'Hedged requests issued to a second backend',
+    ['pool', 'winner'],  # winner: primary|hedge
+)
+
+
+def record_backend_request(pool: str, backend: str, outcome: str, outstanding: int) -> None:
+    """Record a request routed to a backend and its current outstanding count."""
+    try:
+        backend_requests_total.labels(pool=pool, backend=backend, outcome=outcome).inc()
+        backend_outstanding.labels(pool=pool, backend=backend).set(outstanding)
+    except Exception:
+        pass
+
+
+def update_backend_outstanding(pool: str, backend: str, outstanding: int) -> None:
+    """Update outstanding gauge for a backend."""
+    try:
+        backend_outstanding.labels(pool=pool, backend=backend).set(outstanding)
+    except Exception:
+        pass
+
+
+def record_backend_hedge(pool: str, winner: str) -> None:
+    """Record a hedged request and which leg answered first."""
+    try:
+        backend_hedges_total.labels(pool=pool, winner=winner).inc()
+    except Exception:
+        pass
+
+
+# ===== Background Ingest Job Metrics =====
+
+ingest_jobs_total = Counter(
+    'ollama_rag_ingest_jobs_total',
+    'Background ingest job state transitions',
+    ['status'],  # status: queued|running|done|failed
+)
+
+
+def record_ingest_job(status: str) -> None:
+    """Record an ingest job entering a given status."""
+    try:
+        ingest_jobs_total.labels(status=status).inc()
+    except Exception:
+        pass
+
+
+ingest_extract_seconds = Histogram(
+    'ollama_rag_ingest_extract_seconds',
+    'Per-file text extraction time during ingest',
+    ['ext', 'outcome'],  # outcome: ok|error|timeout
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+
+
+def observe_ingest_extract(ext: str, outcome: str, seconds: float) -> None:
+    """Record text extraction time for one file (pdf/docx/txt)."""
+    try:
+        ingest_extract_seconds.labels(ext=ext, outcome=outcome).observe(seconds)
+    except Exception:
+        pass
+
+
+ingest_chunks_deduped_total = Counter(
+    'ollama_rag_ingest_chunks_deduped_total',
+    'Near-duplicate chunks linked to a canonical chunk instead of being indexed',
+)
+
+
+def record_chunks_deduped(count: int) -> None:
+    """Record chunks dropped by the ingest dedup stage."""
+    try:
+        ingest_chunks_deduped_total.inc(count)
+    except Exception:
+        pass
+
+
+lang_detect_texts_total = Counter(
+    'ollama_rag_lang_detect_texts_total',
+    'Texts actually classified by langid (cache misses)',
+)
+
+lang_detect_seconds = Histogram(
+    'ollama_rag_lang_detect_seconds',
+    'Time spent in one batched langid call during ingest',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+
+
+def observe_lang_detect(count: int, seconds: float) -> None:
+    """Record a batched language-identification call."""
+    try:
+        lang_detect_texts_total.inc(count)
+        lang_detect_seconds.observe(seconds)
+    except Exception:
+        pass
+
+
+watch_events_total = Counter(
+    'ollama_rag_watch_events_total',
+    'File events seen by the directory watcher',
+    ['kind'],  # changed|deleted
+)
+
+watch_flushes_total = Counter(
+    'ollama_rag_watch_flushes_total',
+    'Debounced batches pushed from the directory watcher into incremental ingest',
+)
+
+
+def record_watch_event(kind: str) -> None:
+    """Record a debounced-watcher file event."""
+    try:
+        watch_events_total.labels(kind=kind).inc()
+    except Exception:
+        pass
+
+
+def record_watch_flush() -> None:
+    """Record a watcher batch handed to ingest."""
+    try:
+        watch_flushes_total.inc()
+    except Exception:
+        pass
+
+
+rerank_stage_seconds = Histogram(
+    'ollama_rag_rerank_stage_seconds',
+    'Time spent in one rerank cascade stage',
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+rerank_stage_candidates = Histogram(
+    'ollama_rag_rerank_stage_candidates',
+    'Candidates scored by one rerank cascade stage',
+    ['stage'],
+    buckets=(1, 5, 10, 20, 30, 50, 100, 200),
+)
+
+rerank_stage_total = Counter(
+    'ollama_rag_rerank_stage_total',
+    'Rerank cascade stage outcomes',
+    ['stage', 'outcome'],  # ran|probe|skipped|over_budget|unavailable|error
+)
+
+
+def record_rerank_stage(stage: str, outcome: str, n: int = 0, seconds: float | None = None) -> None:
+    """Record one rerank cascade stage (duration/candidates only when it ran)."""
+    try:
+        rerank_stage_total.labels(stage=stage, outcome=outcome).inc()
+        if seconds is not None:
+            rerank_stage_seconds.labels(stage=stage).observe(seconds)
+            rerank_stage_candidates.labels(stage=stage).observe(n)
+    except Exception:
+        pass
+
+
+degradations_total = Counter(
+    'ollama_rag_degradations_total',
+    'Query pipeline steps degraded to meet a request deadline',
+    # rewrite/skipped, retrieval/bm25_only, rerank/shrunk|skipped, generate/capped
+    ['stage', 'action'],
+)
+
+
+def record_degradation(stage: str, action: str) -> None:
+    """Record one deadline-driven degradation decision."""
+    try:
+        degradations_total.labels(stage=stage, action=action).inc()
+    except Exception:
+        pass
+
+
+prompt_tokens = Histogram(
+    'ollama_rag_prompt_tokens',
+    'Estimated prompt tokens after context packing',
+    buckets=(128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+
+packed_contexts_total = Counter(
+    'ollama_rag_packed_contexts_total',
+    'Contexts dropped or trimmed to fit the prompt token budget',
+    ['action'],  # dropped|trimmed
+)
+
+
+def record_context_packing(tokens: int, dropped: int = 0, trimmed: int = 0) -> None:
+    """Record one prompt packing (token count + contexts dropped/trimmed)."""
+    try:
+        prompt_tokens.observe(tokens)
+        if dropped:
+            packed_contexts_total.labels(action="dropped").inc(dropped)
+        if trimmed:
+            packed_contexts_total.labels(action="trimmed").inc(trimmed)
+    except Exception:
+        pass
+
+
+context_compression_ratio = Histogram(
+    'ollama_rag_context_compression_ratio',
+    'Characters kept / characters retrieved by sentence-level context compression',
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0),
+)
+
+
+def record_context_compression(chars_before: int, chars_after: int) -> None:
+    """Record one context compression pass."""
+    try:
+        if chars_before > 0:
+            context_compression_ratio.observe(chars_after / chars_before)
+    except Exception:
+        pass
+
+
+model_loads_total = Counter(
+    'ollama_rag_model_loads_total',
+    'Ollama model loads detected from load_duration',
+    ['model', 'kind'],  # request (cold start trong query)|preload|keepwarm
+)
+
+model_load_seconds = Histogram(
+    'ollama_rag_model_load_seconds',
+    'Ollama model load time reported by load_duration',
+    ['model'],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+def record_model_load(model: str, kind: str, seconds: float) -> None:
+    """Record one detected model load."""
+    try:
+        model_loads_total.labels(model=model, kind=kind).inc()
+        model_load_seconds.labels(model=model).observe(seconds)
+    except Exception:
+        pass
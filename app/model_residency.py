@@ -0,0 +1,248 @@
+"""
+Model residency - giữ LLM/embedding model luôn nằm trong RAM của Ollama 🔥
+
+Ollama unload model sau thời gian rảnh (mặc định 5 phút), nên /api/query đầu tiên sau đó
+phải chờ nạp model vài giây. OllamaClient trước đây không gửi `keep_alive` và không warm
+model lúc khởi động:
+
+- ✅ `keep_alive` cấu hình được (OLLAMA_KEEP_ALIVE) gửi kèm mọi lời gọi generate/embed
+- ✅ Preload LLM_MODEL + EMBED_MODEL trên TỪNG backend lúc startup (thread nền,
+  không chặn server khởi động)
+- ✅ Keep-warm ping định kỳ (MODEL_KEEPWARM_INTERVAL_S), tùy chọn chỉ trong giờ làm việc
+  (MODEL_KEEPWARM_HOURS / MODEL_KEEPWARM_DAYS)
+- ✅ Phát hiện model load qua `load_duration` trong response của Ollama → metrics
+  (phân biệt load trong request thật / preload / keep-warm). Embed model chỉ đo được
+  ở preload/keep-warm qua /api/embed; /api/embeddings (lời gọi embed thật, Ollama cũ)
+  không trả load_duration
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+# Thời gian Ollama giữ model sau lời gọi cuối: "30m", "1h", giây ("600"), "-1" = mãi mãi
+# Trống = không gửi (mặc định của Ollama, 5m)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m").strip()
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "1").lower() in ("1", "true", "yes")
+# Input khi warm embed model qua /api/embed (đủ để Ollama báo load_duration)
+EMBED_WARMUP_INPUT = "warmup"
+# Chu kỳ keep-warm ping (giây, 0 = tắt); nên nhỏ hơn keep_alive
+MODEL_KEEPWARM_INTERVAL_S = max(0.0, float(os.getenv("MODEL_KEEPWARM_INTERVAL_S", "0")))
+# Giờ (0-23, "8-18" = 8:00-17:59) và ngày (ISO 1=thứ 2 .. 7=CN, "1-5") được ping; trống = luôn
+MODEL_KEEPWARM_HOURS = os.getenv("MODEL_KEEPWARM_HOURS", "").strip()
+MODEL_KEEPWARM_DAYS = os.getenv("MODEL_KEEPWARM_DAYS", "").strip()
+# load_duration >= ngưỡng (ms) mới tính là một lần nạp model (model đã resident: vài ms)
+MODEL_LOAD_MIN_MS = float(os.getenv("MODEL_LOAD_MIN_MS", "100"))
+
+KIND_GENERATE = "generate"
+KIND_EMBED = "embed"
+
+
+def keep_alive(value: str | None = None) -> str | int | None:
+    """Giá trị `keep_alive` cho payload Ollama (số → giây, chuỗi duration giữ nguyên)."""
+    raw = (OLLAMA_KEEP_ALIVE if value is None else value).strip()
+    if not raw:
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        return raw
+
+
+def parse_ranges(spec: str, lo: int, hi: int, inclusive_end: bool = True) -> set[int]:
+    """Khoảng dạng "8-18,20" → tập giá trị; bỏ qua phần không hợp lệ. Trống = cả [lo, hi]."""
+    if not spec:
+        return set(range(lo, hi + 1))
+    out: set[int] = set()
+    for part in spec.split(","):
+        part = part.strip()
+        try:
+            if "-" in part:
+                a, b = (int(x) for x in part.split("-", 1))
+                out.update(range(a, b + 1 if inclusive_end else b))
+            elif part:
+                out.add(int(part))
+        except ValueError:
+            logger.warning("Bỏ qua khoảng không hợp lệ %r", part)
+    return {v for v in out if lo <= v <= hi}
+
+
+def in_keepwarm_window(
+    now: datetime | None = None, hours: str | None = None, days: str | None = None
+) -> bool:
+    """Thời điểm hiện tại có nằm trong giờ/ngày keep-warm không."""
+    now = now or datetime.now()
+    hour_set = parse_ranges(MODEL_KEEPWARM_HOURS if hours is None else hours, 0, 23, False)
+    day_set = parse_ranges(MODEL_KEEPWARM_DAYS if days is None else days, 1, 7)
+    return now.hour in hour_set and now.isoweekday() in day_set
+
+
+def observe_load(model: str, data: dict[str, Any] | None, kind: str = "request") -> float | None:
+    """
+    Đọc `load_duration` (ns) từ response Ollama; ghi metrics nếu model vừa được nạp.
+
+    Returns:
+        Số giây nạp model, hoặc None nếu response không có load_duration
+    """
+    if not isinstance(data, dict) or data.get("load_duration") is None:
+        return None
+    try:
+        seconds = float(data["load_duration"]) / 1e9
+    except (TypeError, ValueError):
+        return None
+    if seconds * 1000.0 >= MODEL_LOAD_MIN_MS:
+        if kind == "request":
+            logger.info("🐢 Model %s được nạp trong request (%.2fs) - cold start", model, seconds)
+        if METRICS_ENABLED:
+            metrics.record_model_load(model, kind, seconds)
+    return seconds
+
+
+class ModelResidency:
+    """Preload + keep-warm các model trên mọi backend của một OllamaClient."""
+
+    def __init__(
+        self,
+        client: Any,
+        llm_model: str | None,
+        embed_model: str | None,
+        *,
+        interval_s: float | None = None,
+        hours: str | None = None,
+        days: str | None = None,
+    ):
+        self.client = client
+        self.llm_model = llm_model
+        self.embed_model = embed_model
+        self.interval_s = MODEL_KEEPWARM_INTERVAL_S if interval_s is None else interval_s
+        self.hours = MODEL_KEEPWARM_HOURS if hours is None else hours
+        self.days = MODEL_KEEPWARM_DAYS if days is None else days
+        self._lock = threading.Lock()
+        self._status: dict[tuple[str, str], dict[str, Any]] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # ===== Load / ping =====
+    def _targets(self) -> list[tuple[str, str, str]]:
+        """(kind, model, backend_url) cho mọi model × backend cần giữ resident."""
+        out: list[tuple[str, str, str]] = []
+        if self.llm_model:
+            gen = self.client._gen_pool.backends
+            out += [(KIND_GENERATE, self.llm_model, b.url) for b in gen]
+        if self.embed_model:
+            emb = self.client._embed_pool.backends
+            out += [(KIND_EMBED, self.embed_model, b.url) for b in emb]
+        return out
+
+    def _load(self, kind: str, model: str, base_url: str, reason: str) -> dict[str, Any]:
+        # generate không prompt / embed prompt rỗng: Ollama chỉ nạp model và trả về ngay
+        ka = keep_alive()
+        if kind == KIND_GENERATE:
+            path = "/api/generate"
+            body: dict[str, Any] = {"model": model}
+        else:
+            # /api/embed trả load_duration (/api/embeddings thì không) - input ngắn vì input
+            # rỗng chỉ nạp model, không báo load_duration
+            path, body = "/api/embed", {"model": model, "input": EMBED_WARMUP_INPUT}
+        if ka is not None:
+            body["keep_alive"] = ka
+        entry: dict[str, Any] = {
+            "kind": kind,
+            "model": model,
+            "backend": base_url,
+            "ts": time.time(),
+        }
+        try:
+            resp = self.client._request(
+                "POST", path, json_body=body, base_url=base_url, max_retries=0
+            )
+            if kind != KIND_GENERATE and getattr(resp, "status_code", 200) == 404:
+                # Ollama cũ không có /api/embed: dùng endpoint + payload của OllamaClient.embed
+                # (vẫn nạp + giữ model, nhưng không phát hiện được load → load_s=None)
+                from app.ollama_client import _embed_payload  # import trễ: tránh vòng import
+
+                resp = self.client._request(
+                    "POST",
+                    "/api/embeddings",
+                    json_body=_embed_payload("", model),
+                    base_url=base_url,
+                    max_retries=0,
+                )
+            resp.raise_for_status()
+            load_s = observe_load(model, resp.json(), kind=reason)
+            entry.update(ok=True, load_s=round(load_s, 3) if load_s is not None else None)
+        except Exception as e:
+            logger.warning("⚠️ %s %s trên %s thất bại: %s", reason, model, base_url, e)
+            entry.update(ok=False, error=str(e))
+        with self._lock:
+            self._status[(base_url, model)] = entry
+        return entry
+
+    def preload(self, reason: str = "preload") -> list[dict[str, Any]]:
+        """Nạp (hoặc gia hạn keep_alive) mọi model trên mọi backend."""
+        return [self._load(kind, model, url, reason) for kind, model, url in self._targets()]
+
+    def ping(self) -> list[dict[str, Any]] | None:
+        """Keep-warm ping nếu đang trong khung giờ; None nếu ngoài khung giờ."""
+        if not in_keepwarm_window(hours=self.hours, days=self.days):
+            return None
+        return self.preload(reason="keepwarm")
+
+    # ===== Lifecycle =====
+    def start(self, preload: bool | None = None) -> None:
+        """Chạy preload + vòng keep-warm trên thread nền (không chặn startup)."""
+        preload = MODEL_PRELOAD if preload is None else preload
+        if self._thread is not None or not (preload or self.interval_s > 0):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(preload,), name="model-residency", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, preload: bool) -> None:
+        if preload:
+            t0 = time.perf_counter()
+            results = self.preload()
+            ok = sum(1 for r in results if r.get("ok"))
+            logger.info(
+                "🔥 Preloaded %d/%d model×backend trong %.1fs",
+                ok,
+                len(results),
+                time.perf_counter() - t0,
+            )
+        if self.interval_s <= 0:
+            return
+        while not self._stop.wait(self.interval_s):
+            self.ping()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def status(self) -> dict[str, Any]:
+        with self._lock:
+            entries = [dict(e) for e in self._status.values()]
+        return {
+            "keep_alive": keep_alive(),
+            "keepwarm_interval_s": self.interval_s,
+            "keepwarm_hours": self.hours or "*",
+            "keepwarm_days": self.days or "*",
+            "in_window": in_keepwarm_window(hours=self.hours, days=self.days),
+            "running": self._thread is not None and self._thread.is_alive(),
+            "models": entries,
+        }
@@ -1,14 +1,21 @@
+import asyncio
 import json
 import logging
 import os
 import time
-from collections.abc import Iterator
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import ThreadPoolExecutor
 
+import httpx
 import requests
 from dotenv import load_dotenv
 from requests.adapters import HTTPAdapter
 
+from app.backend_pool import BackendPool, parse_backend_urls
 from app.circuit_breaker import CircuitBreaker, CircuitBreakerConfig, CircuitBreakerError
+from app.deadline import generation_cap
+from app.llm_scheduler import LLM_SCHEDULER_ENABLE, PRIORITY_INTERACTIVE, get_scheduler
+from app.model_residency import keep_alive, observe_load
 
 # Import metrics helpers - monitoring connection pool! 🔌
 try:
@@ -23,6 +30,10 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# Multi-backend: danh sách URL phân cách bằng dấu phẩy (ưu tiên hơn OLLAMA_BASE_URL)
+OLLAMA_BASE_URLS = os.getenv("OLLAMA_BASE_URLS", "")
+OLLAMA_EMBED_BASE_URLS = os.getenv("OLLAMA_EMBED_BASE_URLS", "")  # trống = dùng chung pool generate
+OLLAMA_EMBED_HEDGE_MS = float(os.getenv("OLLAMA_EMBED_HEDGE_MS", "0"))  # 0 = tắt hedging
 LLM_MODEL = os.getenv("LLM_MODEL", "llama3.1:8b")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
 
@@ -37,22 +48,50 @@ POOL_CONNECTIONS = int(os.getenv("OLLAMA_POOL_CONNECTIONS", "10"))  # Number of
 POOL_MAXSIZE = int(os.getenv("OLLAMA_POOL_MAXSIZE", "20"))  # Max connections per pool
 POOL_BLOCK = os.getenv("OLLAMA_POOL_BLOCK", "false").lower() == "true"  # Block when pool full
 
+# Async client (httpx) - keep-alive pool cho hàng nghìn stream đồng thời ⚡
+ASYNC_MAX_CONNECTIONS = int(os.getenv("OLLAMA_ASYNC_MAX_CONNECTIONS", "200"))
+ASYNC_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_ASYNC_KEEPALIVE_EXPIRY", "30"))
+
 # Optional tuning for performance/CPU usage
 OPT_NUM_CTX = os.getenv("OLLAMA_NUM_CTX")
 OPT_NUM_THREAD = os.getenv("OLLAMA_NUM_THREAD")
 OPT_NUM_GPU = os.getenv("OLLAMA_NUM_GPU")
 
 
+def _embed_payload(text: str, model: str | None = None) -> dict:
+    payload = {"model": model or EMBED_MODEL, "prompt": text}
+    ka = keep_alive()
+    if ka is not None:
+        payload["keep_alive"] = ka
+    return payload
+
+
 class OllamaClient:
     def __init__(self, base_url: str | None = None, enable_circuit_breaker: bool = True):
         """
         Initialize Ollama client với Circuit Breaker protection! 🛡️
 
         Args:
-            base_url: Ollama service URL
+            base_url: Ollama service URL (hoặc nhiều URL phân cách bằng dấu phẩy)
             enable_circuit_breaker: Enable circuit breaker for resilience (default: True)
         """
-        self.base_url = base_url or OLLAMA_BASE_URL
+        # Backend pools - generate và embed có thể chạy trên các box khác nhau 🌐
+        if base_url:
+            gen_urls = parse_backend_urls(base_url)
+            embed_urls = gen_urls
+        else:
+            gen_urls = parse_backend_urls(OLLAMA_BASE_URLS) or parse_backend_urls(OLLAMA_BASE_URL)
+            embed_urls = parse_backend_urls(OLLAMA_EMBED_BASE_URLS) or gen_urls
+        self._gen_pool = BackendPool(gen_urls, name="generate")
+        self._embed_pool = BackendPool(embed_urls, name="embed")
+        self._embed_executor: ThreadPoolExecutor | None = None
+        self._async_client: AsyncOllamaClient | None = None
+        self.base_url = self._gen_pool.primary_url
+        if len(gen_urls) > 1 or embed_urls != gen_urls:
+            logger.info(
+                f"🌐 Ollama backend pools: generate={gen_urls}, embed={embed_urls}, "
+                f"strategy={self._gen_pool.strategy}"
+            )
 
         # Connection pooling setup - reuse connections như rockstar! 🎸
         self.session = requests.Session()
@@ -120,11 +159,14 @@ class OllamaClient:
         json_body=None,
         stream: bool = False,
         timeout: tuple[float, float] | None = None,
+        base_url: str | None = None,
+        max_retries: int | None = None,
     ) -> requests.Response:
-        url = f"{self.base_url}{path}"
+        url = f"{base_url or self.base_url}{path}"
         last_exc: Exception | None = None
         to = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
-        for attempt in range(MAX_RETRIES + 1):
+        retries = MAX_RETRIES if max_retries is None else max_retries
+        for attempt in range(retries + 1):
             try:
                 # Track connection pool usage
                 self._connection_stats["total_requests"] += 1
@@ -158,7 +200,7 @@ class OllamaClient:
                 return resp
             except (requests.Timeout, requests.ConnectionError, requests.HTTPError) as e:
                 last_exc = e
-                if attempt >= MAX_RETRIES:
+                if attempt >= retries:
                     break
                 time.sleep(BACKOFF_FACTOR * (2**attempt))
             except Exception as e:
@@ -197,13 +239,30 @@ class OllamaClient:
             },
         }
 
+    def async_client(self) -> "AsyncOllamaClient":
+        """Async twin (httpx) dùng chung backend pools + circuit breaker với client này."""
+        if self._async_client is None:
+            self._async_client = AsyncOllamaClient(sync_client=self)
+        return self._async_client
+
+    def get_backend_pool_metrics(self) -> dict:
+        """Backend pool snapshot - outstanding, EWMA latency, circuit state per backend 🌐"""
+        return {"generate": self._gen_pool.stats(), "embed": self._embed_pool.stats()}
+
     def health_check(self) -> bool:
-        """Check if Ollama service is healthy."""
-        try:
-            response = self.session.post(f"{self.base_url}/api/tags", timeout=CONNECT_TIMEOUT)
-            return response.status_code == 200
-        except Exception:
-            return False
+        """Check if Ollama service is healthy (ít nhất một generate backend trả lời)."""
+        for backend in self._gen_pool.backends:
+            try:
+                response = self.session.post(f"{backend.url}/api/tags", timeout=CONNECT_TIMEOUT)
+                if response.status_code == 200:
+                    return True
+            except Exception:
+                continue
+        return False
+
+    def _pool_retries(self, pool: BackendPool) -> int | None:
+        # Nhiều backend → failover sang backend khác thay vì retry/backoff trên cùng backend
+        return None if len(pool) == 1 else 0
 
     def embed(self, texts: list[str]) -> list[list[float]]:
         """Generate embeddings với Circuit Breaker protection! 🛡️"""
@@ -222,22 +281,43 @@ class OllamaClient:
             return self._embed_impl(texts)
 
     def _embed_impl(self, texts: list[str]) -> list[list[float]]:
-        """Internal implementation of embed - wrapped by circuit breaker."""
-        embeddings: list[list[float]] = []
-        for t in texts:
+        """Internal implementation of embed - wrapped by circuit breaker.
+
+        Với nhiều embed backends, batch được fan-out song song qua pool.
+        """
+        if len(self._embed_pool) > 1 and len(texts) > 1:
+            return list(self._get_embed_executor().map(self._embed_one, texts))
+        return [self._embed_one(t) for t in texts]
+
+    def _embed_one(self, text: str) -> list[float]:
+        retries = self._pool_retries(self._embed_pool)
+
+        def _do(base_url: str) -> list[float]:
             resp = self._request(
                 "POST",
                 "/api/embeddings",
-                json_body={"model": EMBED_MODEL, "prompt": t},
+                json_body=_embed_payload(text),
                 stream=False,
+                base_url=base_url,
+                max_retries=retries,
             )
             resp.raise_for_status()
             data = resp.json()
             emb = data.get("embedding")
             if not emb:
                 raise RuntimeError(f"Ollama embedding failed: {data}")
-            embeddings.append(emb)
-        return embeddings
+            return emb
+
+        if OLLAMA_EMBED_HEDGE_MS > 0:
+            return self._embed_pool.call_hedged(_do, OLLAMA_EMBED_HEDGE_MS / 1000.0)
+        return self._embed_pool.call(_do)
+
+    def _get_embed_executor(self) -> ThreadPoolExecutor:
+        if self._embed_executor is None:
+            self._embed_executor = ThreadPoolExecutor(
+                max_workers=2 * len(self._embed_pool), thread_name_prefix="ollama-embed"
+            )
+        return self._embed_executor
 
     def _gen_options(self) -> dict:
         opts: dict = {}
@@ -251,10 +331,43 @@ class OllamaClient:
                 opts["num_gpu"] = int(OPT_NUM_GPU)
         except Exception:
             pass
+        # Request có deadline → giới hạn số token sinh ra cho kịp
+        cap = generation_cap()
+        if cap is not None:
+            opts["num_predict"] = cap
         return opts
 
-    def generate(self, prompt: str, system: str | None = None) -> str:
-        """Generate text với Circuit Breaker protection! 🛡️"""
+    def _gen_payload(self, prompt: str, system: str | None, stream: bool) -> dict:
+        payload = {
+            "model": LLM_MODEL,
+            "prompt": prompt if system is None else f"[SYSTEM]\n{system}\n[/SYSTEM]\n{prompt}",
+            "stream": stream,
+            "options": self._gen_options(),
+        }
+        ka = keep_alive()
+        if ka is not None:
+            # Giữ model resident giữa các query (xem app/model_residency.py)
+            payload["keep_alive"] = ka
+        return payload
+
+    def generate(
+        self, prompt: str, system: str | None = None, priority: int | str | None = None
+    ) -> str:
+        """Generate text qua LLM scheduler (admission control) + Circuit Breaker! 🛡️
+
+        Args:
+            priority: Priority class (mặc định: priority của context hiện tại)
+
+        Raises:
+            LLMOverloadedError: Khi scheduler từ chối request (hàng đợi quá tải)
+        """
+        # Scheduler nằm ngoài circuit breaker: từ chối do quá tải không phải lỗi của Ollama
+        if LLM_SCHEDULER_ENABLE:
+            with get_scheduler(LLM_MODEL, backends=len(self._gen_pool)).slot(priority):
+                return self._generate_guarded(prompt, system)
+        return self._generate_guarded(prompt, system)
+
+    def _generate_guarded(self, prompt: str, system: str | None = None) -> str:
         if self._circuit_breaker:
             try:
                 return self._circuit_breaker.call(self._generate_impl, prompt, system)
@@ -273,27 +386,65 @@ class OllamaClient:
 
     def _generate_impl(self, prompt: str, system: str | None = None) -> str:
         """Internal implementation of generate - wrapped by circuit breaker."""
-        payload = {
-            "model": LLM_MODEL,
-            "prompt": prompt if system is None else f"[SYSTEM]\n{system}\n[/SYSTEM]\n{prompt}",
-            "stream": False,
-            "options": self._gen_options(),
-        }
-        resp = self._request("POST", "/api/generate", json_body=payload, stream=False)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("response", "")
+        payload = self._gen_payload(prompt, system, stream=False)
+        retries = self._pool_retries(self._gen_pool)
 
-    def generate_stream(self, prompt: str, system: str | None = None) -> Iterator[str]:
-        payload = {
-            "model": LLM_MODEL,
-            "prompt": prompt if system is None else f"[SYSTEM]\n{system}\n[/SYSTEM]\n{prompt}",
-            "stream": True,
-            "options": self._gen_options(),
-        }
-        resp = self._request("POST", "/api/generate", json_body=payload, stream=True)
-        with resp:
+        def _do(base_url: str) -> str:
+            resp = self._request(
+                "POST",
+                "/api/generate",
+                json_body=payload,
+                stream=False,
+                base_url=base_url,
+                max_retries=retries,
+            )
             resp.raise_for_status()
+            data = resp.json()
+            observe_load(LLM_MODEL, data)
+            return data.get("response", "")
+
+        return self._gen_pool.call(_do)
+
+    def generate_stream(
+        self, prompt: str, system: str | None = None, priority: int | str | None = None
+    ) -> Iterator[str]:
+        """Stream tokens; slot của scheduler được giữ cho đến khi stream kết thúc.
+
+        Mặc định stream là interactive (priority cao nhất).
+        """
+        if priority is None:
+            priority = PRIORITY_INTERACTIVE
+        if LLM_SCHEDULER_ENABLE:
+            return get_scheduler(LLM_MODEL, backends=len(self._gen_pool)).stream(
+                lambda: self._generate_stream_impl(prompt, system), priority
+            )
+        return self._generate_stream_impl(prompt, system)
+
+    def _generate_stream_impl(self, prompt: str, system: str | None = None) -> Iterator[str]:
+        payload = self._gen_payload(prompt, system, stream=True)
+        retries = self._pool_retries(self._gen_pool)
+
+        def _open(base_url: str) -> requests.Response:
+            resp = self._request(
+                "POST",
+                "/api/generate",
+                json_body=payload,
+                stream=True,
+                base_url=base_url,
+                max_retries=retries,
+            )
+            try:
+                resp.raise_for_status()
+            except Exception:
+                resp.close()
+                raise
+            return resp
+
+        return self._gen_pool.stream(_open, self._iter_stream)
+
+    @staticmethod
+    def _iter_stream(resp: requests.Response) -> Iterator[str]:
+        with resp:
             for line in resp.iter_lines(decode_unicode=True):
                 if not line:
                     continue
@@ -304,4 +455,240 @@ class OllamaClient:
                 if "response" in data and data["response"]:
                     yield data["response"]
                 if data.get("done"):
+                    # Chunk cuối mang load_duration
+                    observe_load(LLM_MODEL, data)
+                    break
+
+
+class AsyncOllamaClient:
+    """
+    Async Ollama client trên httpx.AsyncClient - chờ LLM mà không giữ thread! ⚡
+
+    Dùng chung backend pools, circuit breaker và LLM scheduler với OllamaClient
+    (sync), nên outstanding requests và health của backend được tính chung cho
+    cả hai đường.
+
+    Example:
+        >>> aclient = OllamaClient().async_client()
+        >>> text = await aclient.generate("Xin chào")
+        >>> async for token in aclient.generate_stream("Kể chuyện"):
+        ...     print(token, end="")
+    """
+
+    def __init__(
+        self,
+        base_url: str | None = None,
+        *,
+        sync_client: OllamaClient | None = None,
+        enable_circuit_breaker: bool = True,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        if sync_client is None:
+            sync_client = OllamaClient(
+                base_url=base_url, enable_circuit_breaker=enable_circuit_breaker
+            )
+        self._sync = sync_client
+        self._gen_pool = sync_client._gen_pool
+        self._embed_pool = sync_client._embed_pool
+        self._circuit_breaker = sync_client._circuit_breaker
+        self.base_url = sync_client.base_url
+        self._transport = transport  # custom transport (tests / proxies)
+        self._client: httpx.AsyncClient | None = None
+        self._client_loop: asyncio.AbstractEventLoop | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # httpx.AsyncClient gắn với event loop tạo ra nó
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=ASYNC_MAX_CONNECTIONS,
+                    max_keepalive_connections=POOL_MAXSIZE,
+                    keepalive_expiry=ASYNC_KEEPALIVE_EXPIRY,
+                ),
+                transport=self._transport,
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._client_loop = None
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        *,
+        json_body=None,
+        stream: bool = False,
+        base_url: str | None = None,
+        max_retries: int | None = None,
+    ) -> httpx.Response:
+        client = self._get_client()
+        url = f"{base_url or self.base_url}{path}"
+        retries = MAX_RETRIES if max_retries is None else max_retries
+        last_exc: Exception | None = None
+        for attempt in range(retries + 1):
+            try:
+                if METRICS_ENABLED:
+                    try:
+                        metrics.record_connection_pool_request(client_name="ollama_async_client")
+                    except Exception:
+                        pass
+                req = client.build_request(method, url, json=json_body)
+                resp = await client.send(req, stream=stream)
+                if resp.status_code == 429 or 500 <= resp.status_code < 600:
+                    await resp.aclose()
+                    raise httpx.HTTPStatusError(
+                        f"{resp.status_code}: transient error", request=req, response=resp
+                    )
+                return resp
+            except (httpx.TimeoutException, httpx.TransportError, httpx.HTTPStatusError) as e:
+                last_exc = e
+                if attempt >= retries:
+                    break
+                await asyncio.sleep(BACKOFF_FACTOR * (2**attempt))
+            except Exception as e:
+                last_exc = e
+                break
+        if last_exc:
+            raise last_exc
+        raise RuntimeError("Request failed without exception")
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        """Async embeddings với Circuit Breaker protection! 🛡️"""
+        if self._circuit_breaker:
+            try:
+                return await self._circuit_breaker.call_async(self._embed_impl, texts)
+            except CircuitBreakerError as e:
+                logger.error(f"🚨 Circuit breaker OPEN for async embed: {e}")
+                return [[0.0] * 768 for _ in texts]
+        return await self._embed_impl(texts)
+
+    async def _embed_impl(self, texts: list[str]) -> list[list[float]]:
+        # Giới hạn fan-out giống executor của client sync
+        sem = asyncio.Semaphore(2 * len(self._embed_pool))
+
+        async def _bounded(text: str) -> list[float]:
+            async with sem:
+                return await self._embed_one(text)
+
+        return list(await asyncio.gather(*(_bounded(t) for t in texts)))
+
+    async def _embed_one(self, text: str) -> list[float]:
+        retries = self._sync._pool_retries(self._embed_pool)
+
+        async def _do(base_url: str) -> list[float]:
+            resp = await self._request(
+                "POST",
+                "/api/embeddings",
+                json_body=_embed_payload(text),
+                base_url=base_url,
+                max_retries=retries,
+            )
+            resp.raise_for_status()
+            data = resp.json()
+            emb = data.get("embedding")
+            if not emb:
+                raise RuntimeError(f"Ollama embedding failed: {data}")
+            return emb
+
+        if OLLAMA_EMBED_HEDGE_MS > 0:
+            return await self._embed_pool.call_hedged_async(_do, OLLAMA_EMBED_HEDGE_MS / 1000.0)
+        return await self._embed_pool.call_async(_do)
+
+    async def generate(
+        self, prompt: str, system: str | None = None, priority: int | str | None = None
+    ) -> str:
+        """Async generate qua LLM scheduler + Circuit Breaker.
+
+        Raises:
+            LLMOverloadedError: Khi scheduler từ chối request (hàng đợi quá tải)
+        """
+        if LLM_SCHEDULER_ENABLE:
+            sched = get_scheduler(LLM_MODEL, backends=len(self._gen_pool))
+            async with sched.slot_async(priority):
+                return await self._generate_guarded(prompt, system)
+        return await self._generate_guarded(prompt, system)
+
+    async def _generate_guarded(self, prompt: str, system: str | None = None) -> str:
+        if self._circuit_breaker:
+            try:
+                return await self._circuit_breaker.call_async(self._generate_impl, prompt, system)
+            except CircuitBreakerError as e:
+                logger.error(f"🚨 Circuit breaker OPEN for async generate: {e}")
+                return (
+                    "[Service temporarily unavailable. The AI service is experiencing issues. "
+                    "Please try again in a moment.]"
+                )
+        return await self._generate_impl(prompt, system)
+
+    async def _generate_impl(self, prompt: str, system: str | None = None) -> str:
+        payload = self._sync._gen_payload(prompt, system, stream=False)
+        retries = self._sync._pool_retries(self._gen_pool)
+
+        async def _do(base_url: str) -> str:
+            resp = await self._request(
+                "POST", "/api/generate", json_body=payload, base_url=base_url, max_retries=retries
+            )
+            resp.raise_for_status()
+            data = resp.json()
+            observe_load(LLM_MODEL, data)
+            return data.get("response", "")
+
+        return await self._gen_pool.call_async(_do)
+
+    def generate_stream(
+        self, prompt: str, system: str | None = None, priority: int | str | None = None
+    ) -> AsyncIterator[str]:
+        """Async token stream; slot của scheduler được giữ cho đến khi stream kết thúc."""
+        if priority is None:
+            priority = PRIORITY_INTERACTIVE
+        if LLM_SCHEDULER_ENABLE:
+            return get_scheduler(LLM_MODEL, backends=len(self._gen_pool)).stream_async(
+                lambda: self._generate_stream_impl(prompt, system), priority
+            )
+        return self._generate_stream_impl(prompt, system)
+
+    def _generate_stream_impl(self, prompt: str, system: str | None = None) -> AsyncIterator[str]:
+        payload = self._sync._gen_payload(prompt, system, stream=True)
+        retries = self._sync._pool_retries(self._gen_pool)
+
+        async def _open(base_url: str) -> httpx.Response:
+            resp = await self._request(
+                "POST",
+                "/api/generate",
+                json_body=payload,
+                stream=True,
+                base_url=base_url,
+                max_retries=retries,
+            )
+            if resp.status_code >= 400:
+                await resp.aclose()
+                resp.raise_for_status()
+            return resp
+
+        return self._gen_pool.stream_async(_open, self._iter_stream)
+
+    @staticmethod
+    async def _iter_stream(resp: httpx.Response) -> AsyncIterator[str]:
+        try:
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except Exception:
+                    continue
+                if "response" in data and data["response"]:
+                    yield data["response"]
+                if data.get("done"):
+                    # Chunk cuối mang load_duration
+                    observe_load(LLM_MODEL, data)
                     break
+        finally:
+            await resp.aclose()
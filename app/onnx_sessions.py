@@ -0,0 +1,239 @@
+"""
+ONNX Sessions - pool InferenceSession cho reranker theo số luồng 🧵
+
+Số luồng của ONNXRuntime cố định lúc tạo session, nên đổi os.environ giữa chừng
+không có tác dụng (và race giữa các request). Pool này:
+
+- ✅ Tạo session riêng cho từng số luồng intra-op được yêu cầu, giữ lại để dùng lại
+- ✅ Nhiều session cùng cấu hình → các request rerank song song không tranh một session
+- ✅ Ngân sách luồng = số core vật lý khả dụng (affinity/cgroup): tổng luồng đang chạy
+  không vượt ngân sách → không oversubscription, request vượt thì chờ
+- ✅ Mặc định theo NUMA: một session không vượt quá số core của một node
+- ✅ Tắt spin-wait của thread pool (nhiều session cùng lúc spin sẽ đốt CPU của nhau)
+"""
+
+import glob
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+try:
+    import psutil  # type: ignore
+except Exception:  # pragma: no cover
+    psutil = None  # optional dependency
+
+logger = logging.getLogger(__name__)
+
+# Tổng số session tối đa trong pool (mọi cấu hình luồng cộng lại). Mỗi session giữ một
+# bản trọng số riêng (bge-reranker-v2-m3 FP32 ~2.3 GB, INT8 ~0.6 GB) → mặc định 2
+RERANK_SESSION_POOL_MAX = max(1, int(os.getenv("RERANK_SESSION_POOL_MAX", "2")))
+# Ngân sách luồng (0 = số core vật lý khả dụng)
+RERANK_THREAD_BUDGET = max(0, int(os.getenv("RERANK_THREAD_BUDGET", "0")))
+# Chờ tối đa (giây) để có đủ luồng trước khi vẫn chạy (tránh treo request)
+RERANK_SESSION_WAIT = float(os.getenv("RERANK_SESSION_WAIT", "30"))
+
+
+def _parse_cpulist(text: str) -> set[int]:
+    """'0-3,8,10-11' → {0, 1, 2, 3, 8, 10, 11}."""
+    out: set[int] = set()
+    for part in text.strip().split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            out.update(range(int(lo), int(hi) + 1))
+        else:
+            out.add(int(part))
+    return out
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except Exception:
+        return None
+
+
+def usable_cpus() -> set[int]:
+    """Logical CPUs process được phép chạy (affinity/cpuset)."""
+    try:
+        return set(os.sched_getaffinity(0))
+    except Exception:
+        return set(range(os.cpu_count() or 1))
+
+
+def physical_cores(cpus: set[int], sysfs: str = "/sys/devices/system/cpu") -> int:
+    """Số core vật lý trong tập CPU (gộp hyperthread siblings)."""
+    groups: set[frozenset[int]] = set()
+    for cpu in cpus:
+        text = _read(os.path.join(sysfs, f"cpu{cpu}", "topology", "thread_siblings_list"))
+        if text is None:
+            groups = set()
+            break
+        groups.add(frozenset(_parse_cpulist(text) & cpus) or frozenset({cpu}))
+    if groups:
+        return len(groups)
+    if psutil is not None and len(cpus) == (os.cpu_count() or 0):
+        try:
+            return max(1, int(psutil.cpu_count(logical=False) or len(cpus)))
+        except Exception:
+            pass
+    return max(1, len(cpus))
+
+
+def numa_nodes(cpus: set[int], sysfs: str = "/sys/devices/system/node") -> list[set[int]]:
+    """CPU khả dụng theo từng NUMA node (một node duy nhất nếu không đọc được)."""
+    nodes: list[set[int]] = []
+    for path in sorted(glob.glob(os.path.join(sysfs, "node[0-9]*", "cpulist"))):
+        text = _read(path)
+        node = (_parse_cpulist(text) if text else set()) & cpus
+        if node:
+            nodes.append(node)
+    return nodes or [set(cpus)]
+
+
+def default_thread_budget() -> int:
+    if RERANK_THREAD_BUDGET > 0:
+        return RERANK_THREAD_BUDGET
+    return physical_cores(usable_cpus())
+
+
+def default_session_threads(budget: int | None = None) -> int:
+    """
+    Số luồng intra-op mặc định cho một session.
+
+    ORT_INTRA_OP_THREADS (nếu đặt) được giữ nguyên; ngược lại = số core vật lý của
+    node NUMA nhỏ nhất, chia đôi ngân sách khi có thể để hai request rerank chạy song song.
+    """
+    env = os.getenv("ORT_INTRA_OP_THREADS")
+    if env:
+        try:
+            return max(1, int(env))
+        except ValueError:
+            pass
+    budget = budget or default_thread_budget()
+    per_node = min(physical_cores(node) for node in numa_nodes(usable_cpus()))
+    return max(1, min(per_node, budget // 2 if budget >= 2 else budget))
+
+
+class OnnxSessionPool:
+    """
+    Pool session cho một model; session được cấp theo số luồng intra-op.
+
+    `factory(threads)` tạo session mới (chỉ gọi ngoài lock). Tổng luồng của các
+    session đang được dùng không vượt `budget`, trừ khi request đơn lẻ đã lớn hơn budget
+    (khi đó chạy một mình).
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[int], Any],
+        budget: int | None = None,
+        max_sessions: int | None = None,
+        default_threads: int | None = None,
+        wait_timeout: float | None = None,
+    ):
+        self._factory = factory
+        self.budget = max(1, budget or default_thread_budget())
+        self.max_sessions = max(1, max_sessions or RERANK_SESSION_POOL_MAX)
+        self.default_threads = max(1, default_threads or default_session_threads(self.budget))
+        self.wait_timeout = RERANK_SESSION_WAIT if wait_timeout is None else wait_timeout
+        self._cond = threading.Condition()
+        self._idle: dict[int, list[Any]] = {}
+        self._total = 0  # session đã tạo (idle + đang dùng + đang tạo)
+        self._threads_in_use = 0
+        self.created = 0
+        self.evicted = 0
+        self.waits = 0
+
+    def add(self, session: Any, threads: int) -> None:
+        """Đưa session có sẵn (vd. session khởi tạo) vào pool."""
+        with self._cond:
+            self._idle.setdefault(threads, []).append(session)
+            self._total += 1
+
+    def _normalize(self, threads: int | None) -> int:
+        t = int(threads) if threads else self.default_threads
+        return max(1, min(t, self.budget))
+
+    def _evict_idle_locked(self, keep: int) -> bool:
+        """Bỏ một session rảnh của cấu hình luồng khác để nhường chỗ."""
+        for t, sessions in self._idle.items():
+            if t != keep and sessions:
+                sessions.pop()
+                self._total -= 1
+                self.evicted += 1
+                return True
+        return False
+
+    @contextmanager
+    def session(self, threads: int | None = None) -> Iterator[Any]:
+        t = self._normalize(threads)
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        create = False
+        sess = None
+        with self._cond:
+            while True:
+                fits = self._threads_in_use + t <= self.budget or self._threads_in_use == 0
+                if fits and self._idle.get(t):
+                    sess = self._idle[t].pop()
+                    break
+                if fits and (self._total < self.max_sessions or self._evict_idle_locked(t)):
+                    self._total += 1
+                    create = True
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # Quá hạn chờ: chạy với session tạm (không giữ lại) thay vì fail request
+                    logger.warning("ONNX session pool saturated, running %d threads over budget", t)
+                    self._total += 1
+                    create = True
+                    break
+                waited = True
+                self._cond.wait(remaining)
+            self._threads_in_use += t
+            if waited:
+                self.waits += 1
+        try:
+            if create:
+                try:
+                    sess = self._factory(t)
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._threads_in_use -= t
+                        self._cond.notify_all()
+                    raise
+                with self._cond:
+                    self.created += 1
+            yield sess
+        finally:
+            if sess is not None:
+                with self._cond:
+                    self._threads_in_use -= t
+                    if self._total <= self.max_sessions:
+                        self._idle.setdefault(t, []).append(sess)
+                    else:
+                        self._total -= 1
+                    self._cond.notify_all()
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            return {
+                "budget": self.budget,
+                "default_threads": self.default_threads,
+                "sessions": self._total,
+                "max_sessions": self.max_sessions,
+                "idle": {t: len(s) for t, s in self._idle.items() if s},
+                "threads_in_use": self._threads_in_use,
+                "created": self.created,
+                "evicted": self.evicted,
+                "waits": self.waits,
+            }
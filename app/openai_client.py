@@ -1,10 +1,14 @@
+import asyncio
 import json
 import os
 import time
-from collections.abc import Iterator
+from collections.abc import AsyncIterator, Iterator
 
+import httpx
 import requests
 
+from app.deadline import generation_cap
+
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -13,6 +17,38 @@ CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
 READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "180"))
 MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
 BACKOFF_FACTOR = float(os.getenv("OPENAI_RETRY_BACKOFF", "0.6"))
+ASYNC_MAX_CONNECTIONS = int(os.getenv("OPENAI_ASYNC_MAX_CONNECTIONS", "100"))
+
+
+def _chat_payload(prompt: str, system: str | None, stream: bool) -> dict:
+    messages = []
+    if system:
+        messages.append({"role": "system", "content": system})
+    messages.append({"role": "user", "content": prompt})
+    payload = {
+        "model": OPENAI_MODEL,
+        "messages": messages,
+        "stream": stream,
+    }
+    # Request có deadline → giới hạn số token sinh ra cho kịp
+    cap = generation_cap()
+    if cap is not None:
+        payload["max_tokens"] = cap
+    return payload
+
+
+def _parse_sse_line(line: str) -> tuple[str | None, bool]:
+    """Parse một dòng SSE của chat completions → (delta, done)."""
+    if not line or not line.startswith("data: "):
+        return None, False
+    chunk = line[len("data: ") :].strip()
+    if chunk == "[DONE]":
+        return None, True
+    try:
+        data = json.loads(chunk)
+        return data["choices"][0]["delta"].get("content"), False
+    except Exception:
+        return None, False
 
 
 class OpenAIClient:
@@ -22,6 +58,13 @@ class OpenAIClient:
         if not self.api_key:
             raise RuntimeError("OPENAI_API_KEY is not set")
         self.session = requests.Session()
+        self._async_client: AsyncOpenAIClient | None = None
+
+    def async_client(self) -> "AsyncOpenAIClient":
+        """Async twin (httpx) cùng base_url/api_key."""
+        if self._async_client is None:
+            self._async_client = AsyncOpenAIClient(base_url=self.base_url, api_key=self.api_key)
+        return self._async_client
 
     def _headers(self) -> dict:
         return {
@@ -67,15 +110,7 @@ class OpenAIClient:
         raise RuntimeError("OpenAI request failed")
 
     def generate(self, prompt: str, system: str | None = None) -> str:
-        messages = []
-        if system:
-            messages.append({"role": "system", "content": system})
-        messages.append({"role": "user", "content": prompt})
-        payload = {
-            "model": OPENAI_MODEL,
-            "messages": messages,
-            "stream": False,
-        }
+        payload = _chat_payload(prompt, system, stream=False)
         resp = self._request("POST", "/chat/completions", json_body=payload, stream=False)
         resp.raise_for_status()
         data = resp.json()
@@ -85,29 +120,107 @@ class OpenAIClient:
             return ""
 
     def generate_stream(self, prompt: str, system: str | None = None) -> Iterator[str]:
-        messages = []
-        if system:
-            messages.append({"role": "system", "content": system})
-        messages.append({"role": "user", "content": prompt})
-        payload = {
-            "model": OPENAI_MODEL,
-            "messages": messages,
-            "stream": True,
-        }
+        payload = _chat_payload(prompt, system, stream=True)
         resp = self._request("POST", "/chat/completions", json_body=payload, stream=True)
         with resp:
             resp.raise_for_status()
             for line in resp.iter_lines(decode_unicode=True):
-                if not line:
-                    continue
-                if line.startswith("data: "):
-                    chunk = line[len("data: ") :].strip()
-                    if chunk == "[DONE]":
-                        break
-                    try:
-                        data = json.loads(chunk)
-                        delta = data["choices"][0]["delta"].get("content")
-                        if delta:
-                            yield delta
-                    except Exception:
-                        continue
+                delta, done = _parse_sse_line(line)
+                if done:
+                    break
+                if delta:
+                    yield delta
+
+
+class AsyncOpenAIClient:
+    """Async OpenAI-compatible client trên httpx.AsyncClient (pooling + keep-alive) ⚡"""
+
+    def __init__(
+        self,
+        base_url: str | None = None,
+        api_key: str | None = None,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.base_url = base_url or OPENAI_BASE_URL
+        self.api_key = api_key or OPENAI_API_KEY
+        if not self.api_key:
+            raise RuntimeError("OPENAI_API_KEY is not set")
+        self._transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self._client_loop: asyncio.AbstractEventLoop | None = None
+
+    def _headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS),
+                headers=self._headers(),
+                transport=self._transport,
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._client_loop = None
+
+    async def _request(
+        self, method: str, path: str, *, json_body=None, stream: bool = False
+    ) -> httpx.Response:
+        client = self._get_client()
+        url = f"{self.base_url}{path}"
+        last_exc: Exception | None = None
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                req = client.build_request(method, url, json=json_body)
+                resp = await client.send(req, stream=stream)
+                if resp.status_code in (429, 500, 502, 503, 504):
+                    await resp.aclose()
+                    raise httpx.HTTPStatusError(
+                        f"{resp.status_code}: transient", request=req, response=resp
+                    )
+                return resp
+            except (httpx.TimeoutException, httpx.TransportError, httpx.HTTPStatusError) as e:
+                last_exc = e
+                if attempt >= MAX_RETRIES:
+                    break
+                await asyncio.sleep(BACKOFF_FACTOR * (2**attempt))
+            except Exception as e:
+                last_exc = e
+                break
+        if last_exc:
+            raise last_exc
+        raise RuntimeError("OpenAI request failed")
+
+    async def generate(self, prompt: str, system: str | None = None) -> str:
+        payload = _chat_payload(prompt, system, stream=False)
+        resp = await self._request("POST", "/chat/completions", json_body=payload)
+        resp.raise_for_status()
+        data = resp.json()
+        try:
+            return data["choices"][0]["message"]["content"]
+        except Exception:
+            return ""
+
+    async def generate_stream(self, prompt: str, system: str | None = None) -> AsyncIterator[str]:
+        payload = _chat_payload(prompt, system, stream=True)
+        resp = await self._request("POST", "/chat/completions", json_body=payload, stream=True)
+        try:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                delta, done = _parse_sse_line(line)
+                if done:
+                    break
+                if delta:
+                    yield delta
+        finally:
+            await resp.aclose()
@@ -1,3 +1,4 @@
+import asyncio
 import contextlib
 import hashlib
 import json
@@ -7,8 +8,7 @@ import re
 import shutil
 import threading
 import time
-import uuid
-from collections.abc import Sequence
+from collections.abc import AsyncIterator, Callable, Collection, Sequence
 from typing import Any
 
 import numpy as _np  # for FAISS cosine and array building
@@ -17,23 +17,49 @@ from chromadb.api.types import Documents, Embeddings, IDs, Metadatas
 from chromadb.config import Settings
 from dotenv import load_dotenv
 
+from .bm25_index import CompactBM25
 from .cache_utils import LRUCacheWithTTL
+from .chunk_dedup import CHUNK_DEDUP_ENABLED, ChunkDeduper
+from .context_compressor import CONTEXT_COMPRESSION, ContextCompressor
+from .context_packer import PROMPT_PACKING, ContextPacker
+from .deadline import current_deadline, generation_capped
 from .exceptions import IngestError
-from .file_utils import read_file_by_extension
 from .gen_cache import GenCache
-from .ollama_client import OllamaClient
+from .ingest_manifest import IngestManifest, chunk_id, path_in_scope
+from .ingest_pipeline import (
+    INGEST_BATCH_SIZE,
+    ChunkBatch,
+    Document,
+    IngestPipeline,
+    IngestProgressFn,
+    IngestStats,
+    report_progress,
+)
+from .lang_detect import UNKNOWN_LANG, LangDetector
+from .llm_scheduler import (
+    LLM_SCHEDULER_ENABLE,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_REWRITE,
+    get_scheduler,
+    llm_priority,
+)
+from .meta_summary import MetaSummary
+from .ollama_client import LLM_MODEL, OllamaClient
 from .openai_client import OpenAIClient  # type: ignore
+from .rerank_cascade import (
+    RERANK_CASCADE_BGE,
+    RERANK_CASCADE_BGE_BUDGET_MS,
+    RERANK_CASCADE_CE_BUDGET_MS,
+    RERANK_CASCADE_CE_KEEP,
+    RERANK_CASCADE_CE_MODEL,
+    RERANK_CASCADE_DEFAULT,
+    RERANK_CASCADE_EMBED_BUDGET_MS,
+    RERANK_CASCADE_EMBED_KEEP,
+    CascadeStage,
+    RerankCascade,
+)
 from .reranker import BgeOnnxReranker, SimpleEmbedReranker
-
-try:
-    from rank_bm25 import BM25Okapi  # type: ignore
-except Exception:  # pragma: no cover
-    BM25Okapi = None  # fallback if package not installed
-
-try:
-    import langid  # type: ignore
-except Exception:  # pragma: no cover
-    langid = None  # optional dependency
+from .single_flight import SingleFlight, normalize_query
 
 load_dotenv()
 # Optional FAISS (install via: pip install faiss-cpu). Import lazily.
@@ -55,6 +81,18 @@ DEFAULT_DB = os.getenv("DB_NAME", "default")
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "800"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "120"))
 
+# Incremental ingest: bỏ qua file không đổi, xóa chunks của file đã biến mất
+INGEST_INCREMENTAL = os.getenv("INGEST_INCREMENTAL", "1").strip() not in ("0", "false", "False")
+
+# Kết quả retrieval nội bộ: (chunk_id, score) theo thứ tự liên quan giảm dần
+Ranked = list[tuple[str, float]]
+
+# Số chunks mỗi trang khi đọc Chroma để build BM25
+BM25_BUILD_PAGE_SIZE = max(1, int(os.getenv("BM25_BUILD_PAGE_SIZE", "2000")))
+
+# Số chunk IDs mỗi lệnh xóa khi xóa hàng loạt (Chroma/FAISS/summary)
+DELETE_BATCH_SIZE = max(1, int(os.getenv("DELETE_BATCH_SIZE", "1000")))
+
 # Vector backend: chroma | faiss
 VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower().strip()
 
@@ -66,6 +104,30 @@ GEN_CACHE_TTL = int(os.getenv("GEN_CACHE_TTL", "86400"))
 RRF_ENABLE_DEFAULT = os.getenv("RRF_ENABLE", "1").strip() not in ("0", "false", "False")
 RRF_K_DEFAULT = int(os.getenv("RRF_K", "60"))
 
+# Single-flight: gom các query/generation giống hệt đang chạy đồng thời
+SINGLE_FLIGHT_ENABLE = os.getenv("SINGLE_FLIGHT_ENABLE", "1").strip() not in ("0", "false", "False")
+
+# Tham số mặc định của answer()/answer_async() - dùng cho coalescing key
+ANSWER_DEFAULTS: dict[str, Any] = {
+    "top_k": 5,
+    "method": "vector",
+    "bm25_weight": 0.5,
+    "rerank_enable": False,
+    "rerank_top_n": 10,
+    "provider": None,
+    "rrf_enable": None,
+    "rrf_k": None,
+    "rewrite_enable": False,
+    "rewrite_n": 2,
+    "languages": None,
+    "versions": None,
+    "rr_provider": None,
+    "rr_max_k": None,
+    "rr_batch_size": None,
+    "rr_num_threads": None,
+    "compress": None,
+}
+
 
 def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list[str]:
     text = text.replace("\r\n", "\n")
@@ -159,26 +221,34 @@ class RagEngine:
         self._openai: OpenAIClient | None = None
         self.default_provider = os.getenv("PROVIDER", "ollama").lower()
         self.vector_backend = VECTOR_BACKEND if _faiss is not None else "chroma"
+        # Language ID theo tài liệu (batch + cache), dùng chung mọi DB
+        self.lang_detector = LangDetector()
         # Initialize storage and client
         self._init_client()
 
         # Generation cache per DB
         self.gen_cache = GenCache(self.persist_dir, enabled=GEN_CACHE_ENABLE, ttl_sec=GEN_CACHE_TTL)
 
-        # BM25 state (in-memory)
-        self._bm25 = None  # type: ignore
-        self._bm25_docs: list[str] = []
-        self._bm25_metas: list[dict[str, Any]] = []
-        self._bm25_tokens: list[list[str]] = []
+        # BM25 state (in-memory, compact: term IDs + metadata columns, text lấy lazily)
+        self._bm25: CompactBM25 | None = None
         self._bm25_lock = threading.RLock()  # Reentrant lock for BM25 operations
 
         # Reranker
         self._bge_rr: BgeOnnxReranker | None = None
         self._embed_rr: SimpleEmbedReranker | None = None
+        self._rr_cascade: RerankCascade | None = None
+        # Context packing theo ngân sách token (tạo lazily - có thể nạp tokenizer HF)
+        self._ctx_packer: ContextPacker | None = None
+        # Nén contexts theo câu (tùy chọn, cache embedding câu)
+        self._ctx_compressor: ContextCompressor | None = None
 
         # ✅ FIX BUG #7: Dùng LRU cache với TTL và size limit - Ngăn memory leak 🧹
         self._filters_cache = LRUCacheWithTTL[list[str]](max_size=100, ttl=300)
 
+        # Single-flight groups: thundering herd → một lần retrieval/LLM
+        self._answer_flight = SingleFlight("answer")
+        self._gen_flight = SingleFlight("generate")
+
     # ===== Multi-DB =====
     @property
     def persist_dir(self) -> str:
@@ -199,6 +269,15 @@ class RagEngine:
             name=self.collection_name,
             embedding_function=OllamaEmbeddingFunction(self.ollama),
         )
+        # Manifest cho incremental ingest (per-DB)
+        self.manifest = IngestManifest(self.persist_dir)
+        # LSH index cho dedup chunk gần trùng (per-DB)
+        self.deduper = ChunkDeduper(self.persist_dir) if CHUNK_DEDUP_ENABLED else None
+        # Tóm tắt metadata (sources/languages/versions) duy trì tăng dần (per-DB)
+        self.meta_summary = MetaSummary(self.persist_dir)
+        with contextlib.suppress(Exception):
+            if not self.meta_summary.is_ready() and self.collection.count() == 0:
+                self.meta_summary.rebuild([])  # DB mới: summary rỗng đã khớp
         # Optional FAISS init
         self._faiss_index = None
         self._faiss_map_conn = None
@@ -331,6 +410,20 @@ class RagEngine:
         except Exception:
             return [None for _ in idxs]
 
+    def _faiss_forget(self, ids: list[str]) -> None:
+        """Bỏ mapping của chunk IDs đã xóa (vector thành tombstone, search bỏ qua)."""
+        if self._faiss_index is None or not ids:
+            return
+        try:
+            with self._faiss_connection() as conn:
+                for start in range(0, len(ids), DELETE_BATCH_SIZE):
+                    part = ids[start : start + DELETE_BATCH_SIZE]
+                    marks = ",".join("?" * len(part))
+                    conn.execute(f"DELETE FROM map WHERE id IN ({marks})", part)
+                conn.commit()
+        except Exception:
+            pass
+
     @staticmethod
     def _l2_normalize(mat: _np.ndarray) -> _np.ndarray:
         norm = _np.linalg.norm(mat, axis=1, keepdims=True) + 1e-12
@@ -480,116 +573,288 @@ class RagEngine:
 
     # ===== Ingest =====
     def _detect_lang(self, text: str) -> str | None:
-        try:
-            if langid is None:
-                return None
-            code, _ = langid.classify(text)
-            return code
-        except Exception:
-            return None
+        lang = self.lang_detector.detect(text)
+        return None if lang == UNKNOWN_LANG else lang
 
     def ingest_texts(
         self,
         texts: list[str],
         metadatas: list[dict[str, Any]] | None = None,
         version: str | None = None,
+        progress: IngestProgressFn | None = None,
+        should_cancel: Callable[[], bool] | None = None,
     ) -> int:
+        documents = (
+            Document(metadatas[i].get("source") if metadatas else f"text_{i}", t)
+            for i, t in enumerate(texts)
+        )
+        stats = IngestStats()
+        try:
+            self._ingest_pipeline(version).run_documents(documents, progress, should_cancel, stats)
+        finally:
+            self._after_ingest()
+        return stats.chunks_written
+
+    def _ingest_pipeline(self, version: str | None = None) -> IngestPipeline:
+        batch_size = INGEST_BATCH_SIZE
+        # Không vượt max batch size của Chroma (tùy phiên bản/SQLite)
+        max_batch = getattr(self.client, "max_batch_size", None)
+        if isinstance(max_batch, int) and max_batch > 0:
+            batch_size = min(batch_size, max_batch)
+        return IngestPipeline(
+            build_chunks=lambda doc: self._build_chunks(doc.text or "", doc.source, version),
+            embed=self.ollama.embed,
+            write=self._write_batch,
+            batch_size=batch_size,
+            manifest=self.manifest if INGEST_INCREMENTAL else None,
+            version=version,
+            deduper=self.deduper,
+        )
+
+    def _build_chunks(
+        self, text: str, source: Any, version: str | None = None
+    ) -> tuple[IDs, Documents, Metadatas]:
+        """Chunk một tài liệu + detect language cho từng chunk."""
         ids: IDs = []
         docs: Documents = []
         mds: Metadatas = []
-
-        for i, t in enumerate(texts):
-            # Version cho cả tài liệu này (áp cho tất cả chunks)
-            ver = version or (hashlib.blake2b(t.encode("utf-8"), digest_size=16).hexdigest()[:8])
-            src_val = metadatas[i].get("source") if metadatas else f"text_{i}"
-            for j, chunk in enumerate(chunk_text(t)):
-                ids.append(str(uuid.uuid4()))
-                docs.append(chunk)
-                lang = self._detect_lang(chunk) or "unknown"
-                meta = {
-                    "source": src_val,
-                    "chunk": j,
-                    "version": ver,
-                    "language": lang,
-                }
-                mds.append(meta)
-        self.collection.add(ids=ids, documents=docs, metadatas=mds)
-        # Optional: add to FAISS
+        # Version cho cả tài liệu này (áp cho tất cả chunks)
+        ver = version or (hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()[:8])
+        chunks = list(chunk_text(text))
+        # Detect ngôn ngữ một lần cho tài liệu (trên mẫu), từng chunk chỉ khi mixed
+        langs = self.lang_detector.detect_chunks(chunks)
+        seen: dict[str, int] = {}
+        for j, (chunk, lang) in enumerate(zip(chunks, langs, strict=True)):
+            # ID từ nội dung (+ version nếu caller truyền) → re-ingest là upsert, sửa một
+            # đoạn chỉ đổi ID các chunk chứa nó. Version tự sinh (hash cả file) không vào ID
+            occurrence = seen.get(chunk, 0)
+            seen[chunk] = occurrence + 1
+            ids.append(chunk_id(source, version or "", chunk, occurrence))
+            docs.append(chunk)
+            meta = {
+                "source": source,
+                "chunk": j,
+                "version": ver,
+                "language": lang,
+            }
+            if not version:
+                meta["version_auto"] = True
+            mds.append(meta)
+        return ids, docs, mds
+
+    def _write_batch(self, batch: ChunkBatch) -> None:
+        """Ghi một batch đã embed vào Chroma (+ FAISS nếu bật), dùng chung embeddings."""
+        if batch.delete_ids:
+            self._delete_chunks(list(batch.delete_ids))
+        if batch.refresh_ids:
+            self._refresh_metas(batch.refresh_ids, batch.refresh_metas)
+        if not len(batch):
+            return
+        self.collection.upsert(
+            ids=batch.ids, documents=batch.docs, metadatas=batch.metas, embeddings=batch.embeddings
+        )
+        self._summary_update(lambda summary: summary.add(batch.ids, batch.metas))
         if self.vector_backend == "faiss" and _faiss is not None:
             try:
-                # recompute embeddings locally for FAISS index
-                embs = self.ollama.embed(list(docs))
-                self._faiss_add(embs, list(ids))
+                self._faiss_add(batch.embeddings or [], batch.ids)
             except Exception:
                 pass
+
+    def _refresh_metas(self, ids: list[str], metas: list[dict[str, Any]]) -> None:
+        """Chunks giữ lại khi file đổi: cập nhật metadata (vị trí, version tự sinh), giữ vector."""
+        stored = set(self.collection.get(ids=ids, include=[])["ids"])
+        pairs = [(i, m) for i, m in zip(ids, metas, strict=True) if i in stored]
+        if pairs:
+            keep_ids = [i for i, _ in pairs]
+            keep_metas = [m for _, m in pairs]
+            self.collection.update(ids=keep_ids, metadatas=keep_metas)
+            self._summary_update(lambda summary: summary.add(keep_ids, keep_metas))
+        linked = [(i, m) for i, m in zip(ids, metas, strict=True) if i not in stored]
+        if linked and self.deduper is not None:
+            # Chunk trùng chỉ có link → metadata dùng khi promote cũng phải mới
+            self.deduper.update_link_metas([i for i, _ in linked], [m for _, m in linked])
+
+    def _after_ingest(self) -> None:
         # invalidate bm25 to rebuild on next query
         self._bm25 = None
         # clear filters cache
         self._filters_cache.clear()
         # bump corpus stamp to invalidate gen-cache for new knowledge
         self._bump_corpus_stamp()
-        return len(docs)
 
-    def ingest_paths(self, paths: list[str], version: str | None = None) -> int:
+    def refresh_corpus(self) -> None:
+        """DB hiện tại vừa được ghi bởi engine khác (ingest job) → bỏ cache, đọc lại stamp.
+
+        FAISS index trong RAM cũng được đọc lại từ đĩa: giữ bản cũ thì `_faiss_add`
+        sau đó sẽ ghi đè faiss.index và cấp trùng hàng trong faiss_map.
+        """
+        self._bm25 = None
+        self._filters_cache.clear()
+        self._ensure_corpus_stamp()
+        if self.vector_backend == "faiss" and _faiss is not None:
+            self._init_faiss()
+
+    def _delete_chunks(self, ids: list[str]) -> int:
+        """Xóa chunk IDs theo lô cố định khỏi Chroma, FAISS map, summary và dedup index."""
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return 0
+        batch_size = DELETE_BATCH_SIZE
+        max_batch = getattr(getattr(self, "client", None), "max_batch_size", None)
+        if isinstance(max_batch, int) and max_batch > 0:
+            batch_size = min(batch_size, max_batch)
+        for start in range(0, len(ids), batch_size):
+            self.collection.delete(ids=ids[start : start + batch_size])
+        if self.vector_backend == "faiss" and _faiss is not None:
+            self._faiss_forget(ids)
+        self._summary_update(lambda summary: summary.remove(ids))
+        self._dedup_forget(ids)
+        return len(ids)
+
+    def _summary_update(self, update: Callable[[MetaSummary], Any]) -> None:
+        """Cập nhật meta summary; lỗi → invalidate để lần đọc sau rebuild từ store."""
+        summary = getattr(self, "meta_summary", None)
+        if summary is None:
+            return
+        try:
+            update(summary)
+        except Exception as e:
+            logging.warning(f"Meta summary update failed ({e}) → will rebuild on next read")
+            with contextlib.suppress(Exception):
+                summary.invalidate()
+
+    def _meta_summary_ready(self) -> bool:
+        """Summary dùng được: đã dựng và khớp số chunks trong store (lệch → rebuild một lần)."""
+        summary = getattr(self, "meta_summary", None)
+        if summary is None:
+            return False
+        try:
+            count = int(self.collection.count())
+            if summary.is_ready() and summary.total_chunks() == count:
+                return True
+            pages = (
+                (ids, metas)
+                for ids, _docs, metas in self._iter_collection_pages(include=["metadatas"])
+            )
+            rebuilt = summary.rebuild(pages)
+            logging.info(f"Rebuilt metadata summary for {self.db_name} ({rebuilt} chunks)")
+            return rebuilt == count
+        except Exception as e:
+            logging.debug(f"Meta summary unavailable, scanning collection: {e}")
+            return False
+
+    def _dedup_forget(self, ids: list[str]) -> int:
+        """Xóa chunks khỏi dedup index; duplicate mất canonical được promote (embed + ghi)."""
+        deduper = getattr(self, "deduper", None)
+        if deduper is None or not ids:
+            return 0
+        orphan_ids, docs, metas = deduper.remove_chunks(ids)
+        if not orphan_ids:
+            return 0
+        keep = deduper.filter_batch(orphan_ids, docs, metas)
+        batch = ChunkBatch(
+            ids=[x for x, k in zip(orphan_ids, keep, strict=True) if k],
+            docs=[x for x, k in zip(docs, keep, strict=True) if k],
+            metas=[x for x, k in zip(metas, keep, strict=True) if k],
+        )
+        for start in range(0, len(batch), INGEST_BATCH_SIZE):
+            part = ChunkBatch(
+                ids=batch.ids[start : start + INGEST_BATCH_SIZE],
+                docs=batch.docs[start : start + INGEST_BATCH_SIZE],
+                metas=batch.metas[start : start + INGEST_BATCH_SIZE],
+            )
+            part.embeddings = self.ollama.embed(part.docs)
+            self._write_batch(part)
+        logging.info(f"Promoted {len(batch)} duplicate chunk(s) whose canonical was removed")
+        return len(batch)
+
+    def dedup_stats(self) -> dict[str, Any]:
+        deduper = getattr(self, "deduper", None)
+        if deduper is None:
+            return {"enabled": False}
+        return {"enabled": True, **deduper.stats()}
+
+    def _remove_vanished(self, paths: list[str], progress: IngestProgressFn | None = None) -> int:
+        """Xóa chunks + manifest record của file trong phạm vi `paths` không còn tồn tại."""
+        vanished = [
+            p
+            for p in self.manifest.list_paths()
+            if path_in_scope(p, paths) and not os.path.isfile(p)
+        ]
+        ids = [cid for p in vanished for cid in self.manifest.chunk_ids(p)]
+        deleted = self._delete_chunks(ids)
+        if vanished:
+            self.manifest.remove_sources(vanished)
+        if deleted:
+            logging.info(f"Removed {deleted} chunks from {len(vanished)} vanished file(s)")
+            report_progress(progress, "chunks_deleted", deleted)
+        return deleted
+
+    def ingest_paths(
+        self,
+        paths: list[str],
+        version: str | None = None,
+        progress: IngestProgressFn | None = None,
+        should_cancel: Callable[[], bool] | None = None,
+        skip_files: Collection[str] | None = None,
+    ) -> int:
         """
         Ingest files from paths với proper error handling.
 
         ✅ FIX BUG #6: Specific exceptions, error tracking, file size limits
+        ✅ Streaming pipeline (app/ingest_pipeline.py): peak memory không phụ thuộc corpus
+
+        Args:
+            progress: callback(stage, amount, path) - stages: files_total, files_parsed,
+                files_failed, chunks_embedded, chunks_written, file_done
+            should_cancel: trả True để dừng (raise IngestCancelledError)
+            skip_files: file đã xử lý xong ở lần chạy trước (resume)
 
         Returns:
             Number of chunks indexed
         """
-        import glob
-
-        contents: list[str] = []
-        metas: list[dict[str, Any]] = []
-        errors: list[dict[str, str]] = []  # ✅ Track errors
-
-        for p in paths:
-            for file in glob.glob(p, recursive=True):
-                if os.path.isdir(file):
-                    # Ingest *.txt, *.pdf, *.docx recursively
-                    for pattern in ("*.txt", "*.pdf", "*.docx"):
-                        for f2 in glob.glob(os.path.join(file, "**", pattern), recursive=True):
-                            # ✅ Use safe file reading with error tracking
-                            content, error = read_file_by_extension(f2)
-                            if content:
-                                contents.append(content)
-                                metas.append({"source": f2})
-                            elif error:
-                                logging.warning(f"Skipping {f2}: {error}")
-                                errors.append({"file": f2, "error": error})
-                else:
-                    # ✅ Use safe file reading
-                    content, error = read_file_by_extension(file)
-                    if content:
-                        contents.append(content)
-                        metas.append({"source": file})
-                    elif error:
-                        logging.warning(f"Skipping {file}: {error}")
-                        errors.append({"file": file, "error": error})
-
+        stats = IngestStats()
+        try:
+            self._ingest_pipeline(version).run_paths(
+                paths, progress, should_cancel, skip_files, stats
+            )
+            if INGEST_INCREMENTAL:
+                stats.chunks_deleted += self._remove_vanished(paths, progress)
+        finally:
+            if stats.chunks_written or stats.chunks_deleted:
+                self._after_ingest()
+
+        errors = stats.errors
+        logging.info(
+            f"Ingest: {stats.files_parsed} files parsed ({stats.extract_s:.1f}s extract), "
+            f"{stats.files_skipped} unchanged, {stats.chunks_written} chunks written, "
+            f"{stats.chunks_deduped} deduped ({stats.dedup_ratio:.1%}), "
+            f"{stats.chunks_deleted} deleted"
+        )
         # ✅ Log summary
         if errors:
             logging.warning(
-                f"Ingest completed with {len(errors)} errors: {len(contents)} files processed"
+                f"Ingest completed with {len(errors)} errors: {stats.files_parsed} files processed"
             )
 
-        if not contents:
-            if errors:
-                raise IngestError(
-                    f"No files ingested successfully. {len(errors)} file(s) failed. "
-                    f"First error: {errors[0]['error']}"
-                )
-            return 0
-
-        return self.ingest_texts(contents, metas, version=version)
+        if not stats.files_parsed and errors and not skip_files:
+            raise IngestError(
+                f"No files ingested successfully. {len(errors)} file(s) failed. "
+                f"First error: {errors[0]['error']}"
+            )
+        return stats.chunks_written
 
     # ===== Docs listing/deletion =====
-    def list_sources(self) -> list[dict[str, Any]]:
+    def list_sources(self, details: bool = False) -> list[dict[str, Any]]:
         """Return a list of unique sources with their chunk counts.
+        Đọc từ meta summary (O(số sources)); chỉ quét collection khi summary không dùng được.
         Safe across ChromaDB versions by using .get(include=["metadatas"]) with fallback.
+
+        Args:
+            details: kèm versions/languages của từng source
         """
+        if self._meta_summary_ready():
+            return self.meta_summary.sources(details=details)
         try:
             results = self.collection.get(include=["metadatas"])  # type: ignore[arg-type]
             metas = results.get("metadatas", [])
@@ -597,6 +862,7 @@ class RagEngine:
             results = self.collection.get()
             metas = results.get("metadatas", [])
         counts: dict[str, int] = {}
+        facets: dict[str, tuple[set[str], set[str]]] = {}
         for md in metas:
             try:
                 src = str((md or {}).get("source") or "")
@@ -605,51 +871,101 @@ class RagEngine:
             if not src:
                 continue
             counts[src] = counts.get(src, 0) + 1
-        items = [{"source": s, "chunks": c} for s, c in sorted(counts.items(), key=lambda x: x[0])]
+            if details:
+                vers, langs = facets.setdefault(src, (set(), set()))
+                for key, out in (("version", vers), ("language", langs)):
+                    val = (md or {}).get(key)
+                    if val is not None and str(val).strip():
+                        out.add(str(val).strip())
+        items: list[dict[str, Any]] = [
+            {"source": s, "chunks": c} for s, c in sorted(counts.items(), key=lambda x: x[0])
+        ]
+        if details:
+            for item in items:
+                vers, langs = facets.get(item["source"], (set(), set()))
+                item["versions"], item["languages"] = sorted(vers), sorted(langs)
         return items
 
-    def delete_sources(self, sources: list[str]) -> int:
-        """Delete all chunks whose metadata.source is in the provided list.
-        Returns the number of source entries attempted (not exact chunk count).
-        """
-        if not sources:
-            return 0
+    def _source_chunk_ids(self, sources: list[str]) -> list[str]:
+        """Chunk IDs của các source: chỉ mục meta summary, không có thì `$in` theo lô."""
+        if self._meta_summary_ready():
+            return self.meta_summary.chunk_ids(sources)
+        ids: list[str] = []
+        for start in range(0, len(sources), DELETE_BATCH_SIZE):
+            part = sources[start : start + DELETE_BATCH_SIZE]
+            res = self.collection.get(
+                where={"source": {"$in": part}}, include=[]
+            )  # type: ignore[arg-type]
+            ids.extend(str(i) for i in res["ids"])
+        return ids
+
+    def _delete_sources_legacy(self, sources: list[str]) -> int:
+        """Fallback cho store không hỗ trợ `$in`: xóa từng source bằng where."""
         deleted = 0
         for s in sources:
-            if not s:
-                continue
-            try:
-                # Preferred path (supported in newer chromadb):
-                self.collection.delete(where={"source": s})  # type: ignore[arg-type]
-                deleted += 1
-                continue
-            except Exception:
-                pass
-            # Fallback: try to fetch IDs then delete by ids
             try:
-                ids: list[str] = []
+                res = self.collection.get(
+                    where={"source": s}, include=["metadatas"]
+                )  # type: ignore[arg-type]
+                n = len(res.get("ids") or res.get("metadatas") or [])
                 try:
-                    res = self.collection.get(where={"source": s}, include=["ids"])  # type: ignore[arg-type]
-                    raw_ids = res.get("ids", [])
+                    self.collection.delete(where={"source": s})  # type: ignore[arg-type]
                 except Exception:
-                    res = self.collection.get()
-                    raw_ids = res.get("ids", [])
-                # raw_ids may be nested list depending on API; flatten safely
-                if isinstance(raw_ids, list):
-                    for item in raw_ids:
-                        if isinstance(item, list):
-                            ids.extend([str(x) for x in item])
-                        elif item is not None:
-                            ids.append(str(item))
-                if ids:
-                    self.collection.delete(ids=ids)
-                    deleted += 1
+                    # Store không xóa được bằng where → xóa theo IDs của source
+                    ids = list(res.get("ids") or [])
+                    if not ids:
+                        res = self.collection.get(
+                            where={"source": s}, include=["ids"]
+                        )  # type: ignore[arg-type]
+                        ids = list(res.get("ids") or [])
+                    if not ids:
+                        continue
+                    self.collection.delete(ids=[str(i) for i in ids])
+                    n = len(ids)
+                deleted += n
             except Exception:
                 # Ignore errors per-source to be robust
                 pass
+        manifest = getattr(self, "manifest", None)
+        if manifest is not None:
+            with contextlib.suppress(Exception):
+                for s in sources:
+                    self._dedup_forget(manifest.chunk_ids(s))
+        return deleted
+
+    def delete_sources(self, sources: list[str]) -> int:
+        """Delete all chunks whose metadata.source is in the provided list.
+
+        ✅ Bulk: resolve chunk IDs qua chỉ mục source → chunk IDs rồi xóa theo lô cố định
+        trên Chroma, FAISS và meta summary trong một lượt; BM25 được build lại lazily.
+
+        Returns:
+            Số chunks đã xóa (chính xác)
+        """
+        srcs = list(dict.fromkeys(s for s in sources or [] if s))
+        if not srcs:
+            return 0
+        # Links duplicate của các source này bỏ trước → không bị promote khi canonical mất
+        deduper = getattr(self, "deduper", None)
+        if deduper is not None:
+            with contextlib.suppress(Exception):
+                deduper.remove_sources(srcs)
+        try:
+            deleted = self._delete_chunks(self._source_chunk_ids(srcs))
+        except Exception as e:
+            logging.warning(f"Bulk delete unavailable ({e}) → deleting source by source")
+            deleted = self._delete_sources_legacy(srcs)
+        # Re-ingest sau khi xóa phải index lại từ đầu
+        manifest = getattr(self, "manifest", None)
+        if manifest is not None:
+            with contextlib.suppress(Exception):
+                manifest.remove_sources(srcs)
+        self._summary_update(lambda summary: summary.remove_sources(srcs))
         # Invalidate caches
         self._bm25 = None
         self._filters_cache.clear()
+        if deleted:
+            self._bump_corpus_stamp()
         return deleted
 
     # ===== Tokenize & BM25 =====
@@ -657,46 +973,44 @@ class RagEngine:
     def _tokenize(text: str) -> list[str]:
         return re.findall(r"\w+", (text or "").lower())
 
+    def _iter_collection_pages(
+        self,
+        page_size: int = BM25_BUILD_PAGE_SIZE,
+        include: list[str] | None = None,
+    ):
+        """Đọc (ids, documents, metadatas) theo trang → không giữ toàn bộ text trong RAM."""
+        include = include or ["documents", "metadatas"]
+        offset = 0
+        while True:
+            try:
+                results = self.collection.get(
+                    include=include, limit=page_size, offset=offset
+                )  # type: ignore[arg-type]
+            except Exception:
+                # Fallback: store không hỗ trợ phân trang/include → một trang duy nhất
+                if offset:
+                    return
+                results = self.collection.get()
+                yield (
+                    results.get("ids", []),
+                    results.get("documents", []),
+                    results.get("metadatas", []),
+                )
+                return
+            ids = results.get("ids", [])
+            if not ids:
+                return
+            yield ids, results.get("documents", []), results.get("metadatas", [])
+            if len(ids) < page_size:
+                return
+            offset += page_size
+
     def _build_bm25_from_collection(self) -> None:
         """Build BM25 index with thread safety."""
         with self._bm25_lock:
-            if BM25Okapi is None:
-                self._bm25 = None
-                self._bm25_docs = []
-                self._bm25_metas = []
-                self._bm25_tokens = []
-                return
-        try:
-            # Try new API with include
-            results = self.collection.get(include=["documents", "metadatas"])  # type: ignore[arg-type]
-            docs: list[str] = results.get("documents", [])  # type: ignore[assignment]
-            metas: list[dict[str, Any]] = results.get("metadatas", [])  # type: ignore[assignment]
-        except Exception:
-            # Fallback without include
-            results = self.collection.get()
-            docs = results.get("documents", [])  # type: ignore[assignment]
-            metas = results.get("metadatas", [])  # type: ignore[assignment]
-        # Filter empties keeping alignment
-        new_docs: list[str] = []
-        new_metas: list[dict[str, Any]] = []
-        new_tokens: list[list[str]] = []
-        for d, m in zip(docs, metas, strict=False):
-            if d and d.strip():
-                new_docs.append(d)
-                new_metas.append(m)
-                new_tokens.append(self._tokenize(d))
-        if not new_docs:
-            self._bm25 = None
-            self._bm25_docs = []
-            self._bm25_metas = []
-            self._bm25_tokens = []
-            return
-        self._bm25 = BM25Okapi(new_tokens)  # type: ignore[operator]
-        self._bm25_docs = new_docs
-        self._bm25_metas = new_metas
-        self._bm25_tokens = new_tokens
-        # clear filters cache as corpus changed
-        self._filters_cache.clear()
+            self._bm25 = CompactBM25.build(self._iter_collection_pages(), self._tokenize)
+            # clear filters cache as corpus changed
+            self._filters_cache.clear()
 
     def _ensure_bm25(self) -> bool:
         """
@@ -762,93 +1076,187 @@ class RagEngine:
 
         return True
 
-    def retrieve(
+    # ===== Candidates: (chunk_id, score) - text chỉ materialize cho kết quả cuối =====
+    def _vector_candidates(
         self,
         query: str,
         top_k: int = 5,
-        *,
         languages: list[str] | None = None,
         versions: list[str] | None = None,
-    ) -> dict[str, Any]:
-        # If FAISS backend is enabled and available, use it and map IDs back from Chroma
+    ) -> Ranked:
+        """(chunk_id, distance) theo thứ tự gần nhất; không kéo text chunk từ store."""
+        filtering = bool(languages) or bool(versions)
+        # If FAISS backend is enabled and available, use it and check IDs/metadata in Chroma
         if self.vector_backend == "faiss" and _faiss is not None and self._faiss_index is not None:
             try:
                 q_emb = self.ollama.embed([query])[0]
                 ids, scores = self._faiss_query(q_emb, max(top_k * 5, 25))
                 if ids:
-                    # Fetch documents/metas for these ids from Chroma
-                    try:
-                        results = self.collection.get(ids=ids, include=["documents", "metadatas"])  # type: ignore[arg-type]
-                        docs_all: list[str] = results.get("documents", [])
-                        metas_all: list[dict[str, Any]] = results.get("metadatas", [])
-                    except Exception:
-                        results = self.collection.get(ids=ids)
-                        docs_all = results.get("documents", [])
-                        metas_all = results.get("metadatas", [])
-                    # Build dict by id to preserve FAISS order
-                    id_to_doc = {}
-                    id_to_meta = {}
-                    # results may return lists aligned with ids param
-                    for i, idv in enumerate(ids):
-                        if i < len(docs_all):
-                            id_to_doc[idv] = docs_all[i]
-                        if i < len(metas_all):
-                            id_to_meta[idv] = metas_all[i]
-                    # Filter and keep order
-                    filt_docs: list[str] = []
-                    filt_metas: list[dict[str, Any]] = []
-                    filt_dists: list[float] = []
+                    id_to_meta = self._fetch_metadatas(ids)
+                    out: Ranked = []
                     for idv, s in zip(ids, scores, strict=False):
-                        d = id_to_doc.get(idv)
-                        m = id_to_meta.get(idv, {})
-                        if not d:
+                        if idv not in id_to_meta:
                             continue
-                        if self._meta_match(m or {}, languages, versions):
-                            filt_docs.append(d)
-                            filt_metas.append(m)
+                        if self._meta_match(id_to_meta[idv] or {}, languages, versions):
                             # Convert cosine sim ~ inner product to pseudo distance
-                            dist = max(0.0, 1.0 - float(s))
-                            filt_dists.append(dist)
-                        if len(filt_docs) >= top_k:
+                            out.append((idv, max(0.0, 1.0 - float(s))))
+                        if len(out) >= top_k:
                             break
-                    return {
-                        "documents": filt_docs[:top_k],
-                        "metadatas": filt_metas[:top_k],
-                        "distances": filt_dists[:top_k],
-                        "ids": ids[: len(filt_docs)],
-                    }
+                    return out
             except Exception:
                 # fallback to chroma below
                 pass
-        # Default: Chroma vector query
+        # Default: Chroma vector query (chỉ IDs + distances, metadata khi cần lọc)
         n_fetch = max(top_k * 5, 25)
         n_fetch = min(n_fetch, 200)
-        results = self.collection.query(query_texts=[query], n_results=n_fetch)
-        docs_all: list[str] = results.get("documents", [[]])[0]
-        metas_all: list[dict[str, Any]] = results.get("metadatas", [[]])[0]
-        dists_all: list[float] = results.get("distances", [[]])[0]
-        ids_all = results.get("ids", [[]])[0] if "ids" in results else []
-        # Lọc theo metadata và giữ thứ tự
-        filt_docs: list[str] = []
-        filt_metas: list[dict[str, Any]] = []
-        filt_dists: list[float] = []
-        filt_ids: list[str] = []
-        for d, m, dist, idv in zip(
-            docs_all, metas_all, dists_all, ids_all or [None] * len(docs_all), strict=False
-        ):
-            if self._meta_match(m or {}, languages, versions):
-                filt_docs.append(d)
-                filt_metas.append(m)
-                filt_dists.append(dist)
-                if ids_all:
-                    filt_ids.append(idv)  # type: ignore[arg-type]
-            if len(filt_docs) >= top_k:
+        include = ["metadatas", "distances"] if filtering else ["distances"]
+        results = self.collection.query(
+            query_texts=[query], n_results=n_fetch, include=include  # type: ignore[arg-type]
+        )
+        ids_all: list[str] = (results.get("ids") or [[]])[0]
+        dists_all: list[float] = (results.get("distances") or [[]])[0]
+        metas_all = (results.get("metadatas") or [[]])[0] if filtering else None
+        out = []
+        for j, (idv, dist) in enumerate(zip(ids_all, dists_all, strict=False)):
+            if metas_all is not None and not self._meta_match(
+                (metas_all[j] if j < len(metas_all) else None) or {}, languages, versions
+            ):
+                continue
+            out.append((idv, dist))
+            if len(out) >= top_k:
                 break
+        return out
+
+    def _bm25_candidates(
+        self,
+        query: str,
+        top_k: int = 5,
+        languages: list[str] | None = None,
+        versions: list[str] | None = None,
+    ) -> Ranked:
+        """(chunk_id, điểm BM25) giảm dần, lọc metadata trên cột của CompactBM25."""
+        if not self._ensure_bm25():
+            return []
+        with self._bm25_lock:
+            bm25 = self._bm25
+        if bm25 is None:
+            return []
+        # Filter theo metadata dạng cột (vectorized), cùng ngữ nghĩa với _meta_match
+        mask = None
+        for key, allowed in (("language", languages), ("version", versions)):
+            m = bm25.filter_mask(key, allowed)
+            if m is not None:
+                mask = m if mask is None else (mask & m)
+        sel, scores = bm25.top_k(self._tokenize(query), top_k, mask)
+        return list(zip(bm25.chunk_ids(sel), scores, strict=False))
+
+    def _hybrid_candidates(
+        self,
+        query: str,
+        top_k: int = 5,
+        bm25_weight: float = 0.5,
+        rrf_enable: bool | None = None,
+        rrf_k: int | None = None,
+        languages: list[str] | None = None,
+        versions: list[str] | None = None,
+    ) -> Ranked:
+        """Fuse vector + BM25 trên chunk IDs (RRF hoặc weighted min-max)."""
+        vec = self._vector_candidates(query, top_k, languages, versions)
+        # get a bit more for better merge
+        bm = self._bm25_candidates(query, max(top_k, 10), languages, versions)
+
+        # Decide fusion strategy
+        use_rrf = RRF_ENABLE_DEFAULT if rrf_enable is None else bool(rrf_enable)
+        rrf_k_val = RRF_K_DEFAULT if rrf_k is None else int(rrf_k)
+        if use_rrf:
+            return self._rrf_fuse([[i for i, _ in vec], [i for i, _ in bm]], rrf_k_val)[:top_k]
+
+        # Weighted normalization merge (legacy)
+        v_norm = self._min_max(self._to_similarity([d for _, d in vec]))
+        b_norm = self._min_max([s for _, s in bm])
+        cand: dict[str, list[float]] = {}
+        for (cid, _), s in zip(vec, v_norm, strict=False):
+            cand[cid] = [s, 0.0]
+        for (cid, _), s in zip(bm, b_norm, strict=False):
+            cand.setdefault(cid, [0.0, 0.0])[1] = s
+        w = max(0.0, min(1.0, float(bm25_weight)))
+        combined = [(cid, (1.0 - w) * v + w * b) for cid, (v, b) in cand.items()]
+        combined.sort(key=lambda x: x[1], reverse=True)
+        return combined[:top_k]
+
+    def _candidates(
+        self,
+        method: str,
+        query: str,
+        top_k: int,
+        bm25_weight: float = 0.5,
+        rrf_enable: bool | None = None,
+        rrf_k: int | None = None,
+        languages: list[str] | None = None,
+        versions: list[str] | None = None,
+    ) -> Ranked:
+        if method == "bm25":
+            return self._bm25_candidates(query, top_k, languages, versions)
+        if method == "hybrid":
+            return self._hybrid_candidates(
+                query, top_k, bm25_weight, rrf_enable, rrf_k, languages, versions
+            )
+        return self._vector_candidates(query, top_k, languages, versions)
+
+    @staticmethod
+    def _rrf_fuse(rankings: list[list[str]], k: int) -> Ranked:
+        """Reciprocal Rank Fusion trên chunk IDs; hòa điểm giữ thứ tự xuất hiện đầu tiên."""
+        fused: dict[str, float] = {}
+        for ranking in rankings:
+            for rank, cid in enumerate(ranking, start=1):
+                fused[cid] = fused.get(cid, 0.0) + 1.0 / (k + rank)
+        return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+    def _fetch_metadatas(self, ids: list[str]) -> dict[str, dict[str, Any]]:
+        """id → metadata (không kéo text) - dùng để lọc kết quả FAISS."""
+        try:
+            res = self.collection.get(ids=ids, include=["metadatas"])  # type: ignore[arg-type]
+        except Exception:
+            res = self.collection.get(ids=ids)
+        metas = res.get("metadatas") or []
+        return {str(i): (m or {}) for i, m in zip(res.get("ids", []), metas, strict=False)}
+
+    def _materialize(self, ids: list[str]) -> tuple[list[str], list[str], list[dict[str, Any]]]:
+        """Một lần bulk get text + metadata cho các chunk IDs, giữ thứ tự; bỏ ID đã mất."""
+        if not ids:
+            return [], [], []
+        try:
+            res = self.collection.get(
+                ids=list(dict.fromkeys(ids)), include=["documents", "metadatas"]
+            )  # type: ignore[arg-type]
+        except Exception:
+            res = self.collection.get(ids=list(dict.fromkeys(ids)))
+        docs = res.get("documents") or []
+        metas = res.get("metadatas") or []
+        found = {
+            str(i): (d, m or {})
+            for i, d, m in zip(res.get("ids", []), docs, metas, strict=False)
+            if d is not None
+        }
+        kept = [i for i in ids if i in found]
+        return kept, [found[i][0] for i in kept], [found[i][1] for i in kept]
+
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = 5,
+        *,
+        languages: list[str] | None = None,
+        versions: list[str] | None = None,
+    ) -> dict[str, Any]:
+        ranked = self._vector_candidates(query, top_k, languages, versions)
+        ids, docs, metas = self._materialize([cid for cid, _ in ranked])
+        dist = dict(ranked)
         return {
-            "documents": filt_docs[:top_k],
-            "metadatas": filt_metas[:top_k],
-            "distances": filt_dists[:top_k],
-            "ids": filt_ids[:top_k] if filt_ids else [],
+            "documents": docs,
+            "metadatas": metas,
+            "distances": [dist[i] for i in ids],
+            "ids": ids,
         }
 
     def retrieve_bm25(
@@ -859,24 +1267,16 @@ class RagEngine:
         languages: list[str] | None = None,
         versions: list[str] | None = None,
     ) -> dict[str, Any]:
-        if not self._ensure_bm25():
-            return {"documents": [], "metadatas": [], "scores": []}
-
-        with self._bm25_lock:
-            q_tokens = self._tokenize(query)
-            scores_list = list(self._bm25.get_scores(q_tokens))  # type: ignore[union-attr]
-        # chỉ lấy các chỉ số khớp filter theo thứ tự điểm giảm dần
-        idxs_sorted = sorted(range(len(scores_list)), key=lambda i: scores_list[i], reverse=True)
-        sel: list[int] = []
-        for i in idxs_sorted:
-            if self._meta_match(self._bm25_metas[i] or {}, languages, versions):
-                sel.append(i)
-                if len(sel) >= top_k:
-                    break
-        docs = [self._bm25_docs[i] for i in sel]
-        metas = [self._bm25_metas[i] for i in sel]
-        scores = [scores_list[i] for i in sel]
-        return {"documents": docs, "metadatas": metas, "scores": scores}
+        ranked = self._bm25_candidates(query, top_k, languages, versions)
+        # Text lấy lazily theo ID từ Chroma (BM25 không giữ text trong RAM)
+        ids, docs, metas = self._materialize([cid for cid, _ in ranked])
+        score = dict(ranked)
+        return {
+            "documents": docs,
+            "metadatas": metas,
+            "scores": [score[i] for i in ids],
+            "ids": ids,
+        }
 
     @staticmethod
     def _to_similarity(distances: list[float]) -> list[float]:
@@ -938,10 +1338,6 @@ class RagEngine:
         # ✅ Safe normalization
         return [(v - vmin) / (vmax - vmin) for v in clean_values]
 
-    @staticmethod
-    def _make_key(doc: str, meta: dict[str, Any]) -> tuple[str, Any, Any]:
-        return (meta.get("source", ""), meta.get("chunk", -1), len(doc))
-
     def retrieve_hybrid(
         self,
         query: str,
@@ -953,81 +1349,11 @@ class RagEngine:
         languages: list[str] | None = None,
         versions: list[str] | None = None,
     ) -> dict[str, Any]:
-        # Fetch candidates
-        vec = self.retrieve(query, top_k=top_k, languages=languages, versions=versions)
-        bm = self.retrieve_bm25(
-            query, top_k=max(top_k, 10), languages=languages, versions=versions
-        )  # get a bit more for better merge
-
-        v_docs: list[str] = vec.get("documents", [])
-        v_metas: list[dict[str, Any]] = vec.get("metadatas", [])
-        v_dists: list[float] = vec.get("distances", [])
-        v_sims = self._to_similarity(v_dists)
-        v_norm = self._min_max(v_sims)
-
-        b_docs: list[str] = bm.get("documents", [])
-        b_metas: list[dict[str, Any]] = bm.get("metadatas", [])
-        b_scores: list[float] = bm.get("scores", [])
-        b_norm = self._min_max(b_scores)
-
-        # Decide fusion strategy
-        use_rrf = RRF_ENABLE_DEFAULT if rrf_enable is None else bool(rrf_enable)
-        rrf_k_val = RRF_K_DEFAULT if rrf_k is None else int(rrf_k)
-
-        if use_rrf:
-            # Build ranks
-            ranks_vec: dict[tuple[str, Any, Any], int] = {}
-            for idx, (doc, meta) in enumerate(zip(v_docs, v_metas, strict=False), start=1):
-                ranks_vec[self._make_key(doc, meta)] = idx
-            ranks_bm: dict[tuple[str, Any, Any], int] = {}
-            for idx, (doc, meta) in enumerate(zip(b_docs, b_metas, strict=False), start=1):
-                ranks_bm[self._make_key(doc, meta)] = idx
-            # Union keys
-            keys = set(ranks_vec.keys()) | set(ranks_bm.keys())
-            combined = []
-            for key in keys:
-                r1 = ranks_vec.get(key)
-                r2 = ranks_bm.get(key)
-                score = 0.0
-                if r1 is not None:
-                    score += 1.0 / (rrf_k_val + r1)
-                if r2 is not None:
-                    score += 1.0 / (rrf_k_val + r2)
-                # pick representative doc/meta (prefer vector side if available)
-                if key in ranks_vec:
-                    i = r1 - 1  # type: ignore
-                    doc = v_docs[i]
-                    meta = v_metas[i]
-                else:
-                    i = r2 - 1  # type: ignore
-                    doc = b_docs[i]
-                    meta = b_metas[i]
-                combined.append((score, doc, meta))
-            combined.sort(key=lambda x: x[0], reverse=True)
-            docs = [d for _, d, _ in combined[:top_k]]
-            metas = [m for _, _, m in combined[:top_k]]
-            return {"documents": docs, "metadatas": metas}
-        else:
-            # Weighted normalization merge (legacy)
-            cand: dict[tuple[str, Any, Any], dict[str, Any]] = {}
-            for doc, meta, s in zip(v_docs, v_metas, v_norm, strict=False):
-                key = self._make_key(doc, meta)
-                cand[key] = {"doc": doc, "meta": meta, "v": s, "b": 0.0}
-            for doc, meta, s in zip(b_docs, b_metas, b_norm, strict=False):
-                key = self._make_key(doc, meta)
-                if key in cand:
-                    cand[key]["b"] = s
-                else:
-                    cand[key] = {"doc": doc, "meta": meta, "v": 0.0, "b": s}
-            combined = []
-            w = max(0.0, min(1.0, float(bm25_weight)))
-            for item in cand.values():
-                score = (1.0 - w) * item["v"] + w * item["b"]
-                combined.append((score, item["doc"], item["meta"]))
-            combined.sort(key=lambda x: x[0], reverse=True)
-            docs = [d for _, d, _ in combined[:top_k]]
-            metas = [m for _, _, m in combined[:top_k]]
-            return {"documents": docs, "metadatas": metas}
+        ranked = self._hybrid_candidates(
+            query, top_k, bm25_weight, rrf_enable, rrf_k, languages, versions
+        )
+        ids, docs, metas = self._materialize([cid for cid, _ in ranked])
+        return {"documents": docs, "metadatas": metas, "ids": ids}
 
     # ===== Prompt & Answer =====
     def build_prompt(self, question: str, context_docs: list[str]) -> str:
@@ -1047,6 +1373,67 @@ class RagEngine:
         )
         return prompt
 
+    def compress_contexts(
+        self, question: str, docs: list[str], enable: bool | None = None
+    ) -> tuple[list[str], dict[str, Any] | None]:
+        """
+        Giữ các câu liên quan tới câu hỏi trong mỗi context (xem app/context_compressor.py).
+
+        Số lượng/thứ tự contexts không đổi nên metas và citation [n] vẫn khớp.
+        enable=None → theo CONTEXT_COMPRESSION.
+        """
+        if not (CONTEXT_COMPRESSION if enable is None else enable) or not docs:
+            return docs, None
+        compressor = getattr(self, "_ctx_compressor", None)
+        if compressor is None:
+            compressor = self._ctx_compressor = ContextCompressor(self.ollama.embed)
+        res = compressor.compress(question, docs)
+        return res.docs, res.report()
+
+    def pack_contexts(
+        self,
+        question: str,
+        docs: list[str],
+        metas: list[dict],
+        scores: list[float] | None = None,
+    ) -> tuple[list[str], list[dict], dict[str, Any] | None]:
+        """
+        Xếp contexts vào ngân sách token của prompt (xem app/context_packer.py).
+
+        Trả về (docs, metas, report): contexts đã lọc/cắt theo đúng thứ tự đánh số [CTX n]
+        của build_prompt - trả chính docs/metas này cho client để citation [n] khớp.
+        """
+        if not PROMPT_PACKING or not docs:
+            return docs, metas, None
+        packer = getattr(self, "_ctx_packer", None)
+        if packer is None:
+            packer = self._ctx_packer = ContextPacker()
+        packed = packer.pack(
+            docs,
+            metas,
+            scaffold=self.build_prompt(question, []),
+            scores=scores,
+            render=lambda kept: self.build_prompt(question, kept),
+        )
+        return packed.docs, packed.metas, packed.report()
+
+    def prepare_contexts(
+        self,
+        question: str,
+        docs: list[str],
+        metas: list[dict],
+        compress: bool | None = None,
+    ) -> tuple[list[str], list[dict], dict[str, Any]]:
+        """Compress (tùy chọn) rồi pack contexts; trả về docs/metas dùng cho build_prompt."""
+        info: dict[str, Any] = {}
+        docs, compression = self.compress_contexts(question, docs, compress)
+        if compression is not None:
+            info["compression"] = compression
+        docs, metas, packing = self.pack_contexts(question, docs, metas)
+        if packing is not None:
+            info["packing"] = packing
+        return docs, metas, info
+
     def _ensure_rerankers(self) -> None:
         if self._bge_rr is None:
             try:
@@ -1056,6 +1443,57 @@ class RagEngine:
         if self._embed_rr is None:
             self._embed_rr = SimpleEmbedReranker(self.ollama.embed)
 
+    def _ensure_cascade(self) -> RerankCascade:
+        """Cascade embed → cross-encoder → BGE (tạo một lần; tầng thiếu model tự bỏ qua)."""
+        if self._rr_cascade is not None:
+            return self._rr_cascade
+        self._ensure_rerankers()
+        embed_rr, bge_rr = self._embed_rr, self._bge_rr
+        assert embed_rr is not None
+        stages = [
+            CascadeStage(
+                "embed",
+                lambda q, d, keys, opts: embed_rr.score(q, d, self._stored_embeddings(keys)),
+                keep=RERANK_CASCADE_EMBED_KEEP,
+                budget_ms=RERANK_CASCADE_EMBED_BUDGET_MS,
+            )
+        ]
+        ce_rr = None
+        try:
+            from .cross_encoder_reranker import CrossEncoderReranker
+
+            ce_rr = CrossEncoderReranker(model=RERANK_CASCADE_CE_MODEL)
+        except Exception as e:
+            logging.warning(f"Cross-encoder stage disabled: {e}")
+        if ce_rr is not None:
+            stages.append(
+                CascadeStage(
+                    "cross_encoder",
+                    lambda q, d, keys, opts: ce_rr.score(q, d),
+                    keep=RERANK_CASCADE_CE_KEEP,
+                    budget_ms=RERANK_CASCADE_CE_BUDGET_MS,
+                    available=ce_rr.is_available,
+                )
+            )
+        if RERANK_CASCADE_BGE and bge_rr is not None:
+            stages.append(
+                CascadeStage(
+                    "bge",
+                    lambda q, d, keys, opts: bge_rr.score(
+                        q,
+                        d,
+                        batch_size=opts.get("batch_size") or 32,
+                        keys=keys,
+                        num_threads=opts.get("num_threads"),
+                    ),
+                    keep=1,  # tầng cuối: giữ top_k
+                    budget_ms=RERANK_CASCADE_BGE_BUDGET_MS,
+                    available=bge_rr.available,
+                )
+            )
+        self._rr_cascade = RerankCascade(stages)
+        return self._rr_cascade
+
     def _apply_rerank(
         self,
         question: str,
@@ -1066,22 +1504,38 @@ class RagEngine:
         rr_max_k: int | None = None,
         rr_batch_size: int | None = None,
         rr_num_threads: int | None = None,
+        ids: list[str] | None = None,
     ) -> tuple[list[str], list[dict[str, Any]]]:
         # Giới hạn số lượng doc cần rerank (tiết kiệm chi phí)
         maxk = int(rr_max_k) if rr_max_k is not None else len(docs)
         if maxk <= 0:
             maxk = len(docs)
+        # Deadline: còn ít thời gian → rerank ít candidate hơn, quá ít → bỏ rerank
+        dl = current_deadline()
+        if dl is not None:
+            maxk = dl.rerank_limit(min(maxk, len(docs)), top_k)
+            if maxk <= 0:
+                return docs[:top_k], metas[:top_k]
         docs_in = docs[:maxk]
         metas_in = metas[:maxk]
 
         provider = (rr_provider or "auto").lower()
-        # Cập nhật threads cho ONNX nếu được yêu cầu (tạo lại session để áp dụng)
-        if rr_num_threads is not None and rr_num_threads > 0:
-            try:
-                os.environ["ORT_INTRA_OP_THREADS"] = str(int(rr_num_threads))
-                os.environ["ORT_INTER_OP_THREADS"] = str(int(rr_num_threads))
-            except Exception:
-                pass
+        # Số luồng ONNX theo request → session tương ứng trong pool của reranker
+        threads = int(rr_num_threads) if rr_num_threads and rr_num_threads > 0 else None
+
+        # Chunk IDs: key cache token/điểm (BGE) và lookup vector đã lưu (embed)
+        ids_in = list(ids)[:maxk] if ids else self._derive_chunk_ids(docs_in, metas_in)
+        bs = int(rr_batch_size) if rr_batch_size else 32  # 32 (từ 16) cho throughput tốt hơn
+
+        if provider == "cascade" or (provider == "auto" and RERANK_CASCADE_DEFAULT):
+            return self._ensure_cascade().rerank(
+                question,
+                docs_in,
+                metas_in,
+                top_k,
+                keys=ids_in,
+                options={"batch_size": bs, "num_threads": threads},
+            )
 
         self._ensure_rerankers()
         use_bge = False
@@ -1092,15 +1546,69 @@ class RagEngine:
 
         if use_bge and self._bge_rr:
             try:
-                bs = (
-                    int(rr_batch_size) if rr_batch_size else 32
-                )  # Increased from 16 to 32 for better throughput
-                return self._bge_rr.rerank(question, docs_in, metas_in, top_k, batch_size=bs)
+                return self._bge_rr.rerank(
+                    question,
+                    docs_in,
+                    metas_in,
+                    top_k,
+                    batch_size=bs,
+                    keys=ids_in,
+                    num_threads=threads,
+                )
             except Exception:
                 pass
-        # Fallback embed
+        # Fallback embed: dùng lại vector đã lưu của chunks, chỉ embed query
         assert self._embed_rr is not None
-        return self._embed_rr.rerank(question, docs_in, metas_in, top_k)
+        return self._embed_rr.rerank(
+            question, docs_in, metas_in, top_k, doc_embeddings=self._stored_embeddings(ids_in)
+        )
+
+    @staticmethod
+    def _derive_chunk_ids(docs: list[str], metas: list[dict[str, Any]]) -> list[str | None]:
+        """Chunk ID xác định từ metadata + text (caller không giữ IDs); thiếu field → None.
+
+        Chunk trùng nội dung lần thứ 2 trở đi trong một tài liệu nhận ID của lần đầu - cùng
+        text nên cache điểm/vector theo ID vẫn đúng.
+        """
+        out: list[str | None] = []
+        for doc, meta in zip(docs, metas, strict=False):
+            m = meta or {}
+            if m.get("source") is None or m.get("version") is None:
+                out.append(None)
+                continue
+            version = "" if m.get("version_auto") else str(m["version"])
+            out.append(chunk_id(m["source"], version, doc))
+        return out
+
+    def _stored_embeddings(self, ids: list[str | None]) -> list[list[float] | None]:
+        """Vector đã lưu theo chunk ID (FAISS reconstruct hoặc Chroma include=embeddings)."""
+        found: dict[str, list[float]] = {}
+        wanted = [i for i in dict.fromkeys(ids) if i]
+        if wanted and getattr(self, "_faiss_index", None) is not None:
+            try:
+                with self._faiss_connection() as conn:
+                    marks = ",".join("?" * len(wanted))
+                    rows = conn.execute(
+                        f"SELECT id, idx FROM map WHERE id IN ({marks})", wanted
+                    ).fetchall()
+                for idv, idx in rows:
+                    found[str(idv)] = self._faiss_index.reconstruct(int(idx)).tolist()
+            except Exception:
+                found = {}
+        rest = [i for i in wanted if i not in found]
+        if rest:
+            try:
+                res = self.collection.get(
+                    ids=rest, include=["embeddings"]
+                )  # type: ignore[arg-type]
+                embs = res.get("embeddings")
+                if embs is not None:
+                    for idv, emb in zip(res.get("ids", []), embs, strict=False):
+                        if emb is not None and len(emb):
+                            found[str(idv)] = list(emb)
+            except Exception:
+                pass
+        return [found.get(i) if i else None for i in ids]
 
     def _get_llm(self, provider: str | None = None):
         name = (provider or self.default_provider or "ollama").lower()
@@ -1130,21 +1638,36 @@ class RagEngine:
         except Exception:
             return str(abs(hash(seed)))
 
-    def generate_text(self, prompt: str, provider: str | None = None) -> str:
-        # Cache layer
-        key = self._gen_cache_key(prompt, provider)
-        cached = self.gen_cache.get(key)
-        if cached is not None and cached.strip():
-            return cached
+    def _gen_flight_key(self, cache_key: str) -> str:
+        # gen cache key đã gồm provider/model/stamp/prompt; thêm DB để không gộp nhầm giữa các DB
+        # Request có deadline (num_predict bị giới hạn) không gộp với request không giới hạn
+        dl = "|deadline" if current_deadline() is not None else ""
+        return f"{self.persist_dir}|{cache_key}{dl}"
+
+    def _generate_uncached(self, key: str, prompt: str, provider: str | None) -> str:
         llm = self._get_llm(provider)
         out = llm.generate(prompt)
         try:
-            if out and out.strip():
+            # Câu trả lời bị cắt num_predict theo deadline → không cache
+            if out and out.strip() and not generation_capped():
                 self.gen_cache.set(key, out)
         except Exception:
             pass
         return out
 
+    def generate_text(self, prompt: str, provider: str | None = None) -> str:
+        # Cache layer
+        key = self._gen_cache_key(prompt, provider)
+        cached = self.gen_cache.get(key)
+        if cached is not None and cached.strip():
+            return cached
+        if not SINGLE_FLIGHT_ENABLE:
+            return self._generate_uncached(key, prompt, provider)
+        out, _ = self._gen_flight.do(
+            self._gen_flight_key(key), self._generate_uncached, key, prompt, provider
+        )
+        return out
+
     def generate_stream(self, prompt: str, provider: str | None = None):
         # If cached, stream from cache to preserve API contract
         key = self._gen_cache_key(prompt, provider)
@@ -1159,7 +1682,67 @@ class RagEngine:
 
             return _gen()
         llm = self._get_llm(provider)
-        return llm.generate_stream(prompt)
+        if not SINGLE_FLIGHT_ENABLE:
+            return llm.generate_stream(prompt)
+        # Followers subscribe vào token stream của leader thay vì gọi LLM lần nữa
+        return self._gen_flight.stream(
+            self._gen_flight_key(key), lambda: llm.generate_stream(prompt)
+        )
+
+    def _get_async_llm(self, provider: str | None = None):
+        """Async twin (httpx) của client được chọn bởi `_get_llm`."""
+        return self._get_llm(provider).async_client()
+
+    async def _generate_uncached_async(self, key: str, prompt: str, provider: str | None) -> str:
+        out = await self._get_async_llm(provider).generate(prompt)
+        try:
+            if out and out.strip() and not generation_capped():
+                self.gen_cache.set(key, out)
+        except Exception:
+            pass
+        return out
+
+    async def generate_text_async(self, prompt: str, provider: str | None = None) -> str:
+        """Async version của `generate_text` (gen cache + single-flight)."""
+        key = self._gen_cache_key(prompt, provider)
+        cached = self.gen_cache.get(key)
+        if cached is not None and cached.strip():
+            return cached
+        if not SINGLE_FLIGHT_ENABLE:
+            return await self._generate_uncached_async(key, prompt, provider)
+        out, _ = await self._gen_flight.do_async(
+            self._gen_flight_key(key), self._generate_uncached_async, key, prompt, provider
+        )
+        return out
+
+    def generate_stream_async(self, prompt: str, provider: str | None = None) -> AsyncIterator[str]:
+        """Async version của `generate_stream` - gọi trong event loop đang chạy."""
+        key = self._gen_cache_key(prompt, provider)
+        cached = self.gen_cache.get(key)
+        if cached is not None and cached.strip():
+
+            async def _gen():
+                chunk = 1024
+                for i in range(0, len(cached), chunk):
+                    yield cached[i : i + chunk]
+
+            return _gen()
+        llm = self._get_async_llm(provider)
+        if not SINGLE_FLIGHT_ENABLE:
+            return llm.generate_stream(prompt)
+        return self._gen_flight.stream_async(
+            self._gen_flight_key(key), lambda: llm.generate_stream(prompt)
+        )
+
+    def check_llm_admission(self, provider: str | None = None) -> None:
+        """Từ chối sớm (LLMOverloadedError) nếu stream mới sẽ phải chờ quá lâu.
+
+        Gọi trước khi mở StreamingResponse để client nhận 503 + Retry-After
+        thay vì một stream treo. Chỉ áp dụng cho Ollama (OpenAI có quota riêng).
+        """
+        if not LLM_SCHEDULER_ENABLE or self._get_llm(provider) is not self.ollama:
+            return
+        get_scheduler(LLM_MODEL).check_admission(PRIORITY_INTERACTIVE)
 
     # ===== Rewrite & Aggregate Retrieval =====
     def _rewrite_queries(self, question: str, n: int = 2, provider: str | None = None) -> list[str]:
@@ -1175,7 +1758,8 @@ class RagEngine:
         prompt = f"[SYSTEM]\n{sys}\n[/SYSTEM]\n{ins}"
         try:
             llm = self._get_llm(provider)
-            raw = llm.generate(prompt)
+            with llm_priority(PRIORITY_REWRITE):
+                raw = llm.generate(prompt)
             s = raw
             if not s:
                 return []
@@ -1207,6 +1791,12 @@ class RagEngine:
         versions: list[str] | None = None,
     ) -> dict[str, Any]:
         method = (method or "vector").lower()
+        dl = current_deadline()
+        if dl is not None:
+            # Deadline: bỏ rewrite (thêm lượt LLM), vector/hybrid → BM25 khi gần hết giờ
+            if rewrite_enable and not dl.allow_rewrite():
+                rewrite_enable = False
+            method = dl.retrieval_method(method)
         queries: list[str] = [question]
         if rewrite_enable:
             try:
@@ -1216,14 +1806,15 @@ class RagEngine:
                         queries.append(rw.strip())
             except Exception:
                 pass
-        # Thu thập kết quả cho từng query
-        per_query: list[tuple[list[str], list[dict[str, Any]]]] = []
-        for q in queries:
+        # Một query: public retrieve* đã materialize đúng top_k
+        if len(queries) == 1:
             if method == "bm25":
-                r = self.retrieve_bm25(q, top_k=top_k, languages=languages, versions=versions)
+                r = self.retrieve_bm25(
+                    question, top_k=top_k, languages=languages, versions=versions
+                )
             elif method == "hybrid":
                 r = self.retrieve_hybrid(
-                    q,
+                    question,
                     top_k=top_k,
                     bm25_weight=bm25_weight,
                     rrf_enable=rrf_enable,
@@ -1232,27 +1823,43 @@ class RagEngine:
                     versions=versions,
                 )
             else:
-                r = self.retrieve(q, top_k=top_k, languages=languages, versions=versions)
-            per_query.append((r.get("documents", []), r.get("metadatas", [])))
-        # RRF fuse across rewrites
-        if len(per_query) == 1:
-            docs, metas = per_query[0]
-            return {"documents": docs[:top_k], "metadatas": metas[:top_k]}
+                r = self.retrieve(question, top_k=top_k, languages=languages, versions=versions)
+            docs, metas = r.get("documents", []), r.get("metadatas", [])
+            out = {"documents": docs[:top_k], "metadatas": metas[:top_k]}
+            if r.get("ids") is not None:
+                out["ids"] = list(r["ids"])[:top_k]
+            return out
+        # Nhiều rewrites: RRF trên chunk IDs, chỉ materialize top_k sau cùng
+        rankings = [
+            [
+                cid
+                for cid, _ in self._candidates(
+                    method, q, top_k, bm25_weight, rrf_enable, rrf_k, languages, versions
+                )
+            ]
+            for q in queries
+        ]
         rrf_k_val = RRF_K_DEFAULT if rrf_k is None else int(rrf_k)
-        score_map: dict[tuple[str, Any, Any], tuple[float, str, dict[str, Any]]] = {}
-        for docs, metas in per_query:
-            for idx, (d, m) in enumerate(zip(docs, metas, strict=False), start=1):
-                key = self._make_key(d, m)
-                inc = 1.0 / (rrf_k_val + idx)
-                if key in score_map:
-                    cur = score_map[key]
-                    score_map[key] = (cur[0] + inc, cur[1], cur[2])
-                else:
-                    score_map[key] = (inc, d, m)
-        combined = sorted(score_map.values(), key=lambda x: x[0], reverse=True)
-        out_docs = [d for _, d, _ in combined[:top_k]]
-        out_metas = [m for _, _, m in combined[:top_k]]
-        return {"documents": out_docs, "metadatas": out_metas}
+        fused = self._rrf_fuse(rankings, rrf_k_val)[:top_k]
+        out_ids, out_docs, out_metas = self._materialize([cid for cid, _ in fused])
+        return {"documents": out_docs, "metadatas": out_metas, "ids": out_ids}
+
+    def _answer_flight_key(self, question: str, params: dict[str, Any]) -> str:
+        seed = json.dumps(
+            {
+                "db": self.persist_dir,
+                "stamp": getattr(self, "_corpus_stamp", "0"),
+                "q": normalize_query(question),
+                "prov": (params.get("provider") or self.default_provider or "ollama").lower(),
+                "params": params,
+                # Kết quả đã degrade theo deadline không chia sẻ cho request không có deadline
+                "deadline": current_deadline() is not None,
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(seed.encode("utf-8")).hexdigest()
 
     def answer(
         self,
@@ -1273,7 +1880,113 @@ class RagEngine:
         rr_max_k: int | None = None,
         rr_batch_size: int | None = None,
         rr_num_threads: int | None = None,
+        compress: bool | None = None,
     ) -> dict[str, Any]:
+        """Answer a question, coalescing identical concurrent requests (single-flight).
+
+        Followers nhận bản sao nông (shallow copy) của kết quả leader, để caller
+        có thể gắn thêm field (db, cache_hit, ...) mà không ảnh hưởng nhau.
+        """
+        params: dict[str, Any] = {
+            "top_k": top_k,
+            "method": method,
+            "bm25_weight": bm25_weight,
+            "rerank_enable": rerank_enable,
+            "rerank_top_n": rerank_top_n,
+            "provider": provider,
+            "rrf_enable": rrf_enable,
+            "rrf_k": rrf_k,
+            "rewrite_enable": rewrite_enable,
+            "rewrite_n": rewrite_n,
+            "languages": languages,
+            "versions": versions,
+            "rr_provider": rr_provider,
+            "rr_max_k": rr_max_k,
+            "rr_batch_size": rr_batch_size,
+            "rr_num_threads": rr_num_threads,
+            "compress": compress,
+        }
+        if not SINGLE_FLIGHT_ENABLE:
+            return self._answer_impl(question, params)
+        key = self._answer_flight_key(question, params)
+        result, _ = self._answer_flight.do(key, self._answer_impl, question, params)
+        return dict(result)
+
+    async def answer_async(self, question: str, **params: Any) -> dict[str, Any]:
+        """Async version của `answer` (cùng tham số).
+
+        Retrieval/rerank (CPU + SQLite/Chroma) chạy trong thread qua `asyncio.to_thread`;
+        lời gọi LLM đi qua async client nên không chiếm thread khi chờ model.
+        """
+        params = {**ANSWER_DEFAULTS, **params}
+        if not SINGLE_FLIGHT_ENABLE:
+            return await self._answer_impl_async(question, params)
+        key = self._answer_flight_key(question, params)
+        result, _ = await self._answer_flight.do_async(
+            key, self._answer_impl_async, question, params
+        )
+        return dict(result)
+
+    def _answer_impl(self, question: str, params: dict[str, Any]) -> dict[str, Any]:
+        docs, metas, prompt, prompt_info = self._prepare_answer(question, **params)
+        reply = self.generate_text(prompt, provider=params.get("provider"))
+        return self._answer_result(reply, docs, metas, params, prompt_info)
+
+    async def _answer_impl_async(self, question: str, params: dict[str, Any]) -> dict[str, Any]:
+        docs, metas, prompt, prompt_info = await asyncio.to_thread(
+            self._prepare_answer, question, **params
+        )
+        reply = await self.generate_text_async(prompt, provider=params.get("provider"))
+        return self._answer_result(reply, docs, metas, params, prompt_info)
+
+    @staticmethod
+    def _answer_result(
+        reply: str,
+        docs: list[str],
+        metas: list[dict],
+        params: dict[str, Any],
+        prompt_info: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
+        out = {
+            "answer": reply,
+            "contexts": docs,
+            "metadatas": metas,
+            "method": (params.get("method") or "vector").lower(),
+            "bm25_weight": params.get("bm25_weight"),
+            "rerank_enable": params.get("rerank_enable"),
+            "rerank_top_n": params.get("rerank_top_n"),
+        }
+        if prompt_info:
+            # compression (ký tự trước/sau nén), packing (token prompt, contexts bỏ/cắt)
+            out.update(prompt_info)
+        dl = current_deadline()
+        if dl is not None:
+            # deadline_ms, elapsed_ms, degradations (quyết định degrade theo từng bước)
+            out.update(dl.report())
+        return out
+
+    def _prepare_answer(
+        self,
+        question: str,
+        top_k: int = 5,
+        method: str = "vector",
+        bm25_weight: float = 0.5,
+        rerank_enable: bool = False,
+        rerank_top_n: int = 10,
+        provider: str | None = None,
+        rrf_enable: bool | None = None,
+        rrf_k: int | None = None,
+        rewrite_enable: bool = False,
+        rewrite_n: int = 2,
+        languages: list[str] | None = None,
+        versions: list[str] | None = None,
+        rr_provider: str | None = None,
+        rr_max_k: int | None = None,
+        rr_batch_size: int | None = None,
+        rr_num_threads: int | None = None,
+        compress: bool | None = None,
+    ) -> tuple[list[str], list[dict], str, dict[str, Any]]:
+        """Retrieval + rerank + compress + pack + build prompt (phần đồng bộ của answer)."""
         method = (method or "vector").lower()
         base_k = max(top_k, rerank_top_n if rerank_enable else top_k)
         retrieved = self.retrieve_aggregate(
@@ -1301,21 +2014,13 @@ class RagEngine:
                 rr_max_k=rr_max_k,
                 rr_batch_size=rr_batch_size,
                 rr_num_threads=rr_num_threads,
+                ids=retrieved.get("ids"),
             )
         else:
             docs = docs[:top_k]
             metas = metas[:top_k]
-        prompt = self.build_prompt(question, docs)
-        reply = self.generate_text(prompt, provider=provider)
-        return {
-            "answer": reply,
-            "contexts": docs,
-            "metadatas": metas,
-            "method": method,
-            "bm25_weight": bm25_weight,
-            "rerank_enable": rerank_enable,
-            "rerank_top_n": rerank_top_n,
-        }
+        docs, metas, info = self.prepare_contexts(question, docs, metas, compress=compress)
+        return docs, metas, self.build_prompt(question, docs), info
 
     # ===== Multi-hop =====
     def _decompose(self, question: str, fanout: int = 2) -> list[str]:
@@ -1333,7 +2038,8 @@ class RagEngine:
         )
         prompt = f"[SYSTEM]\n{sys}\n[/SYSTEM]\n{ins}"
         try:
-            raw = self.ollama.generate(prompt)
+            with llm_priority(PRIORITY_REWRITE):
+                raw = self.ollama.generate(prompt)
             # Tìm khối JSON array đầu tiên
             start = raw.find('[')
             end = raw.rfind(']')
@@ -1382,11 +2088,12 @@ class RagEngine:
                 return True
             return (int(time.time() * 1000) - start_ms) < budget_ms
 
-        agg_docs: list[str] = []
-        agg_metas: list[dict[str, Any]] = []
-        seen_keys = set()
+        # Gom chunk IDs qua các hop (dedup theo ID), text chỉ lấy cho tập cuối
+        agg_ids: list[str] = []
+        seen_ids: set[str] = set()
         subquestions_all: list[str] = []
         cur_questions = [question]
+        base_k = max(top_k, rerank_top_n if rerank_enable else top_k)
         # Duyệt theo tầng
         for hop_idx in range(depth):
             if not time_left_ok():
@@ -1408,63 +2115,30 @@ class RagEngine:
             for sq in next_questions:
                 if not time_left_ok():
                     break
-                base_k = max(top_k, rerank_top_n if rerank_enable else top_k)
-                if method == "bm25":
-                    retrieved = self.retrieve_bm25(
-                        sq, top_k=base_k, languages=languages, versions=versions
-                    )
-                elif method == "hybrid":
-                    retrieved = self.retrieve_hybrid(
-                        sq,
-                        top_k=base_k,
-                        bm25_weight=bm25_weight,
-                        rrf_enable=rrf_enable,
-                        rrf_k=rrf_k,
-                        languages=languages,
-                        versions=versions,
-                    )
-                else:
-                    retrieved = self.retrieve(
-                        sq, top_k=base_k, languages=languages, versions=versions
-                    )
-                docs = retrieved.get("documents", [])
-                metas = retrieved.get("metadatas", [])
-                for d, m in zip(docs, metas, strict=False):
-                    key = self._make_key(d, m)
-                    if key in seen_keys:
-                        continue
-                    seen_keys.add(key)
-                    agg_docs.append(d)
-                    agg_metas.append(m)
+                ranked = self._candidates(
+                    method, sq, base_k, bm25_weight, rrf_enable, rrf_k, languages, versions
+                )
+                for cid, _ in ranked:
+                    if cid not in seen_ids:
+                        seen_ids.add(cid)
+                        agg_ids.append(cid)
             cur_questions = next_questions
         # Fallback: nếu không thu được context nào qua multi-hop, thử single-hop trên câu hỏi gốc
-        if not agg_docs:
-            base_k = max(top_k, rerank_top_n if rerank_enable else top_k)
-            if method == "bm25":
-                retrieved = self.retrieve_bm25(
-                    question, top_k=base_k, languages=languages, versions=versions
-                )
-            elif method == "hybrid":
-                retrieved = self.retrieve_hybrid(
-                    question,
-                    top_k=base_k,
-                    bm25_weight=bm25_weight,
-                    languages=languages,
-                    versions=versions,
-                )
-            else:
-                retrieved = self.retrieve(
-                    question, top_k=base_k, languages=languages, versions=versions
-                )
-            agg_docs = retrieved.get("documents", [])
-            agg_metas = retrieved.get("metadatas", [])
+        if not agg_ids:
+            ranked = self._candidates(
+                method, question, base_k, bm25_weight, None, None, languages, versions
+            )
+            agg_ids = [cid for cid, _ in ranked]
 
         # Rerank/giới hạn top_k
-        if rerank_enable and agg_docs:
-            sel_docs, sel_metas = self._apply_rerank(question, agg_docs, agg_metas, top_k)
+        if rerank_enable and agg_ids:
+            kept_ids, agg_docs, agg_metas = self._materialize(agg_ids)
+            sel_docs, sel_metas = self._apply_rerank(
+                question, agg_docs, agg_metas, top_k, ids=kept_ids
+            )
         else:
-            sel_docs = agg_docs[:top_k]
-            sel_metas = agg_metas[:top_k]
+            _, sel_docs, sel_metas = self._materialize(agg_ids[:top_k])
+        sel_docs, sel_metas, prompt_info = self.prepare_contexts(question, sel_docs, sel_metas)
         prompt = self.build_prompt(question, sel_docs)
         reply = "" if skip_answer else self.generate_text(prompt, provider=None)
         return {
@@ -1480,6 +2154,7 @@ class RagEngine:
             "fanout_first_hop": fanout_first_hop,
             "budget_ms": budget_ms,
             "subquestions": subquestions_all,
+            **prompt_info,
         }
 
     # ===== Filters =====
@@ -1498,7 +2173,13 @@ class RagEngine:
             # Cache hit!
             return {"languages": cached[0], "versions": cached[1]}
 
-        # Cache miss - query database
+        # Cache miss - đọc meta summary (O(số giá trị phân biệt))
+        if self._meta_summary_ready():
+            langs, vers = self.meta_summary.filters()
+            self._filters_cache.set(cache_key, (langs, vers))
+            return {"languages": langs, "versions": vers}
+
+        # Fallback: quét toàn bộ collection
         try:
             results = self.collection.get(include=["metadatas"])  # type: ignore[arg-type]
         except Exception:
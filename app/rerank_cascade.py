@@ -0,0 +1,216 @@
+"""
+Rerank Cascade - chấm điểm nhiều tầng trên tập candidate co dần 🪜
+
+Chạy BGE (cross-encoder lớn) trên cả rr_max_k candidates tốn CPU nhất pipeline.
+Cascade dùng scorer rẻ để lọc trước, chỉ phần còn lại mới đến model đắt:
+
+- ✅ Tầng 1: cosine với vector đã lưu (chỉ embed query) → giữ M candidates
+- ✅ Tầng 2: cross-encoder nhỏ (MiniLM) → giữ K candidates
+- ✅ Tầng 3 (tùy chọn): BGE sắp xếp top_k cuối cùng
+- ✅ Mỗi tầng có time budget: ước lượng chi phí (EWMA ms/doc) → cắt bớt input cho vừa,
+  không vừa nổi top_k → bỏ qua tầng, giữ thứ tự của tầng trước
+- ✅ Tầng bị bỏ vì over budget vẫn được chạy thử (top_k docs) định kỳ để EWMA cập nhật →
+  một lần chậm đột biến không loại tầng vĩnh viễn
+- ✅ Tầng không khả dụng/lỗi → bỏ qua, cascade vẫn trả kết quả
+- ✅ Metrics theo tầng: thời gian, số candidate vào, outcome
+"""
+
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable, Sequence
+from typing import Any
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+# provider "auto" dùng cascade thay cho BGE/embed đơn lẻ
+RERANK_CASCADE_DEFAULT = os.getenv("RERANK_CASCADE_DEFAULT", "0").strip() not in (
+    "0",
+    "false",
+    "False",
+)
+# M / K: số candidate giữ lại sau tầng embed / cross-encoder
+RERANK_CASCADE_EMBED_KEEP = max(1, int(os.getenv("RERANK_CASCADE_EMBED_KEEP", "30")))
+RERANK_CASCADE_CE_KEEP = max(1, int(os.getenv("RERANK_CASCADE_CE_KEEP", "10")))
+RERANK_CASCADE_CE_MODEL = os.getenv(
+    "RERANK_CASCADE_CE_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"
+)
+RERANK_CASCADE_BGE = os.getenv("RERANK_CASCADE_BGE", "1").strip() not in ("0", "false", "False")
+# Time budget mỗi tầng (ms, 0 = không giới hạn)
+RERANK_CASCADE_EMBED_BUDGET_MS = float(os.getenv("RERANK_CASCADE_EMBED_BUDGET_MS", "300"))
+RERANK_CASCADE_CE_BUDGET_MS = float(os.getenv("RERANK_CASCADE_CE_BUDGET_MS", "400"))
+RERANK_CASCADE_BGE_BUDGET_MS = float(os.getenv("RERANK_CASCADE_BGE_BUDGET_MS", "800"))
+# Tầng over budget: cứ N lần bị bỏ thì chạy thử top_k docs để đo lại ms/doc
+RERANK_CASCADE_PROBE_EVERY = max(1, int(os.getenv("RERANK_CASCADE_PROBE_EVERY", "10")))
+
+# Scorer: (query, docs, chunk IDs, options của request) → điểm theo thứ tự docs
+Scorer = Callable[[str, list[str], list[str | None], dict[str, Any]], Sequence[float]]
+
+
+class CascadeStage:
+    """Một tầng cascade: scorer + số candidate giữ lại + time budget."""
+
+    EWMA_ALPHA = 0.3
+
+    def __init__(
+        self,
+        name: str,
+        scorer: Scorer,
+        keep: int,
+        budget_ms: float = 0.0,
+        available: Callable[[], bool] | None = None,
+        probe_every: int = RERANK_CASCADE_PROBE_EVERY,
+    ):
+        self.name = name
+        self.scorer = scorer
+        self.keep = max(1, int(keep))
+        self.budget_ms = max(0.0, float(budget_ms))
+        self._available = available
+        self.probe_every = max(1, int(probe_every))
+        self._lock = threading.Lock()
+        self._skips = 0  # số lần bị bỏ vì over budget kể từ lần chạy thử gần nhất
+        self.ms_per_doc: float | None = None  # EWMA, None = chưa có quan sát
+        self.calls = 0
+        self.over_budget = 0
+
+    def available(self) -> bool:
+        try:
+            return self._available() if self._available is not None else True
+        except Exception:
+            return False
+
+    def affordable(self, n: int) -> int:
+        """Số candidate chấm được trong budget theo ước lượng hiện tại."""
+        if not self.budget_ms or self.ms_per_doc is None or self.ms_per_doc <= 0:
+            return n
+        return min(n, int(self.budget_ms / self.ms_per_doc))
+
+    def should_probe(self) -> bool:
+        """Gọi khi tầng không vừa budget: True mỗi `probe_every` lần → chạy thử để đo lại."""
+        with self._lock:
+            self._skips += 1
+            if self._skips < self.probe_every:
+                return False
+            self._skips = 0
+            return True
+
+    def observe(self, n: int, seconds: float, reset: bool = False) -> None:
+        """Cập nhật EWMA ms/doc; `reset` (lần chạy thử) thay hẳn ước lượng cũ đã lỗi thời."""
+        if n <= 0:
+            return
+        per_doc = seconds * 1000.0 / n
+        with self._lock:
+            self.calls += 1
+            if self.ms_per_doc is None or reset:
+                self.ms_per_doc = per_doc
+            else:
+                self.ms_per_doc += self.EWMA_ALPHA * (per_doc - self.ms_per_doc)
+            if self.budget_ms and seconds * 1000.0 > self.budget_ms:
+                self.over_budget += 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "keep": self.keep,
+            "budget_ms": self.budget_ms,
+            "ms_per_doc": self.ms_per_doc,
+            "calls": self.calls,
+            "over_budget": self.over_budget,
+        }
+
+
+def _record(stage: str, outcome: str, n: int = 0, seconds: float | None = None) -> None:
+    if METRICS_ENABLED:
+        metrics.record_rerank_stage(stage, outcome, n, seconds)
+
+
+class RerankCascade:
+    """
+    Chạy các tầng theo thứ tự; mỗi tầng chấm tập candidate hiện tại và giữ lại top `keep`
+    (tầng cuối cùng chạy được giữ top_k). Trả về chỉ số vào danh sách gốc + trace từng tầng.
+    """
+
+    def __init__(self, stages: Sequence[CascadeStage]):
+        self.stages = list(stages)
+
+    def rank(
+        self,
+        query: str,
+        docs: list[str],
+        top_k: int,
+        keys: Sequence[str | None] | None = None,
+        options: dict[str, Any] | None = None,
+    ) -> tuple[list[int], list[dict[str, Any]]]:
+        top_k = max(1, int(top_k))
+        keys = list(keys) if keys is not None else [None] * len(docs)
+        opts = options or {}
+        cand = list(range(len(docs)))
+        trace: list[dict[str, Any]] = []
+        active = [s for s in self.stages if s.available()]
+        for s in self.stages:
+            if s not in active:
+                trace.append({"stage": s.name, "outcome": "unavailable"})
+                _record(s.name, "unavailable")
+        for pos, stage in enumerate(active):
+            last = pos == len(active) - 1
+            keep = top_k if last else max(top_k, stage.keep)
+            # Tầng không lọc được gì và không phải tầng quyết định thứ tự cuối → bỏ qua
+            if len(cand) <= keep and not last:
+                trace.append({"stage": stage.name, "outcome": "skipped", "n": len(cand)})
+                _record(stage.name, "skipped", len(cand))
+                continue
+            n = stage.affordable(len(cand))
+            outcome = "ran"
+            if n < min(top_k, len(cand)):
+                if not stage.should_probe():
+                    trace.append({"stage": stage.name, "outcome": "over_budget", "n": len(cand)})
+                    _record(stage.name, "over_budget", len(cand))
+                    continue
+                # Chạy thử phần tối thiểu (top_k) → observe() cập nhật ước lượng ms/doc
+                n, outcome = min(top_k, len(cand)), "probe"
+            # Chỉ chấm phần đầu (thứ tự tầng trước) vừa budget; phần đuôi bị loại
+            sub = cand[:n]
+            t0 = time.perf_counter()
+            try:
+                scores = list(
+                    stage.scorer(query, [docs[i] for i in sub], [keys[i] for i in sub], opts)
+                )
+                if len(scores) != len(sub):
+                    raise ValueError(f"{stage.name}: got {len(scores)} scores for {len(sub)} docs")
+            except Exception as e:
+                logger.warning("Rerank stage %s failed: %s", stage.name, e)
+                trace.append({"stage": stage.name, "outcome": "error", "n": len(sub)})
+                _record(stage.name, "error", len(sub))
+                continue
+            dt = time.perf_counter() - t0
+            stage.observe(len(sub), dt, reset=outcome == "probe")
+            # Stable: hòa điểm giữ thứ tự tầng trước
+            order = sorted(range(len(sub)), key=lambda j: -scores[j])
+            cand = [sub[j] for j in order[:keep]]
+            trace.append(
+                {"stage": stage.name, "outcome": outcome, "n": len(sub), "ms": dt * 1000.0}
+            )
+            _record(stage.name, outcome, len(sub), dt)
+        return cand[:top_k], trace
+
+    def rerank(
+        self,
+        query: str,
+        docs: list[str],
+        metas: list[dict[str, Any]],
+        top_k: int,
+        keys: Sequence[str | None] | None = None,
+        options: dict[str, Any] | None = None,
+    ) -> tuple[list[str], list[dict[str, Any]]]:
+        idxs, _ = self.rank(query, docs, top_k, keys=keys, options=options)
+        return [docs[i] for i in idxs], [metas[i] for i in idxs]
+
+    def stats(self) -> dict[str, Any]:
+        return {s.name: {"available": s.available(), **s.stats()} for s in self.stages}
@@ -1,6 +1,14 @@
+import hashlib
 import os
+import threading
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
 from typing import Any
 
+from app.cache_utils import LRUCacheWithTTL
+from app.onnx_sessions import OnnxSessionPool, default_session_threads
+from app.reranker_quant import resolve_variant
+
 # Optional deps
 try:
     import onnxruntime as ort  # type: ignore
@@ -19,11 +27,47 @@ except Exception:  # pragma: no cover
 
 import numpy as np  # type: ignore
 
+# Dynamic batching: tổng số token (đã pad) tối đa mỗi batch ONNX
+RERANK_MAX_BATCH_TOKENS = max(64, int(os.getenv("RERANK_MAX_BATCH_TOKENS", "8192")))
+# Cache token IDs của chunk (theo chunk ID) và điểm (query, chunk)
+RERANK_TOKEN_CACHE_SIZE = max(1, int(os.getenv("RERANK_TOKEN_CACHE_SIZE", "20000")))
+RERANK_SCORE_CACHE_SIZE = max(1, int(os.getenv("RERANK_SCORE_CACHE_SIZE", "4096")))
+RERANK_SCORE_CACHE_TTL = max(1, int(os.getenv("RERANK_SCORE_CACHE_TTL", "3600")))
+RERANK_IO_BINDING = os.getenv("RERANK_IO_BINDING", "1").strip() not in ("0", "false", "False")
+
+
+def _text_key(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _truncate_pair(q: list[int], d: list[int], budget: int) -> tuple[list[int], list[int]]:
+    """Cắt kiểu longest_first: bớt token của chuỗi dài hơn trước (hòa → cắt doc)."""
+    over = len(q) + len(d) - max(0, budget)
+    if over <= 0:
+        return q, d
+    lq, ld = len(q), len(d)
+    step = min(over, abs(lq - ld))
+    if lq > ld:
+        lq -= step
+    else:
+        ld -= step
+    over -= step
+    ld -= (over + 1) // 2
+    lq -= over // 2
+    return q[: max(0, lq)], d[: max(0, ld)]
+
 
 class BgeOnnxReranker:
     """
     Reranker dùng ONNXRuntime cho model BAAI/bge-reranker-v2-m3 (nếu có ONNX).
     Nếu không khả dụng, phương thức available() sẽ trả về False.
+
+    - ✅ Chunk được tokenize một lần (cache theo chunk ID), query tokenize một lần mỗi lượt
+    - ✅ Batch theo độ dài (sort + ngân sách token) → gần như không tốn compute cho padding
+    - ✅ LRU điểm (query hash, chunk ID) → rerank lặp lại không chạy model
+    - ✅ IO binding cho input/output (tránh copy thừa), fallback session.run
+    - ✅ Biến thể INT8/FP16 đã convert cục bộ (RERANK_MODEL_VARIANT, xem reranker_quant)
+    - ✅ Session theo số luồng từ pool (onnx_sessions) → rerank song song không oversubscribe
     """
 
     def __init__(
@@ -31,14 +75,34 @@ class BgeOnnxReranker:
         repo_id: str = "BAAI/bge-reranker-v2-m3",
         onnx_filename: str = "onnx/model.onnx",
         max_length: int = 512,
+        variant: str | None = None,
+        model_dir: str | None = None,
     ):
         self.repo_id = repo_id
         self.onnx_filename = onnx_filename
         self.max_length = max_length
+        # variant thực tế được chọn (fp32 nếu chưa có bản convert hợp lệ)
+        self.variant, self.model_path = resolve_variant(repo_id, variant, model_dir)
         self._session: ort.InferenceSession | None = None
+        self._pool: OnnxSessionPool | None = None
+        self._model_file: str | None = None
+        # Trọng số đã prepack dùng chung giữa các session trong pool (mỗi session vẫn giữ
+        # initializers của riêng nó → RAM tăng theo RERANK_SESSION_POOL_MAX)
+        self._prepacked: Any = None
         self._tokenizer = None
         self._input_names: list[str] = []
         self._output_names: list[str] = []
+        self._doc_tokens = LRUCacheWithTTL[list[int]](
+            max_size=RERANK_TOKEN_CACHE_SIZE, ttl=7 * 24 * 3600
+        )
+        self._scores = LRUCacheWithTTL[float](
+            max_size=RERANK_SCORE_CACHE_SIZE, ttl=RERANK_SCORE_CACHE_TTL
+        )
+        self._io_binding = RERANK_IO_BINDING
+        self._lock = threading.Lock()
+        self.pairs_scored = 0
+        self.padded_tokens = 0
+        self.real_tokens = 0
         self._init_try()
 
     def available(self) -> bool:
@@ -47,75 +111,224 @@ class BgeOnnxReranker:
     def _init_try(self) -> None:
         if ort is None or AutoTokenizer is None or hf_hub_download is None:
             return
-        try:
-            model_path = hf_hub_download(repo_id=self.repo_id, filename=self.onnx_filename)
-        except Exception:
-            # thử đường dẫn fallback (nếu repo không có thư mục onnx)
-            try:
-                model_path = hf_hub_download(repo_id=self.repo_id, filename="model.onnx")
-            except Exception:
+        model_path = self.model_path
+        if model_path is None:
+            model_path = self.fp32_model_path()
+            if model_path is None:
                 return
         try:
-            sess_options = ort.SessionOptions()
-            # Giới hạn số luồng để tránh chiếm CPU toàn máy khi test
-            try:
-                intra = int(os.getenv("ORT_INTRA_OP_THREADS", "1"))
-                inter = int(os.getenv("ORT_INTER_OP_THREADS", "1"))
-                if hasattr(sess_options, "intra_op_num_threads"):
-                    sess_options.intra_op_num_threads = intra
-                if hasattr(sess_options, "inter_op_num_threads"):
-                    sess_options.inter_op_num_threads = inter
-            except Exception:
-                pass
-            self._session = ort.InferenceSession(
-                model_path, sess_options=sess_options, providers=["CPUExecutionProvider"]
-            )  # type: ignore[arg-type]
+            self._model_file = model_path
+            threads = default_session_threads()
+            self._session = self._make_session(threads)
             self._input_names = [i.name for i in self._session.get_inputs()]
             self._output_names = [o.name for o in self._session.get_outputs()]
             self._tokenizer = AutoTokenizer.from_pretrained(self.repo_id, use_fast=True)
+            self._pool = OnnxSessionPool(self._make_session, default_threads=threads)
+            self._pool.add(self._session, threads)
         except Exception:
             self._session = None
+            self._pool = None
             self._tokenizer = None
             self._input_names = []
             self._output_names = []
+            if self.model_path is not None:
+                # Bản convert hỏng/không tương thích → quay về FP32
+                self.variant, self.model_path = "fp32", None
+                self._init_try()
 
-    def score(self, query: str, docs: list[str], batch_size: int = 16) -> list[float]:
-        if not self.available():
-            raise RuntimeError("BGE ONNX reranker not available")
-        assert self._session is not None and self._tokenizer is not None
-        scores: list[float] = []
-        for i in range(0, len(docs), batch_size):
-            batch = docs[i : i + batch_size]
+    def _make_session(self, threads: int) -> Any:
+        """InferenceSession mới với `threads` luồng intra-op (số luồng cố định theo session)."""
+        assert ort is not None and self._model_file is not None
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = max(1, int(threads))
+        # Một request = một session tuần tự; song song đến từ nhiều session trong pool
+        sess_options.inter_op_num_threads = 1
+        sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        try:
+            # Không spin-wait khi rảnh: các session trong pool không đốt CPU của nhau
+            sess_options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        except Exception:
+            pass
+        kwargs: dict[str, Any] = {}
+        if self._prepacked is None and hasattr(ort, "PrepackedWeightsContainer"):
+            self._prepacked = ort.PrepackedWeightsContainer()
+        if self._prepacked is not None:
+            kwargs["prepacked_weights_container"] = self._prepacked
+        return ort.InferenceSession(
+            self._model_file,
+            sess_options=sess_options,
+            providers=["CPUExecutionProvider"],
+            **kwargs,
+        )  # type: ignore[arg-type]
+
+    @contextmanager
+    def _acquire(self, num_threads: int | None = None) -> Iterator[Any]:
+        if self._pool is None:
+            yield self._session
+            return
+        with self._pool.session(num_threads) as session:
+            yield session
+
+    def fp32_model_path(self) -> str | None:
+        """Model FP32 gốc từ HF Hub (cache của huggingface_hub), None nếu không tải được."""
+        if hf_hub_download is None:
+            return None
+        for filename in (self.onnx_filename, "model.onnx"):
+            try:
+                path = hf_hub_download(repo_id=self.repo_id, filename=filename)
+            except Exception:
+                # thử đường dẫn fallback (nếu repo không có thư mục onnx)
+                continue
+            try:
+                # model lớn lưu trọng số ở external data cạnh file .onnx
+                hf_hub_download(repo_id=self.repo_id, filename=filename + "_data")
+            except Exception:
+                pass
+            return path
+        return None
+
+    @property
+    def model_tag(self) -> str:
+        """Định danh model cho cache key (đổi model/variant → không dùng lại điểm cũ)."""
+        return f"{self.repo_id}:{self.onnx_filename}:{self.variant}:{self.max_length}"
+
+    def _doc_token_ids(self, docs: list[str], keys: list[str]) -> list[list[int]]:
+        """Token IDs (không special tokens) của chunks, tokenize một lần cho chunk mới."""
+        assert self._tokenizer is not None
+        out: list[list[int] | None] = [self._doc_tokens.get(k) for k in keys]
+        missing = [i for i, ids in enumerate(out) if ids is None]
+        if missing:
             enc = self._tokenizer(
-                [query] * len(batch),
-                batch,
+                [docs[i] for i in missing],
+                add_special_tokens=False,
                 truncation=True,
-                padding=True,
                 max_length=self.max_length,
-                return_tensors='np',
             )
-            inputs: dict[str, np.ndarray] = {}
-            for name in self._input_names:
-                if name in enc:
-                    arr = enc[name]
-                elif name == 'token_type_ids' and 'token_type_ids' not in enc:
-                    # nếu không có token_type_ids (robust cho tokenizer không dùng segment ids)
-                    shape = enc['input_ids'].shape
-                    arr = np.zeros(shape, dtype=np.int64)
-                else:
-                    continue
-                # đảm bảo dtype int64 cho ids/masks
-                if arr.dtype != np.int64:
-                    try:
-                        arr = arr.astype(np.int64)
-                    except Exception:
-                        pass
-                inputs[name] = arr
-            out = self._session.run(self._output_names, inputs)
-            logits = out[0]  # (batch, 1) or (batch, num_labels)
-            logits = np.array(logits).reshape(-1)
-            scores.extend(logits.tolist())
-        return scores
+            for i, ids in zip(missing, enc["input_ids"], strict=False):
+                ids = list(ids)
+                self._doc_tokens.set(keys[i], ids)
+                out[i] = ids
+        return out  # type: ignore[return-value]
+
+    def _encode_pair(self, q_ids: list[int], d_ids: list[int]) -> tuple[list[int], list[int]]:
+        tok = self._tokenizer
+        budget = self.max_length - tok.num_special_tokens_to_add(pair=True)
+        q, d = _truncate_pair(q_ids, d_ids, budget)
+        ids = tok.build_inputs_with_special_tokens(q, d)
+        try:
+            types = tok.create_token_type_ids_from_sequences(q, d)
+        except Exception:
+            types = [0] * len(ids)
+        return list(ids), list(types)
+
+    def _buckets(self, lengths: list[int], batch_size: int) -> list[list[int]]:
+        """Nhóm chỉ số theo độ dài tăng dần; mỗi batch <= batch_size và <= ngân sách token."""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        batches: list[list[int]] = []
+        cur: list[int] = []
+        for i in order:
+            # lengths tăng dần → độ dài pad của batch = lengths[i]
+            if cur and (
+                len(cur) >= batch_size or (len(cur) + 1) * lengths[i] > RERANK_MAX_BATCH_TOKENS
+            ):
+                batches.append(cur)
+                cur = []
+            cur.append(i)
+        if cur:
+            batches.append(cur)
+        return batches
+
+    def _run(self, session: Any, inputs: dict[str, np.ndarray]) -> np.ndarray:
+        assert session is not None
+        feed = {k: v for k, v in inputs.items() if k in self._input_names}
+        if self._io_binding:
+            try:
+                binding = session.io_binding()
+                for name, arr in feed.items():
+                    binding.bind_cpu_input(name, np.ascontiguousarray(arr))
+                binding.bind_output(self._output_names[0])
+                session.run_with_iobinding(binding)
+                return np.asarray(binding.copy_outputs_to_cpu()[0]).reshape(-1)
+            except Exception:
+                # Session/provider không hỗ trợ IO binding → dùng run thường
+                self._io_binding = False
+        out = session.run(self._output_names[:1], feed)
+        return np.asarray(out[0]).reshape(-1)
+
+    def score(
+        self,
+        query: str,
+        docs: list[str],
+        batch_size: int = 16,
+        keys: Sequence[str | None] | None = None,
+        num_threads: int | None = None,
+    ) -> list[float]:
+        """
+        Điểm cross-encoder cho (query, doc); `keys` = chunk IDs để cache token/điểm.
+
+        `num_threads` chọn session có số luồng intra-op đó trong pool (None = mặc định).
+        """
+        if not self.available():
+            raise RuntimeError("BGE ONNX reranker not available")
+        assert self._session is not None and self._tokenizer is not None
+        if not docs:
+            return []
+        doc_keys = [
+            (k if k else _text_key(d))
+            for k, d in zip(keys if keys is not None else [None] * len(docs), docs, strict=False)
+        ]
+        q_key = _text_key(f"{self.model_tag}\x00{query}")
+        scores: list[float | None] = [self._scores.get(f"{q_key}:{k}") for k in doc_keys]
+        todo = [i for i, sc in enumerate(scores) if sc is None]
+        if todo:
+            # Fast tokenizer không an toàn khi dùng đồng thời → chỉ khóa phần tokenize
+            with self._lock:
+                q_ids = list(
+                    self._tokenizer(
+                        query, add_special_tokens=False, truncation=True, max_length=self.max_length
+                    )["input_ids"]
+                )
+                d_ids = self._doc_token_ids([docs[i] for i in todo], [doc_keys[i] for i in todo])
+                pairs = [self._encode_pair(q_ids, ids) for ids in d_ids]
+            pad_id = getattr(self._tokenizer, "pad_token_id", None) or 0
+            with self._acquire(num_threads) as session:
+                for batch in self._buckets([len(p[0]) for p in pairs], max(1, batch_size)):
+                    width = max(len(pairs[j][0]) for j in batch)
+                    input_ids = np.full((len(batch), width), pad_id, dtype=np.int64)
+                    attention = np.zeros((len(batch), width), dtype=np.int64)
+                    type_ids = np.zeros((len(batch), width), dtype=np.int64)
+                    for row, j in enumerate(batch):
+                        ids, types = pairs[j]
+                        input_ids[row, : len(ids)] = ids
+                        attention[row, : len(ids)] = 1
+                        type_ids[row, : len(types)] = types
+                        self.real_tokens += len(ids)
+                    self.padded_tokens += input_ids.size
+                    feed = {
+                        "input_ids": input_ids,
+                        "attention_mask": attention,
+                        "token_type_ids": type_ids,
+                    }
+                    logits = self._run(session, feed)
+                    for row, j in enumerate(batch):
+                        i = todo[j]
+                        scores[i] = float(logits[row])
+                        self._scores.set(f"{q_key}:{doc_keys[i]}", scores[i])
+            self.pairs_scored += len(todo)
+        return [float(sc) for sc in scores]  # type: ignore[arg-type]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "available": self.available(),
+            "variant": self.variant,
+            "pairs_scored": self.pairs_scored,
+            "padding_ratio": (
+                1.0 - self.real_tokens / self.padded_tokens if self.padded_tokens else 0.0
+            ),
+            "token_cache": self._doc_tokens.stats(),
+            "score_cache": self._scores.stats(),
+            "sessions": self._pool.stats() if self._pool is not None else None,
+        }
 
     def rerank(
         self,
@@ -124,8 +337,10 @@ class BgeOnnxReranker:
         metas: list[dict[str, Any]],
         top_k: int,
         batch_size: int = 16,
+        keys: Sequence[str | None] | None = None,
+        num_threads: int | None = None,
     ) -> tuple[list[str], list[dict[str, Any]]]:
-        scores = self.score(query, docs, batch_size=batch_size)
+        scores = self.score(query, docs, batch_size=batch_size, keys=keys, num_threads=num_threads)
         idxs = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
         return [docs[i] for i in idxs], [metas[i] for i in idxs]
 
@@ -138,19 +353,66 @@ def cosine_similarity(a: list[float], b: list[float]) -> float:
     return float(np.dot(va, vb) / (na * nb))
 
 
+def cosine_scores(query: Sequence[float], docs: Sequence[Sequence[float]]) -> np.ndarray:
+    """Cosine similarity của query với từng vector trong docs (một phép matmul)."""
+    q = np.asarray(query, dtype=np.float32)
+    m = np.asarray(docs, dtype=np.float32).reshape(len(docs), -1)
+    q = q / (np.linalg.norm(q) + 1e-12)
+    m = m / (np.linalg.norm(m, axis=1, keepdims=True) + 1e-12)
+    return m @ q
+
+
 class SimpleEmbedReranker:
-    """Reranker fallback: dùng embedding cosine similarity (Ollama embed)."""
+    """Reranker fallback: dùng embedding cosine similarity (Ollama embed).
+
+    Nhận thêm `doc_embeddings` (vector đã lưu trong Chroma/FAISS theo chunk ID) → chỉ
+    embed query (+ chunk thiếu vector), chấm điểm bằng một phép nhân ma trận.
+    """
 
     def __init__(self, embedder):
         self.embedder = embedder  # callable: List[str] -> List[List[float]]
 
+    def _vectors(
+        self,
+        query: str,
+        docs: list[str],
+        doc_embeddings: Sequence[Sequence[float] | None] | None,
+    ) -> tuple[list[float], list[Sequence[float]]]:
+        stored = list(doc_embeddings) if doc_embeddings is not None else [None] * len(docs)
+        missing = [i for i, e in enumerate(stored) if e is None or not len(e)]
+        embs = self.embedder([query] + [docs[i] for i in missing])
+        q_emb = list(embs[0])
+        for j, i in enumerate(missing):
+            stored[i] = embs[1 + j]
+        # Vector lưu từ model embed khác (khác số chiều) → embed lại những chunk đó
+        stale = [i for i, e in enumerate(stored) if len(e) != len(q_emb)]
+        if stale:
+            for i, e in zip(stale, self.embedder([docs[i] for i in stale]), strict=True):
+                stored[i] = e
+        return q_emb, stored  # type: ignore[return-value]
+
+    def score(
+        self,
+        query: str,
+        docs: list[str],
+        doc_embeddings: Sequence[Sequence[float] | None] | None = None,
+    ) -> list[float]:
+        if not docs:
+            return []
+        q_emb, d_embs = self._vectors(query, docs, doc_embeddings)
+        return cosine_scores(q_emb, d_embs).tolist()
+
     def rerank(
-        self, query: str, docs: list[str], metas: list[dict[str, Any]], top_k: int
+        self,
+        query: str,
+        docs: list[str],
+        metas: list[dict[str, Any]],
+        top_k: int,
+        doc_embeddings: Sequence[Sequence[float] | None] | None = None,
     ) -> tuple[list[str], list[dict[str, Any]]]:
-        embs = self.embedder([query] + docs)
-        q_emb = embs[0]
-        d_embs = embs[1:]
-        pairs = [(cosine_similarity(q_emb, d_embs[i]), i) for i in range(len(docs))]
-        pairs.sort(key=lambda x: x[0], reverse=True)
-        idxs = [i for _, i in pairs[:top_k]]
+        if not docs:
+            return [], []
+        scores = np.asarray(self.score(query, docs, doc_embeddings), dtype=np.float32)
+        # Stable: hòa điểm giữ thứ tự retrieval
+        idxs = [int(i) for i in np.argsort(-scores, kind="stable")[:top_k]]
         return [docs[i] for i in idxs], [metas[i] for i in idxs]
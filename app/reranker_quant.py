@@ -0,0 +1,224 @@
+"""
+Reranker Quant - biến thể INT8/FP16 cho BGE ONNX reranker ⚡
+
+Cross-encoder FP32 trên CPUExecutionProvider là bước tốn CPU nhất khi bật rerank:
+
+- ✅ Chuyển đổi offline (scripts/quantize_reranker.py): INT8 dynamic quantization
+  (không cần dữ liệu calibration), FP16 tùy chọn → cache dưới RERANK_MODEL_DIR
+- ✅ Kiểm tra độ chính xác so với FP32 trên eval set → report JSON cạnh model
+- ✅ RERANK_MODEL_VARIANT=auto: dùng INT8 (rồi FP16) nếu đã convert *và* report đạt ngưỡng,
+  ngược lại FP32 từ HF Hub
+"""
+
+import contextlib
+import json
+import logging
+import os
+import time
+from collections.abc import Callable, Sequence
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = ("fp32", "int8", "fp16")
+# auto: thứ tự ưu tiên khi chọn biến thể đã convert + đã kiểm tra
+AUTO_ORDER = ("int8", "fp16")
+
+RERANK_MODEL_VARIANT = os.getenv("RERANK_MODEL_VARIANT", "auto").strip().lower()
+RERANK_MODEL_DIR = os.getenv("RERANK_MODEL_DIR", os.path.join("data", "models", "reranker"))
+# Ngưỡng chấp nhận: trung bình tỉ lệ trùng top-k và tương quan hạng Spearman với FP32
+RERANK_QUANT_MIN_TOPK_OVERLAP = float(os.getenv("RERANK_QUANT_MIN_TOPK_OVERLAP", "0.9"))
+RERANK_QUANT_MIN_SPEARMAN = float(os.getenv("RERANK_QUANT_MIN_SPEARMAN", "0.95"))
+
+
+def _slug(repo_id: str) -> str:
+    return repo_id.replace("/", "__")
+
+
+def variant_path(repo_id: str, variant: str, model_dir: str | None = None) -> str:
+    """Đường dẫn cục bộ của model đã convert (model_int8.onnx / model_fp16.onnx)."""
+    return os.path.join(model_dir or RERANK_MODEL_DIR, _slug(repo_id), f"model_{variant}.onnx")
+
+
+def report_path(model_path: str) -> str:
+    return model_path + ".check.json"
+
+
+def load_report(model_path: str) -> dict[str, Any] | None:
+    try:
+        with open(report_path(model_path), encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def resolve_variant(
+    repo_id: str, variant: str | None = None, model_dir: str | None = None
+) -> tuple[str, str | None]:
+    """
+    Chọn biến thể model → (variant, local_path). local_path=None nghĩa là FP32 từ HF Hub.
+
+    - fp32: luôn HF Hub
+    - int8/fp16: dùng file cục bộ nếu có (không bắt buộc report), thiếu file → fp32
+    - auto: biến thể đầu tiên trong AUTO_ORDER có file và report "passed"
+    """
+    v = (variant or RERANK_MODEL_VARIANT or "auto").strip().lower()
+    if v in ("int8", "fp16"):
+        path = variant_path(repo_id, v, model_dir)
+        if os.path.exists(path):
+            return v, path
+        logger.warning("Reranker variant %s not found at %s, using fp32", v, path)
+        return "fp32", None
+    if v == "auto":
+        for cand in AUTO_ORDER:
+            path = variant_path(repo_id, cand, model_dir)
+            report = load_report(path)
+            if os.path.exists(path) and report and report.get("passed"):
+                return cand, path
+    return "fp32", None
+
+
+def _ranks(values: Sequence[float]) -> list[float]:
+    """Hạng trung bình (xử lý giá trị bằng nhau) cho Spearman."""
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for t in range(i, j + 1):
+            ranks[order[t]] = (i + j) / 2.0
+        i = j + 1
+    return ranks
+
+
+def spearman(a: Sequence[float], b: Sequence[float]) -> float:
+    n = len(a)
+    if n < 2:
+        return 1.0
+    ra, rb = _ranks(a), _ranks(b)
+    ma, mb = sum(ra) / n, sum(rb) / n
+    cov = sum((x - ma) * (y - mb) for x, y in zip(ra, rb, strict=False))
+    va = sum((x - ma) ** 2 for x in ra)
+    vb = sum((y - mb) ** 2 for y in rb)
+    if va == 0 or vb == 0:
+        return 1.0 if va == vb else 0.0
+    return cov / (va * vb) ** 0.5
+
+
+def topk_overlap(a: Sequence[float], b: Sequence[float], k: int) -> float:
+    k = min(k, len(a))
+    if k <= 0:
+        return 1.0
+    top_a = set(sorted(range(len(a)), key=lambda i: a[i], reverse=True)[:k])
+    top_b = set(sorted(range(len(b)), key=lambda i: b[i], reverse=True)[:k])
+    return len(top_a & top_b) / k
+
+
+def compare_scores(
+    reference: Sequence[Sequence[float]],
+    candidate: Sequence[Sequence[float]],
+    k: int = 5,
+    min_topk_overlap: float | None = None,
+    min_spearman: float | None = None,
+) -> dict[str, Any]:
+    """So điểm biến thể với FP32 theo từng query (mỗi phần tử = điểm các candidate)."""
+    min_overlap = RERANK_QUANT_MIN_TOPK_OVERLAP if min_topk_overlap is None else min_topk_overlap
+    min_rho = RERANK_QUANT_MIN_SPEARMAN if min_spearman is None else min_spearman
+    overlaps: list[float] = []
+    rhos: list[float] = []
+    top1 = 0
+    max_abs = 0.0
+    for ref, cand in zip(reference, candidate, strict=True):
+        if not ref:
+            continue
+        overlaps.append(topk_overlap(ref, cand, k))
+        rhos.append(spearman(ref, cand))
+        best_ref = max(range(len(ref)), key=ref.__getitem__)
+        top1 += int(best_ref == max(range(len(cand)), key=cand.__getitem__))
+        max_abs = max(max_abs, max(abs(x - y) for x, y in zip(ref, cand, strict=False)))
+    n = len(overlaps)
+    mean_overlap = sum(overlaps) / n if n else 0.0
+    mean_rho = sum(rhos) / n if n else 0.0
+    return {
+        "queries": n,
+        "k": k,
+        "topk_overlap": mean_overlap,
+        "spearman": mean_rho,
+        "top1_agreement": top1 / n if n else 0.0,
+        "max_abs_diff": max_abs,
+        "passed": bool(n) and mean_overlap >= min_overlap and mean_rho >= min_rho,
+        "thresholds": {"topk_overlap": min_overlap, "spearman": min_rho},
+    }
+
+
+def quantize_model(src_path: str, dst_path: str, variant: str = "int8") -> str:
+    """
+    Convert model FP32 → INT8 (dynamic, weight per-channel) hoặc FP16.
+
+    INT8 cần onnxruntime (+ onnx); FP16 cần onnxconverter-common. Model > 2GB
+    được lưu với external data cạnh file .onnx. Report kiểm tra cũ bị xóa: nó thuộc
+    về model trước, auto chỉ chọn lại biến thể này sau khi kiểm tra lại.
+    """
+    if variant not in ("int8", "fp16"):
+        raise ValueError(f"Unsupported reranker variant: {variant}")
+    os.makedirs(os.path.dirname(dst_path) or ".", exist_ok=True)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(report_path(dst_path))
+    t0 = time.time()
+    if variant == "int8":
+        from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+
+        quantize_dynamic(
+            src_path,
+            dst_path,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            use_external_data_format=os.path.getsize(src_path) > (1 << 31) - 1,
+        )
+    else:
+        import onnx  # type: ignore
+        from onnxconverter_common import float16  # type: ignore
+
+        model = onnx.load(src_path)
+        model = float16.convert_float_to_float16(model, keep_io_types=True)
+        # Model FP32 > 4GB → bản FP16 vẫn vượt giới hạn 2GB của protobuf
+        onnx.save_model(
+            model, dst_path, save_as_external_data=os.path.getsize(src_path) > (1 << 32) - 1
+        )
+    logger.info("Quantized reranker %s → %s (%.1fs)", variant, dst_path, time.time() - t0)
+    return dst_path
+
+
+def check_variant(
+    score_ref: Callable[[str, list[str]], list[float]],
+    score_variant: Callable[[str, list[str]], list[float]],
+    eval_set: Sequence[tuple[str, list[str]]],
+    model_path: str | None = None,
+    k: int = 5,
+) -> dict[str, Any]:
+    """
+    Chấm eval set (query, candidates) bằng FP32 và biến thể, so sánh; ghi report nếu có model_path.
+    """
+    ref: list[list[float]] = []
+    cand: list[list[float]] = []
+    t_ref = t_var = 0.0
+    for query, docs in eval_set:
+        if not docs:
+            continue
+        t0 = time.perf_counter()
+        ref.append(list(score_ref(query, docs)))
+        t1 = time.perf_counter()
+        cand.append(list(score_variant(query, docs)))
+        t_ref += t1 - t0
+        t_var += time.perf_counter() - t1
+    report = compare_scores(ref, cand, k=k)
+    report["fp32_seconds"] = t_ref
+    report["variant_seconds"] = t_var
+    report["speedup"] = (t_ref / t_var) if t_var > 0 else 0.0
+    report["checked_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    if model_path:
+        with open(report_path(model_path), "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
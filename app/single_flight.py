@@ -0,0 +1,366 @@
+"""
+Single-flight request coalescing - một request chạy, các request giống hệt chờ kết quả 🛫
+
+Khi một câu hỏi "hot" đến hàng loạt cùng lúc (ví dụ ngay sau một thông báo),
+mọi request đều miss cache và tự gọi retrieval + LLM. SingleFlight gom các
+lời gọi đồng thời có cùng key lại: request đầu tiên (leader) thực thi, các
+request sau (followers) chờ và nhận chung kết quả.
+
+Features:
+- ✅ `do()` cho lời gọi trả về một giá trị (answer, generate)
+- ✅ `stream()` cho token stream: followers subscribe vào stream của leader
+- ✅ Lỗi của leader được truyền cho mọi followers
+- ✅ Caller async bị cancel chỉ rời khỏi lời gọi chung, không hủy kết quả của người khác
+- ✅ Producer của stream dừng khi không còn subscriber nào
+- ✅ Thread-safe, không phụ thuộc event loop
+- ✅ Biến thể async (`do_async`, `stream_async`) cho các route async
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from typing import Any, TypeVar
+
+try:
+    from app import metrics
+
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover
+    METRICS_ENABLED = False
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def normalize_query(text: str) -> str:
+    """Chuẩn hóa query cho coalescing key: gộp khoảng trắng, không phân biệt hoa/thường."""
+    return " ".join((text or "").split()).casefold()
+
+
+class _Call:
+    """Một lời gọi đang bay (in-flight) của `SingleFlight.do`."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.followers = 0
+
+
+class _AsyncCall:
+    """Một lời gọi đang bay của `SingleFlight.do_async`: task chạy `fn` + số caller đang chờ."""
+
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class _Broadcast:
+    """Buffer token dùng chung giữa producer và các subscribers của một stream."""
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._chunks: list[str] = []
+        self._done = False
+        self._error: BaseException | None = None
+        self.subscribers = 0
+        self._started = False  # đã có subscriber bắt đầu đọc
+
+    def publish(self, chunk: str) -> None:
+        with self._cond:
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error: BaseException | None = None) -> None:
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def has_subscribers(self) -> bool:
+        """Còn subscriber đang đọc (trước khi subscriber đầu tiên bắt đầu: coi như còn)."""
+        with self._cond:
+            return self.subscribers > 0 or not self._started
+
+    def subscribe(self) -> Iterator[str]:
+        """Replay các chunk đã có rồi chờ chunk mới cho đến khi producer kết thúc.
+
+        Subscriber chỉ được đếm từ lần `next()` đầu tiên: iterator không bao giờ được đọc
+        (không có `finally` để trừ) không giữ producer chạy mãi.
+        """
+        return self._iter()
+
+    def _iter(self) -> Iterator[str]:
+        with self._cond:
+            self.subscribers += 1
+            self._started = True
+        idx = 0
+        try:
+            while True:
+                with self._cond:
+                    while idx >= len(self._chunks) and not self._done:
+                        self._cond.wait()
+                    pending = self._chunks[idx:]
+                    idx += len(pending)
+                    finished = self._done and idx >= len(self._chunks)
+                    error = self._error
+                yield from pending
+                if finished:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+
+class _AsyncBroadcast:
+    """Như `_Broadcast` nhưng cho asyncio: producer là task, subscribers là async iterators."""
+
+    def __init__(self) -> None:
+        self._cond = asyncio.Condition()
+        self._chunks: list[str] = []
+        self._done = False
+        self._error: BaseException | None = None
+        self.subscribers = 0
+
+    async def publish(self, chunk: str) -> None:
+        async with self._cond:
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    async def finish(self, error: BaseException | None = None) -> None:
+        async with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def subscribe(self) -> AsyncIterator[str]:
+        self.subscribers += 1
+        return self._aiter()
+
+    async def _aiter(self) -> AsyncIterator[str]:
+        idx = 0
+        try:
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(lambda i=idx: i < len(self._chunks) or self._done)
+                    pending = self._chunks[idx:]
+                    idx += len(pending)
+                    finished = self._done and idx >= len(self._chunks)
+                    error = self._error
+                for chunk in pending:
+                    yield chunk
+                if finished:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self.subscribers -= 1
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls by key - một lần LLM cho cả đám đông! 🛫
+
+    Example:
+        >>> flight = SingleFlight("answer")
+        >>> result, shared = flight.do(key, expensive_fn, question)
+        >>> for token in flight.stream(key, lambda: llm.generate_stream(prompt)):
+        ...     print(token)
+    """
+
+    def __init__(self, name: str = "default"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self._streams: dict[str, _Broadcast] = {}
+        # Async calls/streams gắn với event loop của chúng
+        self._async_calls: dict[str, _AsyncCall] = {}
+        self._async_streams: dict[str, _AsyncBroadcast] = {}
+        self._producer_tasks: set[asyncio.Task] = set()  # giữ reference, tránh bị GC
+
+    def _record(self, kind: str, role: str) -> None:
+        if METRICS_ENABLED:
+            try:
+                metrics.record_singleflight(self.name, kind, role)
+            except Exception:
+                pass
+
+    def in_flight(self) -> int:
+        """Số key đang được thực thi (calls + streams)."""
+        with self._lock:
+            return (
+                len(self._calls)
+                + len(self._streams)
+                + len(self._async_calls)
+                + len(self._async_streams)
+            )
+
+    def do(self, key: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> tuple[T, bool]:
+        """
+        Execute `fn` once per key among concurrent callers.
+
+        Returns:
+            Tuple (result, shared) - shared=True nếu caller là follower
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.followers += 1
+
+        if not leader:
+            self._record("call", "follower")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        self._record("call", "leader")
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+            if call.followers:
+                logger.debug(f"SingleFlight '{self.name}': {call.followers} follower(s) coalesced")
+        return call.result, False
+
+    def stream(self, key: str, factory: Callable[[], Iterator[str]]) -> Iterator[str]:
+        """
+        Share one token stream per key among concurrent subscribers.
+
+        Producer chạy trong background thread để việc một client ngắt kết nối
+        không làm hỏng stream của các client khác; producer dừng sớm nếu
+        không còn subscriber nào.
+        """
+        with self._lock:
+            bc = self._streams.get(key)
+            leader = bc is None
+            if leader:
+                bc = _Broadcast()
+                self._streams[key] = bc
+            sub = bc.subscribe()
+
+        if not leader:
+            self._record("stream", "follower")
+            return sub
+
+        self._record("stream", "leader")
+
+        def _produce() -> None:
+            error: BaseException | None = None
+            try:
+                for chunk in factory():
+                    bc.publish(chunk)
+                    if not bc.has_subscribers():
+                        # Subscriber đến muộn không nhận nhầm một stream bị cắt cụt
+                        error = RuntimeError("single-flight stream stopped: no subscribers left")
+                        break
+            except BaseException as e:  # propagate to subscribers
+                error = e
+            finally:
+                with self._lock:
+                    if self._streams.get(key) is bc:
+                        self._streams.pop(key, None)
+                bc.finish(error)
+
+        # Thread không tự mang contextvars (deadline, llm_priority) → chạy trong bản sao context
+        ctx = contextvars.copy_context()
+        threading.Thread(
+            target=ctx.run, args=(_produce,), name=f"singleflight-{self.name}", daemon=True
+        ).start()
+        return sub
+
+    async def do_async(
+        self, key: str, fn: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any
+    ) -> tuple[T, bool]:
+        """
+        Async version của `do` - `fn` là coroutine function.
+
+        Returns:
+            Tuple (result, shared) - shared=True nếu caller là follower
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            call = self._async_calls.get(key)
+            leader = call is None or call.task.get_loop() is not loop
+            if leader:
+                # fn chạy trong task riêng (copy contextvars của leader): leader bị cancel
+                # chỉ tách leader ra, không hủy kết quả mà followers đang chờ
+                call = _AsyncCall(loop.create_task(fn(*args, **kwargs)))
+                self._async_calls[key] = call
+                call.task.add_done_callback(lambda _t, c=call: self._forget_async(key, c))
+            call.waiters += 1
+
+        self._record("call", "leader" if leader else "follower")
+        cancelled = False
+        try:
+            result = await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            with self._lock:
+                call.waiters -= 1
+                orphan = cancelled and call.waiters <= 0
+            if orphan:
+                # Không còn ai chờ → dừng task chung thay vì chạy LLM vô ích
+                call.task.cancel()
+        return result, not leader
+
+    def _forget_async(self, key: str, call: _AsyncCall) -> None:
+        with self._lock:
+            if self._async_calls.get(key) is call:
+                self._async_calls.pop(key, None)
+        if not call.task.cancelled():
+            call.task.exception()  # đánh dấu đã retrieve khi mọi caller đã rời đi
+
+    def stream_async(
+        self, key: str, factory: Callable[[], AsyncIterator[str]]
+    ) -> AsyncIterator[str]:
+        """Async version của `stream` - producer chạy như một asyncio task."""
+        with self._lock:
+            bc = self._async_streams.get(key)
+            leader = bc is None
+            if leader:
+                bc = _AsyncBroadcast()
+                self._async_streams[key] = bc
+            sub = bc.subscribe()
+
+        if not leader:
+            self._record("stream", "follower")
+            return sub
+
+        self._record("stream", "leader")
+
+        async def _produce() -> None:
+            error: BaseException | None = None
+            try:
+                async for chunk in factory():
+                    await bc.publish(chunk)
+                    if bc.subscribers <= 0:
+                        break
+            except BaseException as e:  # propagate to subscribers
+                error = e
+            finally:
+                with self._lock:
+                    if self._async_streams.get(key) is bc:
+                        self._async_streams.pop(key, None)
+                await bc.finish(error)
+
+        task = asyncio.get_running_loop().create_task(_produce())
+        self._producer_tasks.add(task)
+        task.add_done_callback(self._producer_tasks.discard)
+        return sub
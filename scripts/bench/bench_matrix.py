@@ -24,7 +24,7 @@ def wait_server(timeout=60):
 
 
 def ensure_ingest(db=None):
-    payload = {"paths": ["data/docs"]}
+    payload = {"paths": ["data/docs"], "wait": True}
     if db:
         payload["db"] = db
     r = requests.post(BASE + "/api/ingest", json=payload, timeout=120)
@@ -0,0 +1,94 @@
+"""
+Convert BGE ONNX reranker sang INT8 (hoặc FP16) và kiểm tra độ chính xác so với FP32.
+
+    python -m scripts.quantize_reranker --variant int8 --eval eval.json --db default
+
+eval.json dùng cùng định dạng với /api/eval/offline ({"queries": [{"query": ...}, ...]}
+hoặc list các item). Candidates mỗi query lấy từ retrieval của DB như khi rerank thật.
+Report ghi cạnh model (<model>.check.json); RERANK_MODEL_VARIANT=auto chỉ dùng biến thể
+có report "passed".
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from app.reranker import BgeOnnxReranker
+from app.reranker_quant import (
+    RERANK_MODEL_DIR,
+    check_variant,
+    quantize_model,
+    variant_path,
+)
+
+
+def load_eval_queries(path: str) -> list[str]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    items = data.get("queries", []) if isinstance(data, dict) else data
+    out: list[str] = []
+    for it in items:
+        q = it.get("query") if isinstance(it, dict) else it
+        if q and str(q).strip():
+            out.append(str(q).strip())
+    return out
+
+
+def build_eval_set(queries: list[str], db: str | None, method: str, top_n: int):
+    from app.rag_engine import RagEngine
+
+    engine = RagEngine(persist_dir=os.path.join("data", "chroma"))
+    if db:
+        engine.use_db(db)
+    eval_set: list[tuple[str, list[str]]] = []
+    for q in queries:
+        res = engine.retrieve_aggregate(q, top_k=top_n, method=method)
+        eval_set.append((q, list(res.get("documents", []))[:top_n]))
+    return eval_set
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--variant", choices=["int8", "fp16"], default="int8")
+    ap.add_argument("--repo-id", default="BAAI/bge-reranker-v2-m3")
+    ap.add_argument("--model-dir", default=RERANK_MODEL_DIR)
+    ap.add_argument("--eval", dest="eval_path", help="Eval set JSON (queries)")
+    ap.add_argument("--db", default=None)
+    ap.add_argument("--method", default="hybrid")
+    ap.add_argument("--top-n", type=int, default=30, help="Candidates mỗi query")
+    ap.add_argument("--k", type=int, default=5, help="So trùng top-k với FP32")
+    ap.add_argument("--skip-convert", action="store_true", help="Chỉ chạy lại bước kiểm tra")
+    args = ap.parse_args(argv)
+
+    fp32 = BgeOnnxReranker(repo_id=args.repo_id, variant="fp32")
+    dst = variant_path(args.repo_id, args.variant, args.model_dir)
+    if not args.skip_convert:
+        src = fp32.fp32_model_path()
+        if src is None:
+            print(f"Cannot download FP32 ONNX model for {args.repo_id}", file=sys.stderr)
+            return 1
+        quantize_model(src, dst, args.variant)
+        print(f"Wrote {dst}")
+    if not args.eval_path:
+        print("No --eval given: variant not checked, auto mode will not select it yet")
+        return 0
+
+    quant = BgeOnnxReranker(repo_id=args.repo_id, variant=args.variant, model_dir=args.model_dir)
+    if not fp32.available() or quant.variant != args.variant or not quant.available():
+        print("Reranker sessions unavailable (onnxruntime/transformers?)", file=sys.stderr)
+        return 1
+    eval_set = build_eval_set(load_eval_queries(args.eval_path), args.db, args.method, args.top_n)
+    report = check_variant(
+        lambda q, d: fp32.score(q, d, batch_size=32),
+        lambda q, d: quant.score(q, d, batch_size=32),
+        eval_set,
+        model_path=dst,
+        k=args.k,
+    )
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report["passed"] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -69,6 +69,21 @@ def mock_ollama_in_ci(monkeypatch):
     except ImportError as e:
         print(f"⚠️ Could not mock OllamaClient: {e}")
 
+    # Mock async client (used by async query routes)
+    async def mock_async_embed(self, texts, model: str = None):
+        return mock_embed(self, texts, model)
+
+    async def mock_async_generate(self, prompt: str, model: str = None, **kwargs) -> str:
+        return mock_generate(self, prompt, model)
+
+    try:
+        from app.ollama_client import AsyncOllamaClient
+
+        monkeypatch.setattr(AsyncOllamaClient, "embed", mock_async_embed)
+        monkeypatch.setattr(AsyncOllamaClient, "generate", mock_async_generate)
+    except ImportError as e:
+        print(f"⚠️ Could not mock AsyncOllamaClient: {e}")
+
     yield
 
     print("🧹 Cleaning up Ollama mocks")
@@ -48,6 +48,9 @@ class FakeEngine:
             "contexts": [],
         }
 
+    async def answer_async(self, query: str, **kwargs: Any) -> dict[str, Any]:
+        return self.answer(query, **kwargs)
+
 
 @pytest.fixture()
 def client(monkeypatch):
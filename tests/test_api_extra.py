@@ -3,13 +3,16 @@
 Extra API tests:
 - /api/analytics/chat/{id}: create a chat then fetch analytics
 - /api/logs/export with since/until: ensure 200 OK
+- /api/eval/offline: LLM overload keeps 503 + Retry-After
 """
 
 import unittest
+from unittest import mock
 
 from fastapi.testclient import TestClient
 
-from app.main import app
+from app.exceptions import LLMOverloadedError
+from app.main import app, engine
 
 
 class ApiExtraTests(unittest.TestCase):
@@ -45,6 +48,13 @@ class ApiExtraTests(unittest.TestCase):
         r = self.client.get("/api/logs/export?since=19700101&until=29991231")
         self.assertEqual(r.status_code, 200)
 
+    def test_eval_offline_overload_is_503(self):
+        err = LLMOverloadedError("queue full", retry_after=7)
+        with mock.patch.object(engine, "retrieve_aggregate", side_effect=err):
+            r = self.client.post("/api/eval/offline", json={"queries": [{"query": "q"}]})
+        self.assertEqual(r.status_code, 503, r.text)
+        self.assertEqual(r.headers.get("Retry-After"), "7")
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,210 @@
+"""
+Tests for the async LLM path: AsyncOllamaClient / AsyncOpenAIClient (httpx),
+async single-flight and RagEngine.answer_async.
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.ollama_client import AsyncOllamaClient
+from app.openai_client import AsyncOpenAIClient
+from app.rag_engine import RagEngine
+from app.single_flight import SingleFlight
+
+
+def _ollama_transport(calls: list[str]) -> httpx.MockTransport:
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(f"{request.url.host}{request.url.path}")
+        body = json.loads(request.content or b"{}")
+        if request.url.path == "/api/embeddings":
+            return httpx.Response(200, json={"embedding": [float(len(body["prompt"]))]})
+        if body.get("stream"):
+            lines = [
+                json.dumps({"response": "Xin ", "done": False}),
+                json.dumps({"response": "chào", "done": True}),
+            ]
+            return httpx.Response(200, content="\n".join(lines).encode())
+        return httpx.Response(200, json={"response": "ok"})
+
+    return httpx.MockTransport(handler)
+
+
+def test_async_ollama_stream_and_embed():
+    calls: list[str] = []
+    client = AsyncOllamaClient(
+        base_url="http://a:11434,http://b:11434", transport=_ollama_transport(calls)
+    )
+
+    async def run():
+        tokens = [t async for t in client.generate_stream("hi")]
+        embs = await client._embed_impl(["x", "yy", "zzz"])
+        text = await client._generate_guarded("hi")
+        await client.aclose()
+        return tokens, embs, text
+
+    tokens, embs, text = asyncio.run(run())
+    assert "".join(tokens) == "Xin chào"
+    assert embs == [[1.0], [2.0], [3.0]]
+    assert text == "ok"
+    # Embeddings được phân phối qua cả hai backend
+    assert {c.split("/")[0] for c in calls if c.endswith("/api/embeddings")} == {"a", "b"}
+
+
+def test_async_ollama_stream_fails_over_to_healthy_backend():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "down":
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, content=json.dumps({"response": "up", "done": True}).encode())
+
+    client = AsyncOllamaClient(
+        base_url="http://down:11434,http://up:11434", transport=httpx.MockTransport(handler)
+    )
+
+    async def run():
+        return [t async for t in client.generate_stream("hi")]
+
+    assert asyncio.run(run()) == ["up"]
+
+
+def test_async_openai_stream_and_generate():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.headers["Authorization"] == "Bearer k"
+        body = json.loads(request.content)
+        if body["stream"]:
+            sse = (
+                'data: {"choices":[{"delta":{"content":"A"}}]}\n\n'
+                'data: {"choices":[{"delta":{"content":"B"}}]}\n\n'
+                "data: [DONE]\n\n"
+            )
+            return httpx.Response(200, content=sse.encode())
+        return httpx.Response(200, json={"choices": [{"message": {"content": "full"}}]})
+
+    client = AsyncOpenAIClient(
+        base_url="http://oai/v1", api_key="k", transport=httpx.MockTransport(handler)
+    )
+
+    async def run():
+        tokens = [t async for t in client.generate_stream("q")]
+        return tokens, await client.generate("q")
+
+    tokens, text = asyncio.run(run())
+    assert tokens == ["A", "B"]
+    assert text == "full"
+
+
+def test_single_flight_do_async_coalesces():
+    flight = SingleFlight("test")
+    calls = {"n": 0}
+
+    async def slow():
+        calls["n"] += 1
+        await asyncio.sleep(0.05)
+        return "R"
+
+    async def run():
+        return await asyncio.gather(*(flight.do_async("k", slow) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert calls["n"] == 1
+    assert [r for r, _ in results] == ["R"] * 5
+    assert sum(1 for _, shared in results if not shared) == 1
+
+
+def test_single_flight_do_async_survives_leader_cancel():
+    flight = SingleFlight("test")
+    calls = {"n": 0}
+
+    async def slow():
+        calls["n"] += 1
+        await asyncio.sleep(0.05)
+        return "R"
+
+    async def run():
+        leader = asyncio.create_task(flight.do_async("k", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do_async("k", slow))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        result = await follower
+        # Mọi caller rời đi → task chung bị hủy
+        lone = asyncio.create_task(flight.do_async("k2", slow))
+        await asyncio.sleep(0.01)
+        lone.cancel()
+        await asyncio.sleep(0.01)
+        return result, flight.in_flight()
+
+    assert asyncio.run(run()) == (("R", True), 0)
+    assert calls["n"] == 2
+
+
+def test_single_flight_stream_async_shares_tokens():
+    flight = SingleFlight("test")
+    produced = {"n": 0}
+
+    async def factory():
+        produced["n"] += 1
+        for t in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield t
+
+    async def consume(it):
+        return "".join([t async for t in it])
+
+    async def run():
+        s1 = flight.stream_async("k", factory)
+        s2 = flight.stream_async("k", factory)
+        return await asyncio.gather(consume(s1), consume(s2))
+
+    assert asyncio.run(run()) == ["abc", "abc"]
+    assert produced["n"] == 1
+
+
+class _FakeGenCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+
+class _FakeAsyncLLM:
+    async def generate(self, prompt):
+        return f"LLM:{len(prompt)}"
+
+
+class _FakeLLM:
+    def async_client(self):
+        return _FakeAsyncLLM()
+
+
+class _AsyncDummyEngine(RagEngine):
+    def __init__(self):  # bỏ qua init nặng (Chroma/Ollama)
+        self.default_provider = "ollama"
+        self.persist_root = "data"
+        self.db_name = "test_async"
+        self._corpus_stamp = "0"
+        self.gen_cache = _FakeGenCache()
+        self._answer_flight = SingleFlight("answer")
+        self._gen_flight = SingleFlight("generate")
+
+    def retrieve(self, query, top_k=5, where=None, languages=None, versions=None):
+        return {"documents": ["doc A", "doc B"], "metadatas": [{"source": "a"}, {"source": "b"}]}
+
+    def _get_llm(self, provider=None):
+        return _FakeLLM()
+
+
+def test_answer_async_matches_sync_shape():
+    eng = _AsyncDummyEngine()
+    res = asyncio.run(eng.answer_async("Câu hỏi?", top_k=1))
+    assert res["answer"].startswith("LLM:")
+    assert res["contexts"] == ["doc A"]
+    assert res["metadatas"] == [{"source": "a"}]
+    assert res["method"] == "vector"
+    # Engine dựng không qua __init__ vẫn pack contexts (packer tạo lazily)
+    assert res["packing"]["kept"] == 1
@@ -0,0 +1,149 @@
+"""
+Unit tests for multi-backend load balancing (app/backend_pool.py).
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.backend_pool import STRATEGY_EWMA, BackendPool, parse_backend_urls
+from app.circuit_breaker import CircuitBreakerConfig, CircuitBreakerError
+
+URLS = ["http://a:11434", "http://b:11434", "http://c:11434"]
+
+
+def test_parse_backend_urls():
+    assert parse_backend_urls(" http://a:11434/, http://b:11434 ,,http://a:11434") == [
+        "http://a:11434",
+        "http://b:11434",
+    ]
+    assert parse_backend_urls(None) == []
+
+
+def test_requires_at_least_one_backend():
+    with pytest.raises(ValueError):
+        BackendPool([])
+
+
+def test_least_outstanding_spreads_concurrent_requests():
+    pool = BackendPool(URLS)
+    gate = threading.Event()
+    seen = []
+    lock = threading.Lock()
+
+    def fn(url):
+        with lock:
+            seen.append(url)
+        gate.wait(2)
+        return url
+
+    threads = [threading.Thread(target=pool.call, args=(fn,)) for _ in range(3)]
+    for t in threads:
+        t.start()
+        time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join(5)
+    assert sorted(seen) == sorted(URLS)
+    assert all(b.outstanding == 0 for b in pool.backends)
+
+
+def test_sequential_requests_rotate_backends():
+    pool = BackendPool(URLS)
+    used = [pool.call(lambda url: url) for _ in range(6)]
+    assert set(used) == set(URLS)
+
+
+def test_failover_to_next_backend():
+    pool = BackendPool(URLS[:2])
+
+    def fn(url):
+        if url == URLS[0]:
+            raise ConnectionError("down")
+        return url
+
+    assert all(pool.call(fn) == URLS[1] for _ in range(3))
+
+
+def test_open_circuit_excludes_backend():
+    cfg = CircuitBreakerConfig(failure_threshold=1, timeout=60)
+    pool = BackendPool(URLS[:2], breaker_config=cfg)
+
+    def fn(url):
+        if url == URLS[0]:
+            raise ConnectionError("down")
+        return url
+
+    pool.call(fn)  # opens circuit of backend a
+    calls = []
+    for _ in range(3):
+        pool.call(lambda url: calls.append(url) or url)
+    assert calls == [URLS[1]] * 3
+
+
+def test_all_backends_open_raises():
+    cfg = CircuitBreakerConfig(failure_threshold=1, timeout=60)
+    pool = BackendPool(URLS[:1], breaker_config=cfg)
+    with pytest.raises(ConnectionError):
+        pool.call(lambda url: (_ for _ in ()).throw(ConnectionError("down")))
+    with pytest.raises(CircuitBreakerError):
+        pool.call(lambda url: url)
+
+
+def test_ewma_prefers_faster_backend():
+    pool = BackendPool(URLS[:2], strategy=STRATEGY_EWMA)
+    pool.backends[0].ewma_latency_s = 2.0
+    pool.backends[1].ewma_latency_s = 0.1
+    assert pool.pick().url == URLS[1]
+
+
+def test_hedged_request_uses_faster_leg():
+    pool = BackendPool(URLS[:2])
+    pool.backends[1].outstanding = 1  # primary sẽ là backend a
+
+    def fn(url):
+        if url == URLS[0]:
+            time.sleep(1.0)
+        return url
+
+    start = time.time()
+    assert pool.call_hedged(fn, hedge_delay_s=0.05) == URLS[1]
+    assert time.time() - start < 0.9
+
+
+def test_stream_holds_lease_and_fails_over_on_open():
+    pool = BackendPool(URLS[:2])
+
+    def open_fn(url):
+        if url == URLS[0]:
+            raise ConnectionError("refused")
+        return url
+
+    it = pool.stream(open_fn, lambda url: iter([url, "!"]))
+    assert next(it) == URLS[1]
+    assert pool.backends[1].outstanding == 1
+    assert list(it) == ["!"]
+    assert pool.backends[1].outstanding == 0
+
+
+def test_cancelled_lease_is_not_a_latency_sample():
+    pool = BackendPool(URLS[:1])
+    backend = pool.backends[0]
+    backend.ewma_latency_s = 0.2
+
+    async def slow():
+        with pool.lease(backend):
+            await asyncio.sleep(5)
+
+    async def run():
+        task = asyncio.create_task(slow())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert backend.outstanding == 0
+    assert backend.ewma_latency_s == 0.2
@@ -0,0 +1,195 @@
+"""
+Tests for BgeOnnxReranker batching/caching (app/reranker.py) with a fake tokenizer + session.
+"""
+
+import numpy as np
+import pytest
+
+from app import reranker as rr_mod
+from app.reranker import BgeOnnxReranker, _truncate_pair
+
+CLS, PAD, SEP = 0, 1, 2
+
+
+class FakeTokenizer:
+    """Whitespace tokenizer theo kiểu XLM-R: <s> q </s></s> d </s>."""
+
+    pad_token_id = PAD
+
+    def __init__(self):
+        self.vocab: dict[str, int] = {}
+        self.calls: list[list[str]] = []
+
+    def _ids(self, text):
+        return [self.vocab.setdefault(w, 10 + len(self.vocab)) for w in text.lower().split()]
+
+    def __call__(self, texts, add_special_tokens=False, truncation=True, max_length=512):
+        batch = [texts] if isinstance(texts, str) else list(texts)
+        self.calls.append(batch)
+        ids = [self._ids(t)[:max_length] for t in batch]
+        return {"input_ids": ids[0] if isinstance(texts, str) else ids}
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 4 if pair else 2
+
+    def build_inputs_with_special_tokens(self, q, d):
+        return [CLS] + q + [SEP, SEP] + d + [SEP]
+
+
+class FakeBinding:
+    def __init__(self, session):
+        self.session = session
+        self.inputs = {}
+
+    def bind_cpu_input(self, name, arr):
+        self.inputs[name] = arr
+
+    def bind_output(self, name):
+        pass
+
+    def copy_outputs_to_cpu(self):
+        return [self.session.outputs]
+
+
+class FakeSession:
+    """Điểm = số token của query xuất hiện trong doc (chỉ trong attention mask)."""
+
+    def __init__(self, query_ids, io_binding=True):
+        self.query_ids = set(query_ids)
+        self.shapes: list[tuple[int, int]] = []
+        self.bound = 0
+        self.io = io_binding
+        self.outputs = None
+
+    def _score(self, feed):
+        ids, mask = feed["input_ids"], feed["attention_mask"]
+        self.shapes.append(ids.shape)
+        out = []
+        for row, m in zip(ids, mask, strict=True):
+            toks = row[m.astype(bool)].tolist()
+            first_sep = toks.index(SEP)
+            doc = toks[first_sep + 2 : -1]
+            out.append([float(sum(1 for t in doc if t in self.query_ids))])
+        return np.array(out, dtype=np.float32)
+
+    def io_binding(self):
+        if not self.io:
+            raise RuntimeError("no io binding")
+        return FakeBinding(self)
+
+    def run_with_iobinding(self, binding):
+        self.bound += 1
+        self.outputs = self._score(binding.inputs)
+
+    def run(self, names, feed):
+        return [self._score(feed)]
+
+
+@pytest.fixture
+def reranker():
+    rr = BgeOnnxReranker()
+    rr._tokenizer = FakeTokenizer()
+    rr._input_names = ["input_ids", "attention_mask"]
+    rr._output_names = ["logits"]
+    return rr
+
+
+def _attach_session(rr, query, io_binding=True):
+    rr._session = FakeSession(rr._tokenizer._ids(query), io_binding=io_binding)
+    rr._tokenizer.calls.clear()
+    return rr._session
+
+
+DOCS = [
+    "bảo hành",
+    "chính sách bảo hành sản phẩm trong mười hai tháng kể từ ngày mua hàng",
+    "đổi trả",
+    "hướng dẫn cài đặt phần mềm và bảo hành thiết bị điện tử tại trung tâm",
+    "không",
+]
+
+
+def test_truncate_pair_longest_first():
+    assert _truncate_pair([1, 2], [3, 4, 5], 10) == ([1, 2], [3, 4, 5])
+    # Cắt doc (dài hơn) trước, tới khi bằng nhau thì cắt luân phiên (hòa → doc)
+    assert _truncate_pair([1, 2], list(range(10)), 6) == ([1, 2], [0, 1, 2, 3])
+    q, d = _truncate_pair(list(range(5)), list(range(5)), 7)
+    assert (len(q), len(d)) == (4, 3)
+
+
+def test_scores_match_unbucketed_and_batches_are_length_sorted(reranker):
+    session = _attach_session(reranker, "bảo hành sản phẩm")
+    scores = reranker.score("bảo hành sản phẩm", DOCS, batch_size=2)
+    assert scores == [2.0, 4.0, 0.0, 2.0, 0.0]
+    # Batch theo độ dài: các chunk ngắn đi cùng nhau, chunk dài đi cùng nhau
+    assert [s[0] for s in session.shapes] == [2, 2, 1]
+    widths = [s[1] for s in session.shapes]
+    assert widths == sorted(widths)
+    # Padding ít hơn nhiều so với batch theo thứ tự retrieval
+    lengths = [len(d.split()) + 3 + 4 for d in DOCS]
+    naive = sum(
+        max(lengths[i : i + 2]) * len(lengths[i : i + 2]) for i in range(0, len(lengths), 2)
+    )
+    assert reranker.stats()["padding_ratio"] < 1 - sum(lengths) / naive
+    assert session.bound == 3
+
+
+def test_token_budget_limits_batch(reranker, monkeypatch):
+    monkeypatch.setattr(rr_mod, "RERANK_MAX_BATCH_TOKENS", 64)
+    session = _attach_session(reranker, "bảo hành")
+    reranker.score("bảo hành", DOCS, batch_size=16)
+    assert all(rows * width <= 64 or rows == 1 for rows, width in session.shapes)
+    assert len(session.shapes) > 1
+
+
+def test_doc_tokens_and_scores_are_cached_by_chunk_id(reranker):
+    ids = [f"c{i}" for i in range(len(DOCS))]
+    session = _attach_session(reranker, "bảo hành")
+    first = reranker.score("bảo hành", DOCS, keys=ids)
+    assert reranker._tokenizer.calls == [["bảo hành"], DOCS]
+
+    # Query mới: chỉ tokenize query, chunk lấy từ cache token
+    reranker._tokenizer.calls.clear()
+    reranker.score("sản phẩm", DOCS, keys=ids)
+    assert reranker._tokenizer.calls == [["sản phẩm"]]
+
+    # Lặp lại query cũ: điểm lấy từ LRU, không chạy model
+    runs = len(session.shapes)
+    assert reranker.score("bảo hành", DOCS, keys=ids) == first
+    assert len(session.shapes) == runs
+    assert reranker.pairs_scored == 2 * len(DOCS)
+
+
+def test_falls_back_to_session_run_without_io_binding(reranker):
+    session = _attach_session(reranker, "bảo hành", io_binding=False)
+    docs, _ = reranker.rerank("bảo hành", DOCS, [{}] * len(DOCS), top_k=2)
+    assert docs[0] in (DOCS[0], DOCS[1])
+    assert session.bound == 0 and session.shapes
+    assert reranker._io_binding is False
+
+
+def test_pool_sessions_share_prepacked_weights(monkeypatch):
+    created = []
+
+    class FakeOrt:
+        class ExecutionMode:
+            ORT_SEQUENTIAL = 0
+
+        class SessionOptions:
+            def add_session_config_entry(self, key, value):
+                pass
+
+        class PrepackedWeightsContainer:
+            pass
+
+        @staticmethod
+        def InferenceSession(path, sess_options=None, providers=None, **kwargs):
+            created.append(kwargs.get("prepacked_weights_container"))
+            return object()
+
+    rr = BgeOnnxReranker()
+    monkeypatch.setattr(rr_mod, "ort", FakeOrt)
+    rr._model_file = "model.onnx"
+    rr._make_session(2)
+    rr._make_session(4)
+    assert len(created) == 2 and created[0] is not None and created[0] is created[1]
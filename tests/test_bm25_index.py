@@ -0,0 +1,116 @@
+"""
+Tests for the compact BM25 index (app/bm25_index.py) and RagEngine.retrieve_bm25.
+"""
+
+import re
+import sys
+
+import numpy as np
+import pytest
+
+from app.bm25_index import CompactBM25
+
+
+def _tok(text):
+    return re.findall(r"\w+", text.lower())
+
+
+CORPUS = [
+    "Chính sách bảo hành sản phẩm mười hai tháng",
+    "Hướng dẫn cài đặt phần mềm trên máy tính",
+    "Bảo hành không áp dụng cho hư hỏng do người dùng",
+    "   ",
+    "Phần mềm cập nhật tự động mỗi tuần một lần",
+    "Sản phẩm được đổi trả trong bảy ngày",
+]
+METAS = [
+    {"source": "a.txt", "language": "vi", "version": "v1", "chunk": 0},
+    {"source": "a.txt", "language": "vi", "version": "v1", "chunk": 1},
+    {"source": "b.txt", "language": "vi", "version": "v2", "chunk": 0},
+    {"source": "c.txt", "language": "vi", "version": "v2", "chunk": 0},
+    {"source": "d.txt", "language": "en", "version": "v2", "chunk": 0},
+    {"source": "e.txt", "version": "v1", "chunk": 0},
+]
+IDS = [f"id{i}" for i in range(len(CORPUS))]
+
+
+def _index(page_size=2):
+    pages = [
+        (IDS[i : i + page_size], CORPUS[i : i + page_size], METAS[i : i + page_size])
+        for i in range(0, len(CORPUS), page_size)
+    ]
+    return CompactBM25.build(pages, _tok)
+
+
+def test_scores_match_rank_bm25():
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    kept = [d for d in CORPUS if d.strip()]
+    ref = rank_bm25.BM25Okapi([_tok(d) for d in kept])
+    idx = _index()
+    assert len(idx) == len(kept)
+    for q in ("bảo hành sản phẩm", "phần mềm phần mềm", "không có từ nào"):
+        np.testing.assert_allclose(idx.get_scores(_tok(q)), ref.get_scores(_tok(q)), rtol=1e-5)
+
+
+def test_top_k_with_metadata_mask_and_lazy_lookup():
+    idx = _index()
+    rows, scores = idx.top_k(_tok("bảo hành"), 2)
+    assert sorted(idx.chunk_ids(rows)) == ["id0", "id2"]
+    assert scores == sorted(scores, reverse=True)
+    mask = idx.filter_mask("version", ["v2"])
+    rows, scores = idx.top_k(_tok("bảo hành"), 5, mask)
+    # Chỉ chunks version v2 (id3 rỗng đã bị bỏ khi build), điểm 0 vẫn được trả như trước
+    assert idx.chunk_ids(rows) == ["id2", "id4"]
+    assert scores[0] > 0 == scores[1]
+    # Thiếu metadata → không khớp filter (như _meta_match)
+    assert not idx.filter_mask("language", ["vi", "en"])[-1]
+    assert idx.filter_mask("language", None) is None
+    assert idx.metadata(rows[0]) == METAS[2]
+    assert idx.metadata(len(idx) - 1) == {"source": "e.txt", "version": "v1", "chunk": 0}
+
+
+def test_empty_corpus_returns_none():
+    assert CompactBM25.build([(["x"], ["  "], [{}])], _tok) is None
+
+
+def test_compact_index_is_much_smaller_than_python_lists():
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    rng = np.random.default_rng(0)
+    words = [f"từ{i}" for i in range(3000)]
+    docs = [" ".join(rng.choice(words, 150)) for _ in range(1000)]
+    metas = [
+        {"source": f"doc{i // 10}.txt", "language": "vi", "version": "v1"} for i in range(1000)
+    ]
+    idx = CompactBM25.build([([f"{i:032x}" for i in range(1000)], docs, metas)], _tok)
+
+    tokens = [_tok(d) for d in docs]
+    ref = rank_bm25.BM25Okapi(tokens)
+
+    def deep(obj):
+        if isinstance(obj, dict):
+            return sys.getsizeof(obj) + sum(deep(k) + deep(v) for k, v in obj.items())
+        if isinstance(obj, list):
+            return sys.getsizeof(obj) + sum(deep(x) for x in obj)
+        return sys.getsizeof(obj)
+
+    legacy = deep(docs) + deep(metas) + deep(tokens) + deep(ref.doc_freqs) + deep(ref.idf)
+    assert idx.nbytes() * 5 < legacy
+
+
+def test_engine_retrieve_bm25_fetches_text_lazily(tmp_path, monkeypatch):
+    from app.rag_engine import RagEngine
+
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "bm25_test"))
+    eng.collection.add(
+        ids=IDS,
+        documents=[d if d.strip() else "trống" for d in CORPUS],
+        metadatas=METAS,
+        embeddings=[[0.1, 0.2]] * len(IDS),
+    )
+    monkeypatch.setattr("app.rag_engine.BM25_BUILD_PAGE_SIZE", 2)
+    res = eng.retrieve_bm25("bảo hành", top_k=3, versions=["v2"])
+    assert res["documents"][0] == CORPUS[2]
+    assert res["metadatas"][0] == METAS[2]
+    assert all(m["version"] == "v2" for m in res["metadatas"])
+    assert len(eng._bm25) == len(CORPUS)
+    assert not hasattr(eng, "_bm25_docs")
@@ -0,0 +1,88 @@
+"""
+Tests for batched bulk deletion in RagEngine.delete_sources.
+"""
+
+import pytest
+
+from app.rag_engine import RagEngine
+
+MANUAL = (
+    "Hướng dẫn sử dụng máy lọc nước: vệ sinh lõi lọc mỗi ba tháng, thay lõi sau mười hai "
+    "tháng, không dùng nước nóng, kiểm tra áp suất trước khi lắp đặt và khóa van tổng. "
+)
+
+
+class _RecordingCollection:
+    """Proxy ghi lại get/delete (Chroma Collection không cho setattr)."""
+
+    def __init__(self, inner):
+        self._inner = inner
+        self.gets = []
+        self.deletes = []
+
+    def get(self, *args, **kwargs):
+        self.gets.append(kwargs)
+        return self._inner.get(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        self.deletes.append(kwargs)
+        return self._inner.delete(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "bulk_delete_test"))
+    monkeypatch.setattr(eng.ollama, "embed", lambda texts: [[float(len(t)), 1.0] for t in texts])
+    texts = [f"Tài liệu số {i}: " + f"nội dung riêng {i} " * (60 + i) for i in range(4)]
+    eng.ingest_texts(texts, metadatas=[{"source": f"s{i}.txt"} for i in range(4)], version="v1")
+    return eng
+
+
+def _chunks_of(eng, source):
+    return len(eng.collection.get(where={"source": source}, include=[])["ids"])
+
+
+def test_delete_sources_batches_by_chunk_id(engine, monkeypatch):
+    expected = _chunks_of(engine, "s0.txt") + _chunks_of(engine, "s2.txt")
+    assert expected >= 4
+    monkeypatch.setattr("app.rag_engine.DELETE_BATCH_SIZE", 2)
+    rec = _RecordingCollection(engine.collection)
+    monkeypatch.setattr(engine, "collection", rec)
+
+    assert engine.delete_sources(["s0.txt", "s2.txt", "s0.txt", ""]) == expected
+    # IDs lấy từ chỉ mục summary (không đọc collection), xóa theo lô IDs cố định
+    assert rec.gets == []
+    assert all("ids" in d and len(d["ids"]) <= 2 for d in rec.deletes)
+    assert sum(len(d["ids"]) for d in rec.deletes) == expected
+    assert [s["source"] for s in engine.list_sources()] == ["s1.txt", "s3.txt"]
+    assert engine.delete_sources(["s0.txt"]) == 0
+
+
+def test_delete_sources_resolves_ids_with_in_filter_without_summary(engine, monkeypatch):
+    expected = _chunks_of(engine, "s1.txt") + _chunks_of(engine, "s3.txt")
+    monkeypatch.setattr(engine, "_meta_summary_ready", lambda: False)
+    rec = _RecordingCollection(engine.collection)
+    monkeypatch.setattr(engine, "collection", rec)
+
+    assert engine.delete_sources(["s1.txt", "s3.txt"]) == expected
+    assert rec.gets == [{"where": {"source": {"$in": ["s1.txt", "s3.txt"]}}, "include": []}]
+    assert _chunks_of(engine, "s1.txt") == _chunks_of(engine, "s3.txt") == 0
+
+
+def test_deleted_source_duplicates_are_not_promoted(tmp_path, monkeypatch):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "bulk_dedup_test"))
+    if eng.deduper is None:
+        pytest.skip("CHUNK_DEDUP disabled")
+    monkeypatch.setattr(eng.ollama, "embed", lambda texts: [[float(len(t)), 1.0] for t in texts])
+    eng.ingest_texts(
+        [MANUAL, MANUAL, MANUAL],
+        metadatas=[{"source": "a.txt"}, {"source": "b.txt"}, {"source": "c.txt"}],
+        version="v1",
+    )
+    assert [s["source"] for s in eng.list_sources()] == ["a.txt"]
+    # Xóa canonical (a) cùng duplicate (b) → chỉ c được promote
+    assert eng.delete_sources(["a.txt", "b.txt"]) == 1
+    assert [s["source"] for s in eng.list_sources()] == ["c.txt"]
@@ -0,0 +1,121 @@
+"""
+Tests for near-duplicate chunk detection (app/chunk_dedup.py) in the ingest pipeline.
+"""
+
+import numpy as np
+
+from app.chunk_dedup import (
+    CHUNK_DEDUP_SCOPE,
+    ChunkDeduper,
+    lsh_params,
+    minhash_signature,
+    signature_similarity,
+)
+from app.rag_engine import RagEngine
+
+MANUAL = (
+    "Để cài đặt thiết bị, hãy tháo nắp sau, lắp pin AA đúng chiều và đóng nắp lại. "
+    "Nhấn giữ nút nguồn ba giây cho tới khi đèn xanh nhấp nháy, sau đó kết nối "
+    "ứng dụng trên điện thoại qua Bluetooth và làm theo hướng dẫn trên màn hình. "
+    "Khi cập nhật firmware, giữ thiết bị gần điện thoại và không tắt nguồn giữa chừng. "
+    "Nếu đèn đỏ sáng liên tục, hãy khởi động lại bằng cách nhấn đồng thời hai nút bên "
+    "trong mười giây rồi thử kết nối lại. Vệ sinh cảm biến bằng khăn mềm, khô, không "
+    "dùng cồn hay dung dịch tẩy rửa mạnh để tránh làm hỏng lớp phủ bảo vệ."
+)
+
+
+def test_minhash_estimates_jaccard():
+    a = minhash_signature(MANUAL, num_perm=128)
+    b = minhash_signature(MANUAL.replace("ba giây", "năm giây"), num_perm=128)
+    c = minhash_signature("Báo cáo tài chính quý ba của công ty có doanh thu tăng.", 128)
+    assert signature_similarity(a, a) == 1.0
+    assert signature_similarity(a, b) > 0.7
+    assert signature_similarity(a, c) < 0.2
+    assert a.dtype == np.uint32
+
+
+def test_lsh_params_cover_num_perm():
+    bands, rows = lsh_params(0.8, 64)
+    assert bands * rows == 64
+    assert abs((1 / bands) ** (1 / rows) - 0.8) < 0.1
+
+
+def test_filter_batch_links_duplicates_and_respects_scope(tmp_path):
+    d = ChunkDeduper(str(tmp_path), threshold=0.8, scope=("version",))
+    near = MANUAL.replace("ba giây", "năm giây")
+    keep = d.filter_batch(
+        ["a", "b", "c", "d"],
+        [MANUAL, near, "Một đoạn hoàn toàn khác về thời tiết.", MANUAL],
+        [{"source": "x", "version": "v1"}] * 3 + [{"source": "y", "version": "v2"}],
+    )
+    # b trùng a; d cùng nội dung nhưng khác version (scope) → giữ
+    assert keep == [True, False, True, True]
+    assert d.canonical_of("b") == "a"
+    # Lần ingest sau: chunk đã index giữ nguyên, duplicate vẫn là duplicate
+    assert d.filter_batch(["a", "b"], [MANUAL, near], [{"version": "v1"}] * 2) == [True, False]
+    stats = d.stats()
+    assert stats["canonical_chunks"] == 3 and stats["duplicate_chunks"] == 1
+    assert stats["dedup_ratio"] == 0.25
+
+
+def test_default_scope_keeps_other_versions_and_languages(tmp_path):
+    d = ChunkDeduper(str(tmp_path), threshold=0.8, scope=CHUNK_DEDUP_SCOPE)
+    assert CHUNK_DEDUP_SCOPE == ("version", "language")
+    metas = [
+        {"source": "x", "version": "v1", "language": "vi"},
+        {"source": "y", "version": "v1", "language": "vi"},
+        {"source": "z", "version": "v2", "language": "vi"},
+        {"source": "w", "version": "v1", "language": "en"},
+    ]
+    # Filter theo version/language vẫn thấy đủ chunk: chỉ y bị link sang x
+    assert d.filter_batch(["x", "y", "z", "w"], [MANUAL] * 4, metas) == [True, False, True, True]
+
+
+def test_auto_version_does_not_limit_scope(tmp_path):
+    d = ChunkDeduper(str(tmp_path), threshold=0.8, scope=CHUNK_DEDUP_SCOPE)
+    metas = [
+        {"source": "x", "version": "1a2b3c4d", "version_auto": True, "language": "vi"},
+        {"source": "y", "version": "5e6f7a8b", "version_auto": True, "language": "vi"},
+        {"source": "z", "version": "v1", "language": "vi"},
+    ]
+    # Hai file không version → dedup; version truyền tường minh vẫn giữ riêng
+    assert d.filter_batch(["x", "y", "z"], [MANUAL] * 3, metas) == [True, False, True]
+
+
+def test_remove_canonical_returns_orphans(tmp_path):
+    d = ChunkDeduper(str(tmp_path), threshold=0.8)
+    d.filter_batch(["a", "b"], [MANUAL, MANUAL], [{"source": "x"}, {"source": "y"}])
+    ids, docs, metas = d.remove_chunks(["a"])
+    assert ids == ["b"] and docs == [MANUAL] and metas == [{"source": "y"}]
+    assert d.canonical_of("b") is None
+    # Xóa cả canonical lẫn duplicate → không có orphan
+    d.filter_batch(["a", "b"], [MANUAL, MANUAL], [{}, {}])
+    assert d.remove_chunks(["a", "b"])[0] == []
+
+
+def test_engine_dedups_near_identical_files(tmp_path, monkeypatch):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "dedup_test"))
+    monkeypatch.setattr(eng.ollama, "embed", lambda texts: [[0.1] * 8 for _ in texts])
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "manual_v1.txt").write_text(MANUAL, encoding="utf-8")
+    (docs / "manual_v2.txt").write_text(MANUAL + " Phiên bản 2.", encoding="utf-8")
+    (docs / "other.txt").write_text("Chính sách bảo hành mười hai tháng. " * 5, encoding="utf-8")
+
+    events: list[tuple] = []
+    # Không truyền version: mỗi file có version tự sinh riêng nhưng vẫn dedup với nhau
+    eng.ingest_paths([str(docs)], progress=lambda s, a, p=None: events.append((s, a)))
+    deduped = sum(a for s, a in events if s == "chunks_deduped")
+    assert deduped > 0
+    stats = eng.dedup_stats()
+    assert stats["enabled"] and stats["duplicate_chunks"] == deduped
+    assert eng.collection.count() == stats["canonical_chunks"]
+
+    # Xóa source chứa canonical → duplicate của file kia được promote vào index
+    canonical_src = {s["source"] for s in eng.list_sources()}
+    assert str(docs / "other.txt") in canonical_src
+    first = sorted(s for s in canonical_src if "manual" in s)[0]
+    eng.delete_sources([first])
+    remaining = {s["source"] for s in eng.list_sources()}
+    manuals = {str(docs / "manual_v1.txt"), str(docs / "manual_v2.txt")}
+    assert remaining & manuals == manuals - {first}
@@ -0,0 +1,113 @@
+"""
+Tests for query-aware sentence-level context compression (app/context_compressor.py).
+"""
+
+from app.context_compressor import ContextCompressor, split_sentences
+from app.rag_engine import RagEngine
+
+TOPICS = ("bảo hành", "giao hàng", "thanh toán", "đổi trả")
+
+
+def _embed_by_topic(texts):
+    """Vector one-hot theo chủ đề xuất hiện trong text (đủ để xếp hạng câu)."""
+    return [[1.0 if t in s.lower() else 0.0 for t in TOPICS] + [0.01] for s in texts]
+
+
+class _CountingEmbed:
+    def __init__(self):
+        self.calls: list[list[str]] = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return _embed_by_topic(texts)
+
+
+def _doc(*topics: str) -> str:
+    return " ".join(f"Đây là đoạn nói về {t} của cửa hàng số {i}." for i, t in enumerate(topics))
+
+
+def test_split_sentences_merges_short_fragments():
+    text = "1. Mục đầu tiên nói về bảo hành.\nOk.\nCâu thứ hai dài hơn một chút! Cuối"
+    assert split_sentences(text) == [
+        "1. Mục đầu tiên nói về bảo hành. Ok.",
+        "Câu thứ hai dài hơn một chút! Cuối",
+    ]
+    assert split_sentences("") == []
+
+
+def test_compress_keeps_relevant_sentences_with_neighbours():
+    embed = _CountingEmbed()
+    comp = ContextCompressor(embed, ratio=0.2, neighbors=1, min_chars=0)
+    docs = [
+        _doc("giao hàng", "thanh toán", "đổi trả", "bảo hành", "giao hàng", "thanh toán"),
+        _doc("thanh toán", "giao hàng", "đổi trả", "thanh toán"),
+    ]
+    res = comp.compress("chính sách bảo hành?", docs)
+    assert len(res.docs) == 2
+    first = res.docs[0]
+    # Câu liên quan + hai câu lân cận, phần bị lược đánh dấu "…"
+    assert "bảo hành" in first and "đổi trả" in first and "số 4" in first
+    assert "số 0" not in first and first.startswith("…") and first.endswith("…")
+    # Context không liên quan vẫn giữ một câu (citation [2] vẫn tồn tại)
+    assert res.docs[1] and res.docs[1] != docs[1]
+    assert res.chars_after < res.chars_before and res.ratio < 0.6
+    # Một lời gọi embed cho query + mọi câu
+    assert len(embed.calls) == 1 and embed.calls[0][0] == "chính sách bảo hành?"
+
+
+def test_sentence_embeddings_are_cached_between_queries():
+    embed = _CountingEmbed()
+    comp = ContextCompressor(embed, ratio=0.3, neighbors=0, min_chars=0)
+    docs = [_doc("giao hàng", "bảo hành", "thanh toán")]
+    comp.compress("bảo hành", docs)
+    comp.compress("thanh toán", docs)
+    assert embed.calls[1] == ["thanh toán"]
+    res = comp.compress("thanh toán", docs)
+    assert "thanh toán" in res.docs[0] and "bảo hành" not in res.docs[0]
+
+
+def test_short_contexts_and_embed_failures_pass_through():
+    comp = ContextCompressor(_embed_by_topic, ratio=0.2, min_chars=1000)
+    docs = [_doc("bảo hành", "giao hàng")]
+    assert comp.compress("bảo hành", docs).docs == docs
+
+    def broken(texts):
+        raise RuntimeError("ollama down")
+
+    res = ContextCompressor(broken, ratio=0.2, min_chars=0).compress("q", docs)
+    assert res.docs == docs and res.ratio == 1.0
+
+
+def test_zero_fallback_vectors_skip_compression_and_are_not_cached():
+    docs = [_doc("giao hàng", "bảo hành", "thanh toán")]
+    healthy = _CountingEmbed()
+    state = {"down": True}
+
+    def flaky(texts):
+        # Circuit OPEN: OllamaClient.embed trả vector 0 cho mọi text
+        return [[0.0] * 5 for _ in texts] if state["down"] else healthy(texts)
+
+    comp = ContextCompressor(flaky, ratio=0.3, neighbors=0, min_chars=0)
+    res = comp.compress("bảo hành", docs)
+    assert res.docs == docs and res.ratio == 1.0
+    assert comp.stats()["sentence_cache"]["size"] == 0
+
+    state["down"] = False
+    res = comp.compress("bảo hành", docs)
+    assert len(healthy.calls[0]) == 4 and res.chars_after < res.chars_before
+
+
+def test_engine_answer_compresses_when_requested(tmp_path, monkeypatch):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "compress"))
+    monkeypatch.setattr(eng.ollama, "embed", _embed_by_topic)
+    long_doc = _doc("giao hàng", "thanh toán", "bảo hành", "đổi trả", "giao hàng", "thanh toán")
+    eng.ingest_texts([long_doc], metadatas=[{"source": "a.txt"}])
+    eng._ctx_compressor = ContextCompressor(eng.ollama.embed, ratio=0.2, neighbors=0, min_chars=0)
+    prompts = []
+    monkeypatch.setattr(eng.ollama, "generate", lambda p: prompts.append(p) or "ok [1]")
+    out = eng._answer_impl("bảo hành", {"top_k": 1, "method": "bm25", "compress": True})
+    assert out["compression"]["chars_after"] < out["compression"]["chars_before"]
+    assert "bảo hành" in out["contexts"][0] and out["metadatas"][0]["source"] == "a.txt"
+    assert prompts[0] == eng.build_prompt("bảo hành", out["contexts"])
+    plain = eng._answer_impl("bảo hành", {"top_k": 1, "method": "bm25", "compress": False})
+    assert "compression" not in plain
@@ -0,0 +1,104 @@
+"""
+Tests for token-budgeted context packing (app/context_packer.py + engine wiring).
+"""
+
+from app import context_packer as cp
+from app.context_packer import ApproxTokenCounter, ContextPacker, allocate, trim_text
+from app.rag_engine import RagEngine
+
+
+def _sentences(n: int, word: str = "alpha") -> str:
+    return " ".join(f"{word} beta gamma delta {i}." for i in range(n))
+
+
+def test_approx_counter_counts_and_cuts():
+    c = ApproxTokenCounter()
+    assert c.count("") == 0
+    assert c.count("hi all.") == 3
+    # Từ dài / có dấu tách thành nhiều token
+    assert c.count("internationalization") == 5
+    assert c.count("nghiêng") == 3
+    text = "one two three four"
+    assert text[: c.cut(text, 2)] == "one two"
+    assert c.cut(text, 100) == len(text)
+
+
+def test_allocate_water_fills_short_contexts_first():
+    # Context 2 ngắn lấy đủ, phần dư chia lại cho 0 và 1 theo trọng số
+    alloc = allocate([500, 500, 20], [1.0, 1.0, 1.0], 300)
+    assert alloc[2] == 20
+    assert alloc[0] == alloc[1] == 140
+    assert allocate([10, 10], [1.0, 0.5], 1000) == [10, 10]
+
+
+def test_trim_text_prefers_sentence_boundary():
+    c = ApproxTokenCounter()
+    text = _sentences(20)
+    out = trim_text(text, 30, c)
+    assert out.endswith(" …")
+    assert out[:-2].endswith(".")
+    assert c.count(out) <= 30
+    assert trim_text("short text", 30, c) == "short text"
+
+
+def test_pack_fits_budget_and_renumbers_kept_contexts():
+    c = ApproxTokenCounter()
+    docs = [_sentences(30, f"d{i}") for i in range(6)]
+    metas = [{"i": i} for i in range(6)]
+    packer = ContextPacker(budget=400, min_ctx_tokens=40, counter=c)
+    res = packer.pack(docs, metas, scaffold="system câu hỏi")
+    assert res.context_tokens + c.count("system câu hỏi") <= 400
+    assert res.prompt_tokens <= 400
+    # Hạng thấp bị bỏ trước, thứ tự hạng giữ nguyên; metas lọc cùng docs
+    assert res.kept == sorted(res.kept) and res.kept[0] == 0
+    assert res.dropped and res.dropped == [i for i in range(6) if i not in res.kept]
+    assert res.metas == [{"i": i} for i in res.kept]
+    assert all(d.startswith(f"d{i} ") for d, i in zip(res.docs, res.kept, strict=True))
+    # Context hạng cao được phần lớn hơn
+    assert len(res.docs[0]) >= len(res.docs[-1])
+    report = res.report()
+    assert report["kept"] == len(res.kept) and report["tokenizer"] == "approx"
+
+
+def test_pack_keeps_everything_when_it_fits_and_uses_scores():
+    packer = ContextPacker(budget=10000, counter=ApproxTokenCounter())
+    res = packer.pack(["a b c", "d e f"], [{}, {}])
+    assert res.docs == ["a b c", "d e f"] and res.dropped == [] and res.trimmed == []
+
+    docs = [_sentences(30, f"d{i}") for i in range(3)]
+    tight = ContextPacker(budget=200, min_ctx_tokens=60, counter=ApproxTokenCounter())
+    # Điểm cao nhất ở cuối → context cuối được giữ, context đầu (điểm thấp) bị bỏ
+    res = tight.pack(docs, None, scores=[0.1, 0.2, 0.9])
+    assert 2 in res.kept and 0 in res.dropped
+
+
+def test_pack_always_keeps_best_context():
+    packer = ContextPacker(budget=10, min_ctx_tokens=20, counter=ApproxTokenCounter())
+    res = packer.pack([_sentences(50), _sentences(50)], [{}, {}], scaffold="x " * 50)
+    assert res.kept == [0] and res.trimmed == [0]
+
+
+def test_default_budget_follows_num_ctx(monkeypatch):
+    monkeypatch.setattr(cp, "PROMPT_TOKEN_BUDGET", 0)
+    monkeypatch.setenv("OLLAMA_NUM_CTX", "1024")
+    assert cp.default_prompt_budget() == 1024 - cp.PROMPT_ANSWER_RESERVE
+    monkeypatch.setattr(cp, "PROMPT_TOKEN_BUDGET", 700)
+    assert cp.default_prompt_budget() == 700
+
+
+def test_engine_answer_reports_packing(tmp_path, monkeypatch):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "packing"))
+    monkeypatch.setattr(eng.ollama, "embed", lambda texts: [[float(len(t)), 1.0] for t in texts])
+    eng.ingest_texts(
+        ["Chính sách bảo hành mười hai tháng. " * 40, "Bảo hành đổi trả trong bảy ngày. " * 40],
+        metadatas=[{"source": "a.txt"}, {"source": "b.txt"}],
+    )
+    eng._ctx_packer = ContextPacker(budget=300, min_ctx_tokens=40, counter=ApproxTokenCounter())
+    prompts = []
+    monkeypatch.setattr(eng.ollama, "generate", lambda p: prompts.append(p) or "ok [1]")
+    out = eng._answer_impl("bảo hành", {"top_k": 2, "method": "bm25"})
+    packing = out["packing"]
+    assert packing["prompt_tokens"] <= 300
+    assert packing["kept"] == len(out["contexts"]) == len(out["metadatas"])
+    # Prompt được dựng từ đúng contexts trả về → [CTX n] khớp contexts[n-1]
+    assert prompts[0] == eng.build_prompt("bảo hành", out["contexts"])
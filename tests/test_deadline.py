@@ -0,0 +1,122 @@
+"""
+Tests for request deadlines and graceful degradation (app/deadline.py + engine wiring).
+"""
+
+import time
+
+import pytest
+
+from app import deadline as dl_mod
+from app.deadline import Deadline, current_deadline, generation_cap, new_deadline, use_deadline
+from app.rag_engine import RagEngine
+
+
+def _deadline(budget_ms, remaining_ms):
+    """Deadline đã chạy sao cho còn đúng `remaining_ms`."""
+    start = time.monotonic() - (budget_ms - remaining_ms) / 1000.0
+    return Deadline(budget_ms, start=start)
+
+
+def test_new_deadline_sources(monkeypatch):
+    assert new_deadline(500).budget_ms == 500
+    assert new_deadline(None, "1200").budget_ms == 1200
+    assert new_deadline(None, "abc") is None
+    monkeypatch.setattr(dl_mod, "QUERY_DEADLINE_MS", 3000)
+    assert new_deadline(None, None).budget_ms == 3000
+    assert new_deadline(0) is None
+
+
+def test_use_deadline_sets_and_restores_context():
+    d = Deadline(1000)
+    assert current_deadline() is None and generation_cap() is None
+    with use_deadline(d):
+        assert current_deadline() is d
+    assert current_deadline() is None
+
+
+def test_stage_decisions_follow_remaining_time():
+    plenty = _deadline(60000, 59000)
+    assert plenty.allow_rewrite()
+    assert plenty.retrieval_method("hybrid") == "hybrid"
+    assert plenty.rerank_limit(20, 5) == 20
+    assert plenty.degradations == []
+
+    tight = _deadline(5000, 500)
+    assert not tight.allow_rewrite()
+    assert tight.retrieval_method("vector") == "bm25"
+    assert tight.retrieval_method("bm25") == "bm25"
+    assert tight.rerank_limit(20, 5) == 0
+    cap = tight.generation_cap()
+    assert cap == dl_mod.DEADLINE_MIN_PREDICT
+    actions = [(d["stage"], d["action"]) for d in tight.degradations]
+    assert actions == [
+        ("rewrite", "skipped"),
+        ("retrieval", "bm25_only"),
+        ("rerank", "skipped"),
+        ("generate", "capped"),
+    ]
+
+
+def test_rerank_shrinks_between_thresholds():
+    mid = (dl_mod.DEADLINE_RERANK_MIN_MS + dl_mod.DEADLINE_RERANK_FULL_MS) / 2
+    d = _deadline(10000, mid)
+    limit = d.rerank_limit(25, 5)
+    assert 5 < limit < 25
+    assert d.degradations[0]["action"] == "shrunk" and d.degradations[0]["limit"] == limit
+    # Degrade lặp lại cùng (stage, action) chỉ giữ một entry
+    d.rerank_limit(25, 5)
+    assert len(d.degradations) == 1
+
+
+def test_ollama_options_cap_num_predict():
+    from app.ollama_client import OllamaClient
+
+    opts = OllamaClient._gen_options(OllamaClient.__new__(OllamaClient))
+    assert "num_predict" not in opts
+    with use_deadline(_deadline(10000, 3000)):
+        opts = OllamaClient._gen_options(OllamaClient.__new__(OllamaClient))
+    expected = int((3000 - dl_mod.DEADLINE_PROMPT_RESERVE_MS) / dl_mod.DEADLINE_MS_PER_TOKEN)
+    assert opts["num_predict"] == pytest.approx(expected, abs=1)
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "deadline"))
+    monkeypatch.setattr(eng.ollama, "embed", lambda texts: [[float(len(t)), 1.0] for t in texts])
+    eng.ingest_texts(
+        ["Chính sách bảo hành mười hai tháng.", "Hướng dẫn đổi trả trong bảy ngày."],
+        metadatas=[{"source": "a.txt"}, {"source": "b.txt"}],
+    )
+    return eng
+
+
+def test_tight_deadline_skips_rewrite_and_vector_search(engine, monkeypatch):
+    calls = []
+    monkeypatch.setattr(engine, "_rewrite_queries", lambda *a, **k: calls.append("rw") or [])
+    monkeypatch.setattr(engine, "retrieve", lambda *a, **k: calls.append("vector") or {})
+    d = _deadline(3000, 200)
+    with use_deadline(d):
+        res = engine.retrieve_aggregate("bảo hành", top_k=2, method="hybrid", rewrite_enable=True)
+    assert calls == []
+    assert res["documents"]
+    assert {x["stage"] for x in d.degradations} == {"rewrite", "retrieval"}
+
+
+def test_answer_reports_degradations_and_skips_gen_cache(engine, monkeypatch):
+    # Còn < DEADLINE_RERANK_MIN_MS → _apply_rerank trả về ngay, không nạp reranker
+    monkeypatch.setattr(engine, "_ensure_rerankers", lambda: pytest.fail("rerank ran"))
+    cap_seen = []
+
+    def fake_generate(prompt):
+        cap_seen.append(generation_cap())
+        return "trả lời ngắn"
+
+    monkeypatch.setattr(engine.ollama, "generate", fake_generate)
+    d = _deadline(3000, 900)
+    with use_deadline(d):
+        out = engine._answer_impl("bảo hành", {"top_k": 1, "method": "bm25", "rerank_enable": True})
+    assert cap_seen and cap_seen[0] >= dl_mod.DEADLINE_MIN_PREDICT
+    assert out["deadline_ms"] == 3000
+    assert {x["stage"] for x in out["degradations"]} == {"rerank", "generate"}
+    key = engine._gen_cache_key(engine.build_prompt("bảo hành", out["contexts"]), None)
+    assert engine.gen_cache.get(key) is None
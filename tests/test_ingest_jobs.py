@@ -0,0 +1,266 @@
+"""
+Tests for background ingest jobs (app/ingest_jobs.py) and the async /api/upload flow.
+"""
+
+import os
+import threading
+
+from fastapi.testclient import TestClient
+
+from app.exceptions import IngestCancelledError
+from app.ingest_jobs import (
+    STATUS_CANCELLED,
+    STATUS_DONE,
+    STATUS_FAILED,
+    STATUS_QUEUED,
+    STATUS_RUNNING,
+    IngestJobManager,
+)
+
+
+def _manager(tmp_path, ingest, **kwargs) -> IngestJobManager:
+    return IngestJobManager(ingest, str(tmp_path / "jobs.sqlite"), **kwargs)
+
+
+def test_job_runs_in_background_and_reports_progress(tmp_path):
+    gate = threading.Event()
+
+    def ingest(paths, db, version, progress, should_cancel, skip_files):
+        progress("files_total", len(paths))
+        gate.wait(2)
+        for p in paths:
+            progress("files_parsed", 1, p)
+            progress("chunks_embedded", 10)
+            progress("chunks_written", 10)
+            progress("file_done", 1, p)
+        return len(paths) * 10
+
+    mgr = _manager(tmp_path, ingest)
+    job = mgr.submit(["a.txt", "b.txt"], db="kb", version="v1")
+    assert job["status"] in (STATUS_QUEUED, STATUS_RUNNING)
+    gate.set()
+    final = mgr.wait(job["id"], timeout=5)
+    assert final["status"] == STATUS_DONE
+    assert final["files_total"] == 2
+    assert final["files_parsed"] == 2
+    assert final["chunks_embedded"] == final["chunks_written"] == 20
+    assert final["chunks_indexed"] == 20
+    assert final["finished_at"] >= final["started_at"]
+    mgr.shutdown()
+
+
+def test_failed_job_records_error(tmp_path):
+    def ingest(paths, db, version, **kwargs):
+        raise RuntimeError("boom")
+
+    mgr = _manager(tmp_path, ingest)
+    job = mgr.wait(mgr.submit(["x.pdf"])["id"], timeout=5)
+    assert job["status"] == STATUS_FAILED
+    assert "boom" in job["error"]
+    mgr.shutdown()
+
+
+def test_cancel_running_and_queued_jobs(tmp_path):
+    started = threading.Event()
+
+    def ingest(paths, db, version, progress, should_cancel, skip_files):
+        started.set()
+        for _ in range(200):
+            if should_cancel():
+                raise IngestCancelledError("cancelled")
+            progress("chunks_written", 1)
+            threading.Event().wait(0.01)
+        return 200
+
+    mgr = _manager(tmp_path, ingest)
+    running = mgr.submit(["a.txt"])
+    queued = mgr.submit(["b.txt"])
+    assert started.wait(2)
+    assert mgr.cancel(queued["id"])["status"] == STATUS_CANCELLED
+    mgr.cancel(running["id"])
+    job = mgr.wait(running["id"], timeout=5)
+    assert job["status"] == STATUS_CANCELLED
+    assert 0 < job["chunks_indexed"] < 200
+    assert mgr.wait(queued["id"], timeout=1)["status"] == STATUS_CANCELLED
+    mgr.shutdown()
+
+
+def test_resume_after_restart_skips_finished_files(tmp_path):
+    mgr = _manager(tmp_path, lambda *a, **k: 0)
+    job_id = mgr.submit(["a.txt", "b.txt"])["id"]
+    mgr.wait(job_id, timeout=5)
+    # Giả lập job đang chạy dở khi server restart
+    mgr.store.update(job_id, status=STATUS_RUNNING)
+    mgr.store.mark_file_done(job_id, "a.txt")
+    mgr.shutdown()
+
+    seen = {}
+
+    def ingest(paths, db, version, progress, should_cancel, skip_files):
+        seen["skip"] = set(skip_files)
+        return 5
+
+    mgr2 = _manager(tmp_path, ingest)
+    assert mgr2.resume() == [job_id]
+    job = mgr2.wait(job_id, timeout=5)
+    assert job["status"] == STATUS_DONE
+    assert job["attempts"] == 2
+    assert seen["skip"] == {"a.txt"}
+    mgr2.shutdown()
+
+
+def test_history_trims_finished_jobs(tmp_path):
+    mgr = _manager(tmp_path, lambda *a, **k: 1, max_history=2)
+    ids = [mgr.submit([f"{i}.txt"])["id"] for i in range(4)]
+    mgr.wait(ids[-1], timeout=5)
+    mgr.submit(["last.txt"])
+    assert len(mgr.list_jobs()) <= 3
+    assert mgr.get(ids[0]) is None
+    mgr.shutdown()
+
+
+def test_engine_ingest_paths_reports_progress_and_cancels(tmp_path, monkeypatch):
+    from app.rag_engine import RagEngine
+
+    for i in range(3):
+        (tmp_path / f"doc{i}.txt").write_text(f"Tài liệu số {i}. " * 50, encoding="utf-8")
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "jobs_test"))
+    monkeypatch.setattr(eng.ollama, "embed", lambda texts: [[0.1] * 8 for _ in texts])
+    events: list[tuple] = []
+    n = eng.ingest_paths(
+        [str(tmp_path)],
+        progress=lambda stage, amount, path=None: events.append((stage, amount)),
+        skip_files={str(tmp_path / "doc0.txt")},
+    )
+    stages = [s for s, _ in events]
+    assert n > 0
+    assert sum(a for s, a in events if s == "files_total") == 3
+    assert stages.count("files_parsed") == 2
+    assert sum(a for s, a in events if s == "chunks_written") == n
+
+    calls = {"n": 0}
+
+    def cancel_after_first():
+        calls["n"] += 1
+        return calls["n"] > 1
+
+    try:
+        eng.ingest_paths([str(tmp_path)], should_cancel=cancel_after_first)
+        raise AssertionError("expected cancellation")
+    except IngestCancelledError:
+        pass
+
+
+def test_api_ingest_and_cancel_endpoints(monkeypatch):
+    from app import main
+
+    monkeypatch.setattr(main.ingest_jobs, "ingest_fn", lambda paths, db, version, **kw: 4)
+    client = TestClient(main.app)
+    r = client.post("/api/ingest", json={"paths": ["data/docs"], "wait": True})
+    assert r.status_code == 202, r.text
+    data = r.json()
+    assert data["status"] == STATUS_DONE and data["chunks_indexed"] == 4
+    r = client.post(f"/api/ingest/jobs/{data['job_id']}/cancel")
+    assert r.status_code == 200
+    assert r.json()["status"] == STATUS_DONE  # job đã xong thì không đổi
+    assert client.post("/api/ingest/jobs/missing/cancel").status_code == 404
+
+
+def test_upload_returns_job_id_and_ingests_in_background(monkeypatch):
+    from app import main
+
+    calls = []
+
+    def fake_ingest(paths, db, version, **kwargs):
+        calls.append((paths, db, version))
+        return 3
+
+    monkeypatch.setattr(main.ingest_jobs, "ingest_fn", fake_ingest)
+    client = TestClient(main.app)
+    files = [("files", ("note.txt", b"hello " * 1000, "text/plain"))]
+    r = client.post("/api/upload", files=files, data={"version": "v1"})
+    assert r.status_code == 202, r.text
+    data = r.json()
+    assert data["job_id"] and len(data["saved"]) == 1
+
+    job = main.ingest_jobs.wait(data["job_id"], timeout=5)
+    assert job["status"] == STATUS_DONE
+    assert job["chunks_indexed"] == 3
+    r = client.get(f"/api/ingest/jobs/{data['job_id']}")
+    assert r.status_code == 200
+    assert r.json()["status"] == STATUS_DONE
+    saved_path = calls[0][0][0]
+    with open(saved_path, "rb") as f:
+        assert f.read() == b"hello " * 1000
+    os.remove(saved_path)
+    assert client.get("/api/ingest/jobs/missing").status_code == 404
+
+
+def test_upload_wait_returns_chunk_count(monkeypatch):
+    from app import main
+
+    saved = []
+
+    def fake_ingest(paths, db, version, **kwargs):
+        saved.extend(paths)
+        return 7
+
+    monkeypatch.setattr(main.ingest_jobs, "ingest_fn", fake_ingest)
+    client = TestClient(main.app)
+    files = [("files", ("note.txt", b"hi", "text/plain"))]
+    r = client.post("/api/upload", files=files, data={"wait": "true"})
+    assert r.status_code == 202, r.text
+    assert r.json()["status"] == STATUS_DONE
+    assert r.json()["chunks_indexed"] == 7
+    for p in saved:
+        os.remove(p)
+
+
+def test_upload_413_removes_files_already_saved(monkeypatch, tmp_path):
+    from app import main
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "MAX_UPLOAD_SIZE_BYTES", 10)
+    client = TestClient(main.app)
+    files = [
+        ("files", ("ok.txt", b"small", "text/plain")),
+        ("files", ("big.txt", b"x" * 100, "text/plain")),
+    ]
+    r = client.post("/api/upload", files=files)
+    assert r.status_code == 413, r.text
+    assert os.listdir(tmp_path / "data" / "docs" / "uploads") == []
+
+
+def test_job_runner_uses_its_own_engine_per_db(monkeypatch):
+    from app import main
+
+    seen = []
+
+    def fake_ingest_paths(self, paths, version=None, **kwargs):
+        seen.append((self.db_name, self is main.engine))
+        return len(paths)
+
+    monkeypatch.setattr(main.RagEngine, "ingest_paths", fake_ingest_paths)
+    current = main.engine.db_name
+    assert main._run_ingest_job(["a.txt", "b.txt"], "jobs_isolated", None) == 2
+    assert main._run_ingest_job(["c.txt"], "jobs_isolated", None) == 1
+    # DB đang chọn của HTTP requests không đổi; engine của job được dùng lại theo DB
+    assert main.engine.db_name == current
+    assert seen == [("jobs_isolated", False), ("jobs_isolated", False)]
+    assert main._job_engine("jobs_isolated") is main._job_engine("jobs_isolated")
+    main.api_delete_db("jobs_isolated")
+    assert "jobs_isolated" not in main._job_engines
+
+
+def test_refresh_corpus_reloads_faiss_index(monkeypatch):
+    from app import main, rag_engine
+
+    reloads = []
+    monkeypatch.setattr(rag_engine, "_faiss", object())
+    monkeypatch.setattr(main.engine, "vector_backend", "faiss")
+    monkeypatch.setattr(main.engine, "_init_faiss", lambda: reloads.append(True))
+    monkeypatch.setattr(
+        main.RagEngine, "ingest_paths", lambda self, paths, version=None, **kw: len(paths)
+    )
+    assert main._run_ingest_job(["a.txt"], main.engine.db_name, None) == 1
+    assert reloads == [True]
@@ -0,0 +1,154 @@
+"""
+Tests for incremental ingest (app/ingest_manifest.py + RagEngine.ingest_paths).
+"""
+
+import os
+import time
+
+import pytest
+
+from app.ingest_manifest import IngestManifest, chunk_id, path_in_scope
+from app.rag_engine import RagEngine
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "manifest_test"))
+    embedded: list[str] = []
+
+    def fake_embed(texts):
+        embedded.extend(texts)
+        return [[float(len(t)), 1.0] for t in texts]
+
+    monkeypatch.setattr(eng.ollama, "embed", fake_embed)
+    eng.embedded = embedded
+    return eng
+
+
+def _write(path, text):
+    path.write_text(text, encoding="utf-8")
+    # mtime khác lần trước dù ghi trong cùng một giây
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + time.time() % 1 + 1))
+
+
+def test_chunk_ids_are_deterministic():
+    assert chunk_id("a.txt", "v1", "x") == chunk_id("a.txt", "v1", "x")
+    assert chunk_id("a.txt", "v1", "x") != chunk_id("a.txt", "v1", "x", 1)
+    assert chunk_id("a.txt", "v1", "x") != chunk_id("b.txt", "v1", "x")
+    assert chunk_id("a.txt", "v1", "x") != chunk_id("a.txt", "v2", "x")
+
+
+def test_path_in_scope(tmp_path):
+    d = str(tmp_path)
+    assert path_in_scope(os.path.join(d, "a", "b.txt"), [d])
+    assert not path_in_scope(d + "x/b.txt", [d])
+    assert path_in_scope("docs/a.pdf", ["docs/*.pdf"])
+    assert path_in_scope("one.txt", ["one.txt"])
+
+
+def test_reingest_skips_unchanged_and_replaces_changed(engine, tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    _write(docs / "a.txt", "Alpha " * 300)
+    _write(docs / "b.txt", "Beta " * 300)
+
+    first = engine.ingest_paths([str(docs)])
+    total = engine.collection.count()
+    assert first == total > 0
+
+    engine.embedded.clear()
+    assert engine.ingest_paths([str(docs)]) == 0
+    assert engine.embedded == []
+    assert engine.collection.count() == total
+
+    # Touch không đổi nội dung → không embed lại
+    _write(docs / "a.txt", "Alpha " * 300)
+    assert engine.ingest_paths([str(docs)]) == 0
+
+    _write(docs / "b.txt", "Gamma " * 100)
+    written = engine.ingest_paths([str(docs)])
+    assert written > 0
+    assert all(t.startswith("Gamma") for t in engine.embedded)
+    sources = {s["source"]: s["chunks"] for s in engine.list_sources()}
+    assert sources[str(docs / "b.txt")] == written
+    assert engine.collection.count() == sources[str(docs / "a.txt")] + written
+
+
+def test_editing_one_paragraph_reembeds_only_its_chunks(engine, tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    paragraphs = [f"Paragraph {i:02d}: " + f"topic{i} " * 120 for i in range(10)]
+    _write(docs / "a.txt", "\n\n".join(paragraphs))
+    total = engine.ingest_paths([str(docs)])
+    assert total > 6
+
+    # Sửa một đoạn ở giữa (giữ độ dài → ranh giới các chunk khác không dịch)
+    paragraphs[5] = paragraphs[5].replace("topic5", "edit05")
+    _write(docs / "a.txt", "\n\n".join(paragraphs))
+    engine.embedded.clear()
+    written = engine.ingest_paths([str(docs)])
+    assert 0 < written <= 3
+    assert all("edit05" in t for t in engine.embedded)
+    assert engine.collection.count() == total
+    # Chunks giữ lại cũng mang version tự sinh mới của file
+    metas = engine.collection.get(include=["metadatas"])["metadatas"]
+    assert len({m["version"] for m in metas}) == 1
+    assert sorted(m["chunk"] for m in metas) == list(range(total))
+
+
+def test_version_change_reindexes_untouched_files(engine, tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    _write(docs / "a.txt", "Alpha " * 300)
+    n = engine.ingest_paths([str(docs)], version="v1")
+    assert engine.manifest.is_unchanged(
+        str(docs / "a.txt"), *_size_mtime(docs / "a.txt"), version="v1"
+    )
+    assert engine.ingest_paths([str(docs)], version="v1") == 0
+
+    # Cùng size + mtime nhưng version khác → phải index lại với version mới
+    engine.embedded.clear()
+    engine.ingest_paths([str(docs)], version="v2")
+    assert engine.embedded
+    assert engine.manifest.get_file(str(docs / "a.txt"))["version"] == "v2"
+    metas = engine.collection.get(include=["metadatas"])["metadatas"]
+    assert len(metas) == n and {m.get("version") for m in metas} == {"v2"}
+
+
+def _size_mtime(path):
+    st = os.stat(path)
+    return int(st.st_size), float(st.st_mtime)
+
+
+def test_vanished_files_are_removed(engine, tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    _write(docs / "keep.txt", "Keep " * 200)
+    _write(docs / "gone.txt", "Gone " * 200)
+    engine.ingest_paths([str(docs)])
+    before = engine.collection.count()
+
+    os.remove(docs / "gone.txt")
+    engine.ingest_paths([str(docs)])
+    remaining = {s["source"] for s in engine.list_sources()}
+    assert remaining == {str(docs / "keep.txt")}
+    assert engine.collection.count() < before
+    assert str(docs / "gone.txt") not in engine.manifest.list_paths()
+
+
+def test_delete_sources_forgets_manifest(engine, tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    _write(docs / "a.txt", "Alpha " * 200)
+    n = engine.ingest_paths([str(docs)])
+    engine.delete_sources([str(docs / "a.txt")])
+    assert engine.collection.count() == 0
+    assert engine.ingest_paths([str(docs)]) == n
+
+
+def test_ingest_texts_is_idempotent(engine):
+    n = engine.ingest_texts(["Xin chào " * 200], [{"source": "t1"}], version="v1")
+    engine.ingest_texts(["Xin chào " * 200], [{"source": "t1"}], version="v1")
+    assert engine.collection.count() == n
+    assert len(IngestManifest(engine.persist_dir).chunk_ids("t1")) == n
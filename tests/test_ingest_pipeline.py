@@ -0,0 +1,147 @@
+"""
+Unit tests for the streaming ingest pipeline (app/ingest_pipeline.py).
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.exceptions import IngestCancelledError
+from app.ingest_pipeline import (
+    Document,
+    IngestPipeline,
+    chunk_batches,
+    discover_files,
+    extract_files,
+    prefetch,
+)
+
+
+def _build(doc):
+    parts = doc.text.split()
+    ids = [f"{doc.source}:{i}" for i in range(len(parts))]
+    return ids, parts, [{"source": doc.source} for _ in parts]
+
+
+def test_discover_files_is_lazy_and_dedupes(tmp_path):
+    (tmp_path / "sub").mkdir()
+    for name in ("a.txt", "sub/b.pdf", "c.md"):
+        (tmp_path / name).write_text("x")
+    events = []
+    files = list(
+        discover_files(
+            [str(tmp_path), str(tmp_path / "a.txt")], lambda s, a, p=None: events.append(s)
+        )
+    )
+    assert sorted(f.replace(str(tmp_path), "") for f in files) == ["/a.txt", "/sub/b.pdf"]
+    assert events == ["files_total", "files_total"]
+
+
+def test_chunk_batches_are_fixed_size_and_mark_files_done_after_last_chunk():
+    docs = [Document("a", "1 2 3 4 5"), Document("bad", None, "err"), Document("b", "6 7")]
+    batches = list(chunk_batches(docs, _build, batch_size=3))
+    assert [len(b) for b in batches] == [3, 3, 1]
+    assert batches[0].files_done == []
+    assert [d.source for d in batches[1].files_done] == ["a", "bad"]
+    assert [d.source for d in batches[2].files_done] == ["b"]
+    # text được giải phóng ngay sau khi chunk
+    assert batches[1].files_done[0].text is None
+
+
+def test_prefetch_applies_backpressure():
+    produced = []
+
+    def gen():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    it = prefetch(gen(), maxsize=2)
+    assert next(it) == 0
+    time.sleep(0.1)
+    # Producer bị chặn bởi queue (2) → không đọc trước toàn bộ corpus
+    assert len(produced) <= 4
+    assert list(it) == list(range(1, 100))
+
+
+def test_prefetch_reraises_producer_error():
+    def gen():
+        yield 1
+        raise ValueError("bad file")
+
+    with pytest.raises(ValueError):
+        list(prefetch(gen(), maxsize=1))
+
+
+def test_pipeline_runs_end_to_end_with_progress():
+    written, events = [], []
+    lock = threading.Lock()
+
+    def progress(stage, amount, path=None):
+        with lock:
+            events.append((stage, amount, path))
+
+    pipe = IngestPipeline(
+        build_chunks=_build,
+        embed=lambda docs: [[float(len(d))] for d in docs],
+        write=lambda batch: written.append((list(batch.ids), batch.embeddings)),
+        batch_size=2,
+    )
+    docs = [Document(f"d{i}", "w " * 5) for i in range(4)]
+    stats = pipe.run_documents(iter(docs), progress)
+    assert stats.chunks_written == 20
+    assert stats.files_parsed == 4
+    assert all(len(ids) == 2 and len(embs) == 2 for ids, embs in written)
+    done = [p for s, _, p in events if s == "file_done"]
+    assert done == ["d0", "d1", "d2", "d3"]
+    assert sum(a for s, a, _ in events if s == "chunks_embedded") == 20
+
+
+def test_pipeline_cancel_stops_writing():
+    writes = []
+    pipe = IngestPipeline(
+        build_chunks=_build,
+        embed=lambda docs: [[0.0] for _ in docs],
+        write=lambda batch: writes.append(len(batch)),
+        batch_size=1,
+    )
+    docs = (Document(f"d{i}", "a b c") for i in range(100))
+    with pytest.raises(IngestCancelledError):
+        pipe.run_documents(docs, should_cancel=lambda: len(writes) >= 3)
+    assert 3 <= len(writes) < 300
+
+
+def _slow_reader(path):
+    if "slow" in path:
+        time.sleep(30)
+    return f"text of {path}", None
+
+
+def _crashing_reader(path):
+    if "crash" in path:
+        import os
+
+        os._exit(1)
+    return f"text of {path}", None
+
+
+def test_parallel_extraction_keeps_order_and_times_out_slow_files():
+    files = [f"doc{i}.txt" for i in range(3)] + ["slow.pdf"] + [f"doc{i}.txt" for i in range(3, 6)]
+    start = time.time()
+    results = list(extract_files(files, _slow_reader, workers=2, timeout_s=10))
+    assert time.time() - start < 28
+    assert [r[0] for r in results] == files
+    slow = results[3]
+    assert slow[1] is None and "timed out" in slow[2]
+    assert all(r[1] == f"text of {r[0]}" for i, r in enumerate(results) if i != 3)
+    assert all(r[3] >= 0 for r in results)
+
+
+def test_parallel_extraction_survives_worker_crash():
+    files = ["a.txt", "crash.pdf", "b.txt", "c.txt"]
+    results = list(extract_files(files, _crashing_reader, workers=2, timeout_s=20))
+    assert [r[0] for r in results] == files
+    by_path = {r[0]: r for r in results}
+    assert by_path["crash.pdf"][1] is None
+    assert by_path["c.txt"][1] == "text of c.txt"
@@ -0,0 +1,73 @@
+"""
+Tests for per-document language detection with batching + cache (app/lang_detect.py).
+"""
+
+import pytest
+
+from app import lang_detect
+from app.lang_detect import UNKNOWN_LANG, LangDetector, _sample_indices
+
+VI = "Hôm nay trời đẹp, chúng tôi đi dạo quanh hồ và uống cà phê sữa đá. "
+EN = "The quick brown fox jumps over the lazy dog while the farmer watches. "
+
+
+class _CountingDetector(LangDetector):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches: list[list[str]] = []
+
+    def _classify_batch(self, texts):
+        self.batches.append(list(texts))
+        return super()._classify_batch(texts)
+
+
+def test_sample_indices_spread_over_document():
+    assert _sample_indices(3, 5) == [0, 1, 2]
+    assert _sample_indices(100, 5) == [0, 25, 50, 74, 99]
+    assert _sample_indices(10, 1) == [5]
+
+
+@pytest.mark.skipif(lang_detect.langid is None, reason="langid not installed")
+def test_batch_matches_langid_classify():
+    import langid
+
+    texts = [VI, EN, "Bonjour tout le monde, comment allez-vous aujourd'hui ?"]
+    d = LangDetector()
+    assert d._classify_batch(texts) == [langid.classify(t)[0] for t in texts]
+
+
+@pytest.mark.skipif(lang_detect.langid is None, reason="langid not installed")
+def test_uniform_document_detects_samples_only_and_caches():
+    d = _CountingDetector(sample_chunks=3)
+    chunks = [VI + f"Đoạn số {i}." for i in range(40)]
+    assert d.detect_chunks(chunks) == ["vi"] * 40
+    assert len(d.batches) == 1 and len(d.batches[0]) == 3
+    # Lần 2 (re-ingest / tài liệu trùng): hoàn toàn từ cache
+    d.detect_chunks(chunks)
+    assert len(d.batches) == 1
+    assert d.classified == 3
+
+
+@pytest.mark.skipif(lang_detect.langid is None, reason="langid not installed")
+def test_mixed_document_falls_back_to_per_chunk():
+    d = _CountingDetector(sample_chunks=4)
+    chunks = [VI * 2, EN * 2, VI * 2 + "x", EN * 2 + "y"]
+    langs = d.detect_chunks(chunks)
+    assert langs == ["vi", "en", "vi", "en"]
+    assert d.mixed_documents == 1
+
+
+def test_empty_and_blank_chunks_are_unknown():
+    d = LangDetector()
+    assert d.detect_chunks([]) == []
+    assert d.detect_chunks(["   ", ""]) == [UNKNOWN_LANG, UNKNOWN_LANG]
+
+
+@pytest.mark.skipif(lang_detect.langid is None, reason="langid not installed")
+def test_engine_build_chunks_uses_document_language(tmp_path):
+    from app.rag_engine import RagEngine
+
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "lang_test"))
+    ids, docs, metas = eng._build_chunks(EN * 60, "a.txt", "v1")
+    assert len(docs) > 1
+    assert {m["language"] for m in metas} == {"en"}
@@ -0,0 +1,88 @@
+"""
+Tests for late materialization: retrieval carries chunk IDs, text is fetched once at the end.
+"""
+
+from app.rag_engine import RagEngine
+
+DOCS = [
+    "Chính sách bảo hành sản phẩm mười hai tháng",
+    "Hướng dẫn cài đặt phần mềm trên máy tính",
+    "Bảo hành không áp dụng cho hư hỏng do người dùng",
+    "Phần mềm cập nhật tự động mỗi tuần một lần",
+]
+IDS = [f"c{i}" for i in range(len(DOCS))]
+METAS = [{"source": f"{i}.txt", "chunk": 0, "version": "v1"} for i in range(len(DOCS))]
+
+
+def _engine(tmp_path):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "late_mat"))
+    eng.collection.add(
+        ids=IDS,
+        documents=DOCS,
+        metadatas=METAS,
+        embeddings=[[1.0, float(i)] for i in range(len(DOCS))],
+    )
+    return eng
+
+
+class _CountingCollection:
+    """Proxy ghi lại các lần collection.get (Chroma Collection không cho setattr)."""
+
+    def __init__(self, inner):
+        self._inner = inner
+        self.get_calls = []
+
+    def get(self, *args, **kwargs):
+        self.get_calls.append(kwargs.get("ids"))
+        return self._inner.get(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+def _count_gets(monkeypatch, eng):
+    proxy = _CountingCollection(eng.collection)
+    monkeypatch.setattr(eng, "collection", proxy)
+    return proxy.get_calls
+
+
+def test_rrf_fuse_on_ids():
+    fused = RagEngine._rrf_fuse([["a", "b", "c"], ["b", "d"]], k=60)
+    ids = [cid for cid, _ in fused]
+    assert ids[0] == "b"
+    assert set(ids) == {"a", "b", "c", "d"}
+    assert len(ids) == len(set(ids))
+
+
+def test_materialize_preserves_order_and_drops_missing(tmp_path):
+    eng = _engine(tmp_path)
+    ids, docs, metas = eng._materialize(["c3", "gone", "c0", "c3"])
+    assert ids == ["c3", "c0", "c3"]
+    assert docs == [DOCS[3], DOCS[0], DOCS[3]]
+    assert metas[1]["source"] == "0.txt"
+    assert eng._materialize([]) == ([], [], [])
+
+
+def test_retrieve_hybrid_returns_ids_with_single_lookup(tmp_path, monkeypatch):
+    eng = _engine(tmp_path)
+    monkeypatch.setattr(eng, "_vector_candidates", lambda q, k, langs, vers: [("c1", 0.2)])
+    eng._ensure_bm25()
+    calls = _count_gets(monkeypatch, eng)
+    res = eng.retrieve_hybrid("bảo hành", top_k=3, rrf_enable=True)
+    assert res["ids"][0] in ("c0", "c1", "c2")
+    assert "c1" in res["ids"] and "c0" in res["ids"]
+    assert res["documents"] == [DOCS[IDS.index(i)] for i in res["ids"]]
+    assert len(calls) == 1
+
+
+def test_aggregate_rewrites_materialize_once(tmp_path, monkeypatch):
+    eng = _engine(tmp_path)
+    monkeypatch.setattr(eng, "_rewrite_queries", lambda q, n=2, provider=None: ["q1", "q2"])
+    ranked = {"q1": [("c0", 0.1), ("c2", 0.3)], "q2": [("c2", 0.1), ("c3", 0.2)]}
+    monkeypatch.setattr(eng, "_vector_candidates", lambda q, k, langs, vers: ranked.get(q, []))
+    calls = _count_gets(monkeypatch, eng)
+    res = eng.retrieve_aggregate("q0", top_k=2, method="vector", rewrite_enable=True)
+    # c2 xuất hiện ở cả hai rewrite → đứng đầu sau RRF; text chỉ lấy cho top_k
+    assert res["documents"][0] == DOCS[2]
+    assert len(res["documents"]) == 2
+    assert calls == [["c2", "c0"]]
@@ -0,0 +1,123 @@
+"""
+Unit tests for LLM admission control / priority scheduler (app/llm_scheduler.py).
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.exceptions import LLMOverloadedError, get_http_status_code
+from app.llm_scheduler import (
+    PRIORITY_EVAL,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_QUERY,
+    PRIORITY_REWRITE,
+    LLMScheduler,
+    current_priority,
+    llm_priority,
+    resolve_priority,
+)
+
+
+def _wait_for_queue(sched: LLMScheduler, depth: int, timeout: float = 2.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if sched.stats()["queue_depth"] >= depth:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"queue never reached depth {depth}")
+
+
+def test_free_slot_admits_immediately():
+    sched = LLMScheduler("m", max_concurrency=2)
+    assert sched.acquire(PRIORITY_QUERY) == 0.0
+    assert sched.acquire(PRIORITY_QUERY) == 0.0
+    stats = sched.stats()
+    assert stats["in_flight"] == 2
+    assert stats["admitted"] == 2
+    sched.release()
+    sched.release()
+    assert sched.stats()["in_flight"] == 0
+
+
+def test_waiters_are_served_by_priority():
+    sched = LLMScheduler("m", max_concurrency=1, max_est_wait_s=1000)
+    sched.acquire(PRIORITY_QUERY)
+    order = []
+
+    def worker(priority, label):
+        with sched.slot(priority):
+            order.append(label)
+
+    threads = []
+    for priority, label in [(PRIORITY_EVAL, "eval"), (PRIORITY_REWRITE, "rewrite")]:
+        t = threading.Thread(target=worker, args=(priority, label))
+        t.start()
+        threads.append(t)
+        _wait_for_queue(sched, len(threads))
+    t = threading.Thread(target=worker, args=(PRIORITY_INTERACTIVE, "interactive"))
+    t.start()
+    threads.append(t)
+    _wait_for_queue(sched, 3)
+
+    sched.release()
+    for t in threads:
+        t.join(5)
+    assert order == ["interactive", "rewrite", "eval"]
+
+
+def test_rejects_fast_when_estimated_wait_too_long():
+    sched = LLMScheduler("m", max_concurrency=1, max_est_wait_s=5, service_time_init_s=10)
+    sched.acquire(PRIORITY_QUERY)
+    with pytest.raises(LLMOverloadedError) as ei:
+        sched.acquire(PRIORITY_QUERY)
+    assert ei.value.retry_after >= 10
+    assert get_http_status_code(ei.value) == 503
+    assert sched.stats()["rejected"] == 1
+    with pytest.raises(LLMOverloadedError):
+        sched.check_admission(PRIORITY_INTERACTIVE)
+
+
+def test_rejects_when_queue_full():
+    sched = LLMScheduler("m", max_concurrency=1, max_queue=0, max_est_wait_s=1000)
+    sched.acquire()
+    with pytest.raises(LLMOverloadedError):
+        sched.acquire()
+
+
+def test_queue_timeout_removes_waiter():
+    sched = LLMScheduler("m", max_concurrency=1, max_est_wait_s=1000, queue_timeout_s=0.05)
+    sched.acquire()
+    with pytest.raises(LLMOverloadedError):
+        sched.acquire()
+    stats = sched.stats()
+    assert stats["timeout"] == 1
+    assert stats["queue_depth"] == 0
+    sched.release()
+    assert sched.acquire() == 0.0
+
+
+def test_release_updates_service_time_ewma():
+    sched = LLMScheduler("m", service_time_init_s=10)
+    sched.acquire()
+    sched.release(0.0001)
+    assert sched.stats()["service_time_ewma_s"] < 10
+
+
+def test_stream_holds_slot_until_consumed():
+    sched = LLMScheduler("m", max_concurrency=1)
+    it = sched.stream(lambda: iter(["a", "b"]), PRIORITY_INTERACTIVE)
+    assert next(it) == "a"
+    assert sched.stats()["in_flight"] == 1
+    assert list(it) == ["b"]
+    assert sched.stats()["in_flight"] == 0
+
+
+def test_priority_context_var():
+    assert current_priority() == PRIORITY_QUERY
+    with llm_priority("eval"):
+        assert current_priority() == PRIORITY_EVAL
+        assert resolve_priority(None) == PRIORITY_EVAL
+    assert current_priority() == PRIORITY_QUERY
+    assert resolve_priority("unknown") == PRIORITY_QUERY
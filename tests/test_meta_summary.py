@@ -0,0 +1,91 @@
+"""
+Tests for the incremental metadata summary (app/meta_summary.py + RagEngine filters/sources).
+"""
+
+import pytest
+
+from app.meta_summary import MetaSummary
+from app.rag_engine import RagEngine
+
+
+def _meta(source, version="v1", language="vi"):
+    return {"source": source, "version": version, "language": language, "chunk": 0}
+
+
+def test_summary_counts_upserts_and_deletes(tmp_path):
+    summary = MetaSummary(str(tmp_path))
+    summary.add(
+        ["a1", "a2", "b1"], [_meta("a.txt"), _meta("a.txt", "v2"), _meta("b.txt", None, "en")]
+    )
+    # Upsert cùng ID không đếm hai lần, đổi version → chuyển sang nhóm mới
+    summary.add(["a1"], [_meta("a.txt", "v2")])
+    assert summary.sources(details=True) == [
+        {"source": "a.txt", "chunks": 2, "versions": ["v2"], "languages": ["vi"]},
+        {"source": "b.txt", "chunks": 1, "versions": [], "languages": ["en"]},
+    ]
+    assert summary.filters() == (["en", "vi"], ["v2"])
+    assert summary.total_chunks() == 3
+
+    summary.remove(["a1", "missing"])
+    summary.remove_sources(["b.txt"])
+    assert summary.sources() == [{"source": "a.txt", "chunks": 1}]
+    assert summary.filters() == (["vi"], ["v2"])
+
+
+def test_rebuild_and_ready_flag(tmp_path):
+    summary = MetaSummary(str(tmp_path))
+    assert not summary.is_ready()
+    pages = [(["x1", "x2"], [_meta("x.txt"), _meta("x.txt")]), (["y1"], [None])]
+    assert summary.rebuild(pages) == 3
+    assert summary.is_ready()
+    assert summary.sources() == [{"source": "x.txt", "chunks": 2}]
+    assert summary.total_chunks() == 3
+    summary.invalidate()
+    assert not summary.is_ready()
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "summary_test"))
+    monkeypatch.setattr(eng.ollama, "embed", lambda texts: [[float(len(t)), 1.0] for t in texts])
+    return eng
+
+
+def test_engine_serves_filters_and_sources_from_summary(engine, monkeypatch):
+    engine.ingest_texts(
+        ["Hướng dẫn sử dụng sản phẩm " * 40, "User manual for the product " * 40],
+        metadatas=[{"source": "vi.txt"}, {"source": "en.txt"}],
+        version="v1",
+    )
+    # Lần đọc đầu: summary đã được ingest cập nhật, khớp count → không rebuild
+    real_get = type(engine.collection).get
+    scans = []
+
+    def counting_get(self, *args, **kwargs):
+        scans.append(kwargs)
+        return real_get(self, *args, **kwargs)
+
+    monkeypatch.setattr(type(engine.collection), "get", counting_get)
+    sources = engine.list_sources(details=True)
+    assert [s["source"] for s in sources] == ["en.txt", "vi.txt"]
+    assert all(s["versions"] == ["v1"] for s in sources)
+    assert sum(s["chunks"] for s in sources) == engine.collection.count()
+    assert engine.get_filters()["versions"] == ["v1"]
+    assert scans == []
+
+    engine.delete_sources(["vi.txt"])
+    assert [s["source"] for s in engine.list_sources()] == ["en.txt"]
+    assert scans == []
+
+
+def test_engine_rebuilds_summary_when_store_drifts(engine):
+    # Ghi thẳng vào collection (bỏ qua ingest) → count lệch → rebuild một lần theo trang
+    engine.collection.add(
+        ids=["c1", "c2"],
+        documents=["một", "hai"],
+        metadatas=[_meta("legacy.txt", "v0"), _meta("legacy.txt", "v0", "en")],
+        embeddings=[[0.1, 0.2], [0.2, 0.1]],
+    )
+    assert engine.list_sources() == [{"source": "legacy.txt", "chunks": 2}]
+    assert engine.meta_summary.is_ready()
+    assert engine.get_filters() == {"languages": ["en", "vi"], "versions": ["v0"]}
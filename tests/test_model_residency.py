@@ -0,0 +1,161 @@
+"""
+Tests for model residency: keep_alive on Ollama calls, preload/keep-warm and load detection.
+"""
+
+import asyncio
+import json
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app import model_residency as mr
+from app.backend_pool import BackendPool
+from app.model_residency import ModelResidency, in_keepwarm_window, keep_alive, parse_ranges
+from app.ollama_client import AsyncOllamaClient, OllamaClient
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Ghi lại các lần record_model_load (model, kind, seconds)."""
+    seen: list[tuple[str, str, float]] = []
+    fake = SimpleNamespace(record_model_load=lambda m, k, s: seen.append((m, k, s)))
+    monkeypatch.setattr(mr, "metrics", fake, raising=False)
+    monkeypatch.setattr(mr, "METRICS_ENABLED", True)
+    return seen
+
+
+def test_keep_alive_values(monkeypatch):
+    assert keep_alive("30m") == "30m"
+    assert keep_alive("600") == 600
+    assert keep_alive("-1") == -1
+    assert keep_alive("") is None
+    monkeypatch.setattr(mr, "OLLAMA_KEEP_ALIVE", "1h")
+    payload = OllamaClient._gen_payload(OllamaClient.__new__(OllamaClient), "hi", None, False)
+    assert payload["keep_alive"] == "1h"
+    monkeypatch.setattr(mr, "OLLAMA_KEEP_ALIVE", "")
+    payload = OllamaClient._gen_payload(OllamaClient.__new__(OllamaClient), "hi", None, False)
+    assert "keep_alive" not in payload
+
+
+def test_keepwarm_window_hours_and_days():
+    assert parse_ranges("8-10,20", 0, 23, inclusive_end=False) == {8, 9, 20}
+    assert parse_ranges("", 1, 7) == set(range(1, 8))
+    assert parse_ranges("x,2", 1, 7) == {2}
+    monday_9 = datetime(2026, 10, 19, 9, 0)
+    assert in_keepwarm_window(monday_9, hours="8-18", days="1-5")
+    assert not in_keepwarm_window(monday_9.replace(hour=18), hours="8-18", days="1-5")
+    assert not in_keepwarm_window(datetime(2026, 10, 18, 9, 0), hours="8-18", days="1-5")
+    assert in_keepwarm_window(monday_9, hours="", days="")
+
+
+def test_observe_load_only_counts_real_loads(loads):
+    assert mr.observe_load("m", {"response": "x"}) is None
+    assert mr.observe_load("m", {"load_duration": 2_000_000}) == pytest.approx(0.002)
+    assert loads == []
+    assert mr.observe_load("m", {"load_duration": 3_500_000_000}, kind="preload") == 3.5
+    assert loads == [("m", "preload", 3.5)]
+
+
+class _FakeResp:
+    def __init__(self, data, status=200):
+        self._data = data
+        self.status_code = status
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self._data
+
+
+class _FakeClient:
+    def __init__(self, gen_urls, embed_urls, down=()):
+        self._gen_pool = BackendPool(gen_urls, name="generate")
+        self._embed_pool = BackendPool(embed_urls, name="embed")
+        self.down = set(down)
+        self.missing: set[str] = set()
+        self.calls: list[tuple[str, str, dict]] = []
+
+    def _request(self, method, path, *, json_body=None, base_url=None, max_retries=None):
+        self.calls.append((base_url, path, json_body))
+        if base_url in self.down:
+            raise ConnectionError("refused")
+        if path in self.missing:
+            return _FakeResp({"error": "404 page not found"}, status=404)
+        if path == "/api/embeddings":
+            return _FakeResp({"embedding": [0.1]})
+        return _FakeResp({"done": True, "load_duration": 1_500_000_000})
+
+
+def test_preload_every_model_on_every_backend(loads, monkeypatch):
+    monkeypatch.setattr(mr, "OLLAMA_KEEP_ALIVE", "30m")
+    client = _FakeClient(["http://a:1", "http://b:1"], ["http://e:1"], down={"http://b:1"})
+    res = ModelResidency(client, "llm", "emb")
+    results = res.preload()
+    assert [(u, p) for u, p, _ in client.calls] == [
+        ("http://a:1", "/api/generate"),
+        ("http://b:1", "/api/generate"),
+        ("http://e:1", "/api/embed"),
+    ]
+    assert client.calls[0][2] == {"model": "llm", "keep_alive": "30m"}
+    assert client.calls[2][2] == {"model": "emb", "input": "warmup", "keep_alive": "30m"}
+    assert [r["ok"] for r in results] == [True, False, True]
+    assert loads == [("llm", "preload", 1.5), ("emb", "preload", 1.5)]
+    status = res.status()
+    assert status["keep_alive"] == "30m" and len(status["models"]) == 3
+
+    # Ngoài khung giờ keep-warm → không ping
+    off = ModelResidency(client, "llm", None)
+    monkeypatch.setattr(mr, "in_keepwarm_window", lambda **kw: False)
+    assert off.ping() is None
+
+
+def test_embed_preload_falls_back_without_api_embed(loads, monkeypatch):
+    monkeypatch.setattr(mr, "OLLAMA_KEEP_ALIVE", "30m")
+    client = _FakeClient(["http://a:1"], ["http://e:1"])
+    client.missing.add("/api/embed")
+    results = ModelResidency(client, None, "emb").preload()
+    assert [p for _, p, _ in client.calls] == ["/api/embed", "/api/embeddings"]
+    assert client.calls[1][2] == {"model": "emb", "prompt": "", "keep_alive": "30m"}
+    # /api/embeddings không có load_duration → model vẫn được nạp nhưng không đo load
+    assert results[0]["ok"] and results[0]["load_s"] is None
+    assert loads == []
+
+
+def test_keepwarm_loop_pings_until_stopped():
+    client = _FakeClient(["http://a:1"], ["http://a:1"])
+    res = ModelResidency(client, "llm", None, interval_s=0.01, hours="", days="")
+    res.start(preload=False)
+    for _ in range(200):
+        if len(client.calls) >= 2:
+            break
+        time.sleep(0.01)
+    res.stop()
+    assert len(client.calls) >= 2 and not res.status()["running"]
+
+
+def test_stream_final_chunk_reports_cold_load(loads, monkeypatch):
+    monkeypatch.setattr(mr, "OLLAMA_KEEP_ALIVE", "30m")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        assert "keep_alive" in body
+        lines = [
+            json.dumps({"response": "ok", "done": False}),
+            json.dumps({"response": "", "done": True, "load_duration": 4_000_000_000}),
+        ]
+        return httpx.Response(200, content="\n".join(lines).encode())
+
+    client = AsyncOllamaClient(base_url="http://a:11434", transport=httpx.MockTransport(handler))
+
+    async def run():
+        out = [t async for t in client._generate_stream_impl("hi")]
+        await client.aclose()
+        return out
+
+    assert asyncio.run(run()) == ["ok"]
+    assert [(k, s) for _, k, s in loads] == [("request", 4.0)]
@@ -0,0 +1,120 @@
+"""
+Tests for the ONNX session pool and core/NUMA-aware defaults (app/onnx_sessions.py).
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.onnx_sessions import OnnxSessionPool, _parse_cpulist, numa_nodes, physical_cores
+
+
+class _Factory:
+    def __init__(self, delay=0.0):
+        self.made: list[int] = []
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def __call__(self, threads):
+        time.sleep(self.delay)
+        with self._lock:
+            self.made.append(threads)
+            return {"threads": threads, "n": len(self.made)}
+
+
+def _write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def test_parse_cpulist():
+    assert _parse_cpulist("0-3,8,10-11\n") == {0, 1, 2, 3, 8, 10, 11}
+    assert _parse_cpulist("") == set()
+
+
+def test_physical_cores_and_numa_nodes_from_sysfs(tmp_path):
+    cpu = tmp_path / "cpu"
+    # 4 core vật lý, mỗi core 2 hyperthread: (0,4) (1,5) (2,6) (3,7)
+    for c in range(8):
+        _write(cpu / f"cpu{c}" / "topology" / "thread_siblings_list", f"{c % 4},{c % 4 + 4}")
+    node = tmp_path / "node"
+    _write(node / "node0" / "cpulist", "0-1,4-5")
+    _write(node / "node1" / "cpulist", "2-3,6-7")
+
+    assert physical_cores(set(range(8)), str(cpu)) == 4
+    # Affinity chỉ gồm hyperthread siblings của một core → một core vật lý
+    assert physical_cores({0, 4}, str(cpu)) == 1
+    assert numa_nodes({0, 1, 2, 4}, str(node)) == [{0, 1, 4}, {2}]
+    assert numa_nodes({0, 1}, str(tmp_path / "missing")) == [{0, 1}]
+
+
+def test_sessions_are_reused_per_thread_count():
+    factory = _Factory()
+    pool = OnnxSessionPool(factory, budget=8, max_sessions=4, default_threads=2)
+    with pool.session() as a:
+        pass
+    with pool.session(2) as b:
+        pass
+    with pool.session(4) as c:
+        pass
+    assert a is b and c["threads"] == 4
+    assert factory.made == [2, 4]
+    # Số luồng vượt ngân sách bị kẹp về budget
+    with pool.session(64) as d:
+        assert d["threads"] == 8
+
+
+def test_concurrent_requests_get_separate_sessions_within_budget():
+    factory = _Factory(delay=0.01)
+    pool = OnnxSessionPool(factory, budget=4, max_sessions=4, default_threads=2)
+    in_use = []
+    peak = [0]
+    lock = threading.Lock()
+    seen = set()
+
+    def worker():
+        with pool.session() as s:
+            with lock:
+                in_use.append(s)
+                seen.add(id(s))
+                peak[0] = max(peak[0], pool.stats()["threads_in_use"])
+            time.sleep(0.02)
+            with lock:
+                in_use.remove(s)
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # budget 4 / 2 luồng mỗi session → tối đa 2 session chạy cùng lúc
+    assert peak[0] <= 4
+    assert len(seen) == 2 and len(factory.made) == 2
+    assert pool.stats()["waits"] > 0
+
+
+def test_idle_sessions_of_other_sizes_are_evicted_at_capacity():
+    factory = _Factory()
+    pool = OnnxSessionPool(factory, budget=8, max_sessions=2, default_threads=1)
+    with pool.session(1):
+        pass
+    with pool.session(2):
+        pass
+    with pool.session(4):
+        pass
+    stats = pool.stats()
+    assert stats["sessions"] == 2 and stats["evicted"] == 1
+    assert 4 in stats["idle"]
+
+
+def test_factory_failure_releases_budget():
+    def boom(threads):
+        raise RuntimeError("bad model")
+
+    pool = OnnxSessionPool(boom, budget=2, max_sessions=1, default_threads=2)
+    with pytest.raises(RuntimeError):
+        with pool.session():
+            pass
+    stats = pool.stats()
+    assert stats["threads_in_use"] == 0 and stats["sessions"] == 0
@@ -10,20 +10,27 @@ from app.rag_engine import RagEngine
 
 
 class FakeCollection:
-    def __init__(self, metadatas=None, ids_map=None, fail_where_sources=None):
+    def __init__(self, metadatas=None, ids_map=None, fail_where_sources=None, supports_in=True):
         # metadatas: list of dicts with key 'source'
         self.metas = list(metadatas or [])
         # ids_map: source -> list of ids (strings)
         self.ids_map = dict(ids_map or {})
         # which sources should fail on delete(where={"source": ...}) to trigger fallback
         self.fail_where = set(fail_where_sources or [])
+        # False → get(where={"source": {"$in": ...}}) fails like stores without `$in`
+        self.supports_in = supports_in
+        self.delete_calls = []
 
-    def get(self, include=None, where=None):
+    def get(self, include=None, where=None, **kwargs):
         include = include or []
         where = where or {}
         # If asked for ids by where filter
         if where and "source" in where:
             src = where.get("source")
+            if isinstance(src, dict):
+                if not self.supports_in:
+                    raise Exception("$in not supported")
+                return {"ids": [i for s in src["$in"] for i in self.ids_map.get(s, [])]}
             if "ids" in include:
                 return {"ids": self.ids_map.get(src, [])}
             # Default return for safety
@@ -41,6 +48,7 @@ class FakeCollection:
         return out
 
     def delete(self, where=None, ids=None):
+        self.delete_calls.append({"where": where, "ids": ids})
         if where:
             src = (where or {}).get("source")
             if src in self.fail_where:
@@ -50,9 +58,12 @@ class FakeCollection:
             self.ids_map[src] = []
             return
         if ids:
-            # emulate removal by ids
-            # (we won't map ids back to metas precisely in this fake)
-            return
+            # emulate removal by ids: drop the ids and one meta per removed id of that source
+            for src, src_ids in self.ids_map.items():
+                gone = [i for i in src_ids if i in ids]
+                self.ids_map[src] = [i for i in src_ids if i not in ids]
+                for _ in gone:
+                    self.metas.remove(next(m for m in self.metas if m.get("source") == src))
 
 
 class RagEngineSourcesTests(unittest.TestCase):
@@ -85,8 +96,7 @@ class RagEngineSourcesTests(unittest.TestCase):
             ],
         )
 
-    def test_delete_sources_with_where_and_fallback(self):
-        # Prepare metas and ids mapping per source
+    def _fake_with_two_sources(self, **kwargs):
         metas = [
             {"source": "s1.txt"},
             {"source": "s1.txt"},
@@ -96,18 +106,36 @@ class RagEngineSourcesTests(unittest.TestCase):
             "s1.txt": ["id1", "id2"],
             "s2.txt": ["id3"],
         }
-        # s1 fails delete(where=...), triggers fallback; s2 succeeds delete(where=...)
-        fake = FakeCollection(metadatas=metas, ids_map=ids_map, fail_where_sources={"s1.txt"})
+        fake = FakeCollection(metadatas=metas, ids_map=ids_map, **kwargs)
         self.engine.collection = fake
         # Put something into caches to verify they get cleared
         self.engine._bm25 = object()
-        self.engine._filters_cache["languages"] = ["vi"]
+        self.engine._filters_cache.set("languages", ["vi"])
+        return fake
 
-        deleted_count = self.engine.delete_sources(["s1.txt", "s2.txt"])
-        self.assertEqual(deleted_count, 2)
+    def test_delete_sources_bulk_by_ids(self):
+        fake = self._fake_with_two_sources()
+
+        deleted_count = self.engine.delete_sources(["s1.txt", "s2.txt", "missing.txt"])
+        # exact chunk count: 2 chunks of s1 + 1 chunk of s2, resolved via `$in` in one pass
+        self.assertEqual(deleted_count, 3)
+        self.assertEqual(fake.delete_calls, [{"where": None, "ids": ["id1", "id2", "id3"]}])
+        self.assertEqual(fake.metas, [])
+        self.assertEqual(fake.ids_map, {"s1.txt": [], "s2.txt": []})
         # caches cleared
         self.assertIsNone(self.engine._bm25)
-        self.assertEqual(self.engine._filters_cache, {})
+        self.assertIsNone(self.engine._filters_cache.get("languages"))
+
+    def test_delete_sources_with_where_and_fallback(self):
+        # Store không hỗ trợ `$in` → xóa từng source; s1 fails delete(where=...) → xóa theo IDs
+        fake = self._fake_with_two_sources(supports_in=False, fail_where_sources={"s1.txt"})
+
+        deleted_count = self.engine.delete_sources(["s1.txt", "s2.txt"])
+        # exact chunk count: 2 chunks of s1 (via id fallback) + 1 chunk of s2
+        self.assertEqual(deleted_count, 3)
+        self.assertEqual(fake.metas, [])
+        self.assertIsNone(self.engine._bm25)
+        self.assertIsNone(self.engine._filters_cache.get("languages"))
 
 
 if __name__ == "__main__":
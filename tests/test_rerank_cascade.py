@@ -0,0 +1,122 @@
+"""
+Tests for the cascaded reranker (app/rerank_cascade.py) and its engine wiring.
+"""
+
+from app.rag_engine import RagEngine
+from app.rerank_cascade import CascadeStage, RerankCascade
+from app.reranker import SimpleEmbedReranker
+
+DOCS = [f"d{i}" for i in range(10)]
+
+
+class _Scorer:
+    """Điểm theo bảng cố định; ghi lại docs/keys mỗi lần gọi."""
+
+    def __init__(self, table, fail=False):
+        self.table = table
+        self.fail = fail
+        self.calls: list[tuple[list[str], list]] = []
+
+    def __call__(self, query, docs, keys, opts):
+        self.calls.append((list(docs), list(keys)))
+        if self.fail:
+            raise RuntimeError("model crashed")
+        return [self.table[d] for d in docs]
+
+
+def test_stages_prune_to_shrinking_candidate_sets():
+    cheap = _Scorer({d: -i for i, d in enumerate(DOCS)})  # giữ thứ tự retrieval
+    ce = _Scorer({d: i for i, d in enumerate(DOCS)})  # đảo ngược
+    big = _Scorer({d: i % 2 for i, d in enumerate(DOCS)})
+    cascade = RerankCascade(
+        [
+            CascadeStage("embed", cheap, keep=6),
+            CascadeStage("ce", ce, keep=3),
+            CascadeStage("bge", big, keep=1),
+        ]
+    )
+    idxs, trace = cascade.rank("q", DOCS, 2, keys=[f"id{i}" for i in range(10)])
+    assert len(cheap.calls[0][0]) == 10
+    assert ce.calls[0][0] == DOCS[:6]
+    assert big.calls[0] == (["d5", "d4", "d3"], ["id5", "id4", "id3"])
+    # bge: d5, d3 (điểm 1, hòa → giữ thứ tự tầng trước)
+    assert idxs == [5, 3]
+    assert [t["outcome"] for t in trace] == ["ran", "ran", "ran"]
+
+
+def test_unavailable_failed_and_non_pruning_stages_are_skipped():
+    cheap = _Scorer({d: -i for i, d in enumerate(DOCS)})
+    broken = _Scorer({}, fail=True)
+    off = _Scorer({})
+    cascade = RerankCascade(
+        [
+            CascadeStage("embed", cheap, keep=20),
+            CascadeStage("ce", off, keep=3, available=lambda: False),
+            CascadeStage("bge", broken, keep=1),
+        ]
+    )
+    docs, metas = cascade.rerank("q", DOCS, [{"i": i} for i in range(10)], 3)
+    # embed không lọc được (10 <= 20) → bỏ qua; bge lỗi → giữ thứ tự retrieval
+    assert docs == ["d0", "d1", "d2"] and metas == [{"i": 0}, {"i": 1}, {"i": 2}]
+    assert cheap.calls == [] and off.calls == []
+    outcomes = {t["stage"]: t["outcome"] for t in cascade.rank("q", DOCS, 3)[1]}
+    assert outcomes == {"ce": "unavailable", "embed": "skipped", "bge": "error"}
+
+
+def test_stage_budget_limits_scored_candidates():
+    slow = _Scorer({d: i for i, d in enumerate(DOCS)})
+    stage = CascadeStage("bge", slow, keep=1, budget_ms=40)
+    stage.ms_per_doc = 10.0  # ước lượng: 4 docs vừa budget
+    cascade = RerankCascade([stage])
+    idxs, _ = cascade.rank("q", DOCS, 2)
+    assert slow.calls[0][0] == DOCS[:4]
+    assert idxs == [3, 2]
+
+    # Budget không đủ cho top_k → bỏ qua tầng
+    stage.ms_per_doc = 100.0
+    idxs, trace = cascade.rank("q", DOCS, 2)
+    assert idxs == [0, 1] and trace[-1]["outcome"] == "over_budget"
+
+
+def test_over_budget_stage_probes_and_recovers():
+    fast = _Scorer({d: i for i, d in enumerate(DOCS)})
+    stage = CascadeStage("bge", fast, keep=1, budget_ms=40, probe_every=3)
+    stage.ms_per_doc = 1000.0  # một lần chậm đột biến
+    cascade = RerankCascade([stage])
+    outcomes = [cascade.rank("q", DOCS, 2)[1][-1]["outcome"] for _ in range(3)]
+    assert outcomes == ["over_budget", "over_budget", "probe"]
+    # Lần thử chỉ chấm top_k docs và thay ước lượng cũ bằng thời gian đo được
+    assert fast.calls[0][0] == DOCS[:2] and stage.ms_per_doc < 20.0
+    idxs, trace = cascade.rank("q", DOCS, 2)
+    assert trace[-1]["outcome"] == "ran" and idxs == [9, 8]
+
+
+def test_engine_cascade_provider_uses_stored_vectors(tmp_path, monkeypatch):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "rerank_cascade"))
+    eng.collection.add(
+        ids=["a", "b", "c"],
+        documents=["alpha", "beta", "gamma"],
+        metadatas=[{"source": s, "chunk": 0} for s in ("a.txt", "b.txt", "c.txt")],
+        embeddings=[[0.0, 1.0], [1.0, 0.0], [0.7, 0.7]],
+    )
+    eng._embed_rr = SimpleEmbedReranker(lambda texts: [[1.0, 0.0] for _ in texts])
+    monkeypatch.setattr(eng, "_bge_rr", None)
+    monkeypatch.setattr(eng, "_ensure_rerankers", lambda: None)
+    eng._rr_cascade = RerankCascade(
+        [
+            CascadeStage(
+                "embed",
+                lambda q, d, keys, opts: eng._embed_rr.score(q, d, eng._stored_embeddings(keys)),
+                keep=2,
+            )
+        ]
+    )
+    docs, _ = eng._apply_rerank(
+        "question",
+        ["alpha", "beta", "gamma"],
+        [{"source": "a.txt"}, {"source": "b.txt"}, {"source": "c.txt"}],
+        2,
+        rr_provider="cascade",
+        ids=["a", "b", "c"],
+    )
+    assert docs == ["beta", "gamma"]
@@ -0,0 +1,71 @@
+"""
+Tests for SimpleEmbedReranker reusing stored chunk embeddings (only the query is embedded).
+"""
+
+import pytest
+
+from app.rag_engine import RagEngine
+from app.reranker import SimpleEmbedReranker, cosine_scores
+
+
+class _RecordingEmbedder:
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [self.vectors.get(t, [0.5, 0.5]) for t in texts]
+
+
+def test_cosine_scores_matches_pairwise():
+    scores = cosine_scores([1.0, 0.0], [[0.0, 2.0], [3.0, 0.0], [1.0, 1.0]])
+    assert scores.tolist() == pytest.approx([0.0, 1.0, 2**-0.5], abs=1e-6)
+
+
+def test_rerank_embeds_only_query_and_missing_or_stale_vectors():
+    emb = _RecordingEmbedder({"q": [1.0, 0.0], "d2": [0.0, 1.0], "d3": [1.0, 0.1]})
+    rr = SimpleEmbedReranker(emb)
+    docs = ["d1", "d2", "d3"]
+    metas = [{"i": 1}, {"i": 2}, {"i": 3}]
+    # d1 có vector lưu sẵn, d2 thiếu, d3 là vector 3 chiều (model cũ) → embed lại
+    stored = [[0.9, 0.1], None, [1, 0, 0]]
+    out_docs, out_metas = rr.rerank("q", docs, metas, 2, doc_embeddings=stored)
+    assert emb.calls == [["q", "d2"], ["d3"]]
+    assert out_docs == ["d3", "d1"]
+    assert out_metas == [{"i": 3}, {"i": 1}]
+
+
+def test_engine_rerank_reuses_stored_embeddings(tmp_path, monkeypatch):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "rerank_reuse"))
+    eng.collection.add(
+        ids=["a", "b", "c"],
+        documents=["alpha", "beta", "gamma"],
+        metadatas=[{"source": s, "chunk": 0} for s in ("a.txt", "b.txt", "c.txt")],
+        embeddings=[[0.0, 1.0], [1.0, 0.0], [0.7, 0.7]],
+    )
+    emb = _RecordingEmbedder({"question": [1.0, 0.0]})
+    eng._embed_rr = SimpleEmbedReranker(emb)
+    monkeypatch.setattr(eng, "_bge_rr", None)
+    monkeypatch.setattr(eng, "_ensure_rerankers", lambda: None)
+
+    docs, metas = eng._apply_rerank(
+        "question",
+        ["alpha", "beta", "gamma"],
+        [{"source": "a.txt"}, {"source": "b.txt"}, {"source": "c.txt"}],
+        2,
+        rr_provider="embed",
+        ids=["a", "b", "c"],
+    )
+    assert emb.calls == [["question"]]
+    assert docs == ["beta", "gamma"]
+
+
+def test_engine_derives_chunk_ids_for_ingested_chunks(tmp_path, monkeypatch):
+    eng = RagEngine(persist_dir=str(tmp_path / "kb" / "rerank_derive"))
+    monkeypatch.setattr(eng.ollama, "embed", lambda texts: [[float(len(t)), 1.0] for t in texts])
+    eng.ingest_texts(["Tài liệu ngắn về bảo hành."], metadatas=[{"source": "w.txt"}])
+    res = eng.collection.get(include=["documents", "metadatas", "embeddings"])
+    derived = eng._derive_chunk_ids(res["documents"], res["metadatas"])
+    assert derived == res["ids"]
+    assert eng._stored_embeddings(derived + [None]) == [list(res["embeddings"][0]), None]
@@ -0,0 +1,120 @@
+"""
+Tests for quantized reranker variant selection and accuracy check (app/reranker_quant.py).
+"""
+
+import json
+import os
+import sys
+import types
+
+import pytest
+
+from app.reranker import BgeOnnxReranker
+from app.reranker_quant import (
+    check_variant,
+    compare_scores,
+    load_report,
+    quantize_model,
+    resolve_variant,
+    spearman,
+    topk_overlap,
+    variant_path,
+)
+
+REPO = "BAAI/bge-reranker-v2-m3"
+
+
+def _touch_model(model_dir, variant, passed=None):
+    path = variant_path(REPO, variant, str(model_dir))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"onnx")
+    if passed is not None:
+        with open(path + ".check.json", "w", encoding="utf-8") as f:
+            json.dump({"passed": passed}, f)
+    return path
+
+
+def test_rank_metrics():
+    assert spearman([1, 2, 3, 4], [10, 20, 30, 40]) == pytest.approx(1.0)
+    assert spearman([1, 2, 3, 4], [4, 3, 2, 1]) == pytest.approx(-1.0)
+    # Giá trị bằng nhau → hạng trung bình
+    assert spearman([1, 1, 2], [5, 5, 9]) == pytest.approx(1.0)
+    assert topk_overlap([0.9, 0.1, 0.8, 0.2], [0.7, 0.3, 0.6, 0.65], 2) == 0.5
+
+
+def test_compare_scores_passes_on_small_perturbation_only():
+    ref = [[3.0, 1.0, 2.0, -1.0, 0.5], [0.1, 0.9, 0.4, 0.3, 0.2]]
+    close = [[x + 0.01 for x in row] for row in ref]
+    report = compare_scores(ref, close, k=2)
+    assert report["passed"] and report["top1_agreement"] == 1.0
+    assert report["max_abs_diff"] == pytest.approx(0.01)
+
+    reversed_rows = [[-x for x in row] for row in ref]
+    assert not compare_scores(ref, reversed_rows, k=2)["passed"]
+    assert not compare_scores([], [], k=2)["passed"]
+
+
+def test_resolve_variant_auto_requires_passed_check(tmp_path):
+    assert resolve_variant(REPO, "auto", str(tmp_path)) == ("fp32", None)
+
+    fp16 = _touch_model(tmp_path, "fp16", passed=True)
+    int8 = _touch_model(tmp_path, "int8")
+    # INT8 chưa kiểm tra → auto bỏ qua, dùng FP16 đã đạt
+    assert resolve_variant(REPO, "auto", str(tmp_path)) == ("fp16", fp16)
+    # Chỉ định rõ → dùng file dù chưa có report
+    assert resolve_variant(REPO, "int8", str(tmp_path)) == ("int8", int8)
+
+    _touch_model(tmp_path, "int8", passed=False)
+    assert resolve_variant(REPO, "auto", str(tmp_path)) == ("fp16", fp16)
+    _touch_model(tmp_path, "int8", passed=True)
+    assert resolve_variant(REPO, "auto", str(tmp_path)) == ("int8", int8)
+
+    assert resolve_variant(REPO, "fp32", str(tmp_path)) == ("fp32", None)
+    assert resolve_variant("other/model", "int8", str(tmp_path)) == ("fp32", None)
+
+
+def test_check_variant_writes_report(tmp_path):
+    path = _touch_model(tmp_path, "int8")
+    eval_set = [("q1", ["a", "bb", "ccc"]), ("q2", ["dddd", "e"]), ("q3", [])]
+    calls = []
+
+    def ref(q, docs):
+        calls.append(q)
+        return [float(len(d)) for d in docs]
+
+    report = check_variant(ref, lambda q, d: [len(x) * 0.99 for x in d], eval_set, path, k=1)
+    assert calls == ["q1", "q2"]
+    assert report["queries"] == 2 and report["passed"]
+    assert load_report(path)["passed"] is True
+
+
+def test_reconvert_drops_stale_check_report(tmp_path, monkeypatch):
+    int8 = _touch_model(tmp_path, "int8", passed=True)
+    src = tmp_path / "model.onnx"
+    src.write_bytes(b"fp32")
+
+    def fake_quantize_dynamic(src_path, dst_path, **kwargs):
+        with open(dst_path, "wb") as f:
+            f.write(b"int8-new")
+
+    fake = types.ModuleType("onnxruntime.quantization")
+    fake.QuantType = types.SimpleNamespace(QInt8="QInt8")
+    fake.quantize_dynamic = fake_quantize_dynamic
+    monkeypatch.setitem(sys.modules, "onnxruntime.quantization", fake)
+    quantize_model(str(src), int8, "int8")
+    # Model mới chưa kiểm tra → auto không chọn theo report của model cũ
+    assert load_report(int8) is None
+    assert resolve_variant(REPO, "auto", str(tmp_path)) == ("fp32", None)
+
+
+def test_reranker_resolves_variant_in_model_dir(tmp_path):
+    int8 = _touch_model(tmp_path, "int8")
+    rr = BgeOnnxReranker(variant="int8", model_dir=str(tmp_path))
+    assert (rr.variant, rr.model_path) == ("int8", int8)
+
+
+def test_variant_is_part_of_score_cache_key():
+    rr = BgeOnnxReranker(variant="fp32")
+    assert rr.variant == "fp32" and rr.model_path is None
+    assert ":fp32:" in rr.model_tag
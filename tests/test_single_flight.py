@@ -0,0 +1,152 @@
+"""
+Unit tests for single-flight request coalescing (app/single_flight.py).
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.single_flight import SingleFlight, normalize_query
+
+
+def test_normalize_query_collapses_whitespace_and_case():
+    assert normalize_query("  What   is\tRAG? ") == "what is rag?"
+    assert normalize_query("") == ""
+
+
+def test_do_runs_once_for_concurrent_callers():
+    flight = SingleFlight("test")
+    calls = {"n": 0}
+    gate = threading.Event()
+
+    def slow():
+        calls["n"] += 1
+        gate.wait(2)
+        return {"answer": "A"}
+
+    results = []
+
+    def worker():
+        results.append(flight.do("k", slow))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    # Let followers queue up behind the leader
+    time.sleep(0.2)
+    gate.set()
+    for t in threads:
+        t.join(5)
+
+    assert calls["n"] == 1
+    assert len(results) == 8
+    assert all(r[0] == {"answer": "A"} for r in results)
+    assert sum(1 for _, shared in results if not shared) == 1
+    assert flight.in_flight() == 0
+
+
+def test_do_propagates_leader_error_to_followers():
+    flight = SingleFlight("test")
+    gate = threading.Event()
+
+    def boom():
+        gate.wait(2)
+        raise RuntimeError("llm down")
+
+    errors = []
+
+    def worker():
+        try:
+            flight.do("k", boom)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)
+    gate.set()
+    for t in threads:
+        t.join(5)
+    assert errors == ["llm down"] * 4
+
+
+def test_do_sequential_calls_are_not_shared():
+    flight = SingleFlight("test")
+    calls = {"n": 0}
+
+    def fn():
+        calls["n"] += 1
+        return calls["n"]
+
+    assert flight.do("k", fn) == (1, False)
+    assert flight.do("k", fn) == (2, False)
+
+
+def test_stream_followers_replay_leader_tokens():
+    flight = SingleFlight("test")
+    produced = {"n": 0}
+    gate = threading.Event()
+
+    def factory():
+        produced["n"] += 1
+        yield "Xin "
+        gate.wait(2)
+        yield "chào"
+
+    leader = flight.stream("k", factory)
+    follower = flight.stream("k", factory)
+    gate.set()
+    assert "".join(leader) == "Xin chào"
+    assert "".join(follower) == "Xin chào"
+    assert produced["n"] == 1
+
+
+def test_stream_error_reaches_subscribers():
+    flight = SingleFlight("test")
+
+    def factory():
+        yield "a"
+        raise ValueError("broken stream")
+
+    sub = flight.stream("k", factory)
+    with pytest.raises(ValueError):
+        list(sub)
+
+
+def test_stream_producer_sees_caller_contextvars():
+    import contextvars
+
+    var = contextvars.ContextVar("sf_test_var", default="unset")
+    var.set("caller")
+    flight = SingleFlight("test")
+
+    def factory():
+        yield var.get()
+
+    assert list(flight.stream("k", factory)) == ["caller"]
+
+
+def test_stream_unread_subscriber_does_not_keep_producer_alive():
+    flight = SingleFlight("test")
+    produced = {"n": 0}
+    gate = threading.Event()
+
+    def factory():
+        yield "a"
+        gate.wait(2)
+        for _ in range(50):
+            produced["n"] += 1
+            yield "x"
+
+    leader = flight.stream("k", factory)
+    flight.stream("k", factory)  # follower không bao giờ được đọc
+    assert next(leader) == "a"
+    leader.close()
+    gate.set()
+    deadline = time.time() + 2
+    while flight.in_flight() and time.time() < deadline:
+        time.sleep(0.01)
+    assert flight.in_flight() == 0
+    assert produced["n"] == 1
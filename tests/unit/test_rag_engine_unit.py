@@ -147,14 +147,19 @@ def test_retrieve_aggregate_rrf_across_rewrites(monkeypatch):
     # Force rewrites to two variants
     monkeypatch.setattr(eng, "_rewrite_queries", lambda q, n=2, provider=None: ["q1", "q2"])
 
-    # For q1, prefer vector docs; for q2, also return vector docs different so RRF unions
-    def ret_vec(q, top_k=5, languages=None, versions=None):
-        docs = [f"V-{q}-1", f"V-{q}-2"]
-        metas = [{"source": f"{q}-s1", "chunk": 0}, {"source": f"{q}-s2", "chunk": 1}]
-        # distances smaller => higher similarity
-        return {"documents": docs, "metadatas": metas, "distances": [0.1, 0.2]}
+    # For q1, prefer vector docs; for q2, also return vector docs different so RRF unions.
+    # Rewrites được fuse trên chunk IDs; text chỉ materialize cho top_k cuối.
+    def vec_candidates(q, top_k=5, languages=None, versions=None):
+        return [(f"V-{q}-1", 0.1), (f"V-{q}-2", 0.2)]
 
-    monkeypatch.setattr(eng, "retrieve", ret_vec)
+    materialized: list[list[str]] = []
+
+    def materialize(ids):
+        materialized.append(list(ids))
+        return ids, list(ids), [{"source": i, "chunk": 0} for i in ids]
+
+    monkeypatch.setattr(eng, "_vector_candidates", vec_candidates)
+    monkeypatch.setattr(eng, "_materialize", materialize)
 
     res = eng.retrieve_aggregate("q0", top_k=3, method="vector", rewrite_enable=True, rewrite_n=2)
     docs = res.get("documents", [])
@@ -163,6 +168,7 @@ def test_retrieve_aggregate_rrf_across_rewrites(monkeypatch):
     # Expect unique union (some from q1, some from q2)
     assert any("V-q1-" in d for d in docs)
     assert any("V-q2-" in d for d in docs)
+    assert materialized == [docs]  # một lần bulk lookup duy nhất
 
 
 def test_valid_db_name():
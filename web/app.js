@@ -363,6 +363,17 @@ const inputUrl = document.getElementById('input-url');
 const btnAddDocs = document.getElementById('btn-add-docs');
 const addStatus = document.getElementById('add-status');
 
+async function waitIngestJob(jobId, intervalMs = 1000) {
+  while (true) {
+    const resp = await fetch(`/api/ingest/jobs/${jobId}`);
+    const job = await resp.json();
+    if (!resp.ok) throw new Error(job.detail || 'Job status failed');
+    // queued/running = còn chạy; mọi trạng thái khác (done/failed/cancelled/...) là kết thúc
+    if (job.status !== 'queued' && job.status !== 'running') return job;
+    await new Promise(r => setTimeout(r, intervalMs));
+  }
+}
+
 btnAddDocs?.addEventListener('click', async () => {
   const files = fileUpload?.files;
   const url = inputUrl?.value?.trim();
@@ -389,6 +400,14 @@ btnAddDocs?.addEventListener('click', async () => {
       const data = await resp.json();
       if (!resp.ok) throw new Error(data.detail || 'Upload failed');
 
+      // Ingest chạy nền: chờ job xong rồi mới báo thành công
+      if (data.job_id) {
+        btnAddDocs.textContent = '⏳ Đang index...';
+        const job = await waitIngestJob(data.job_id);
+        if (job.status === 'cancelled') throw new Error('Ingest đã bị hủy');
+        if (job.status !== 'done') throw new Error(job.error || `Ingest ${job.status || 'failed'}`);
+      }
+
       showToast(`✅ Đã thêm ${data.saved?.length || 0} file`, 'success');
 
       if (fileUpload) fileUpload.value = '';